@@ -24,13 +24,21 @@ class ClassDef(object):
      * decode_types - dict, keys = attribute names, values = callables.
          Callables must accept a single parameter
          (the object being decoded) and return a new object.
+     * lazy_attrs - tuple or list, static attribute names whose values
+         are not decoded until they are accessed, when the decoder
+         is created with lazy=True.
+     * raw_attrs - dict, keys = static attribute names, values = names
+         of the instance attributes holding the undecoded values.
+         The encoder reads the undecoded values, so lazily decoded
+         values are written without being decoded.
 
     """
 
     CLASS_DEF = True
 
     def __init__(self, class_, alias=None, static_attrs=None,
-        amf3=None, encode_types=None, decode_types=None, _built_in=False):
+        amf3=None, encode_types=None, decode_types=None, _built_in=False,
+        lazy_attrs=None, raw_attrs=None):
         """arguments
         =============
          * class_ - class, the class being mapped.
@@ -39,6 +47,8 @@ class ClassDef(object):
          * amf3 - bool, if True, this object will be encoded in AMF3. Default = True
          * encode_types - dict, keys = attribute names, values = callables. Default = None
          * decode_types - dict, keys = attribute names, values = callables. Default = None
+         * lazy_attrs - tuple or list, static attribute names to decode lazily. Default = empty tuple
+         * raw_attrs - dict, keys = attribute names, values = undecoded attribute names. Default = empty dict
         """
         self.class_ = class_
         self._built_in = _built_in
@@ -67,6 +77,20 @@ class ClassDef(object):
         self.encode_types = encode_types
         self.decode_types = decode_types
 
+        if lazy_attrs is None:
+            if hasattr(class_, LAZY_ATTRS):
+                lazy_attrs = getattr(class_, LAZY_ATTRS)
+            else:
+                lazy_attrs = ()
+        self.lazy_attrs = lazy_attrs
+
+        if raw_attrs is None:
+            if hasattr(class_, RAW_ATTRS):
+                raw_attrs = getattr(class_, RAW_ATTRS)
+            else:
+                raw_attrs = {}
+        self.raw_attrs = raw_attrs
+
     def getStaticAttrVals(self, obj):
         """Returns a list of values of attributes defined in self.static_attrs
 
@@ -101,9 +125,10 @@ class DynamicClassDef(ClassDef):
     DYNAMIC_CLASS_DEF = True
 
     def __init__(self, class_, alias=None, static_attrs=None, amf3=True,
-        encode_types=None, decode_types=None, include_private=None, _built_in=False):
+        encode_types=None, decode_types=None, include_private=None, _built_in=False,
+        lazy_attrs=None, raw_attrs=None):
         ClassDef.__init__(self, class_, alias, static_attrs, amf3,
-            encode_types, decode_types, _built_in)
+            encode_types, decode_types, _built_in, lazy_attrs, raw_attrs)
 
         self.include_private = include_private
 
@@ -202,6 +227,15 @@ class ClassDefMapper(object):
         self._lock = threading.RLock()
         self._mapped_classes = {}
         self._mapped_aliases = {}
+
+        # The encoder stores ClassDefs compiled
+        # for encoding here, keyed by class.
+        self._encode_plans = {}
+
+        # The decoder stores traits decoded with
+        # an amfast.decode.InternTable here.
+        self._decode_traits = {}
+
         self._mapBuiltIns()
 
     def __iter__(self):
@@ -229,11 +263,17 @@ class ClassDefMapper(object):
             alias="DSC", _built_in=True))
         self.mapClass(ClassDef(messaging.CommandMessage, _built_in=True))
         self.mapClass(ClassDef(messaging.AcknowledgeMessage, _built_in=True))
+        self.mapClass(messaging.AcknowledgeSmallMsgDef(messaging.AcknowledgeMessageExt,
+            alias="DSK", _built_in=True))
         self.mapClass(ClassDef(messaging.ErrorMessage, _built_in=True))
 
     def mapClass(self, class_def):
         """Map a class_def implementation, so that it can be retrieved based on class attributes.
 
+        A ClassDef is compiled for encoding, and its decoded traits
+        may be cached, the first time it is used,
+        map it again after changing its attributes.
+
         arguments
         ==========
          * class_def - ClassDef, ClassDef being mapped.
@@ -245,6 +285,8 @@ class ClassDefMapper(object):
         try:
             self._mapped_classes[class_def.class_] = class_def
             self._mapped_aliases[class_def.alias] = class_def
+            self._encode_plans = {}
+            self._decode_traits = {}
         finally:
             self._lock.release()
 
@@ -286,6 +328,9 @@ class ClassDefMapper(object):
             class_id = id(class_)
             if class_id in self._mapped_classes:
                 del self._mapped_classes[class_id]
+
+            self._encode_plans = {}
+            self._decode_traits = {}
         finally:
             self._lock.release()
 
@@ -323,8 +368,11 @@ def get_dynamic_attr_vals(obj, ignore_attrs=None, include_private=False):
 ALIAS = '_AMFAST_ALIAS'
 STATIC_ATTRS = '_AMFAST_STATIC_ATTRS'
 AMF3 = '_AMFAST_AMF3'
+LAZY_ATTRS = '_AMFAST_LAZY_ATTRS'
+RAW_ATTRS = '_AMFAST_RAW_ATTRS'
 
-def assign_attrs(class_, alias=None, static_attrs=None, amf3=None):
+def assign_attrs(class_, alias=None, static_attrs=None, amf3=None, lazy_attrs=None,
+    raw_attrs=None):
     """
     Use to map ClassDef attributes to a class. Useful if you want to keep
     ClassDef configuration with the class being mapped, instead of at 
@@ -343,6 +391,8 @@ def assign_attrs(class_, alias=None, static_attrs=None, amf3=None):
      * alias - string, the amf alias name of the mapped class
      * static_attrs - tuple, a tuple of static attribute names, all values must be strings or unicode
      * amf3 - bool, if True, this object will be encoded in AMF3.
+     * lazy_attrs - tuple, a tuple of static attribute names to decode lazily
+     * raw_attrs - dict, keys = static attribute names, values = undecoded attribute names
     """
     if alias is not None:
         setattr(class_, ALIAS, alias)
@@ -352,3 +402,9 @@ def assign_attrs(class_, alias=None, static_attrs=None, amf3=None):
 
     if amf3 is not None:
         setattr(class_, AMF3, amf3)
+
+    if lazy_attrs is not None:
+        setattr(class_, LAZY_ATTRS, lazy_attrs)
+
+    if raw_attrs is not None:
+        setattr(class_, RAW_ATTRS, raw_attrs)
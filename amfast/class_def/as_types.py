@@ -15,6 +15,23 @@ class AsByteArray(object):
     def __init__(self, bytes):
         self.bytes = bytes
 
+class AsCompressedByteArray(AsByteArray):
+    """An Actionscript ByteArray that is compressed with zlib when it is encoded.
+
+    Call ByteArray.uncompress() on the client to get the original bytes.
+
+    attributes
+    ===========
+    bytes - string, uncompressed bytes.
+    level - int, zlib compression level from 1 (fastest) to 9 (smallest).
+    """
+
+    AS_COMPRESSED_BYTE_ARRAY = True
+
+    def __init__(self, bytes, level=6):
+        AsByteArray.__init__(self, bytes)
+        self.level = level
+
 class AsProxy(object):
     """A proxy object.
 
@@ -47,6 +64,99 @@ class AsNoProxy(object):
     def __init__(self, source=None):
         self.source = source
 
+class AsVector(object):
+    """An Actionscript Vector.<Object>.
+
+    array.array objects and numpy arrays are
+    encoded as Vector.<int>, Vector.<uint> or Vector.<Number>.
+    Use AsVector to encode other sequences as a Vector.
+
+    Numeric Vectors are decoded as array.array objects,
+    Vector.<Object> is decoded as a list.
+
+    attributes
+    ===========
+    source - sequence, the Vector's items.
+    type_name - string, alias of the item type, '' for Object.
+    fixed - bool, True if the Vector's length can not be changed.
+    """
+
+    AS_VECTOR = True
+
+    def __init__(self, source=None, type_name='', fixed=False):
+        if source is None:
+            source = []
+        self.source = source
+        self.type_name = type_name
+        self.fixed = fixed
+
+class AsDictionary(object):
+    """An Actionscript Dictionary.
+
+    Dictionary keys can be any type of value.
+    Set use_dictionaries on the EncoderContext to encode
+    all dicts with keys that are not strings as Dictionaries.
+
+    Dictionaries are decoded as dicts.
+
+    attributes
+    ===========
+    source - dict, the Dictionary's keys and values.
+    weak_keys - bool, True if the Dictionary holds weak references to its keys.
+    """
+
+    AS_DICTIONARY = True
+
+    def __init__(self, source=None, weak_keys=False):
+        if source is None:
+            source = {}
+        self.source = source
+        self.weak_keys = weak_keys
+
+class AsRecordArray(object):
+    """An Array of typed objects, from a numpy structured array.
+
+    1 dimensional numpy structured arrays are encoded
+    as an Array of anonymous objects, with one attribute per field.
+    Use AsRecordArray to give the objects an alias.
+
+    All objects share a single trait, field values are
+    read directly from the array's buffer.
+
+    attributes
+    ===========
+    source - numpy.ndarray, 1 dimensional structured array.
+    alias - string, alias of the objects' class, '' for Object.
+    """
+
+    AS_RECORD_ARRAY = True
+
+    def __init__(self, source, alias=''):
+        self.source = source
+        self.alias = alias
+
+class AsEncoded(object):
+    """A value that is already encoded.
+
+    The encoded bytes are written in place of the value,
+    so that values that rarely change can be encoded once
+    and written to many responses.
+
+    The bytes must be encoded on their own,
+    with a new EncoderContext.
+
+    attributes
+    ===========
+    bytes - string, encoded bytes.
+    amf3 - bool, True if bytes are AMF3 encoded.
+    """
+
+    AS_ENCODED = True
+
+    def __init__(self, bytes, amf3=True):
+        self.bytes = bytes
+        self.amf3 = amf3
+
 class AsError(amfast.AmFastError):
     """Equivalent to: 'Error' in AS."""
 
@@ -1,6 +1,10 @@
-from amfast.decode import decode, decode_packet
-from amfast.context import DecoderContext
+import struct
+
+from amfast.decode import decode, decode_packet, DecodeError, Scanner
+from amfast.context import DecoderContext, LimitError
+from amfast.buffer import BufferUnderflowError
 from amfast.class_def import ClassDefMapper
+from amfast import remoting
 
 class Decoder(object):
     """A wrapper class for convenient access to amfast.decode.decode.
@@ -9,9 +13,28 @@ class Decoder(object):
     ========
      * amf3 - bool - True to decode as AMF3.
      * class_def_mapper - amfast.class_def.ClassDefMapper - The object that retrieves ClassDef objects.
+     * use_byte_views - bool - True to decode ByteArray contents as read-only views of the input.
+     * lazy - bool - True to defer decoding of attributes listed in ClassDef.lazy_attrs
+         until they are accessed. Only applies to AMF3 strings and buffers.
+     * intern_table - amfast.decode.InternTable - Shares short strings and traits
+         between decoded packets.
+     * compact_arrays - bool - True to decode AMF3 arrays that only contain numbers
+         as array.array objects instead of lists.
+     * uncompress_byte_arrays - bool - True to inflate ByteArrays
+         that were compressed with zlib.
+     * stats - amfast.context.CodecStats - Records the number, size and decoding time
+         of values by type and ClassDef alias. Set to None to disable.
+     * max_depth - int - Maximum nesting depth of decoded values. 0 for no limit.
+     * max_length - int - Maximum number of items in a decoded collection. 0 for no limit.
+     * max_string - int - Maximum length of a decoded string or ByteArray. 0 for no limit.
+     * max_bytes - int - Maximum number of bytes read for one decode call. 0 for no limit.
+
+    amfast.context.LimitError is raised when input exceeds a limit.
     """ 
 
-    def __init__(self, amf3=False, class_def_mapper=None):
+    def __init__(self, amf3=False, class_def_mapper=None, use_byte_views=False, lazy=False,
+        intern_table=None, compact_arrays=False, uncompress_byte_arrays=False, stats=None,
+        max_depth=0, max_length=0, max_string=0, max_bytes=0):
 
         self.amf3 = amf3
 
@@ -19,15 +42,351 @@ class Decoder(object):
             class_def_mapper = ClassDefMapper()
         self.class_def_mapper = class_def_mapper
 
+        self.use_byte_views = use_byte_views
+        self.lazy = lazy
+        self.intern_table = intern_table
+        self.compact_arrays = compact_arrays
+        self.uncompress_byte_arrays = uncompress_byte_arrays
+        self.stats = stats
+        self.max_depth = max_depth
+        self.max_length = max_length
+        self.max_string = max_string
+        self.max_bytes = max_bytes
+
     def _getContext(self, input, amf3=None):
         if amf3 is None:
             amf3 = self.amf3
-        return DecoderContext(input, amf3=amf3, class_def_mapper=self.class_def_mapper)
+        return DecoderContext(input, amf3=amf3, class_def_mapper=self.class_def_mapper,
+            use_byte_views=self.use_byte_views, lazy=self.lazy,
+            intern_table=self.intern_table, compact_arrays=self.compact_arrays,
+            uncompress_byte_arrays=self.uncompress_byte_arrays, stats=self.stats,
+            max_depth=self.max_depth, max_length=self.max_length,
+            max_string=self.max_string, max_bytes=self.max_bytes)
+
+    def _getContextKey(self, amf3=None):
+        """Returns a tuple that identifies the settings used by _getContext.
+
+        Contexts created with equal keys can be re-used for each other.
+        """
+        if amf3 is None:
+            amf3 = self.amf3
+
+        return (bool(amf3), id(self.class_def_mapper), self.use_byte_views,
+            self.lazy, id(self.intern_table), self.compact_arrays,
+            self.uncompress_byte_arrays, id(self.stats), self.max_depth,
+            self.max_length, self.max_string, self.max_bytes)
 
     def decode(self, val, amf3=None):
-        """Decode a string or file-like-object from AMF."""
+        """Decode a string, buffer or file-like-object from AMF."""
         return decode(self._getContext(val, amf3))
 
     def decode_packet(self, val, amf3=None):
-        """Decode a string or file-like-object representing an AMF packet."""
+        """Decode a string, buffer or file-like-object representing an AMF packet."""
         return decode_packet(self._getContext(val, amf3))
+
+    def push_decoder(self, packet=False, amf3=None):
+        """Returns a PushDecoder with the same settings as this Decoder."""
+        if amf3 is None:
+            amf3 = self.amf3
+        return PushDecoder(amf3=amf3, class_def_mapper=self.class_def_mapper,
+            packet=packet, use_byte_views=self.use_byte_views, lazy=self.lazy,
+            intern_table=self.intern_table, compact_arrays=self.compact_arrays,
+            uncompress_byte_arrays=self.uncompress_byte_arrays, stats=self.stats,
+            max_depth=self.max_depth, max_length=self.max_length,
+            max_string=self.max_string, max_bytes=self.max_bytes)
+
+def _underflow(needed):
+    """Returns a BufferUnderflowError for framing reads."""
+    exc = BufferUnderflowError('Attempted to read past end of buffer.')
+    exc.needed = needed
+    exc.framed = True
+    return exc
+
+class PushDecoder(object):
+    """Incrementally decodes AMF data that arrives in chunks.
+
+    Bytes are passed to feed() as they are received, and
+    feed() returns a list of every value (or packet) that
+    has been completed. Unconsumed bytes are kept until
+    the next call.
+
+    In packet mode, each packet header and message is decoded
+    as soon as its bytes are available, using the byte lengths
+    from the packet framing, so the body of a large packet
+    does not need to be held in memory all at once.
+
+    PushDecoder
+    ============
+     * amf3 - bool - True to decode values as AMF3.
+     * class_def_mapper - amfast.class_def.ClassDefMapper - The object that retrieves ClassDef objects.
+     * packet - bool - True to decode AMF packets instead of individual values.
+
+    When a value is not complete, an amfast.decode.Scanner keeps
+    track of how much of it has been received, so each chunk is only
+    scanned once, and the value is decoded as soon as it is complete.
+    Values the Scanner can not read, such as externalizable objects,
+    are decoded again from their start when more data arrives.
+    Packet bodies with a known byte length are not decoded until
+    all of their bytes have arrived.
+
+    The other arguments are the same as for Decoder. max_bytes limits
+    the size of each value, or of each packet in packet mode.
+    LimitError is raised as soon as pending data is known to exceed
+    a limit, so an incomplete value can not use unbounded memory.
+    """
+
+    UNKNOWN_LEN = 0xFFFFFFFF
+
+    # Packet decoding states
+    PACKET_START = 0
+    PACKET_HEADERS = 1
+    PACKET_MESSAGE_COUNT = 2
+    PACKET_MESSAGES = 3
+
+    def __init__(self, amf3=False, class_def_mapper=None, packet=False,
+        use_byte_views=False, lazy=False, intern_table=None, compact_arrays=False,
+        uncompress_byte_arrays=False, stats=None, max_depth=0, max_length=0,
+        max_string=0, max_bytes=0):
+        self.amf3 = amf3
+
+        if class_def_mapper is None:
+            class_def_mapper = ClassDefMapper()
+        self.class_def_mapper = class_def_mapper
+
+        self.packet = packet
+        self.use_byte_views = use_byte_views
+        self.lazy = lazy
+        self.intern_table = intern_table
+        self.compact_arrays = compact_arrays
+        self.uncompress_byte_arrays = uncompress_byte_arrays
+        self.stats = stats
+        self.max_depth = max_depth
+        self.max_length = max_length
+        self.max_string = max_string
+        self.max_bytes = max_bytes
+
+        self._chunks = []
+        self._data = ''
+        self._pos = 0 # Position of first unconsumed byte in self._data
+        self._len = 0 # Number of bytes in self._data and self._chunks
+        self._need = 1 # Number of bytes required before decoding is attempted
+        self._scanner = None # Scanner for an incomplete value, False if it can't be scanned
+        self._scan_start = 0 # Position of the incomplete value, relative to self._pos
+        self._scan_amf3 = amf3
+        self._resetPacket()
+
+    def _resetPacket(self):
+        self._state = self.PACKET_START
+        self._packet = None
+        self._remaining = 0 # Headers or messages left to decode
+        self._packet_bytes = 0 # Bytes consumed by the current packet
+
+    def _getPending(self):
+        return self._len - self._pos
+    pending = property(_getPending)
+
+    def _getData(self):
+        """Join received chunks and drop consumed bytes."""
+        if len(self._chunks) > 0:
+            self._chunks.insert(0, self._data[self._pos:])
+            self._data = ''.join(self._chunks)
+            self._chunks = []
+            self._need -= self._pos
+            self._len -= self._pos
+            self._pos = 0
+        return self._data
+
+    def _checkBytes(self, used):
+        """Raise LimitError if the current value or packet uses more than max_bytes."""
+        if self.max_bytes > 0 and used > self.max_bytes:
+            raise LimitError('Decoding exceeds max_bytes (%d).' % self.max_bytes)
+
+    def _getContext(self, data, pos, amf3, used=0):
+        """Returns a context that decodes data from pos.
+
+        used is the number of bytes of the current packet before pos.
+        """
+        max_bytes = self.max_bytes
+        if max_bytes > 0:
+            self._checkBytes(used + 1)
+            max_bytes -= used
+
+        context = DecoderContext(data, amf3=amf3,
+            class_def_mapper=self.class_def_mapper,
+            use_byte_views=self.use_byte_views, lazy=self.lazy,
+            intern_table=self.intern_table, compact_arrays=self.compact_arrays,
+            uncompress_byte_arrays=self.uncompress_byte_arrays, stats=self.stats,
+            max_depth=self.max_depth, max_length=self.max_length,
+            max_string=self.max_string, max_bytes=max_bytes)
+        context.buffer.seek(pos)
+        return context
+
+    def feed(self, bytes):
+        """Decode as much data as possible.
+
+        arguments
+        ==========
+         * bytes - string, the next chunk of AMF data.
+
+        Returns a list of completed values or Packets.
+        """
+        if len(bytes) > 0:
+            self._chunks.append(bytes)
+            self._len += len(bytes)
+
+        results = []
+        while self._len >= self._need and self._len > self._pos:
+            data = self._getData()
+            try:
+                if self.packet is True:
+                    result = self._decodePacketItem(data)
+                else:
+                    result = self._decodeValue(data)
+            except BufferUnderflowError, exc:
+                # Don't wait for data that would exceed the limit.
+                self._checkBytes(self._packet_bytes + exc.needed - self._pos)
+                self._need = exc.needed
+
+                if self._scanner is None and not getattr(exc, 'framed', False):
+                    self._scanner = Scanner(amf3=self._scan_amf3,
+                        class_def_mapper=self.class_def_mapper,
+                        max_depth=self.max_depth, max_length=self.max_length,
+                        max_string=self.max_string)
+                break
+
+            self._need = self._pos + 1
+            self._scanner = None
+            if result is not None:
+                results.append(result[0])
+
+        return results
+
+    def close(self):
+        """Raises DecodeError if incomplete data is left over."""
+        if self._len > self._pos or self._state != self.PACKET_START:
+            raise DecodeError('Incomplete AMF data: %d bytes pending.' % self.pending)
+
+    def _scan(self, data, pos, amf3):
+        """Raise BufferUnderflowError if the value at pos is known to be incomplete.
+
+        The first attempt decodes the value directly. After that, the value
+        is scanned from where the last attempt stopped, until it is complete.
+        """
+        if self._scanner is None:
+            self._scan_start = pos - self._pos
+            self._scan_amf3 = amf3
+            return
+
+        if self._scanner is False:
+            return
+
+        result = self._scanner.scan(data, self._pos + self._scan_start)
+        if result is None:
+            # Decode the value each time instead.
+            self._scanner = False
+        elif result[0] is False:
+            raise _underflow(result[1])
+
+    def _decodeValue(self, data):
+        self._scan(data, self._pos, self.amf3)
+        context = self._getContext(data, self._pos, self.amf3)
+        value = decode(context)
+        self._pos = context.buffer.tell()
+        return (value,)
+
+    def _read(self, data, pos, length):
+        end = pos + length
+        if end > len(data):
+            raise _underflow(end)
+        return (data[pos:end], end)
+
+    def _readUShort(self, data, pos):
+        bytes, pos = self._read(data, pos, 2)
+        return (struct.unpack('!H', bytes)[0], pos)
+
+    def _readULong(self, data, pos):
+        bytes, pos = self._read(data, pos, 4)
+        return (struct.unpack('!L', bytes)[0], pos)
+
+    def _readString(self, data, pos):
+        length, pos = self._readUShort(data, pos)
+        bytes, pos = self._read(data, pos, length)
+        return (unicode(bytes, 'utf8'), pos)
+
+    def _decodeBody(self, data, pos, rpc=False):
+        """Decode an AMF0 header or message body."""
+        byte_len, pos = self._readULong(data, pos)
+        if byte_len != self.UNKNOWN_LEN:
+            self._checkBytes(self._packet_bytes + pos - self._pos + byte_len)
+            if pos + byte_len > len(data):
+                raise _underflow(pos + byte_len)
+
+        # The list of RPC arguments is scanned as an AMF0 array.
+        self._scan(data, pos, False)
+
+        if rpc is True:
+            # The list of RPC arguments is not
+            # added to the reference count.
+            arg_count, pos = self._readULong(data, pos + 1)
+            if self.max_length > 0 and arg_count > self.max_length:
+                raise LimitError('Collection of %d items exceeds max_length (%d).' %
+                    (arg_count, self.max_length))
+            context = self._getContext(data, pos, False, self._packet_bytes + pos - self._pos)
+            body = [decode(context) for i in xrange(arg_count)]
+        else:
+            context = self._getContext(data, pos, False, self._packet_bytes + pos - self._pos)
+            body = decode(context)
+        return (body, context.buffer.tell())
+
+    def _decodePacketItem(self, data):
+        """Decode the next complete part of a packet.
+
+        Returns a tuple containing the packet when it is complete.
+        """
+        pos = self._pos
+
+        if self._state == self.PACKET_START:
+            version, pos = self._readUShort(data, pos)
+            if version not in (remoting.Packet.FLASH_8,
+                remoting.Packet.FLASH_COM, remoting.Packet.FLASH_9):
+                raise DecodeError('Unknown client type.')
+
+            self._remaining, pos = self._readUShort(data, pos)
+            self._packet = remoting.Packet(client_type=version)
+            self._state = self.PACKET_HEADERS
+
+        elif self._state == self.PACKET_HEADERS:
+            name, pos = self._readString(data, pos)
+            required, pos = self._read(data, pos, 1)
+            value, pos = self._decodeBody(data, pos)
+
+            self._packet.headers.append(remoting.Header(name,
+                ord(required) == 1, value))
+            self._remaining -= 1
+
+        elif self._state == self.PACKET_MESSAGE_COUNT:
+            self._remaining, pos = self._readUShort(data, pos)
+            self._state = self.PACKET_MESSAGES
+
+        elif self._state == self.PACKET_MESSAGES:
+            target, pos = self._readString(data, pos)
+            response, pos = self._readString(data, pos)
+            body, pos = self._decodeBody(data, pos, len(response) > 0)
+
+            self._packet.messages.append(remoting.Message(target,
+                response, body))
+            self._remaining -= 1
+
+        self._packet_bytes += pos - self._pos
+        self._checkBytes(self._packet_bytes)
+        self._pos = pos
+
+        if self._remaining == 0:
+            if self._state == self.PACKET_HEADERS:
+                self._state = self.PACKET_MESSAGE_COUNT
+            elif self._state == self.PACKET_MESSAGES:
+                packet = self._packet
+                self._resetPacket()
+                return (packet,)
+
+        return None
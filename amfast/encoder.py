@@ -11,29 +11,55 @@ class Encoder(object):
      * use_collections - bool - True to encode lists and tuples as ArrayCollections.
      * use_proxies - bool - True to encode dicts as ObjectProxies.
      * use_references - bool - True to encode multiply occuring objects by reference.
+     * use_object_references - bool - False to skip reference tracking for objects
+         when values are trees, which is faster for large, JSON-like values.
+         Strings and traits are still encoded by reference. Objects that occur
+         more than once are encoded each time, and cycles raise EncodeError.
      * use_legacy_xml - bool - True to XML as XMLDocument instead of e4x.
      * include_private - bool - True to encode attributes starting with '_'.
+     * use_shared_traits - bool - True to encode runs of dicts with the same keys
+         in a list as sealed objects that share a trait. AMF3 only.
+     * use_dictionaries - bool - True to encode dicts with keys that are not strings
+         as Dictionaries. AMF3 only.
      * class_def_mapper - amfast.class_def.ClassDefMapper - The object that retrieves ClassDef objects.
-     * buffer - file-like-object - Output buffer. Set to None to output to a string.
+     * buffer - file-like-object or int - Output buffer, or file descriptor.
+         Set to None to output to a string.
+     * chunk_size - int - If > 0 and buffer is None, output a list of strings
+         of this size instead of a single string. The list can be returned
+         directly as a WSGI response or passed to a file's writelines method.
+         If buffer is set, output is written to buffer each time this many bytes
+         are encoded, so large values are streamed in constant memory.
+     * max_size - int - If > 0 and buffer is None or chunk_size is set,
+         raise amfast.buffer.BufferError when the output grows larger
+         than this many bytes.
+     * stats - amfast.context.CodecStats - Records the number, size and encoding time
+         of values by type and ClassDef alias. Set to None to disable.
 
     """ 
 
     def __init__(self, amf3=False, use_collections=False, use_proxies=False,
         use_references=True, use_legacy_xml=False, include_private=False,
-        class_def_mapper=None, buffer=None):
+        class_def_mapper=None, buffer=None, chunk_size=0, use_shared_traits=False,
+        use_dictionaries=False, stats=None, use_object_references=True, max_size=0):
 
         self.amf3 = amf3
         self.use_collections = use_collections
         self.use_proxies = use_proxies
         self.use_references = use_references
+        self.use_object_references = use_object_references
         self.use_legacy_xml = use_legacy_xml
         self.include_private = include_private
+        self.use_shared_traits = use_shared_traits
+        self.use_dictionaries = use_dictionaries
+        self.stats = stats
 
         if class_def_mapper is None:
             class_def_mapper = ClassDefMapper()
         self.class_def_mapper = class_def_mapper
 
         self.buffer = buffer
+        self.chunk_size = chunk_size
+        self.max_size = max_size
 
     def _getContext(self, amf3=None):
         if amf3 is None:
@@ -44,16 +70,38 @@ class Encoder(object):
             'use_collections': self.use_collections,
             'use_proxies': self.use_proxies,
             'use_references': self.use_references,
+            'use_object_references': self.use_object_references,
             'use_legacy_xml': self.use_legacy_xml,
             'include_private': self.include_private,
-            'class_def_mapper': self.class_def_mapper
+            'use_shared_traits': self.use_shared_traits,
+            'use_dictionaries': self.use_dictionaries,
+            'class_def_mapper': self.class_def_mapper,
+            'stats': self.stats
         }
  
         if self.buffer is not None:
             kwargs['buffer'] = self.buffer
+        if self.chunk_size > 0:
+            kwargs['chunk_size'] = self.chunk_size
+        if self.max_size > 0:
+            kwargs['max_size'] = self.max_size
 
         return EncoderContext(**kwargs);
 
+    def _getContextKey(self, amf3=None):
+        """Returns a tuple that identifies the settings used by _getContext.
+
+        Contexts created with equal keys can be re-used for each other.
+        """
+        if amf3 is None:
+            amf3 = self.amf3
+
+        return (bool(amf3), self.use_collections, self.use_proxies,
+            self.use_references, self.use_object_references, self.use_legacy_xml,
+            self.include_private, self.use_shared_traits, self.use_dictionaries,
+            id(self.class_def_mapper), id(self.stats), id(self.buffer),
+            self.chunk_size, self.max_size)
+
     def encode(self, val, amf3=None):
         """Encode a value to AMF."""
         return encode(val, self._getContext(amf3))
@@ -39,6 +39,35 @@
 #define OBJECT_TYPE 0x0A
 #define XML_TYPE 0x0B
 #define BYTE_ARRAY_TYPE 0x0C
+#define VECTOR_INT_TYPE 0x0D
+#define VECTOR_UINT_TYPE 0x0E
+#define VECTOR_DOUBLE_TYPE 0x0F
+#define VECTOR_OBJECT_TYPE 0x10
+#define DICTIONARY_TYPE 0x11
+
+// ISmallMessage types
+#define SMALL_ASYNC_MSG 1
+#define SMALL_COMMAND_MSG 2
+#define SMALL_ACKNOWLEDGE_MSG 3
+
+// ISmallMessage flags
+#define SMALL_HAS_NEXT_FLAG 0x80
+#define SMALL_BODY_FLAG 0x01
+#define SMALL_CLIENT_ID_FLAG 0x02
+#define SMALL_DESTINATION_FLAG 0x04
+#define SMALL_HEADERS_FLAG 0x08
+#define SMALL_MESSAGE_ID_FLAG 0x10
+#define SMALL_TIMESTAMP_FLAG 0x20
+#define SMALL_TIME_TO_LIVE_FLAG 0x40
+#define SMALL_CLIENT_ID_BYTES_FLAG 0x01
+#define SMALL_MESSAGE_ID_BYTES_FLAG 0x02
+#define SMALL_CORRELATION_ID_FLAG 0x01
+#define SMALL_CORRELATION_ID_BYTES_FLAG 0x02
+#define SMALL_OPERATION_FLAG 0x01
+
+// Flex UIDs are sent as 16 bytes by ISmallMessage
+#define UID_BYTES 16
+#define UID_LEN 36
 
 // ---- AMF0
 
@@ -81,6 +110,34 @@ typedef int Py_ssize_t;
 #endif
 #endif
 
+/*
+ * A LazyValue holds the byte span of an encoded AMF3 value,
+ * and a snapshot of the reference tables at the start of the span.
+ *
+ * The value is decoded the first time it is needed.
+ * The encoder writes the span as-is if the value has not been decoded.
+ */
+typedef struct {
+    PyObject_HEAD
+    PyObject *source; // The object being decoded
+    PyObject *class_mapper; // Object that retrieves ClassDef objects.
+    PyObject *use_byte_views; // True to decode ByteArray contents as views of the input
+    PyObject *obj_refs; // IdxObj for objects, NULL after the value is decoded
+    PyObject *string_refs; // IdxObj for strings, NULL after the value is decoded
+    PyObject *class_refs; // IdxObj for ClassDefs, NULL after the value is decoded
+    int obj_len; // Number of object references before the span
+    int string_len; // Number of string references before the span
+    int class_len; // Number of ClassDef references before the span
+    Py_ssize_t start; // Position of the first byte of the span
+    Py_ssize_t end; // Position after the last byte of the span, -1 if the span is incomplete
+    PyObject *value; // Decoded value
+    PyObject *refs; // IdxObj for objects of the decoded value
+    int spliceable; // 1 if the span can be written by the encoder as-is, -1 if not, 0 if unknown
+    int obj_count; // Number of object references in the span
+    int string_count; // Number of string references in the span
+    int class_count; // Number of ClassDef references in the span
+} LazyValueObj;
+
 // Functions
 int type_list(PyObject* class_def, PyObject *mapper,
     PyObject* name_list, PyObject* val_list, int type);
@@ -1,14 +1,30 @@
 #include <Python.h>
+#include <errno.h>
+
+#ifdef _WIN32
+#include <io.h>
+#define fd_write(fd, data, len) _write(fd, data, (unsigned int)(len))
+#else
+#include <unistd.h>
+#define fd_write(fd, data, len) write(fd, data, (size_t)(len))
+#endif
 
 #define BUFFER_MODULE
 #include "buffer.h"
 
+// Initial size of a contiguous write buffer
+#define BUFFER_MIN_SIZE 256
+
+// Default chunk size of a buffer that writes to a sink
+#define BUFFER_SINK_SIZE 65536
+
 // ------------------------ DECLARATIONS --------------------------------- //
 //
 // ---- GLOBALS
 static PyObject *amfast_mod;
 static PyObject *amfast_Error;
 static PyObject *amfast_BufferError;
+static PyObject *amfast_BufferUnderflowError;
 
 static PyObject* Buffer_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
 {
@@ -20,43 +36,217 @@ static PyObject* Buffer_new(PyTypeObject *type, PyObject *args, PyObject *kwargs
         self->buf = NULL;
         self->len = 0;
         self->pos = 0;
+        self->chunk_size = 0;
+        self->flushed = 0;
+        self->max_size = 0;
+        self->chunk = NULL;
+        self->chunks = NULL;
+        self->sink = NULL;
+        self->sink_fd = -1;
+        self->grows = 0;
+#ifdef PyBUF_SIMPLE
+        self->has_view = 0;
+#endif
     }
 
     return (PyObject *)self;
 }
 
+/*
+ * Returns 1 if an object can be used as the source of a Buffer.
+ *
+ * Strings and objects supporting the buffer protocol
+ * (buffer, bytearray, memoryview, mmap, array) are accepted.
+ */
+static int Buffer_checkSource(PyObject *source)
+{
+    if (PyString_Check(source))
+        return 1;
+
+    // Unicode objects expose their internal representation.
+    if (PyUnicode_Check(source))
+        return 0;
+
+#ifdef PyBUF_SIMPLE
+    if (PyObject_CheckBuffer(source))
+        return 1;
+#endif
+
+    return PyObject_CheckReadBuffer(source);
+}
+
+/*
+ * Point the buffer at the source object's memory.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_initSource(BufferObj *self, PyObject *source)
+{
+    if (PyString_Check(source)) {
+        self->buf = PyString_AS_STRING(source);
+        self->len = PyString_GET_SIZE(source);
+    } else if (!Buffer_checkSource(source)) {
+        PyErr_SetString(amfast_BufferError, "Source must be a string or support the buffer protocol.");
+        return -1;
+    }
+#ifdef PyBUF_SIMPLE
+    else if (PyObject_CheckBuffer(source)) {
+        if (PyObject_GetBuffer(source, &self->view, PyBUF_SIMPLE) == -1)
+            return -1;
+        self->has_view = 1;
+        self->buf = (char*)self->view.buf;
+        self->len = self->view.len;
+    }
+#endif
+    else {
+        const void *c_buf;
+        Py_ssize_t c_len;
+        if (PyObject_AsReadBuffer(source, &c_buf, &c_len) == -1)
+            return -1;
+        self->buf = (char*)c_buf;
+        self->len = c_len;
+    }
+
+    Py_INCREF(source);
+    self->src_str = source;
+    return 0;
+}
+
+/*
+ * Set the object completed chunks are written to.
+ *
+ * The sink is a file descriptor, or an object with a write method.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_initSink(BufferObj *self, PyObject *sink)
+{
+    if (PyInt_Check(sink) || PyLong_Check(sink)) {
+        long fd = PyInt_AsLong(sink);
+        if (fd == -1 && PyErr_Occurred())
+            return -1;
+
+        if (fd < 0 || fd > INT_MAX) {
+            PyErr_SetString(amfast_BufferError, "sink must be a valid file descriptor.");
+            return -1;
+        }
+        self->sink_fd = (int)fd;
+    } else if (!PyObject_HasAttrString(sink, "write")) {
+        PyErr_SetString(amfast_BufferError, "sink must be a file descriptor or have a write method.");
+        return -1;
+    }
+
+    Py_INCREF(sink);
+    self->sink = sink;
+    return 0;
+}
+
 static int Buffer_init(BufferObj *self, PyObject *args, PyObject *kwargs)
 {
-    static char *kwlist[] = {"source", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O", kwlist, &self->src_str))
+    PyObject *source = NULL;
+    Py_ssize_t chunk_size = 0;
+    Py_ssize_t max_size = 0;
+    PyObject *sink = NULL;
+
+    static char *kwlist[] = {"source", "chunk_size", "max_size", "sink", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O" SSIZE_T_FMT SSIZE_T_FMT "O", kwlist,
+        &source, &chunk_size, &max_size, &sink))
         return -1;
 
-    if (self->src_str != NULL) {
-        Py_INCREF(self->src_str);
-        self->buf = PyString_AsString(self->src_str);
-        self->len = PyString_GET_SIZE(self->src_str);
+    if (sink == Py_None)
+        sink = NULL;
+
+    if (chunk_size < 0 || max_size < 0) {
+        PyErr_SetString(amfast_BufferError, "chunk_size and max_size can not be negative.");
+        return -1;
+    }
+
+    if (source != NULL && source != Py_None) {
+        if (chunk_size > 0) {
+            PyErr_SetString(amfast_BufferError, "chunk_size can only be used with write buffers.");
+            return -1;
+        }
+
+        if (max_size > 0) {
+            PyErr_SetString(amfast_BufferError, "max_size can only be used with write buffers.");
+            return -1;
+        }
+
+        if (sink != NULL) {
+            PyErr_SetString(amfast_BufferError, "sink can only be used with write buffers.");
+            return -1;
+        }
+
+        if (Buffer_initSource(self, source) == -1)
+            return -1;
+    } else if (chunk_size > 0 || sink != NULL) {
+        if (sink != NULL) {
+            if (Buffer_initSink(self, sink) == -1)
+                return -1;
+
+            if (chunk_size == 0)
+                chunk_size = BUFFER_SINK_SIZE;
+        }
+
+        // Output is written to a list of PyStrings,
+        // so the buffer never needs to be realloced or copied.
+        self->chunks = PyList_New(0);
+        if (!self->chunks)
+            return -1;
+        self->chunk_size = chunk_size;
+
+        if (self->sink) {
+            // Output written to a sink is staged in private memory,
+            // that is re-used for every chunk.
+            self->buf = (char*)malloc(sizeof(char) * (size_t)chunk_size);
+            if (!self->buf) {
+                PyErr_NoMemory();
+                return -1;
+            }
+            self->len = chunk_size;
+        }
     } else {
-        self->len = 256;
-        self->buf = (char*)malloc(sizeof(char*) * (size_t)self->len);
+        self->len = BUFFER_MIN_SIZE;
+        if (max_size > 0 && max_size < self->len)
+            self->len = max_size;
+        self->buf = (char*)malloc(sizeof(char) * (size_t)self->len);
+        if (!self->buf) {
+            self->len = 0;
+            PyErr_NoMemory();
+            return -1;
+        }
     }
 
+    self->max_size = max_size;
     return 0;
 }
 
 static void Buffer_dealloc(BufferObj *self)
 {
+#ifdef PyBUF_SIMPLE
+    if (self->has_view)
+        PyBuffer_Release(&self->view);
+#endif
     Py_XDECREF(self->src_str);
-    if (!self->src_str)
+    if (self->sink) {
+        free(self->buf);
+    }
+    Py_XDECREF(self->sink);
+    if (self->chunk_size > 0) {
+        Py_XDECREF(self->chunk);
+        Py_XDECREF(self->chunks);
+    } else if (!self->src_str) {
         free(self->buf);
+    }
     self->ob_type->tp_free((PyObject*)self);
 }
 
 /*
  * Returns the current position in the buffer.
  */
-static int Buffer_tell(BufferObj *self)
+static Py_ssize_t Buffer_tell(BufferObj *self)
 {
-    return self->pos;
+    return self->flushed + self->pos;
 }
 
 /*
@@ -64,7 +254,7 @@ static int Buffer_tell(BufferObj *self)
  */
 static PyObject* PyBuffer_tell(BufferObj *self)
 {
-    return PyInt_FromLong((long)Buffer_tell(self));
+    return PyInt_FromSsize_t(Buffer_tell(self));
 }
 
 /*
@@ -72,8 +262,24 @@ static PyObject* PyBuffer_tell(BufferObj *self)
  *
  * Returns position or -1 on error.
  */
-static int Buffer_seek(BufferObj *self, int pos)
+static Py_ssize_t Buffer_seek(BufferObj *self, Py_ssize_t pos)
 {
+    if (self->chunk_size > 0) {
+        // Only the current chunk can be re-written.
+        if (pos < self->flushed) {
+            PyErr_SetString(amfast_BufferError, "Attempted to seek into a completed chunk.");
+            return -1;
+        }
+
+        if (pos - self->flushed > self->len) {
+            PyErr_SetString(amfast_BufferError, "Attempted to seek past end of buffer.");
+            return -1;
+        }
+
+        self->pos = pos - self->flushed;
+        return pos;
+    }
+
     if (pos < 0) {
         PyErr_SetString(amfast_BufferError, "Attempted to seek before start of buffer.");
         return -1;
@@ -93,50 +299,109 @@ static int Buffer_seek(BufferObj *self, int pos)
  */
 static PyObject* PyBuffer_seek(BufferObj *self, PyObject *args, PyObject *kwargs)
 {
-    int pos;
+    Py_ssize_t pos;
 
-    if (!PyArg_ParseTuple(args, "i", &pos))
+    if (!PyArg_ParseTuple(args, SSIZE_T_FMT, &pos))
         return NULL;
 
-    int new_pos = Buffer_seek(self, pos);
+    Py_ssize_t new_pos = Buffer_seek(self, pos);
     if (new_pos == -1)
         return NULL;
 
-    return PyInt_FromLong((long)new_pos);
+    return PyInt_FromSsize_t(new_pos);
+}
+
+/*
+ * Sets BufferUnderflowError.
+ *
+ * needed is the buffer length required
+ * to complete the failed read.
+ */
+static void Buffer_setUnderflow(Py_ssize_t needed)
+{
+    PyObject *exc = PyObject_CallFunction(amfast_BufferUnderflowError,
+        "s", "Attempted to read past end of buffer.");
+    if (!exc)
+        return;
+
+    PyObject *needed_obj = PyInt_FromSsize_t(needed);
+    if (!needed_obj) {
+        Py_DECREF(exc);
+        return;
+    }
+
+    int result = PyObject_SetAttrString(exc, "needed", needed_obj);
+    Py_DECREF(needed_obj);
+    if (result == -1) {
+        Py_DECREF(exc);
+        return;
+    }
+
+    PyErr_SetObject(amfast_BufferUnderflowError, exc);
+    Py_DECREF(exc);
 }
 
 /*
  * Returns a pointer to the current buffer position
  * and increments the position by the given length.
  */
-static char* Buffer_read(BufferObj *self, int len)
+static char* Buffer_read(BufferObj *self, Py_ssize_t len)
 {
-    int new_pos = self->pos + len;
-    if (new_pos < 0) {
+    if (len < -self->pos) {
         PyErr_SetString(amfast_BufferError, "Attempted to read before start of buffer.");
         return NULL;
     }
 
-    if (new_pos > self->len) {
-        PyErr_SetString(amfast_BufferError, "Attempted to read past end of buffer.");
+    // Compare against the remaining length,
+    // so a large len can not overflow the new position.
+    if (len > self->len - self->pos) {
+        if (len > PY_SSIZE_T_MAX - self->pos) {
+            PyErr_SetString(amfast_BufferError, "Attempted to read past maximum buffer size.");
+        } else {
+            Buffer_setUnderflow(self->pos + len);
+        }
         return NULL;
     }
 
     char* result = (char*)(self->buf + self->pos);
-    self->pos = new_pos;
+    self->pos += len;
     return result;
 }
 
 /*
  * Returns a PyString.
  */
-static PyObject* Buffer_readPyString(BufferObj *self, int len)
+static PyObject* Buffer_readPyString(BufferObj *self, Py_ssize_t len)
 {
     char *str = Buffer_read(self, len);
     if (!str)
        return NULL;
 
-    return PyString_FromStringAndSize(str, (Py_ssize_t)len);
+    return PyString_FromStringAndSize(str, len);
+}
+
+/*
+ * Returns a read-only view of the source
+ * that does not copy the underlying bytes.
+ */
+static PyObject* Buffer_readView(BufferObj *self, Py_ssize_t len)
+{
+    if (!self->src_str) {
+        PyErr_SetString(amfast_BufferError, "Cannot read from write-only buffer.");
+        return NULL;
+    }
+
+    Py_ssize_t start = self->pos;
+    if (!Buffer_read(self, len))
+        return NULL;
+
+    #if PY_VERSION_HEX >= 0x02070000
+    // memoryview only supports the new buffer protocol.
+    if (PyMemoryView_Check(self->src_str))
+        return PySequence_GetSlice(self->src_str, start, start + len);
+    #endif
+
+    return PyBuffer_FromObject(self->src_str, start, len);
 }
 
 /*
@@ -144,9 +409,9 @@ static PyObject* Buffer_readPyString(BufferObj *self, int len)
  */
 static PyObject* PyBuffer_readPyString(BufferObj *self, PyObject *args, PyObject *kwargs)
 {
-    int len;
+    Py_ssize_t len;
 
-    if (!PyArg_ParseTuple(args, "i", &len))
+    if (!PyArg_ParseTuple(args, SSIZE_T_FMT, &len))
         return NULL;
 
     if (!self->src_str) {
@@ -157,6 +422,28 @@ static PyObject* PyBuffer_readPyString(BufferObj *self, PyObject *args, PyObject
     return Buffer_readPyString(self, len);
 }
 
+/*
+ * Check that len more bytes can be written
+ * without exceeding max_size.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Buffer_checkSize(BufferObj *self, Py_ssize_t len)
+{
+    Py_ssize_t max_size = self->max_size > 0 ? self->max_size : PY_SSIZE_T_MAX;
+    if (len > max_size - Buffer_tell(self)) {
+        if (self->max_size > 0) {
+            PyErr_Format(amfast_BufferError,
+                "Attempted to write past max_size (%ld).", (long)self->max_size);
+        } else {
+            PyErr_SetString(amfast_BufferError, "Attempted to write past maximum buffer size.");
+        }
+        return 0;
+    }
+
+    return 1;
+}
+
 /*
  * Expand the length of the buffer.
  *
@@ -165,27 +452,229 @@ static PyObject* PyBuffer_readPyString(BufferObj *self, PyObject *args, PyObject
  * Returns size of new buffer, or -1 if failed.
  *
  */
-static int Buffer_grow(BufferObj *self, int len)
+static Py_ssize_t Buffer_grow(BufferObj *self, Py_ssize_t len)
 {
-    int new_len = self->pos + len;
-    int current_len = self->len;
+    if (!Buffer_checkSize(self, len))
+        return -1;
+
+    // Can not overflow, because Buffer_checkSize passed.
+    Py_ssize_t new_len = self->pos + len;
+    Py_ssize_t current_len = self->len;
+    if (new_len <= current_len)
+        return current_len;
+
+    Py_ssize_t max_size = self->max_size > 0 ? self->max_size : PY_SSIZE_T_MAX;
+    if (current_len < BUFFER_MIN_SIZE)
+        current_len = BUFFER_MIN_SIZE;
 
     while (new_len > current_len) {
         // Buffer is not large enough.
         // Double its memory, so that we don't need to realloc everytime.
-        current_len *= 2;
+        if (current_len > max_size / 2) {
+            current_len = max_size;
+        } else {
+            current_len *= 2;
+        }
     }
 
-    if (current_len != self->len) {
-        self->buf = (char*)realloc(self->buf, sizeof(char*) * (size_t)current_len);
-        if (!self->buf) {
-            PyErr_SetNone(PyExc_MemoryError);
+    char *new_buf = (char*)realloc(self->buf, sizeof(char) * (size_t)current_len);
+    if (!new_buf) {
+        // The old buffer is still valid, and is freed on dealloc.
+        PyErr_NoMemory();
+        return -1;
+    }
+    self->buf = new_buf;
+    self->len = current_len;
+    self->grows++;
+
+    return current_len;
+}
+
+/*
+ * Start a new output chunk.
+ *
+ * The chunk is a PyString that is written to in place.
+ * This is safe, because no other object has a reference
+ * to the string until the chunk is completed.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_newChunk(BufferObj *self)
+{
+    self->chunk = PyString_FromStringAndSize(NULL, self->chunk_size);
+    if (!self->chunk)
+        return -1;
+
+    self->buf = PyString_AS_STRING(self->chunk);
+    self->len = self->chunk_size;
+    self->pos = 0;
+    return 0;
+}
+
+/*
+ * Write bytes to a file descriptor.
+ *
+ * The GIL is released while writing,
+ * so other threads can run while a socket or pipe blocks.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_writeFd(int fd, char *data, Py_ssize_t len)
+{
+    while (len > 0) {
+        Py_ssize_t write_len = len;
+        if (write_len > INT_MAX)
+            write_len = INT_MAX;
+
+        Py_ssize_t written;
+        Py_BEGIN_ALLOW_THREADS
+        written = (Py_ssize_t)fd_write(fd, data, write_len);
+        Py_END_ALLOW_THREADS
+
+        if (written == -1) {
+            if (errno == EINTR) {
+                if (PyErr_CheckSignals() == -1)
+                    return -1;
+                continue;
+            }
+
+            PyErr_SetFromErrno(PyExc_OSError);
             return -1;
         }
-        self->len = current_len;
+
+        data += written;
+        len -= written;
     }
 
-    return current_len;
+    return 0;
+}
+
+/*
+ * Write a string to the sink.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_writeSink(BufferObj *self, PyObject *py_str)
+{
+    if (self->sink_fd != -1)
+        return Buffer_writeFd(self->sink_fd, PyString_AS_STRING(py_str), PyString_GET_SIZE(py_str));
+
+    PyObject *result = PyObject_CallMethod(self->sink, "write", "O", py_str);
+    if (!result)
+        return -1;
+
+    Py_DECREF(result);
+    return 0;
+}
+
+/*
+ * Write the buffered output to the sink.
+ *
+ * File descriptors are written to directly from the buffer's memory.
+ * Objects with a write method are passed a new string for every chunk,
+ * so strings are never modified after the sink has seen them.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_flushSink(BufferObj *self)
+{
+    Py_ssize_t pos = self->pos;
+    if (pos == 0)
+        return 0;
+
+    int result;
+    if (self->sink_fd != -1) {
+        result = Buffer_writeFd(self->sink_fd, self->buf, pos);
+    } else {
+        PyObject *py_str = PyString_FromStringAndSize(self->buf, pos);
+        if (!py_str)
+            return -1;
+
+        result = Buffer_writeSink(self, py_str);
+        Py_DECREF(py_str);
+    }
+
+    if (result == -1)
+        return -1;
+
+    self->flushed += pos;
+    self->pos = 0;
+    return 0;
+}
+
+/*
+ * Move the current chunk to the list of completed chunks.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Buffer_flushChunk(BufferObj *self)
+{
+    if (self->sink)
+        return Buffer_flushSink(self);
+
+    if (!self->chunk)
+        return 0;
+
+    PyObject *chunk = self->chunk;
+    Py_ssize_t pos = self->pos;
+
+    self->chunk = NULL;
+    self->buf = NULL;
+    self->len = 0;
+    self->pos = 0;
+
+    if (pos == 0) {
+        Py_DECREF(chunk);
+        return 0;
+    }
+
+    if (pos < PyString_GET_SIZE(chunk)) {
+        // Trim unused space
+        if (_PyString_Resize(&chunk, pos) == -1)
+            return -1;
+    }
+
+    int result = PyList_Append(self->chunks, chunk);
+    Py_DECREF(chunk);
+    if (result == -1)
+        return -1;
+
+    self->flushed += pos;
+    return 0;
+}
+
+/*
+ * Write a C string to a chunked buffer.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Buffer_writeChunks(BufferObj *self, char *str, Py_ssize_t len)
+{
+    if (!Buffer_checkSize(self, len))
+        return 0;
+
+    while (len > 0) {
+        if (!self->chunk && !self->sink) {
+            if (Buffer_newChunk(self) == -1)
+                return 0;
+        }
+
+        Py_ssize_t write_len = self->len - self->pos;
+        if (len < write_len)
+            write_len = len;
+
+        memcpy(self->buf + self->pos, str, (size_t)write_len);
+        self->pos += write_len;
+        str += write_len;
+        len -= write_len;
+
+        if (self->pos == self->len) {
+            if (Buffer_flushChunk(self) == -1)
+                return 0;
+        }
+    }
+
+    return 1;
 }
 
 /*
@@ -193,8 +682,11 @@ static int Buffer_grow(BufferObj *self, int len)
  *
  * Returns 1 on success, 0 on failure.
  */
-static int Buffer_write(BufferObj *self, char *str, int len)
+static int Buffer_write(BufferObj *self, char *str, Py_ssize_t len)
 {
+    if (self->chunk_size > 0)
+        return Buffer_writeChunks(self, str, len);
+
     if (Buffer_grow(self, len) == -1)
         return 0;
 
@@ -209,11 +701,61 @@ static int Buffer_write(BufferObj *self, char *str, int len)
 static int Buffer_writePyString(BufferObj *self, PyObject* py_str)
 {
     char *c_str = PyString_AS_STRING(py_str);
-    int len = PyString_GET_SIZE(py_str);
+    Py_ssize_t len = PyString_GET_SIZE(py_str);
+
+    if (self->chunk_size > 0 && len >= self->chunk_size) {
+        // Strings are immutable,
+        // so large strings can be used as chunks without copying.
+        if (!Buffer_checkSize(self, len))
+            return 0;
+
+        if (Buffer_flushChunk(self) == -1)
+            return 0;
+
+        if (self->sink) {
+            if (Buffer_writeSink(self, py_str) == -1)
+                return 0;
+        } else if (PyList_Append(self->chunks, py_str) == -1) {
+            return 0;
+        }
+
+        self->flushed += len;
+        return 1;
+    }
 
     return Buffer_write(self, c_str, len);
 }
 
+/*
+ * Writes the contents of another write buffer.
+ *
+ * Completed chunks from a chunked buffer
+ * are shared instead of copied when possible.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Buffer_writeBuffer(BufferObj *self, BufferObj *other)
+{
+    if (other->src_str) {
+        PyErr_SetString(amfast_BufferError, "Cannot copy from read-only buffer.");
+        return 0;
+    }
+
+    if (other->chunk_size > 0) {
+        Py_ssize_t chunk_count = PyList_GET_SIZE(other->chunks);
+        Py_ssize_t i;
+        for (i = 0; i < chunk_count; i++) {
+            if (!Buffer_writePyString(self, PyList_GET_ITEM(other->chunks, i)))
+                return 0;
+        }
+
+        if (!other->chunk && !other->sink)
+            return 1;
+    }
+
+    return Buffer_write(self, other->buf, other->pos);
+}
+
 /*
  * Python exposed version of Buffer_writePyString.
  */
@@ -246,14 +788,159 @@ static PyObject* PyBuffer_writePyString(BufferObj *self, PyObject *args, PyObjec
  */
 static PyObject* PyBuffer_getPyString(BufferObj *self, PyObject *args, PyObject *kwargs)
 {
+    if (self->sink) {
+        PyErr_SetString(amfast_BufferError, "Output was written to sink.");
+        return NULL;
+    }
+
+    if (self->chunk_size > 0) {
+        PyObject *result = PyString_FromStringAndSize(NULL, Buffer_tell(self));
+        if (!result)
+            return NULL;
+
+        char *c_result = PyString_AS_STRING(result);
+        Py_ssize_t chunk_count = PyList_GET_SIZE(self->chunks);
+        Py_ssize_t i;
+        for (i = 0; i < chunk_count; i++) {
+            PyObject *chunk = PyList_GET_ITEM(self->chunks, i);
+            Py_ssize_t chunk_len = PyString_GET_SIZE(chunk);
+            memcpy(c_result, PyString_AS_STRING(chunk), (size_t)chunk_len);
+            c_result += chunk_len;
+        }
+
+        if (self->chunk)
+            memcpy(c_result, self->buf, (size_t)self->pos);
+
+        return result;
+    }
+
     if (!self->src_str) {
-        return PyString_FromStringAndSize(self->buf, (Py_ssize_t)self->pos);
+        return PyString_FromStringAndSize(self->buf, self->pos);
+    } else if (!PyString_Check(self->src_str)) {
+        // Copy the contents of a buffer protocol source.
+        return PyString_FromStringAndSize(self->buf, self->len);
     } else {
         Py_XINCREF(self->src_str);
         return self->src_str;
     }
 }
 
+/*
+ * Gets a list of strings for the entire buffer.
+ */
+static PyObject* PyBuffer_getChunks(BufferObj *self, PyObject *args, PyObject *kwargs)
+{
+    if (self->sink) {
+        PyErr_SetString(amfast_BufferError, "Output was written to sink.");
+        return NULL;
+    }
+
+    if (self->chunk_size > 0) {
+        // Complete the current chunk,
+        // later writes will start a new one.
+        if (Buffer_flushChunk(self) == -1)
+            return NULL;
+
+        return PyList_GetSlice(self->chunks, 0, PyList_GET_SIZE(self->chunks));
+    }
+
+    PyObject *value = PyBuffer_getPyString(self, NULL, NULL);
+    if (!value)
+        return NULL;
+
+    PyObject *result = PyList_New(1);
+    if (!result) {
+        Py_DECREF(value);
+        return NULL;
+    }
+
+    PyList_SET_ITEM(result, 0, value);
+    return result;
+}
+
+/*
+ * Write the current chunk to the sink.
+ */
+static PyObject* PyBuffer_flush(BufferObj *self)
+{
+    if (self->sink && Buffer_flushChunk(self) == -1)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+/*
+ * Reset the buffer so it can be used again.
+ *
+ * Write buffers are emptied, but keep their allocated memory.
+ * Read buffers are pointed at a new source.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Buffer_reset(BufferObj *self, PyObject *source)
+{
+    if (source == NULL) {
+        if (self->src_str) {
+            PyErr_SetString(amfast_BufferError, "Read buffers must be reset with a new source.");
+            return 0;
+        }
+
+        if (self->sink) {
+            self->flushed = 0;
+        } else if (self->chunk_size > 0) {
+            Py_XDECREF(self->chunk);
+            self->chunk = NULL;
+            self->buf = NULL;
+            self->len = 0;
+            self->flushed = 0;
+            if (PyList_SetSlice(self->chunks, 0, PyList_GET_SIZE(self->chunks), NULL) == -1)
+                return 0;
+        }
+
+        self->pos = 0;
+        return 1;
+    }
+
+    if (!self->src_str) {
+        PyErr_SetString(amfast_BufferError, "Write buffers can not be reset with a source.");
+        return 0;
+    }
+
+    // Release the old source
+#ifdef PyBUF_SIMPLE
+    if (self->has_view) {
+        PyBuffer_Release(&self->view);
+        self->has_view = 0;
+    }
+#endif
+    Py_CLEAR(self->src_str);
+    self->buf = NULL;
+    self->len = 0;
+    self->pos = 0;
+
+    if (Buffer_initSource(self, source) == -1)
+        return 0;
+
+    return 1;
+}
+
+/*
+ * Python exposed version of Buffer_reset.
+ */
+static PyObject* PyBuffer_reset(BufferObj *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *source = NULL;
+
+    static char *kwlist[] = {"source", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O", kwlist, &source))
+        return NULL;
+
+    if (!Buffer_reset(self, source))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef Buffer_methods[] = {
     {"read", (PyCFunction)PyBuffer_readPyString, METH_VARARGS | METH_KEYWORDS,
      "Read from buffer. Returns a string.\n\n"
@@ -262,6 +949,21 @@ static PyMethodDef Buffer_methods[] = {
      " * len - int, length to read from buffer."},
     {"getvalue", (PyCFunction)PyBuffer_getPyString, METH_VARARGS | METH_KEYWORDS,
      "Gets a string value.\n"},
+    {"getchunks", (PyCFunction)PyBuffer_getChunks, METH_NOARGS,
+     "Gets a list of string values.\n\n"
+     "If the buffer was created with chunk_size, the\n"
+     "strings are the output chunks and the value is never\n"
+     "joined into a single string. Otherwise the list\n"
+     "contains the value returned by getvalue."},
+    {"flush", (PyCFunction)PyBuffer_flush, METH_NOARGS,
+     "Writes buffered output to the sink.\n\n"
+     "Does nothing if the buffer was created without a sink."},
+    {"reset", (PyCFunction)PyBuffer_reset, METH_VARARGS | METH_KEYWORDS,
+     "Resets the buffer so it can be used again.\n\n"
+     "Write buffers are emptied, but keep their allocated memory.\n\n"
+     "arguments\n"
+     "==========\n"
+     " * source - str or buffer, new source for a read buffer. Default = None"},
     {"tell", (PyCFunction)PyBuffer_tell, METH_NOARGS,
      "Returns the current position in the buffer.\n\n"},
     {"seek", (PyCFunction)PyBuffer_seek, METH_VARARGS  | METH_KEYWORDS,
@@ -299,7 +1001,17 @@ static PyTypeObject BufferType = {
     0,                         /*tp_setattro*/
     0,                         /*tp_as_buffer*/
     Py_TPFLAGS_DEFAULT,        /*tp_flags*/
-    "A buffer used to encode and decode AMF strings.",           /* tp_doc */
+    "A buffer used to encode and decode AMF strings.\n\n"
+    "arguments\n"
+    "==========\n"
+    " * source - str or buffer, data to read from. Default = None (write buffer)\n"
+    " * chunk_size - int, write output to a list of strings of this size,\n"
+    "     instead of a single contiguous buffer. Default = 0\n"
+    " * max_size - int, raise BufferError when a write would make the output\n"
+    "     larger than this many bytes. 0 for no limit. Default = 0\n"
+    " * sink - int or file-like-object, file descriptor or object with a write method\n"
+    "     that each completed chunk is written to, instead of keeping\n"
+    "     the output in memory. chunk_size defaults to 64 KiB. Default = None\n",           /* tp_doc */
     0,		               /* tp_traverse */
     0,		               /* tp_clear */
     0,		               /* tp_richcompare */
@@ -351,6 +1063,16 @@ initbuffer(void)
     if (PyModule_AddObject(m, "BufferError", amfast_BufferError) == -1)
         return;
 
+    // Raised when a read runs past the end of the available data.
+    // The 'needed' attribute holds the buffer length required by the read.
+    amfast_BufferUnderflowError = PyErr_NewException("amfast.buffer.BufferUnderflowError", amfast_BufferError, NULL);
+    if (!amfast_BufferUnderflowError)
+        return;
+
+    Py_INCREF(amfast_BufferUnderflowError);
+    if (PyModule_AddObject(m, "BufferUnderflowError", amfast_BufferUnderflowError) == -1)
+        return;
+
     // Setup types
     BufferType.tp_new = Buffer_new;
     if (PyType_Ready(&BufferType) < 0)
@@ -368,6 +1090,10 @@ initbuffer(void)
     PyBuffer_API[Buffer_seek_NUM] = (void*)Buffer_seek;
     PyBuffer_API[Buffer_write_NUM] = (void*)Buffer_write;
     PyBuffer_API[Buffer_writePyString_NUM] = (void*)Buffer_writePyString;
+    PyBuffer_API[Buffer_readView_NUM] = (void*)Buffer_readView;
+    PyBuffer_API[Buffer_checkSource_NUM] = (void*)Buffer_checkSource;
+    PyBuffer_API[Buffer_writeBuffer_NUM] = (void*)Buffer_writeBuffer;
+    PyBuffer_API[Buffer_reset_NUM] = (void*)Buffer_reset;
 
     PyObject *c_api = PyCObject_FromVoidPtr((void*)PyBuffer_API, NULL);
     if (c_api != NULL)
@@ -11,48 +11,81 @@ typedef int Py_ssize_t;
 #define PY_SSIZE_T_MAX INT_MAX
 #define PY_SSIZE_T_MIN INT_MIN
 #endif
+#define PyInt_FromSsize_t(x) PyInt_FromLong((long)(x))
+#define PyNumber_AsSsize_t(o, exc) ((int)PyInt_AsLong(o))
+#define SSIZE_T_FMT "i"
+#else
+#define SSIZE_T_FMT "n"
 #endif
 
 // Use this string buffer for better performance when
 // using string input/outputs.
 typedef struct {
     PyObject_HEAD
-    PyObject *src_str; // Ptr to source if source string was passed
+    PyObject *src_str; // Ptr to source if source string or buffer was passed
     char *buf; // C-Buffer
-    int len; // Length of current buffer
-    int pos; // Current position in buffer
+    Py_ssize_t len; // Length of current buffer
+    Py_ssize_t pos; // Current position in buffer
+    Py_ssize_t chunk_size; // Size of output chunks, 0 for a single contiguous buffer
+    Py_ssize_t flushed; // Number of bytes in completed chunks
+    Py_ssize_t max_size; // Maximum number of bytes that can be written, 0 for no limit
+    PyObject *chunk; // PyString currently being written to, NULL when writing to a sink
+    PyObject *chunks; // PyList of completed chunks
+    PyObject *sink; // Object completed chunks are written to instead of chunks, or NULL
+    int sink_fd; // File descriptor completed chunks are written to, or -1
+    int grows; // Number of times buf was re-allocated to make room for a write
+#ifdef PyBUF_SIMPLE
+    Py_buffer view; // Buffer protocol view of a non-string source
+    int has_view; // 1 if view must be released
+#endif
 } BufferObj;
 
 // All this nasty stuff is for properly exposing API functions. Ugh
 
 // Number of exposed functions
-#define PyBuffer_API_pointers 6
+#define PyBuffer_API_pointers 10
 
 // C Exposed functions
 #define Buffer_read_NUM 0
 #define Buffer_read_RETURN char*
-#define Buffer_read_PROTO (BufferObj *self, int len)
+#define Buffer_read_PROTO (BufferObj *self, Py_ssize_t len)
 
 #define Buffer_readPyString_NUM 1
 #define Buffer_readPyString_RETURN PyObject*
-#define Buffer_readPyString_PROTO (BufferObj *self, int len)
+#define Buffer_readPyString_PROTO (BufferObj *self, Py_ssize_t len)
 
 #define Buffer_tell_NUM 2
-#define Buffer_tell_RETURN int
+#define Buffer_tell_RETURN Py_ssize_t
 #define Buffer_tell_PROTO (BufferObj *self)
 
 #define Buffer_seek_NUM 3
-#define Buffer_seek_RETURN int
-#define Buffer_seek_PROTO (BufferObj *self, int pos)
+#define Buffer_seek_RETURN Py_ssize_t
+#define Buffer_seek_PROTO (BufferObj *self, Py_ssize_t pos)
 
 #define Buffer_write_NUM 4
 #define Buffer_write_RETURN int
-#define Buffer_write_PROTO (BufferObj *self, char *str, int len)
+#define Buffer_write_PROTO (BufferObj *self, char *str, Py_ssize_t len)
 
 #define Buffer_writePyString_NUM 5
 #define Buffer_writePyString_RETURN int
 #define Buffer_writePyString_PROTO (BufferObj *self, PyObject* py_str)
 
+#define Buffer_readView_NUM 6
+#define Buffer_readView_RETURN PyObject*
+#define Buffer_readView_PROTO (BufferObj *self, Py_ssize_t len)
+
+#define Buffer_checkSource_NUM 7
+#define Buffer_checkSource_RETURN int
+#define Buffer_checkSource_PROTO (PyObject *source)
+
+#define Buffer_writeBuffer_NUM 8
+#define Buffer_writeBuffer_RETURN int
+#define Buffer_writeBuffer_PROTO (BufferObj *self, BufferObj *other)
+
+#define Buffer_reset_NUM 9
+#define Buffer_reset_RETURN int
+#define Buffer_reset_PROTO (BufferObj *self, PyObject *source)
+
 #ifdef BUFFER_MODULE
 /* This section is used when compiling module.c */
 
@@ -62,6 +95,10 @@ static Buffer_tell_RETURN Buffer_tell Buffer_tell_PROTO;
 static Buffer_seek_RETURN Buffer_seek Buffer_seek_PROTO;
 static Buffer_write_RETURN Buffer_write Buffer_write_PROTO;
 static Buffer_writePyString_RETURN Buffer_writePyString Buffer_writePyString_PROTO;
+static Buffer_readView_RETURN Buffer_readView Buffer_readView_PROTO;
+static Buffer_checkSource_RETURN Buffer_checkSource Buffer_checkSource_PROTO;
+static Buffer_writeBuffer_RETURN Buffer_writeBuffer Buffer_writeBuffer_PROTO;
+static Buffer_reset_RETURN Buffer_reset Buffer_reset_PROTO;
 
 #else
 /* This section is used in modules that use the module's API */
@@ -86,6 +123,18 @@ static void **PyBuffer_API;
 #define Buffer_writePyString \
  (*(Buffer_writePyString_RETURN (*)Buffer_writePyString_PROTO) PyBuffer_API[Buffer_writePyString_NUM])
 
+#define Buffer_readView \
+ (*(Buffer_readView_RETURN (*)Buffer_readView_PROTO) PyBuffer_API[Buffer_readView_NUM])
+
+#define Buffer_checkSource \
+ (*(Buffer_checkSource_RETURN (*)Buffer_checkSource_PROTO) PyBuffer_API[Buffer_checkSource_NUM])
+
+#define Buffer_writeBuffer \
+ (*(Buffer_writeBuffer_RETURN (*)Buffer_writeBuffer_PROTO) PyBuffer_API[Buffer_writeBuffer_NUM])
+
+#define Buffer_reset \
+ (*(Buffer_reset_RETURN (*)Buffer_reset_PROTO) PyBuffer_API[Buffer_reset_NUM])
+
 static PyObject* import_buffer_mod(void)
 {
     PyObject *m = PyImport_ImportModule("amfast.buffer");
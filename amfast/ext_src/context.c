@@ -6,6 +6,17 @@
 
 #include "structmember.h"
 
+// For 2.4 support
+#ifndef T_PYSSIZET
+#define T_PYSSIZET T_INT
+#endif
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <sys/time.h>
+#endif
+
 // ------------------------ DECLARATIONS --------------------------------- //
 //
 // ---- GLOBALS
@@ -15,6 +26,328 @@ static PyObject *buffer_mod;
 static PyObject *class_def_mod;
 static PyObject *amfast_Error;
 static PyObject *amfast_ContextError;
+static PyObject *amfast_LimitError;
+
+// ---- CODEC STATS
+
+// Names of type markers, as used by CodecStats.types
+static const char *stats_amf0_names[STATS_MARKERS] = {"number", "boolean", "string",
+    "object", "movieclip", "null", "undefined", "reference", "ecma-array", "object-end",
+    "strict-array", "date", "long-string", "unsupported", "recordset", "xml-document",
+    "typed-object", "avmplus-object"};
+static const char *stats_amf3_names[STATS_MARKERS] = {"undefined", "null", "false",
+    "true", "integer", "double", "string", "xml-doc", "date", "array", "object", "xml",
+    "byte-array", "vector-int", "vector-uint", "vector-double", "vector-object", "dictionary"};
+static const char *stats_ref_names[3] = {"object", "string", "class"};
+
+static PyTypeObject CodecStatsType;
+
+static PyObject* CodecStats_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    CodecStatsObj *self;
+
+    self = (CodecStatsObj *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        // tp_alloc zeroes all counters.
+        self->aliases = PyDict_New();
+        if (self->aliases == NULL) {
+            Py_DECREF(self);
+            return NULL;
+        }
+    }
+
+    return (PyObject *)self;
+}
+
+static void CodecStats_dealloc(CodecStatsObj *self)
+{
+    Py_XDECREF(self->aliases);
+    self->ob_type->tp_free((PyObject*)self);
+}
+
+/*
+ * Current time in seconds, used to time values.
+ */
+static double Stats_clock(void)
+{
+#ifdef _WIN32
+    LARGE_INTEGER freq;
+    LARGE_INTEGER count;
+    QueryPerformanceFrequency(&freq);
+    QueryPerformanceCounter(&count);
+    return (double)count.QuadPart / (double)freq.QuadPart;
+#else
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return (double)tv.tv_sec + (double)tv.tv_usec * 0.000001;
+#endif
+}
+
+/*
+ * Returns the number of times an output buffer has been re-allocated.
+ *
+ * External buffers are not counted.
+ */
+static long Stats_bufferGrows(PyObject *buf, int int_buf)
+{
+    if (int_buf != 1)
+        return 0;
+    return (long)((BufferObj*)buf)->grows;
+}
+
+/*
+ * Record a value.
+ *
+ * Values with an unknown type marker are not recorded.
+ */
+static void Stats_record(CodecStatsObj *self, int amf3, int marker, Py_ssize_t bytes, double seconds)
+{
+    if (marker < 0 || marker >= STATS_MARKERS)
+        return;
+
+    amf3 = amf3 ? 1 : 0;
+    self->counts[amf3][marker]++;
+    self->bytes[amf3][marker] += bytes;
+    self->seconds[amf3][marker] += seconds;
+}
+
+/*
+ * Record a value with a ClassDef alias.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int Stats_recordAlias(CodecStatsObj *self, PyObject *alias, Py_ssize_t bytes, double seconds)
+{
+    PyObject *item = PyDict_GetItem(self->aliases, alias);
+    if (item == NULL) {
+        item = Py_BuildValue("[lld]", 0L, 0L, 0.0);
+        if (item == NULL)
+            return 0;
+
+        int return_value = PyDict_SetItem(self->aliases, alias, item);
+        Py_DECREF(item);
+        if (return_value == -1)
+            return 0;
+    }
+
+    PyObject *count = PyInt_FromLong(PyInt_AsLong(PyList_GET_ITEM(item, 0)) + 1);
+    PyObject *total_bytes = PyInt_FromLong(PyInt_AsLong(PyList_GET_ITEM(item, 1)) + bytes);
+    PyObject *total_seconds = PyFloat_FromDouble(PyFloat_AsDouble(PyList_GET_ITEM(item, 2)) + seconds);
+    if (count == NULL || total_bytes == NULL || total_seconds == NULL) {
+        Py_XDECREF(count);
+        Py_XDECREF(total_bytes);
+        Py_XDECREF(total_seconds);
+        return 0;
+    }
+
+    // PyList_SetItem steals the references.
+    PyList_SetItem(item, 0, count);
+    PyList_SetItem(item, 1, total_bytes);
+    PyList_SetItem(item, 2, total_seconds);
+    return 1;
+}
+
+/* Clear all counters. */
+static PyObject* PyCodecStats_reset(CodecStatsObj *self)
+{
+    memset(self->counts, 0, sizeof(self->counts));
+    memset(self->bytes, 0, sizeof(self->bytes));
+    memset(self->seconds, 0, sizeof(self->seconds));
+    memset(self->ref_hits, 0, sizeof(self->ref_hits));
+    memset(self->ref_misses, 0, sizeof(self->ref_misses));
+    self->buffer_grows = 0;
+    self->calls = 0;
+    PyDict_Clear(self->aliases);
+
+    Py_RETURN_NONE;
+}
+
+/* Returns a dict of type name -> (count, bytes, seconds). */
+static PyObject* PyCodecStats_getTypes(CodecStatsObj *self, void *closure)
+{
+    PyObject *types = PyDict_New();
+    if (types == NULL)
+        return NULL;
+
+    int amf3;
+    int marker;
+    for (amf3 = 0; amf3 < 2; amf3++) {
+        for (marker = 0; marker < STATS_MARKERS; marker++) {
+            if (self->counts[amf3][marker] == 0)
+                continue;
+
+            PyObject *name = PyString_FromFormat("%s %s", amf3 ? "amf3" : "amf0",
+                amf3 ? stats_amf3_names[marker] : stats_amf0_names[marker]);
+            if (name == NULL) {
+                Py_DECREF(types);
+                return NULL;
+            }
+
+            PyObject *item = Py_BuildValue("(lld)", self->counts[amf3][marker],
+                self->bytes[amf3][marker], self->seconds[amf3][marker]);
+            if (item == NULL) {
+                Py_DECREF(name);
+                Py_DECREF(types);
+                return NULL;
+            }
+
+            int return_value = PyDict_SetItem(types, name, item);
+            Py_DECREF(name);
+            Py_DECREF(item);
+            if (return_value == -1) {
+                Py_DECREF(types);
+                return NULL;
+            }
+        }
+    }
+
+    return types;
+}
+
+/* Returns a dict of alias -> (count, bytes, seconds). */
+static PyObject* PyCodecStats_getAliases(CodecStatsObj *self, void *closure)
+{
+    PyObject *aliases = PyDict_New();
+    if (aliases == NULL)
+        return NULL;
+
+    PyObject *key;
+    PyObject *value;
+    Py_ssize_t idx = 0;
+    while (PyDict_Next(self->aliases, &idx, &key, &value)) {
+        PyObject *item = PyList_AsTuple(value);
+        if (item == NULL) {
+            Py_DECREF(aliases);
+            return NULL;
+        }
+
+        int return_value = PyDict_SetItem(aliases, key, item);
+        Py_DECREF(item);
+        if (return_value == -1) {
+            Py_DECREF(aliases);
+            return NULL;
+        }
+    }
+
+    return aliases;
+}
+
+/* Returns a dict of reference table name -> (hits, misses). */
+static PyObject* PyCodecStats_getRefs(CodecStatsObj *self, void *closure)
+{
+    return Py_BuildValue("{s:(ll),s:(ll),s:(ll)}",
+        stats_ref_names[STATS_OBJ_REFS], self->ref_hits[STATS_OBJ_REFS], self->ref_misses[STATS_OBJ_REFS],
+        stats_ref_names[STATS_STRING_REFS], self->ref_hits[STATS_STRING_REFS], self->ref_misses[STATS_STRING_REFS],
+        stats_ref_names[STATS_CLASS_REFS], self->ref_hits[STATS_CLASS_REFS], self->ref_misses[STATS_CLASS_REFS]);
+}
+
+/* Returns a dict of reference table name -> fraction of lookups that found a reference. */
+static PyObject* PyCodecStats_getHitRates(CodecStatsObj *self, void *closure)
+{
+    double rates[3];
+    int i;
+    for (i = 0; i < 3; i++) {
+        long total = self->ref_hits[i] + self->ref_misses[i];
+        rates[i] = total ? (double)self->ref_hits[i] / (double)total : 0.0;
+    }
+
+    return Py_BuildValue("{s:d,s:d,s:d}",
+        stats_ref_names[STATS_OBJ_REFS], rates[STATS_OBJ_REFS],
+        stats_ref_names[STATS_STRING_REFS], rates[STATS_STRING_REFS],
+        stats_ref_names[STATS_CLASS_REFS], rates[STATS_CLASS_REFS]);
+}
+
+static PyMethodDef CodecStats_methods[] = {
+    {"reset", (PyCFunction)PyCodecStats_reset, METH_NOARGS,
+     "Clear all counters."},
+    {NULL}  /* Sentinel */
+};
+
+static PyMemberDef CodecStats_members[] = {
+    {"calls", T_LONG, offsetof(CodecStatsObj, calls), READONLY,
+     "int - Number of encode or decode calls."},
+    {"buffer_grows", T_LONG, offsetof(CodecStatsObj, buffer_grows), READONLY,
+     "int - Number of times an output buffer was re-allocated."},
+    {NULL}  /* Sentinel */
+};
+
+static PyGetSetDef CodecStats_getset[] = {
+    {"types", (getter)PyCodecStats_getTypes, NULL,
+     "dict - Type name ('amf3 object', 'amf0 string', etc.) -> (count, bytes, seconds).", NULL},
+    {"aliases", (getter)PyCodecStats_getAliases, NULL,
+     "dict - ClassDef alias -> (count, bytes, seconds).", NULL},
+    {"refs", (getter)PyCodecStats_getRefs, NULL,
+     "dict - Reference table ('object', 'string', 'class') -> (hits, misses).", NULL},
+    {"hit_rates", (getter)PyCodecStats_getHitRates, NULL,
+     "dict - Reference table -> fraction of values that were references.", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject CodecStatsType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "amfast.context.CodecStats", /*tp_name*/
+    sizeof(CodecStatsObj),     /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)CodecStats_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "CodecStats\n"
+    "============\n"
+    "Records the values processed by every EncoderContext\n"
+    "or DecoderContext created with stats=CodecStats().\n\n"
+    "Bytes and seconds of a value include its nested values.\n"
+    "Contexts created without stats do not record anything.\n", /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    CodecStats_methods,        /* tp_methods */
+    CodecStats_members,        /* tp_members */
+    CodecStats_getset,         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    0,                         /* tp_init */
+    0,                         /* tp_alloc */
+    CodecStats_new,            /* tp_new */
+};
+
+/*
+ * Check the stats argument of a context.
+ *
+ * Returns 0 on success, -1 on failure.
+ */
+static int Stats_initContext(PyObject **stats)
+{
+    if (*stats == NULL || *stats == Py_None) {
+        *stats = Py_None;
+    } else if (!PyObject_TypeCheck(*stats, &CodecStatsType)) {
+        *stats = NULL;
+        PyErr_SetString(amfast_ContextError, "stats must be an amfast.context.CodecStats object.");
+        return -1;
+    }
+
+    Py_INCREF(*stats);
+    return 0;
+}
 
 // Idx maps indexes to PyObjects.
 static PyObject* Idx_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
@@ -36,19 +369,57 @@ static PyObject* Idx_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
     return (PyObject *)self;
 }
 
-static void Idx_dealloc(IdxObj *self)
+/*
+ * Releases all indexed objects.
+ */
+static void Idx_clear(IdxObj *self)
 {
     int i;
     int len = self->pos;
     for (i = 0; i < len; i++) {
         Py_DECREF(self->objs[i]);
     }
+    self->pos = 0;
+}
 
+static void Idx_dealloc(IdxObj *self)
+{
+    PyObject_GC_UnTrack(self);
+    Idx_clear(self);
     free(self->objs);
 
     self->ob_type->tp_free((PyObject*)self);
 }
 
+/*
+ * Indexed objects can hold references back to
+ * the Idx (lazily decoded values), so Idx
+ * participates in garbage collection.
+ */
+static int Idx_traverse(IdxObj *self, visitproc visit, void *arg)
+{
+    int i;
+    for (i = 0; i < self->pos; i++) {
+        Py_VISIT(self->objs[i]);
+    }
+    return 0;
+}
+
+static int Idx_tp_clear(IdxObj *self)
+{
+    Idx_clear(self);
+    return 0;
+}
+
+/*
+ * Removes all indexes, but keeps allocated memory.
+ */
+static PyObject* PyIdx_reset(IdxObj *self)
+{
+    Idx_clear(self);
+    Py_RETURN_NONE;
+}
+
 /*
  * Maps a PyObject to the next index.
  * Returns mapped index, or -1 on failure.
@@ -102,7 +473,7 @@ static PyObject* PyIdx_map(IdxObj *self, PyObject *args, PyObject *kwargs)
  */
 static PyObject* Idx_ret(IdxObj *self, int idx)
 {
-    if (idx >= self->pos) {
+    if (idx < 0 || idx >= self->pos) {
         PyErr_SetString(amfast_ContextError, "Index is out of range.");
         return NULL;
     }
@@ -112,6 +483,27 @@ static PyObject* Idx_ret(IdxObj *self, int idx)
     return result;
 }
 
+/*
+ * Removes all indexes after len.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Idx_truncate(IdxObj *self, int len)
+{
+    if (len < 0 || len > self->pos) {
+        PyErr_SetString(amfast_ContextError, "Index is out of range.");
+        return 0;
+    }
+
+    int i;
+    int pos = self->pos;
+    self->pos = len;
+    for (i = len; i < pos; i++) {
+        Py_DECREF(self->objs[i]);
+    }
+    return 1;
+}
+
 /*
  * Python exposed version of Idx_ret.
  */
@@ -136,6 +528,8 @@ static PyMethodDef Idx_methods[] = {
      "arguments\n"
      "==========\n"
      " * idx - int, the index of the object to retrieve."},
+    {"reset", (PyCFunction)PyIdx_reset, METH_NOARGS,
+     "Remove all indexes."},
     {NULL}  /* Sentinel */
 };
 
@@ -160,10 +554,10 @@ static PyTypeObject IdxType = {
     0,                         /*tp_getattro*/
     0,                         /*tp_setattro*/
     0,                         /*tp_as_buffer*/
-    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC, /*tp_flags*/
     "Maps objects to AMF reference indexes.",           /* tp_doc */
-    0,		               /* tp_traverse */
-    0,		               /* tp_clear */
+    (traverseproc)Idx_traverse, /* tp_traverse */
+    (inquiry)Idx_tp_clear,     /* tp_clear */
     0,		               /* tp_richcompare */
     0,		               /* tp_weaklistoffset */
     0,		               /* tp_iter */
@@ -182,6 +576,14 @@ static PyTypeObject IdxType = {
 };
 
 // Ref maps PyObjects indexes.
+
+// Initial number of slots in a Ref table
+#define REF_MIN_SIZE 32
+
+// Tables larger than this are released when a Ref is cleared,
+// smaller tables are kept for the next encode.
+#define REF_KEEP_SIZE 65536
+
 static PyObject* Ref_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
 {
     RefObj *self;
@@ -189,7 +591,9 @@ static PyObject* Ref_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
     self = (RefObj *)type->tp_alloc(type, 0);
     if (self != NULL) {
         self->idx = 0;
-        self->refs = NULL;
+        self->table = NULL;
+        self->size = 0;
+        self->used = 0;
     }
 
     return (PyObject *)self;
@@ -197,63 +601,137 @@ static PyObject* Ref_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
 
 static int Ref_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
 {
-    RefObj *self = (RefObj*)self_raw;
-
-    self->refs = PyDict_New();
-    if (self->refs == NULL)
-        return -1;
-    
     return 0;
 }
 
-static void Ref_dealloc(RefObj *self)
+/*
+ * Returns the slot an object is mapped to,
+ * or the empty slot it should be mapped to.
+ *
+ * Objects are aligned, so the low bits of their
+ * addresses are mixed into the rest before masking.
+ */
+static RefEntry* Ref_lookup(RefEntry *table, int size, PyObject *obj)
+{
+    size_t hash = (size_t)obj >> 3;
+    hash ^= hash >> 16;
+    hash *= 0x45d9f3b;
+    hash ^= hash >> 16;
+
+    size_t mask = (size_t)size - 1;
+    size_t i = hash & mask;
+    while (table[i].obj != NULL && table[i].obj != obj) {
+        i = (i + 1) & mask;
+    }
+
+    return &table[i];
+}
+
+/*
+ * Moves entries to a table with new_size slots.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Ref_resize(RefObj *self, int new_size)
+{
+    RefEntry *table = (RefEntry*)calloc((size_t)new_size, sizeof(RefEntry));
+    if (table == NULL) {
+        PyErr_SetNone(PyExc_MemoryError);
+        return 0;
+    }
+
+    int i;
+    for (i = 0; i < self->size; i++) {
+        if (self->table[i].obj != NULL)
+            *Ref_lookup(table, new_size, self->table[i].obj) = self->table[i];
+    }
+
+    free(self->table);
+    self->table = table;
+    self->size = new_size;
+    return 1;
+}
+
+/*
+ * Releases all mapped objects.
+ *
+ * The table is kept, so a Ref can be re-used
+ * without allocating it again.
+ */
+static void Ref_clear(RefObj *self)
 {
+    self->idx = 0;
+    if (self->used == 0)
+        return;
+
     // DECREF all mapped refs
     // They are incremented in Ref_map.
-    PyObject *obj, *key, *val;
-    Py_ssize_t pos = 0;
+    int i;
+    for (i = 0; i < self->size; i++) {
+        PyObject *obj = self->table[i].obj;
+        if (obj != NULL) {
+            self->table[i].obj = NULL;
+            Py_DECREF(obj);
+        }
+    }
+    self->used = 0;
 
-    while (PyDict_Next(self->refs, &pos, &key, &val)) {
-        obj = (PyObject*) PyLong_AsVoidPtr(key);
-        Py_DECREF(obj);
+    if (self->size > REF_KEEP_SIZE) {
+        free(self->table);
+        self->table = NULL;
+        self->size = 0;
     }
+}
 
-    Py_XDECREF(self->refs);
+static void Ref_dealloc(RefObj *self)
+{
+    Ref_clear(self);
+    free(self->table);
     self->ob_type->tp_free((PyObject*)self);
 }
 
+/*
+ * Removes all references.
+ */
+static PyObject* PyRef_reset(RefObj *self)
+{
+    Ref_clear(self);
+    Py_RETURN_NONE;
+}
+
 /*
  * Maps a PyObject to the next index.
  * Returns mapped index, or -1 on failure.
  */
 static int Ref_map(RefObj *self, PyObject *obj)
 {
-    PyObject *key = PyLong_FromVoidPtr((void*)obj);
-    if (key == NULL)
-        return -1;
-
-    PyObject *val = PyInt_FromLong((long)self->idx);
-    if (val == NULL) {
-        Py_DECREF(key);
-        return -1;
-    }
+    // Keep the table at most 2/3 full.
+    if (self->used * 3 >= self->size * 2) {
+        int new_size = self->size > 0 ? self->size * 2 : REF_MIN_SIZE;
+        if (new_size < 0) {
+            PyErr_SetString(amfast_ContextError, "Too many references.");
+            return -1;
+        }
 
-    int result = PyDict_SetItem(self->refs, key, val);
-    Py_DECREF(key);
-    if (result == -1) {
-        Py_DECREF(val);
-        return -1;
+        if (!Ref_resize(self, new_size))
+            return -1;
     }
 
-    Py_DECREF(val); // give ownership to dict
+    RefEntry *entry = Ref_lookup(self->table, self->size, obj);
 
-    // Make sure the mapped object doesn't get
-    // GC'd before we retrieve it.
-    Py_INCREF(obj);
+    // Objects can be mapped more than once when references are not used,
+    // but only the first mapping holds a reference to the object.
+    if (entry->obj == NULL) {
+        // Make sure the mapped object doesn't get
+        // GC'd before we retrieve it.
+        Py_INCREF(obj);
+        entry->obj = obj;
+        self->used++;
+    }
+    entry->idx = self->idx;
 
-    result = self->idx;
     self->idx++;
-    return result;
+    return entry->idx;
 }
 
 /*
@@ -280,22 +758,14 @@ static PyObject* PyRef_map(RefObj *self, PyObject *args, PyObject *kwargs)
  */
 static int Ref_ret(RefObj *self, PyObject *obj)
 {
-    PyObject *key = PyLong_FromVoidPtr((void*)obj);
-    if (key == NULL)
+    if (self->used == 0)
         return -1;
 
-    if (PyDict_Contains(self->refs, key) == 0) {
-        Py_DECREF(key);
-        return -1;
-    }
-
-    PyObject *val = PyDict_GetItem(self->refs, key);
-    Py_DECREF(key);
-    if (val == NULL)
+    RefEntry *entry = Ref_lookup(self->table, self->size, obj);
+    if (entry->obj == NULL)
         return -1;
 
-    long idx = PyInt_AsLong(val);
-    return (int)idx;
+    return entry->idx;
 }
 
 /*
@@ -323,6 +793,8 @@ static PyMethodDef Ref_methods[] = {
      "arguments\n"
      "==========\n"
      " * obj - object, the object to retrieve an index for."},
+    {"reset", (PyCFunction)PyRef_reset, METH_NOARGS,
+     "Remove all references."},
     {NULL}  /* Sentinel */
 };
 
@@ -388,7 +860,20 @@ static PyObject* Decoder_new(PyTypeObject *type, PyObject *args, PyObject *kwarg
         self->apply_name = NULL;
         self->class_def_name = NULL;
         self->extern_name = NULL;
+        self->use_byte_views = NULL;
+        self->lazy = NULL;
+        self->intern_table = NULL;
+        self->compact_arrays = NULL;
+        self->uncompress_byte_arrays = NULL;
+        self->stats = NULL;
+        self->stats_marker = STATS_IDLE;
         self->int_buf = 0;
+        self->max_depth = 0;
+        self->max_length = 0;
+        self->max_string = 0;
+        self->max_bytes = 0;
+        self->depth = 0;
+        self->bytes_read = 0;
     }
 
     return (PyObject *)self;
@@ -434,13 +919,24 @@ static int Decoder_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
 {
     DecoderObj *self = (DecoderObj*)self_raw;
 
-    static char *kwlist[] = {"buffer", "class_def_mapper", "amf3", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|OO", kwlist,
-        &self->buf, &self->class_mapper, &self->amf3))
+    static char *kwlist[] = {"buffer", "class_def_mapper", "amf3", "use_byte_views", "lazy", "intern_table",
+        "compact_arrays", "uncompress_byte_arrays", "stats", "max_depth", "max_length",
+        "max_string", "max_bytes", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|OOOOOOOOiii" SSIZE_T_FMT, kwlist,
+        &self->buf, &self->class_mapper, &self->amf3, &self->use_byte_views, &self->lazy,
+        &self->intern_table, &self->compact_arrays, &self->uncompress_byte_arrays, &self->stats,
+        &self->max_depth, &self->max_length, &self->max_string, &self->max_bytes))
         return -1;
 
-    if (PyString_Check(self->buf) == 1) {
-        // If input is a string, create our own buffer object.
+    if (self->max_depth < 0 || self->max_length < 0 ||
+        self->max_string < 0 || self->max_bytes < 0) {
+        PyErr_SetString(amfast_ContextError, "Decoder limits must be 0 (no limit) or greater.");
+        return -1;
+    }
+
+    if (Buffer_checkSource(self->buf) == 1) {
+        // If input is a string or supports the buffer protocol,
+        // create our own buffer object to read from it directly.
         PyObject *buf_class = PyObject_GetAttrString(buffer_mod, "Buffer");
         if (buf_class == NULL)
             return -1;
@@ -474,6 +970,29 @@ static int Decoder_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
         self->amf3 = Py_False;
     Py_INCREF(self->amf3);
 
+    if (self->use_byte_views == NULL)
+        self->use_byte_views = Py_False;
+    Py_INCREF(self->use_byte_views);
+
+    if (self->lazy == NULL)
+        self->lazy = Py_False;
+    Py_INCREF(self->lazy);
+
+    if (self->intern_table == NULL)
+        self->intern_table = Py_None;
+    Py_INCREF(self->intern_table);
+
+    if (self->compact_arrays == NULL)
+        self->compact_arrays = Py_False;
+    Py_INCREF(self->compact_arrays);
+
+    if (self->uncompress_byte_arrays == NULL)
+        self->uncompress_byte_arrays = Py_False;
+    Py_INCREF(self->uncompress_byte_arrays);
+
+    if (Stats_initContext(&self->stats) == -1)
+        return -1;
+
     // Init object reference indexes.
     if (Decoder_initIdx(self) == -1)
         return -1;
@@ -527,6 +1046,12 @@ static void Decoder_dealloc(DecoderObj *self)
     Py_XDECREF(self->apply_name);
     Py_XDECREF(self->class_def_name);
     Py_XDECREF(self->extern_name);
+    Py_XDECREF(self->use_byte_views);
+    Py_XDECREF(self->lazy);
+    Py_XDECREF(self->intern_table);
+    Py_XDECREF(self->compact_arrays);
+    Py_XDECREF(self->uncompress_byte_arrays);
+    Py_XDECREF(self->stats);
     self->ob_type->tp_free((PyObject*)self);
 }
 
@@ -567,7 +1092,25 @@ static PyObject* Decoder_copy(DecoderObj *self, int amf3)
     Py_XINCREF(new_decoder->extern_name);
     new_decoder->type_map = self->type_map;
     Py_XINCREF(new_decoder->type_map);
+    new_decoder->use_byte_views = self->use_byte_views;
+    Py_XINCREF(new_decoder->use_byte_views);
+    new_decoder->lazy = self->lazy;
+    Py_XINCREF(new_decoder->lazy);
+    new_decoder->intern_table = self->intern_table;
+    Py_XINCREF(new_decoder->intern_table);
+    new_decoder->compact_arrays = self->compact_arrays;
+    Py_XINCREF(new_decoder->compact_arrays);
+    new_decoder->uncompress_byte_arrays = self->uncompress_byte_arrays;
+    Py_XINCREF(new_decoder->uncompress_byte_arrays);
+    new_decoder->stats = self->stats;
+    Py_XINCREF(new_decoder->stats);
     new_decoder->int_buf = self->int_buf;
+    new_decoder->max_depth = self->max_depth;
+    new_decoder->max_length = self->max_length;
+    new_decoder->max_string = self->max_string;
+    new_decoder->max_bytes = self->max_bytes;
+    new_decoder->depth = self->depth;
+    new_decoder->bytes_read = self->bytes_read;
     if (amf3 == 1) {
         new_decoder->amf3 = Py_True;
     } else {
@@ -603,7 +1146,7 @@ static int Decoder_check(PyObject *self)
 /* 
  * Returns position in stream.
  */
-static int Decoder_tell(DecoderObj *self)
+static Py_ssize_t Decoder_tell(DecoderObj *self)
 {
     if (self->int_buf == 1) {
         return Buffer_tell((BufferObj*)self->buf);
@@ -613,57 +1156,132 @@ static int Decoder_tell(DecoderObj *self)
     if (!pos)
         return -1;
 
-    int result = (int)PyInt_AsLong(pos);
+    Py_ssize_t result = PyNumber_AsSsize_t(pos, PyExc_OverflowError);
     Py_DECREF(pos);
     return result;
 }
 
+/*
+ * Count bytes read against max_bytes.
+ *
+ * Returns 1 on success, 0 if the limit is exceeded.
+ */
+static int Decoder_countBytes(DecoderObj *self, Py_ssize_t len)
+{
+    if (len > self->max_bytes - self->bytes_read) {
+        PyErr_Format(amfast_LimitError,
+            "Decoding exceeds max_bytes (%ld).", (long)self->max_bytes);
+        return 0;
+    }
+
+    self->bytes_read += len;
+    return 1;
+}
+
+/*
+ * Returns the number of bytes left in the input,
+ * or -1 if the input is a file-like-obj.
+ */
+static Py_ssize_t Decoder_remaining(DecoderObj *self)
+{
+    if (self->int_buf != 1)
+        return -1;
+
+    BufferObj *buf = (BufferObj*)self->buf;
+    return buf->len - buf->pos;
+}
+
 /* 
  * Read a PyString from the context.
  *
- * Returns a borrowed reference.
+ * Returns a new reference.
  */
-static PyObject* Decoder_readPyString(DecoderObj *self, int len)
+static PyObject* Decoder_readPyString(DecoderObj *self, Py_ssize_t len)
 {
+    if (self->max_bytes > 0 && !Decoder_countBytes(self, len))
+        return NULL;
+
     if (self->int_buf) {
        return Buffer_readPyString((BufferObj*)self->buf, len); 
     }
 
     PyObject *tmp = self->_buf_str;
-    PyObject *py_len = PyInt_FromLong((long)len);
+    PyObject *py_len = PyInt_FromSsize_t(len);
     if (!py_len)
         return NULL;
     self->_buf_str = PyObject_CallMethodObjArgs(self->buf, self->read_name, py_len, NULL);
     Py_DECREF(py_len);
-    Py_ssize_t buf_str_len = PyString_Size(self->_buf_str);
     Py_XDECREF(tmp); // Decrement reference to OLD string.
+    if (!self->_buf_str)
+        return NULL;
+
+    Py_ssize_t buf_str_len = PyString_Size(self->_buf_str);
+    if (buf_str_len == -1)
+        return NULL;
 
     if (buf_str_len < len) {
         char error_str[100];
-        sprintf(error_str, "Attempted to read %d bytes. Received %d", len, buf_str_len);
+        sprintf(error_str, "Attempted to read %ld bytes. Received %ld", (long)len, (long)buf_str_len);
         PyErr_SetString(amfast_ContextError, error_str);
         return NULL;
    }
 
+    Py_INCREF(self->_buf_str);
     return self->_buf_str;
 }
 
 /*
- * Python exposed version of Decoder_readPyString
+ * Read bytes from the context without copying them.
+ *
+ * Returns a read-only view of the input,
+ * or a PyString if the input is a file-like-obj.
  */
-static PyObject* PyDecoder_readPyString(DecoderObj *self, PyObject *args, PyObject *kwargs)
+static PyObject* Decoder_readView(DecoderObj *self, Py_ssize_t len)
 {
-    int len;
+    if (self->int_buf) {
+        if (self->max_bytes > 0 && !Decoder_countBytes(self, len))
+            return NULL;
+        return Buffer_readView((BufferObj*)self->buf, len);
+    }
+
+    return Decoder_readPyString(self, len);
+}
+
+/*
+ * Returns 1 if an object can be decoded directly,
+ * without calling its read method.
+ */
+static int Decoder_checkSource(PyObject *source)
+{
+    return Buffer_checkSource(source);
+}
 
-    if (!PyArg_ParseTuple(args, "i", &len))
+/*
+ * Returns the object being decoded if the input
+ * is read directly from a string or buffer,
+ * or NULL if the input is a file-like-obj.
+ *
+ * Returns a borrowed reference.
+ */
+static PyObject* Decoder_getSource(DecoderObj *self)
+{
+    if (self->int_buf != 1)
         return NULL;
 
-    PyObject *result = Decoder_readPyString(self, len);
-    if (!result)
+    return ((BufferObj*)self->buf)->src_str;
+}
+
+/*
+ * Python exposed version of Decoder_readPyString
+ */
+static PyObject* PyDecoder_readPyString(DecoderObj *self, PyObject *args, PyObject *kwargs)
+{
+    Py_ssize_t len;
+
+    if (!PyArg_ParseTuple(args, SSIZE_T_FMT, &len))
         return NULL;
 
-    Py_XINCREF(result);
-    return result;
+    return Decoder_readPyString(self, len);
 }
 
 /*
@@ -671,18 +1289,28 @@ static PyObject* PyDecoder_readPyString(DecoderObj *self, PyObject *args, PyObje
  * returning a string. Can be more efficient than
  * Decoder_readPyString.
  */
-static int Decoder_skipBytes(DecoderObj *self, int len)
+static int Decoder_skipBytes(DecoderObj *self, Py_ssize_t len)
 {
+    if (self->max_bytes > 0 && !Decoder_countBytes(self, len))
+        return 0;
+
     if (self->int_buf) {
-        int pos = Buffer_tell((BufferObj*)self->buf);
-        pos += len;
-        int result = Buffer_seek((BufferObj*)self->buf, pos);
-        if (result == -1)
+        if (!Buffer_read((BufferObj*)self->buf, len))
+            return 0;
+        return 1;
+    }
+
+    if (len < 0) {
+        // Rewind file-like-obj
+        PyObject *result = PyObject_CallMethod(self->buf, "seek", SSIZE_T_FMT "i", len, 1);
+        if (result == NULL)
             return 0;
+
+        Py_DECREF(result);
         return 1;
     }
 
-    PyObject *py_len = PyInt_FromLong((long)len);
+    PyObject *py_len = PyInt_FromSsize_t(len);
     if (!py_len)
         return 0;
     PyObject *str = PyObject_CallMethodObjArgs(self->buf, self->read_name, py_len, NULL);
@@ -697,16 +1325,22 @@ static int Decoder_skipBytes(DecoderObj *self, int len)
 /*
  * Read a C string from the buffer.
  */
-static char* Decoder_read(DecoderObj *self, int len)
+static char* Decoder_read(DecoderObj *self, Py_ssize_t len)
 {
     if (self->int_buf) {
+        if (self->max_bytes > 0 && !Decoder_countBytes(self, len))
+            return NULL;
         return Buffer_read((BufferObj*)self->buf, len); 
     }
 
     PyObject* py_str = Decoder_readPyString(self, len);
     if (!py_str)
         return NULL;
-    return PyString_AsString(py_str);
+
+    // self->_buf_str keeps the string alive until the next read.
+    char *result = PyString_AsString(py_str);
+    Py_DECREF(py_str);
+    return result;
 }
 
 /* Reads a single byte from the context. */
@@ -731,12 +1365,135 @@ static PyObject* PyDecoder_copy(DecoderObj *self, PyObject *args, PyObject *kwar
     return Decoder_copy(self, amf3);
 }
 
+/*
+ * Clear an Idx for re-use.
+ *
+ * Lazily decoded values keep a reference to the
+ * Idx they were decoded with, so a shared Idx
+ * is replaced instead of cleared.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Decoder_resetIdx(PyObject **idx)
+{
+    if (*idx == NULL)
+        return 1;
+
+    if ((*idx)->ob_refcnt == 1) {
+        Idx_clear((IdxObj*)*idx);
+        return 1;
+    }
+
+    PyObject *ref = PyObject_CallObject((PyObject*)(*idx)->ob_type, NULL);
+    if (ref == NULL)
+        return 0;
+
+    Py_DECREF(*idx);
+    *idx = ref;
+    return 1;
+}
+
+/*
+ * Reset a Decoder, so it can be re-used to decode new input.
+ *
+ * Indexes are cleared, settings are preserved.
+ * If source is NULL, the current input is released.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Decoder_reset(DecoderObj *self, PyObject *source)
+{
+    if (!Decoder_resetIdx(&self->obj_refs))
+        return 0;
+    if (!Decoder_resetIdx(&self->string_refs))
+        return 0;
+    if (!Decoder_resetIdx(&self->class_refs))
+        return 0;
+    if (self->type_map != NULL)
+        PyDict_Clear(self->type_map);
+    Py_CLEAR(self->_buf_str);
+    self->depth = 0;
+    self->bytes_read = 0;
+
+    PyObject *empty = NULL;
+    if (source == NULL) {
+        empty = PyString_FromStringAndSize(NULL, 0);
+        if (empty == NULL)
+            return 0;
+        source = empty;
+    }
+
+    int result = 1;
+    if (Buffer_checkSource(source) == 1) {
+        if (self->int_buf == 1 && self->buf->ob_refcnt == 1) {
+            // Nobody else is using the buffer object, re-use it.
+            result = Buffer_reset((BufferObj*)self->buf, source);
+        } else {
+            PyObject *buf_class = PyObject_GetAttrString(buffer_mod, "Buffer");
+            PyObject *buf = NULL;
+            if (buf_class != NULL) {
+                buf = PyObject_CallFunctionObjArgs(buf_class, source, NULL);
+                Py_DECREF(buf_class);
+            }
+
+            if (buf == NULL) {
+                result = 0;
+            } else {
+                Py_XDECREF(self->buf);
+                self->buf = buf;
+                self->int_buf = 1;
+            }
+        }
+    } else {
+        if (self->read_name == NULL) {
+            self->read_name = PyString_InternFromString("read");
+            if (self->read_name == NULL)
+                result = 0;
+        }
+
+        if (result == 1) {
+            Py_INCREF(source);
+            Py_XDECREF(self->buf);
+            self->buf = source;
+            self->int_buf = 0;
+        }
+    }
+
+    Py_XDECREF(empty);
+    return result;
+}
+
+/*
+ * Python exposed version of Decoder_reset.
+ */
+static PyObject* PyDecoder_reset(DecoderObj *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *source = NULL;
+
+    static char *kwlist[] = {"buffer", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O", kwlist, &source))
+        return NULL;
+
+    if (source == Py_None)
+        source = NULL;
+
+    if (!Decoder_reset(self, source))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef Decoder_methods[] = {
     {"copy", (PyCFunction)PyDecoder_copy, METH_VARARGS | METH_KEYWORDS,
      "Copy the decoder context. Settings are preserved, but index counts are reset.\n\n"
      "arguments\n"
      "==========\n"
      " * amf3 - bool, True to decode as AMF3."},
+    {"reset", (PyCFunction)PyDecoder_reset, METH_VARARGS | METH_KEYWORDS,
+     "Reset the decoder context, so it can be re-used. Settings are preserved, but indexes are cleared.\n\n"
+     "arguments\n"
+     "==========\n"
+     " * buffer - str, buffer or file-like-object, new input. Default = None (release current input)"},
     {"read", (PyCFunction)PyDecoder_readPyString, METH_VARARGS | METH_KEYWORDS,
      "Reads from the buffer.\n\n"
      "arguments\n"
@@ -758,6 +1515,28 @@ static PyMemberDef Decoder_members[] = {
      "amfast.context.Idx - String references."},
     {"class_refs", T_OBJECT_EX, offsetof(DecoderObj, class_refs), 0,
      "amfast.context.Idx - ClassDef references."},
+    {"use_byte_views", T_OBJECT_EX, offsetof(DecoderObj, use_byte_views), 0,
+     "bool - True to decode ByteArray contents as read-only views of the input."},
+    {"lazy", T_OBJECT_EX, offsetof(DecoderObj, lazy), 0,
+     "bool - True to defer decoding of lazy attributes until they are accessed."},
+    {"intern_table", T_OBJECT_EX, offsetof(DecoderObj, intern_table), 0,
+     "amfast.decode.InternTable - Shares decoded strings between contexts."},
+    {"compact_arrays", T_OBJECT_EX, offsetof(DecoderObj, compact_arrays), 0,
+     "bool - True to decode arrays of numbers as array.array objects."},
+    {"uncompress_byte_arrays", T_OBJECT_EX, offsetof(DecoderObj, uncompress_byte_arrays), 0,
+     "bool - True to inflate ByteArrays that were compressed with zlib."},
+    {"stats", T_OBJECT_EX, offsetof(DecoderObj, stats), READONLY,
+     "amfast.context.CodecStats - Records decoded values, or None."},
+    {"max_depth", T_INT, offsetof(DecoderObj, max_depth), READONLY,
+     "int - Maximum nesting depth of decoded values, 0 for no limit."},
+    {"max_length", T_INT, offsetof(DecoderObj, max_length), READONLY,
+     "int - Maximum number of items in a decoded collection, 0 for no limit."},
+    {"max_string", T_INT, offsetof(DecoderObj, max_string), READONLY,
+     "int - Maximum length of a decoded string or ByteArray, 0 for no limit."},
+    {"max_bytes", T_PYSSIZET, offsetof(DecoderObj, max_bytes), READONLY,
+     "int - Maximum number of bytes read from the input, 0 for no limit."},
+    {"bytes_read", T_PYSSIZET, offsetof(DecoderObj, bytes_read), READONLY,
+     "int - Number of bytes read so far, counted when max_bytes is set."},
     {NULL}  /* Sentinel */
 };
 
@@ -788,7 +1567,31 @@ static PyTypeObject DecoderType = {
     " * amf3 - bool - True to decode as AMF3 format. Default = False\n"
     " * class_def_mapper - amfast.class_def.ClassDefMapper - \n"
     "    Retrieves ClassDef objects.\n"
-    " * buffer - file-like-obj - The object being encoded.\n"
+    " * buffer - file-like-obj - The object being decoded.\n"
+    "    Strings and objects that support the buffer protocol\n"
+    "    (buffer, bytearray, memoryview, mmap) are read without copying.\n"
+    " * use_byte_views - bool - True to decode ByteArray contents\n"
+    "    as read-only views of the buffer instead of copies. Default = False\n"
+    " * lazy - bool - True to defer decoding of attributes listed\n"
+    "    in ClassDef.lazy_attrs until they are accessed. Default = False\n"
+    " * intern_table - amfast.decode.InternTable - Returns shared\n"
+    "    strings for short, repeated strings. Default = None\n"
+    " * compact_arrays - bool - True to decode AMF3 arrays that only\n"
+    "    contain ints as array.array('i'), and arrays that only contain\n"
+    "    ints and doubles as array.array('d'). Default = False\n"
+    " * uncompress_byte_arrays - bool - True to inflate ByteArrays\n"
+    "    that were compressed with zlib, such as the output of\n"
+    "    ActionScript ByteArray.compress(). Default = False\n"
+    " * stats - amfast.context.CodecStats - Records the number, size\n"
+    "    and decode time of values. Default = None\n"
+    " * max_depth - int - Raise LimitError when values are nested\n"
+    "    deeper than this. A list of numbers has a depth of 2. Default = 0 (no limit)\n"
+    " * max_length - int - Raise LimitError when a collection declares\n"
+    "    more items than this. Default = 0 (no limit)\n"
+    " * max_string - int - Raise LimitError when a string or ByteArray\n"
+    "    is longer than this. Default = 0 (no limit)\n"
+    " * max_bytes - int - Raise LimitError when more bytes than this\n"
+    "    are read from the input. Default = 0 (no limit)\n"
     " * obj_refs - amfast.context.Idx - Object references.\n"
     " * string_refs - amfast.context.Idx - String references.\n"
     " * class_refs - amfast.context.Idx - ClassDef references.\n", /* tp_doc */
@@ -823,8 +1626,11 @@ static PyObject* Encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwarg
         self->use_collections = NULL;
         self->use_proxies = NULL;
         self->use_refs = NULL;
+        self->use_obj_refs = NULL;
         self->use_legacy_xml = NULL;
         self->include_private = NULL;
+        self->use_shared_traits = NULL;
+        self->use_dictionaries = NULL;
         self->class_mapper = NULL;
         self->obj_refs = NULL;
         self->string_refs = NULL;
@@ -835,12 +1641,43 @@ static PyObject* Encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwarg
         self->class_def_name = NULL;
         self->write_name = NULL;
         self->extern_name = NULL;
+        self->stats = NULL;
+        self->stats_marker = STATS_IDLE;
         self->int_buf = 0;
+        self->chunk_size = 0;
+        self->max_size = 0;
+        self->depth = 0;
+        self->stream = 0;
     }
 
     return (PyObject *)self;
 }
 
+/*
+ * Create an amfast.buffer.Buffer object to write output to.
+ *
+ * If sink is not NULL, completed chunks are written to it.
+ */
+static PyObject* Encoder_newBuffer(Py_ssize_t chunk_size, Py_ssize_t max_size, PyObject *sink)
+{
+    PyObject *buf_class = PyObject_GetAttrString(buffer_mod, "Buffer");
+    if (buf_class == NULL)
+        return NULL;
+
+    PyObject *buf;
+    if (sink != NULL) {
+        buf = PyObject_CallFunction(buf_class, "O" SSIZE_T_FMT SSIZE_T_FMT "O",
+            Py_None, chunk_size, max_size, sink);
+    } else if (chunk_size > 0 || max_size > 0) {
+        buf = PyObject_CallFunction(buf_class, "O" SSIZE_T_FMT SSIZE_T_FMT,
+            Py_None, chunk_size, max_size);
+    } else {
+        buf = PyObject_CallObject(buf_class, NULL);
+    }
+    Py_DECREF(buf_class);
+    return buf;
+}
+
 /*
  * Initialize Ref objects.
  */
@@ -882,24 +1719,32 @@ static int Encoder_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
     EncoderObj *self = (EncoderObj*)self_raw;
 
     static char *kwlist[] = {"buffer", "class_def_mapper", "amf3", "use_collections",
-        "use_proxies", "use_references", "use_legacy_xml", "include_private", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOOOOOOO", kwlist,
+        "use_proxies", "use_references", "use_legacy_xml", "include_private",
+        "chunk_size", "use_shared_traits", "use_dictionaries", "stats",
+        "use_object_references", "max_size", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOOOOOOO" SSIZE_T_FMT "OOOO" SSIZE_T_FMT, kwlist,
         &self->buf, &self->class_mapper, &self->amf3, &self->use_collections,
-        &self->use_proxies, &self->use_refs, &self->use_legacy_xml, &self->include_private))
+        &self->use_proxies, &self->use_refs, &self->use_legacy_xml, &self->include_private,
+        &self->chunk_size, &self->use_shared_traits, &self->use_dictionaries, &self->stats,
+        &self->use_obj_refs, &self->max_size))
         return -1;
 
     if (self->buf == NULL) {
         // If output buffer is null, create our own buffer object.
-        PyObject *buf_class = PyObject_GetAttrString(buffer_mod, "Buffer");
-        if (buf_class == NULL)
+        PyObject *buf = Encoder_newBuffer(self->chunk_size, self->max_size, NULL);
+        if (buf == NULL)
             return -1;
-
-        PyObject *buf = PyObject_CallObject(buf_class, NULL);
-        Py_DECREF(buf_class);
+        self->buf = buf;
+        self->int_buf = 1;
+    } else if (self->chunk_size > 0 || PyInt_Check(self->buf)) {
+        // Encode to our own buffer object,
+        // and write each completed chunk to the output buffer.
+        PyObject *buf = Encoder_newBuffer(self->chunk_size, self->max_size, self->buf);
         if (buf == NULL)
             return -1;
         self->buf = buf;
         self->int_buf = 1;
+        self->stream = 1;
     } else {
         Py_INCREF(self->buf);
     }
@@ -920,6 +1765,10 @@ static int Encoder_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
         self->use_refs = Py_True;
     Py_INCREF(self->use_refs);
 
+    if (self->use_obj_refs == NULL)
+        self->use_obj_refs = Py_True;
+    Py_INCREF(self->use_obj_refs);
+
     if (self->use_legacy_xml == NULL)
         self->use_legacy_xml = Py_False;
     Py_INCREF(self->use_legacy_xml);
@@ -928,6 +1777,17 @@ static int Encoder_init(PyObject *self_raw, PyObject *args, PyObject *kwargs)
         self->include_private = Py_False;
     Py_INCREF(self->include_private);
 
+    if (self->use_shared_traits == NULL)
+        self->use_shared_traits = Py_False;
+    Py_INCREF(self->use_shared_traits);
+
+    if (self->use_dictionaries == NULL)
+        self->use_dictionaries = Py_False;
+    Py_INCREF(self->use_dictionaries);
+
+    if (Stats_initContext(&self->stats) == -1)
+        return -1;
+
     if (self->class_mapper == NULL) {
         // Create anon class mapper
         PyObject *mapper_class = PyObject_GetAttrString(class_def_mod, "ClassDefMapper");
@@ -981,8 +1841,12 @@ static void Encoder_dealloc(EncoderObj *self)
     Py_XDECREF(self->use_collections);
     Py_XDECREF(self->use_proxies);
     Py_XDECREF(self->use_refs);
+    Py_XDECREF(self->use_obj_refs);
     Py_XDECREF(self->use_legacy_xml);
     Py_XDECREF(self->include_private);
+    Py_XDECREF(self->use_shared_traits);
+    Py_XDECREF(self->use_dictionaries);
+    Py_XDECREF(self->stats);
     Py_XDECREF(self->class_mapper);
     Py_XDECREF(self->obj_refs);
     Py_XDECREF(self->string_refs);
@@ -1020,33 +1884,42 @@ static PyObject* Encoder_copy(EncoderObj *self, int amf3, int new_buf)
 
     if (new_buf == 1) {
         // Create a new buffer object.
-        PyObject *buf_class = PyObject_GetAttrString(buffer_mod, "Buffer");
-        if (buf_class == NULL)
-            return NULL;
-
-        PyObject *buf = PyObject_CallObject(buf_class, NULL);
-        Py_DECREF(buf_class);
-        if (buf == NULL)
+        PyObject *buf = Encoder_newBuffer(self->chunk_size, self->max_size, NULL);
+        if (buf == NULL) {
+            Py_DECREF(new_encoder);
             return NULL;
+        }
         new_encoder->buf = buf;
         new_encoder->int_buf = 1;
     } else {
         new_encoder->buf = self->buf;
         Py_XINCREF(new_encoder->buf);
         new_encoder->int_buf = self->int_buf;
+        new_encoder->stream = self->stream;
     }
 
     // Copy values from original
+    new_encoder->chunk_size = self->chunk_size;
+    new_encoder->max_size = self->max_size;
     new_encoder->use_collections = self->use_collections;
     Py_XINCREF(new_encoder->use_collections);
     new_encoder->use_proxies = self->use_proxies;
     Py_XINCREF(new_encoder->use_proxies);
     new_encoder->use_refs = self->use_refs;
     Py_XINCREF(new_encoder->use_refs);
+    new_encoder->use_obj_refs = self->use_obj_refs;
+    Py_XINCREF(new_encoder->use_obj_refs);
+    new_encoder->depth = self->depth;
     new_encoder->use_legacy_xml = self->use_legacy_xml;
     Py_XINCREF(new_encoder->use_legacy_xml);
     new_encoder->include_private = self->include_private;
     Py_XINCREF(new_encoder->include_private);
+    new_encoder->use_shared_traits = self->use_shared_traits;
+    Py_XINCREF(new_encoder->use_shared_traits);
+    new_encoder->use_dictionaries = self->use_dictionaries;
+    Py_XINCREF(new_encoder->use_dictionaries);
+    new_encoder->stats = self->stats;
+    Py_XINCREF(new_encoder->stats);
     new_encoder->class_mapper = self->class_mapper;
     Py_XINCREF(new_encoder->class_mapper);
     new_encoder->array_collection_def = self->array_collection_def;
@@ -1096,7 +1969,7 @@ static int Encoder_check(PyObject *self)
 /* 
  * Returns position in stream.
  */
-static int Encoder_tell(EncoderObj *self)
+static Py_ssize_t Encoder_tell(EncoderObj *self)
 {
     if (self->int_buf == 1) {
         return Buffer_tell((BufferObj*)self->buf);
@@ -1106,7 +1979,7 @@ static int Encoder_tell(EncoderObj *self)
     if (!pos)
         return -1;
 
-    int result = (int)PyInt_AsLong(pos);
+    Py_ssize_t result = PyNumber_AsSsize_t(pos, PyExc_OverflowError);
     Py_DECREF(pos);
     return result;
 }
@@ -1118,6 +1991,10 @@ static char* Encoder_read(EncoderObj *self)
 {
     if (self->int_buf == 1) {
         BufferObj *buf = (BufferObj*)self->buf;
+        if (buf->chunk_size > 0) {
+            PyErr_SetString(amfast_ContextError, "Can't read from chunked buffer.");
+            return NULL;
+        }
         return buf->buf;
     }
 
@@ -1125,6 +2002,38 @@ static char* Encoder_read(EncoderObj *self)
     return NULL;
 }
 
+/*
+ * Writes the output of another context.
+ *
+ * Chunks are shared between internal buffers,
+ * so large outputs are not copied.
+ */
+static int Encoder_writeEncoder(EncoderObj *self, EncoderObj *other)
+{
+    if (other->int_buf != 1) {
+        PyErr_SetString(amfast_ContextError, "Can't read from unknown buffer type.");
+        return 0;
+    }
+
+    if (self->stats_marker == STATS_PENDING) {
+        BufferObj *other_buf = (BufferObj*)other->buf;
+        if (other_buf->flushed == 0 && other_buf->pos > 0)
+            self->stats_marker = (unsigned char)other_buf->buf[0];
+    }
+
+    if (self->int_buf == 1) {
+        return Buffer_writeBuffer((BufferObj*)self->buf, (BufferObj*)other->buf);
+    }
+
+    PyObject *value = PyObject_CallMethod(other->buf, "getvalue", NULL);
+    if (value == NULL)
+        return 0;
+
+    int result = Encoder_writePyString(self, value);
+    Py_DECREF(value);
+    return result;
+}
+
 /*
  * Python exposed version of Encoder_copy.
  */
@@ -1147,6 +2056,9 @@ static PyObject* PyEncoder_copy(EncoderObj *self, PyObject *args, PyObject *kwar
  */
 static int Encoder_writePyString(EncoderObj *self, PyObject *py_str)
 {
+    if (self->stats_marker == STATS_PENDING && PyString_Check(py_str) && PyString_GET_SIZE(py_str) > 0)
+        self->stats_marker = (unsigned char)PyString_AS_STRING(py_str)[0];
+
     if (self->int_buf == 1) {
         return Buffer_writePyString((BufferObj*)self->buf, py_str);
     }
@@ -1179,13 +2091,17 @@ static PyObject* PyEncoder_writePyString(EncoderObj *self, PyObject *args, PyObj
 /*
  * Writes a CString to the buffer.
  */
-static int Encoder_write(EncoderObj *self, char *str, int len)
+static int Encoder_write(EncoderObj *self, char *str, Py_ssize_t len)
 {
+    // The first byte written for a value is its type marker.
+    if (self->stats_marker == STATS_PENDING && len > 0)
+        self->stats_marker = (unsigned char)str[0];
+
     if (self->int_buf == 1) {
         return Buffer_write((BufferObj*)self->buf, str, len);
     }
 
-    PyObject *py_str = PyString_FromStringAndSize(str, (Py_ssize_t)len);
+    PyObject *py_str = PyString_FromStringAndSize(str, len);
     if (py_str == NULL)
         return 0;
 
@@ -1210,7 +2126,19 @@ static int Encoder_writeByte(EncoderObj *self, char byte)
  */
 static PyObject* Encoder_getReturnVal(EncoderObj *self)
 {
-    if (self->int_buf == 1) {
+    if (self->stream == 1) {
+        // Write the last chunk, and return the output buffer.
+        BufferObj *buf = (BufferObj*)self->buf;
+        PyObject *result = PyObject_CallMethod(self->buf, "flush", NULL);
+        if (result == NULL)
+            return NULL;
+        Py_DECREF(result);
+
+        Py_INCREF(buf->sink);
+        return buf->sink;
+    } else if (self->int_buf == 1) {
+        if (self->chunk_size > 0)
+            return PyObject_CallMethod(self->buf, "getchunks", NULL);
         return PyObject_CallMethod(self->buf, "getvalue", NULL); 
     } else {
         Py_INCREF(self->buf);
@@ -1218,6 +2146,42 @@ static PyObject* Encoder_getReturnVal(EncoderObj *self)
     }
 }
 
+/*
+ * Reset an Encoder, so it can be re-used.
+ *
+ * References are cleared, settings are preserved.
+ * An internal output buffer is emptied, but keeps its allocated memory.
+ *
+ * Returns 1 on success, 0 on failure.
+ */
+static int Encoder_reset(EncoderObj *self)
+{
+    if (self->obj_refs != NULL)
+        Ref_clear((RefObj*)self->obj_refs);
+    if (self->string_refs != NULL)
+        Ref_clear((RefObj*)self->string_refs);
+    if (self->class_refs != NULL)
+        Ref_clear((RefObj*)self->class_refs);
+    if (self->type_map != NULL)
+        PyDict_Clear(self->type_map);
+
+    if (self->int_buf == 1)
+        return Buffer_reset((BufferObj*)self->buf, NULL);
+
+    return 1;
+}
+
+/*
+ * Python exposed version of Encoder_reset.
+ */
+static PyObject* PyEncoder_reset(EncoderObj *self)
+{
+    if (!Encoder_reset(self))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef Encoder_methods[] = {
     {"copy", (PyCFunction)PyEncoder_copy, METH_VARARGS | METH_KEYWORDS,
      "Copy the encoder context. Settings are preserved, but index counts are reset.\n\n"
@@ -1225,6 +2189,9 @@ static PyMethodDef Encoder_methods[] = {
      "==========\n"
      " * amf3 - bool, True to encode as AMF3."
      " * new_buf - bool, True to encode to a new Buffer object."},
+    {"reset", (PyCFunction)PyEncoder_reset, METH_NOARGS,
+     "Reset the encoder context, so it can be re-used. Settings are preserved, but references are cleared.\n"
+     "An internal output buffer is emptied, but keeps its allocated memory."},
     {"write", (PyCFunction)PyEncoder_writePyString, METH_VARARGS | METH_KEYWORDS,
      "Writes a string to the buffer.\n\n"
      "arguments\n"
@@ -1246,10 +2213,22 @@ static PyMemberDef Encoder_members[] = {
      "bool - True to encode dicts as ObjectProxies."},
     {"use_references", T_OBJECT_EX, offsetof(EncoderObj, use_refs), 0,
      "bool - True to encode multiple occuring objects as references."},
+    {"use_object_references", T_OBJECT_EX, offsetof(EncoderObj, use_obj_refs), 0,
+     "bool - False to skip reference tracking for objects, when values are trees."},
     {"use_legacy_xml", T_OBJECT_EX, offsetof(EncoderObj, use_legacy_xml), 0,
      "bool - True to XML as XMLDocument instead of e4x."},
+    {"use_shared_traits", T_OBJECT_EX, offsetof(EncoderObj, use_shared_traits), 0,
+     "bool - True to encode runs of dicts with the same keys as objects that share a trait."},
+    {"use_dictionaries", T_OBJECT_EX, offsetof(EncoderObj, use_dictionaries), 0,
+     "bool - True to encode dicts with keys that are not strings as Dictionaries."},
+    {"stats", T_OBJECT_EX, offsetof(EncoderObj, stats), READONLY,
+     "amfast.context.CodecStats - Records encoded values, or None."},
     {"class_def_mapper", T_OBJECT_EX, offsetof(EncoderObj, class_mapper), 0,
      "amfast.class_def.ClassDefMapper - The object the retrieves ClassDef objects."},
+    {"chunk_size", T_PYSSIZET, offsetof(EncoderObj, chunk_size), READONLY,
+     "int - Size of output chunks, 0 to output a single string."},
+    {"max_size", T_PYSSIZET, offsetof(EncoderObj, max_size), READONLY,
+     "int - Maximum size of the output, 0 for no limit."},
     {"obj_refs", T_OBJECT_EX, offsetof(EncoderObj, obj_refs), 0,
      "amfast.context.Ref - Object references."},
     {"string_refs", T_OBJECT_EX, offsetof(EncoderObj, string_refs), 0,
@@ -1283,14 +2262,34 @@ static PyTypeObject EncoderType = {
     Py_TPFLAGS_DEFAULT,        /*tp_flags*/
     "EncoderContext\n"
     "===============\n"
-    " * buffer - file-like-object - The output.\n"
+    " * buffer - file-like-object or int - The output. An int is used as a file\n"
+    "     descriptor, and output is always streamed to it, see chunk_size.\n"
     " * amf3 - bool - True to encode as AMF3.\n"
     " * use_collections - bool - True to encode lists and tuples as ArrayCollections.\n"
     " * use_proxies - bool - True to encode dicts as ObjectProxies.\n"
     " * use_references - bool - True to encode multiple occuring objects as references.\n"
+    " * use_object_references - bool - False to skip reference tracking for objects.\n"
+    "     Strings and traits are still encoded as references. Only use this when\n"
+    "     values are trees: shared objects are encoded more than once,\n"
+    "     and cycles raise EncodeError. Default = True\n"
     " * use_legacy_xml - bool - True to XML as XMLDocument instead of e4x.\n"
     " * include_private - bool - True to encode attributes starting with '_'.\n"
+    " * use_shared_traits - bool - True to encode runs of dicts with the same keys\n"
+    "     in a list as sealed objects that share a trait. AMF3 only.\n"
+    " * use_dictionaries - bool - True to encode dicts with keys that are not strings\n"
+    "     as Dictionaries. AMF3 only.\n"
+    " * stats - amfast.context.CodecStats - Records the number, size\n"
+    "     and encode time of values. Default = None\n"
     " * class_def_mapper - amfast.class_def.ClassDefMapper - Retrieves ClassDef objects.\n"
+    " * chunk_size - int - If > 0 and buffer is not set, output a list of strings\n"
+    "     of this size instead of a single string. If buffer is set, encode to\n"
+    "     an internal buffer and write it to buffer each time this many bytes\n"
+    "     are encoded, so large values are encoded in constant memory.\n"
+    "     AMF0 packet header and message lengths are written as unknown (-1),\n"
+    "     so they do not need to be buffered. Default = 0\n"
+    " * max_size - int - If > 0 and buffer is not set or chunk_size is set,\n"
+    "     raise amfast.buffer.BufferError\n"
+    "     when the output grows larger than this many bytes. Default = 0 (no limit)\n"
     " * obj_refs - amfast.context.Ref - Object references.\n"
     " * string_refs - amfast.context.Ref - String references.\n"
     " * class_refs - amfast.context.Ref - ClassDef references.\n", /* tp_doc */
@@ -1359,6 +2358,14 @@ initcontext(void)
     if (PyModule_AddObject(context_mod, "ContextError", amfast_ContextError) == -1)
         return;
 
+    amfast_LimitError = PyErr_NewException("amfast.context.LimitError",
+        amfast_ContextError, NULL);
+    if (amfast_LimitError == NULL)
+        return;
+
+    if (PyModule_AddObject(context_mod, "LimitError", amfast_LimitError) == -1)
+        return;
+
     // Idx
     IdxType.tp_new = Idx_new;
     if (PyType_Ready(&IdxType) < 0)
@@ -1372,6 +2379,7 @@ initcontext(void)
 
     PyIdx_API[Idx_map_NUM] = (void*)Idx_map;
     PyIdx_API[Idx_ret_NUM] = (void*)Idx_ret;
+    PyIdx_API[Idx_truncate_NUM] = (void*)Idx_truncate;
 
     PyObject *idx_c_api = PyCObject_FromVoidPtr((void*)PyIdx_API, NULL);
     if (idx_c_api != NULL)
@@ -1393,8 +2401,12 @@ initcontext(void)
     PyDecoder_API[Decoder_tell_NUM] = (void*)Decoder_tell;
     PyDecoder_API[Decoder_readPyString_NUM] = (void*)Decoder_readPyString;
     PyDecoder_API[Decoder_skipBytes_NUM] = (void*)Decoder_skipBytes;
+    PyDecoder_API[Decoder_readView_NUM] = (void*)Decoder_readView;
+    PyDecoder_API[Decoder_checkSource_NUM] = (void*)Decoder_checkSource;
+    PyDecoder_API[Decoder_getSource_NUM] = (void*)Decoder_getSource;
     PyDecoder_API[Decoder_read_NUM] = (void*)Decoder_read;
     PyDecoder_API[Decoder_readByte_NUM] = (void*)Decoder_readByte;
+    PyDecoder_API[Decoder_remaining_NUM] = (void*)Decoder_remaining;
 
     PyObject *decoder_c_api = PyCObject_FromVoidPtr((void*)PyDecoder_API, NULL);
     if (decoder_c_api != NULL)
@@ -1437,8 +2449,28 @@ initcontext(void)
     PyEncoder_API[Encoder_read_NUM] = (void*)Encoder_read;
     PyEncoder_API[Encoder_copy_NUM] = (void*)Encoder_copy;
     PyEncoder_API[Encoder_getReturnVal_NUM] = (void*)Encoder_getReturnVal;
+    PyEncoder_API[Encoder_writeEncoder_NUM] = (void*)Encoder_writeEncoder;
 
     PyObject *encoder_c_api = PyCObject_FromVoidPtr((void*)PyEncoder_API, NULL);
     if (encoder_c_api != NULL)
         PyModule_AddObject(context_mod, "_ENCODER_C_API", encoder_c_api);
+
+    // CodecStats
+    if (PyType_Ready(&CodecStatsType) < 0)
+        return;
+
+    Py_INCREF(&CodecStatsType);
+    PyModule_AddObject(context_mod, "CodecStats", (PyObject *)&CodecStatsType);
+
+    // CodecStats C API
+    static void *PyStats_API[PyStats_API_pointers];
+
+    PyStats_API[Stats_record_NUM] = (void*)Stats_record;
+    PyStats_API[Stats_recordAlias_NUM] = (void*)Stats_recordAlias;
+    PyStats_API[Stats_clock_NUM] = (void*)Stats_clock;
+    PyStats_API[Stats_bufferGrows_NUM] = (void*)Stats_bufferGrows;
+
+    PyObject *stats_c_api = PyCObject_FromVoidPtr((void*)PyStats_API, NULL);
+    if (stats_c_api != NULL)
+        PyModule_AddObject(context_mod, "_STATS_C_API", stats_c_api);
 }
@@ -17,6 +17,84 @@ typedef int Py_ssize_t;
  * Contexts are used to keep track of data relevant
  * to a single run through the encoder/decoder.
  */
+
+/*
+ * CodecStats records the number, size and encode/decode time of values
+ * per type marker and per ClassDef alias.
+ *
+ * Contexts without a CodecStats object do not record anything.
+ */
+
+// Number of type markers recorded, all AMF0 and AMF3 markers are smaller
+#define STATS_MARKERS 0x12
+
+// Reference tables
+#define STATS_OBJ_REFS 0
+#define STATS_STRING_REFS 1
+#define STATS_CLASS_REFS 2
+
+// Context stats_marker values when no type marker is known
+#define STATS_PENDING -1 // Value is being recorded, the marker has not been read or written yet
+#define STATS_IDLE -2 // No value is being recorded
+
+typedef struct {
+    PyObject_HEAD
+    long counts[2][STATS_MARKERS]; // Number of values per AMF version (0 = AMF0, 1 = AMF3) and type marker
+    long bytes[2][STATS_MARKERS]; // Encoded size of values, including nested values
+    double seconds[2][STATS_MARKERS]; // Time spent on values, including nested values
+    PyObject *aliases; // Dict of ClassDef alias -> [count, bytes, seconds]
+    long ref_hits[3]; // Values encoded or decoded as references, per reference table
+    long ref_misses[3]; // Values added to reference tables
+    long buffer_grows; // Number of times an output buffer was re-allocated
+    long calls; // Number of encode/decode calls
+} CodecStatsObj;
+
+// Number of exposed functions
+#define PyStats_API_pointers 4
+
+// C Exposed functions
+#define Stats_record_NUM 0
+#define Stats_record_RETURN void
+#define Stats_record_PROTO (CodecStatsObj *self, int amf3, int marker, Py_ssize_t bytes, double seconds)
+
+#define Stats_recordAlias_NUM 1
+#define Stats_recordAlias_RETURN int
+#define Stats_recordAlias_PROTO (CodecStatsObj *self, PyObject *alias, Py_ssize_t bytes, double seconds)
+
+#define Stats_clock_NUM 2
+#define Stats_clock_RETURN double
+#define Stats_clock_PROTO (void)
+
+#define Stats_bufferGrows_NUM 3
+#define Stats_bufferGrows_RETURN long
+#define Stats_bufferGrows_PROTO (PyObject *buf, int int_buf)
+
+#ifdef CONTEXT_MODULE
+/* This section is used when compiling module.c */
+
+static Stats_record_RETURN Stats_record Stats_record_PROTO;
+static Stats_recordAlias_RETURN Stats_recordAlias Stats_recordAlias_PROTO;
+static Stats_clock_RETURN Stats_clock Stats_clock_PROTO;
+static Stats_bufferGrows_RETURN Stats_bufferGrows Stats_bufferGrows_PROTO;
+
+#else
+/* This section is used in modules that use the module's API */
+
+static void **PyStats_API;
+
+#define Stats_record \
+ (*(Stats_record_RETURN (*)Stats_record_PROTO) PyStats_API[Stats_record_NUM])
+
+#define Stats_recordAlias \
+ (*(Stats_recordAlias_RETURN (*)Stats_recordAlias_PROTO) PyStats_API[Stats_recordAlias_NUM])
+
+#define Stats_clock \
+ (*(Stats_clock_RETURN (*)Stats_clock_PROTO) PyStats_API[Stats_clock_NUM])
+
+#define Stats_bufferGrows \
+ (*(Stats_bufferGrows_RETURN (*)Stats_bufferGrows_PROTO) PyStats_API[Stats_bufferGrows_NUM])
+
+#endif
 typedef struct {
     PyObject_HEAD
     PyObject **objs;
@@ -25,7 +103,7 @@ typedef struct {
 } IdxObj;
 
 // Number of exposed functions
-#define PyIdx_API_pointers 2
+#define PyIdx_API_pointers 3
 
 // C Exposed functions
 #define Idx_map_NUM 0
@@ -36,11 +114,16 @@ typedef struct {
 #define Idx_ret_RETURN PyObject*
 #define Idx_ret_PROTO (IdxObj *self, int idx)
 
+#define Idx_truncate_NUM 2
+#define Idx_truncate_RETURN int
+#define Idx_truncate_PROTO (IdxObj *self, int len)
+
 #ifdef CONTEXT_MODULE
 /* This section is used when compiling module.c */
 
 static Idx_map_RETURN Idx_map Idx_map_PROTO;
 static Idx_ret_RETURN Idx_ret Idx_ret_PROTO;
+static Idx_truncate_RETURN Idx_truncate Idx_truncate_PROTO;
 
 #else
 /* This section is used in modules that use the module's API */
@@ -53,6 +136,9 @@ static void **PyIdx_API;
 #define Idx_ret \
  (*(Idx_ret_RETURN (*)Idx_ret_PROTO) PyIdx_API[Idx_ret_NUM])
 
+#define Idx_truncate \
+ (*(Idx_truncate_RETURN (*)Idx_truncate_PROTO) PyIdx_API[Idx_truncate_NUM])
+
 #endif
 
 typedef struct {
@@ -69,11 +155,24 @@ typedef struct {
     PyObject *apply_name; // PyString name of method that applies attributes to instances
     PyObject *class_def_name; // PyString name of method to retrieve a ClassDef
     PyObject *extern_name; // PyString name of method to read externalizable objects
+    PyObject *use_byte_views; // True to decode ByteArray contents as views of the input
+    PyObject *lazy; // True to defer decoding of lazy attributes until they are accessed
+    PyObject *intern_table; // amfast.decode.InternTable that shares decoded strings, or None
+    PyObject *compact_arrays; // True to decode arrays of numbers as array.array objects
+    PyObject *uncompress_byte_arrays; // True to inflate ByteArrays compressed with zlib
+    PyObject *stats; // CodecStats that records decoded values, or None
+    int stats_marker; // Type marker of the value being recorded, STATS_PENDING or STATS_IDLE
     int int_buf; // 1 if we're using an amfast.buffer.Buffer object as the input, 0 if not
+    int max_depth; // Maximum nesting depth of decoded values, 0 for no limit
+    int max_length; // Maximum number of items in a decoded collection, 0 for no limit
+    int max_string; // Maximum length of a decoded string or ByteArray, 0 for no limit
+    Py_ssize_t max_bytes; // Maximum number of bytes read from the input, 0 for no limit
+    int depth; // Nesting depth of the value being decoded
+    Py_ssize_t bytes_read; // Number of bytes read while max_bytes is set
 } DecoderObj;
 
 // Number of exposed functions
-#define PyDecoder_API_pointers 7
+#define PyDecoder_API_pointers 11
 
 // C Exposed functions
 #define Decoder_check_NUM 0
@@ -85,25 +184,41 @@ typedef struct {
 #define Decoder_copy_PROTO (DecoderObj *self, int amf3)
 
 #define Decoder_tell_NUM 2
-#define Decoder_tell_RETURN int
+#define Decoder_tell_RETURN Py_ssize_t
 #define Decoder_tell_PROTO (DecoderObj *self)
 
 #define Decoder_readPyString_NUM 3
 #define Decoder_readPyString_RETURN PyObject*
-#define Decoder_readPyString_PROTO (DecoderObj *self, int amf3)
+#define Decoder_readPyString_PROTO (DecoderObj *self, Py_ssize_t len)
 
 #define Decoder_skipBytes_NUM 4
 #define Decoder_skipBytes_RETURN int
-#define Decoder_skipBytes_PROTO (DecoderObj *self, int len)
+#define Decoder_skipBytes_PROTO (DecoderObj *self, Py_ssize_t len)
 
 #define Decoder_read_NUM 5
 #define Decoder_read_RETURN char*
-#define Decoder_read_PROTO (DecoderObj *self, int amf3)
+#define Decoder_read_PROTO (DecoderObj *self, Py_ssize_t len)
 
 #define Decoder_readByte_NUM 6
 #define Decoder_readByte_RETURN char*
 #define Decoder_readByte_PROTO (DecoderObj *self)
 
+#define Decoder_readView_NUM 7
+#define Decoder_readView_RETURN PyObject*
+#define Decoder_readView_PROTO (DecoderObj *self, Py_ssize_t len)
+
+#define Decoder_checkSource_NUM 8
+#define Decoder_checkSource_RETURN int
+#define Decoder_checkSource_PROTO (PyObject *source)
+
+#define Decoder_getSource_NUM 9
+#define Decoder_getSource_RETURN PyObject*
+#define Decoder_getSource_PROTO (DecoderObj *self)
+
+#define Decoder_remaining_NUM 10
+#define Decoder_remaining_RETURN Py_ssize_t
+#define Decoder_remaining_PROTO (DecoderObj *self)
+
 #ifdef CONTEXT_MODULE
 /* This section is used when compiling module.c */
 
@@ -114,6 +229,10 @@ static Decoder_readPyString_RETURN Decoder_readPyString Decoder_readPyString_PRO
 static Decoder_skipBytes_RETURN Decoder_skipBytes Decoder_skipBytes_PROTO;
 static Decoder_read_RETURN Decoder_read Decoder_read_PROTO;
 static Decoder_readByte_RETURN Decoder_readByte Decoder_readByte_PROTO;
+static Decoder_readView_RETURN Decoder_readView Decoder_readView_PROTO;
+static Decoder_checkSource_RETURN Decoder_checkSource Decoder_checkSource_PROTO;
+static Decoder_getSource_RETURN Decoder_getSource Decoder_getSource_PROTO;
+static Decoder_remaining_RETURN Decoder_remaining Decoder_remaining_PROTO;
 
 #else
 /* This section is used in modules that use the module's API */
@@ -141,12 +260,31 @@ static void **PyDecoder_API;
 #define Decoder_readByte \
  (*(Decoder_readByte_RETURN (*)Decoder_readByte_PROTO) PyDecoder_API[Decoder_readByte_NUM])
 
+#define Decoder_readView \
+ (*(Decoder_readView_RETURN (*)Decoder_readView_PROTO) PyDecoder_API[Decoder_readView_NUM])
+
+#define Decoder_checkSource \
+ (*(Decoder_checkSource_RETURN (*)Decoder_checkSource_PROTO) PyDecoder_API[Decoder_checkSource_NUM])
+
+#define Decoder_getSource \
+ (*(Decoder_getSource_RETURN (*)Decoder_getSource_PROTO) PyDecoder_API[Decoder_getSource_NUM])
+
+#define Decoder_remaining \
+ (*(Decoder_remaining_RETURN (*)Decoder_remaining_PROTO) PyDecoder_API[Decoder_remaining_NUM])
+
 #endif
 
+typedef struct {
+    PyObject *obj; // Mapped object, NULL if the slot is empty
+    int idx; // Index the object is mapped to
+} RefEntry;
+
 typedef struct {
     PyObject_HEAD
-    PyObject *refs;
-    int idx;
+    RefEntry *table; // Open addressing hash table, keyed by object address
+    int size; // Number of slots in table, a power of 2
+    int used; // Number of occupied slots
+    int idx; // Next index to map
 } RefObj;
 
 // Number of exposed functions
@@ -187,8 +325,11 @@ typedef struct {
     PyObject *use_collections; // True to encode lists and tuples as ArrayCollections.
     PyObject *use_proxies; // True to encode dicts as ObjectProxies
     PyObject *use_refs; // True to encode objects as references.
+    PyObject *use_obj_refs; // False to skip object references for values that are trees
     PyObject *use_legacy_xml; // True to encode XML as XMLDocument instead of e4x
     PyObject *include_private; // True to encode attributes starting with '_' - Default = False
+    PyObject *use_shared_traits; // True to encode runs of dicts with the same keys with a shared trait
+    PyObject *use_dictionaries; // True to encode dicts with keys that are not strings as Dictionaries
     PyObject *class_mapper; // Object that retrieves ClassDef objects.
     PyObject *obj_refs; // IdxObj for objects
     PyObject *string_refs; // IdxObj for strings
@@ -199,11 +340,17 @@ typedef struct {
     PyObject *class_def_name; // Name of method to get class def
     PyObject *write_name; // PyString name of method to write to buffer
     PyObject *extern_name; // PyString name of method to write externalizable objects
+    PyObject *stats; // CodecStats that records encoded values, or None
+    int stats_marker; // Type marker of the value being recorded, STATS_PENDING or STATS_IDLE
     int int_buf; // 1 if we're using an amfast.buffer.Buffer object as the output, 0 if not
+    Py_ssize_t chunk_size; // Size of output chunks for internal buffers, 0 to output a single string
+    Py_ssize_t max_size; // Maximum size of the output for internal buffers, 0 for no limit
+    int depth; // Nesting depth of the value being encoded, counted when use_obj_refs is False
+    int stream; // 1 if output is written to the user's buffer as each chunk is completed
 } EncoderObj;
 
 // Number of exposed functions
-#define PyEncoder_API_pointers 8
+#define PyEncoder_API_pointers 9
 
 // C Exposed functions
 #define Encoder_check_NUM 0
@@ -216,14 +363,14 @@ typedef struct {
 
 #define Encoder_write_NUM 2
 #define Encoder_write_RETURN int
-#define Encoder_write_PROTO (EncoderObj *self, char *str, int len)
+#define Encoder_write_PROTO (EncoderObj *self, char *str, Py_ssize_t len)
 
 #define Encoder_writeByte_NUM 3
 #define Encoder_writeByte_RETURN int
 #define Encoder_writeByte_PROTO (EncoderObj *self, char byte)
 
 #define Encoder_tell_NUM 4
-#define Encoder_tell_RETURN int
+#define Encoder_tell_RETURN Py_ssize_t
 #define Encoder_tell_PROTO (EncoderObj *self)
 
 #define Encoder_read_NUM 5
@@ -238,6 +385,10 @@ typedef struct {
 #define Encoder_getReturnVal_RETURN PyObject*
 #define Encoder_getReturnVal_PROTO (EncoderObj *self)
 
+#define Encoder_writeEncoder_NUM 8
+#define Encoder_writeEncoder_RETURN int
+#define Encoder_writeEncoder_PROTO (EncoderObj *self, EncoderObj *other)
+
 
 #ifdef CONTEXT_MODULE
 /* This section is used when compiling module.c */
@@ -250,6 +401,7 @@ static Encoder_tell_RETURN Encoder_tell Encoder_tell_PROTO;
 static Encoder_read_RETURN Encoder_read Encoder_read_PROTO;
 static Encoder_copy_RETURN Encoder_copy Encoder_copy_PROTO;
 static Encoder_getReturnVal_RETURN Encoder_getReturnVal Encoder_getReturnVal_PROTO;
+static Encoder_writeEncoder_RETURN Encoder_writeEncoder Encoder_writeEncoder_PROTO;
 
 #else
 /* This section is used in modules that use the module's API */
@@ -280,6 +432,9 @@ static void **PyEncoder_API;
 #define Encoder_getReturnVal \
  (*(Encoder_getReturnVal_RETURN (*)Encoder_getReturnVal_PROTO) PyEncoder_API[Encoder_getReturnVal_NUM])
 
+#define Encoder_writeEncoder \
+ (*(Encoder_writeEncoder_RETURN (*)Encoder_writeEncoder_PROTO) PyEncoder_API[Encoder_writeEncoder_NUM])
+
 #endif
 
 #ifndef CONTEXT_MODULE
@@ -325,6 +480,15 @@ static PyObject* import_context_mod(void)
     PyEncoder_API = (void **)PyCObject_AsVoidPtr(encoder_c_api);
     Py_DECREF(encoder_c_api);
 
+    PyObject *stats_c_api = PyObject_GetAttrString(m, "_STATS_C_API");
+    if (stats_c_api == NULL)
+         return NULL;
+    if (!PyCObject_Check(stats_c_api))
+        return NULL;
+
+    PyStats_API = (void **)PyCObject_AsVoidPtr(stats_c_api);
+    Py_DECREF(stats_c_api);
+
     return m;
 }
 #endif
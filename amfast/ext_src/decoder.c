@@ -3,6 +3,13 @@
 #include "amf.h"
 #include "context.h"
 
+#include "structmember.h"
+
+// For 2.4 support
+#ifndef T_PYSSIZET
+#define T_PYSSIZET T_INT
+#endif
+
 // ------------------------ DECLARATIONS --------------------------------- //
 
 // ---- GLOBALS
@@ -11,8 +18,17 @@ static PyObject *amfast_mod;
 static PyObject *context_mod;
 static PyObject *remoting_mod;
 static PyObject *as_types_mod;
+static PyObject *class_def_mod;
+static PyObject *default_get_instance; // Function of ClassDef.getInstance
+static PyObject *default_apply_attr_vals; // Function of ClassDef.applyAttrVals
+static PyObject *traits_name; // Name of ClassDefMapper attribute that stores decoded traits
+static PyTypeObject *array_type; // array.array
+static PyObject *zlib_decompress; // zlib.decompress, once zlib has been imported
+static PyObject *zlib_decompressobj; // zlib.decompressobj, once zlib has been imported
+static PyObject *zlib_error; // zlib.error, once zlib has been imported
 static PyObject *amfast_Error;
 static PyObject *amfast_DecodeError;
+static PyObject *amfast_LimitError;
 static int big_endian; // Flag == 1 if architecture is big_endian, == 0 if not
 
 /*
@@ -36,6 +52,7 @@ static PyObject* class_def_from_alias(DecoderObj *context, PyObject *alias);
 
 // AMF0
 static PyObject* decode_AMF0(DecoderObj *context);
+static PyObject* decode_value_AMF0(DecoderObj *context);
 static PyObject* decode_bool_AMF0(DecoderObj *context);
 static PyObject* decode_string_AMF0(DecoderObj *context);
 static PyObject* decode_long_string_AMF0(DecoderObj *context);
@@ -56,22 +73,172 @@ static PyObject* decode_int_AMF3(DecoderObj *context);
 static int _decode_int_AMF3(DecoderObj *context, int *val);
 static PyObject* deserialize_string_AMF3(DecoderObj *context);
 static PyObject* deserialize_array_AMF3(DecoderObj *context, int collection);
-static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, int array_len, int dict);
+static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, int start, int array_len, int dict);
+static PyObject* decode_numeric_array_AMF3(DecoderObj *context, int array_len, int prealloc, int collection);
+static int add_array_refs(DecoderObj *context, PyObject *list_val, int collection);
+static int set_list_item(PyObject *list_val, int i, PyObject *val);
 static PyObject* deserialize_xml_AMF3(DecoderObj *context);
 static PyObject* deserialize_byte_array_AMF3(DecoderObj *context);
 static PyObject* decode_byte_array_AMF3(DecoderObj *context, int byte_len);
+static PyObject* uncompress_byte_string(DecoderObj *context, PyObject *byte_string);
+static PyObject* deserialize_vector_AMF3(DecoderObj *context, char vector_type);
+static PyObject* decode_numeric_vector_AMF3(DecoderObj *context, char vector_type, int count);
+static PyObject* decode_object_vector_AMF3(DecoderObj *context, int count);
+static PyObject* deserialize_dictionary_AMF3(DecoderObj *context);
 static PyObject* deserialize_obj_AMF3(DecoderObj *context, int proxy);
 static PyObject* deserialize_class_def_AMF3(DecoderObj *context, int header);
 static PyObject* decode_class_def_AMF3(DecoderObj *context, int header);
+static PyObject* new_class_def_AMF3(DecoderObj *context, int header, PyObject *alias, PyObject *cached);
 static int decode_typed_obj_AMF3(DecoderObj *context, PyObject *obj_val, PyObject *class_def_dict);
 static int decode_externalizable_AMF3(DecoderObj *context, PyObject *obj_val, PyObject *class_def);
 static PyObject* decode_obj_attrs_AMF3(DecoderObj *context, PyObject *class_def_dict);
 static int decode_anon_obj_AMF3(DecoderObj *context, PyObject *obj_val, PyObject *class_def_dict);
 static PyObject* decode_AMF3(DecoderObj *context);
+static PyObject* decode_value_AMF3(DecoderObj *context);
+static PyObject* decode_type_AMF3(DecoderObj *context, char byte);
+static PyObject* decode_item_AMF3(DecoderObj *context, char byte);
+static int decode_lazy_attrs(PyObject *class_def_dict, PyObject *class_def, PyObject *static_attrs);
+static int is_default_method(PyObject *class_def, const char *name, PyObject *default_func);
+static PyObject* fast_class_from_class_def(PyObject *class_def);
+static PyObject* fast_instance(PyObject *class_);
+static int fast_apply_attr_vals(PyObject *obj_val, PyObject *decoded_attrs);
+
+// LAZY
+static PyTypeObject LazyValueType;
+static PyObject* decode_lazy_AMF3(DecoderObj *context);
+static int skip_AMF3(DecoderObj *context, PyObject *placeholder);
+static int skip_obj_AMF3(DecoderObj *context, PyObject *placeholder, int proxy);
+static int skip_array_AMF3(DecoderObj *context, PyObject *placeholder, int collection);
+static int skip_dynamic_dict_AMF3(DecoderObj *context, PyObject *placeholder);
+static int skip_sized_AMF3(DecoderObj *context, PyObject *placeholder, int fixed_len);
+static int skip_vector_AMF3(DecoderObj *context, PyObject *placeholder, char vector_type);
+static int skip_dictionary_AMF3(DecoderObj *context, PyObject *placeholder);
+static PyObject* LazyValue_decode(PyObject *self);
+static PyObject* LazyValue_ret(PyObject *self, int idx);
+
+// INTERN
+typedef struct {
+    unsigned long hash;
+    PyObject *bytes; // PyString of the encoded bytes
+    PyObject *value; // Decoded unicode
+} InternEntry;
+
+typedef struct {
+    PyObject_HEAD
+    InternEntry *entries; // Open addressing hash table
+    int mask; // Number of entries - 1
+    int count; // Number of strings in the table
+    int max_entries; // Table is emptied when this many strings are stored
+    int max_len; // Longer strings are not stored
+} InternTableObj;
+
+static PyTypeObject InternTableType;
+static int intern_table_check(DecoderObj *context);
+static PyObject* InternTable_get(InternTableObj *self, const char *str, int len);
+static void InternTable_clear(InternTableObj *self);
+static PyObject* trait_cache(DecoderObj *context);
+
+// SCANNER
+// Frame types
+#define SCAN_AMF0 0 // AMF0 values
+#define SCAN_AMF0_DICT 1 // AMF0 name/value pairs, ending with an empty name
+#define SCAN_AMF3 2 // AMF3 values
+#define SCAN_AMF3_DICT 3 // AMF3 name/value pairs, ending with an empty name
+#define SCAN_AMF3_MARKER 4 // AMF3 value that must start with a specific marker
+
+// Scan results
+#define SCAN_DONE 1 // Value or part of value is complete
+#define SCAN_MORE 0 // More bytes are needed
+#define SCAN_FAIL -1 // Value can only be read by decoding it
+#define SCAN_ERROR -2 // Python exception is set
+
+// Trait kinds
+#define SCAN_TRAIT_OBJECT 0
+#define SCAN_TRAIT_COLLECTION 1
+#define SCAN_TRAIT_PROXY 2
+
+typedef struct {
+    int type; // SCAN_* frame type
+    Py_ssize_t count; // Values left, or marker byte of a SCAN_AMF3_MARKER frame
+} ScanFrame;
+
+typedef struct {
+    int kind; // SCAN_TRAIT_* kind
+    int static_len; // Number of static attrs
+    int dynamic; // 1 if trait is dynamic
+} ScanTrait;
+
+typedef struct {
+    Py_ssize_t pos; // Position of string bytes, relative to start of value
+    int len; // Length of string bytes
+} ScanString;
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *class_mapper; // ClassDefMapper used to identify externalizable traits
+    int amf3; // 1 if value is AMF3
+    int max_depth; // Frames are limited to a multiple of this, 0 for no limit
+    int max_length; // Maximum collection length, 0 for no limit
+    int max_string; // Maximum string length, 0 for no limit
+    Py_ssize_t pos; // Bytes scanned, relative to start of value
+    ScanFrame *frames; // Stack of values left to scan
+    int frame_len;
+    int frame_size;
+    ScanString *strings; // AMF3 string reference table
+    int string_len;
+    int string_size;
+    ScanTrait *traits; // AMF3 trait reference table
+    int trait_len;
+    int trait_size;
+} ScannerObj;
+
+typedef struct {
+    const char *buf; // Start of value
+    Py_ssize_t len; // Bytes available from start of value
+    Py_ssize_t pos; // Position of next byte to scan
+    Py_ssize_t need; // Bytes needed from start of value, when SCAN_MORE is returned
+} ScanCursor;
+
+static PyTypeObject ScannerType;
+static int scan_step(ScannerObj *self, ScanCursor *cur);
+static int scan_value_AMF0(ScannerObj *self, ScanCursor *cur);
+static int scan_value_AMF3(ScannerObj *self, ScanCursor *cur);
+static int scan_obj_AMF3(ScannerObj *self, ScanCursor *cur);
+static int scan_string_AMF3(ScannerObj *self, ScanCursor *cur, Py_ssize_t *str_pos, int *str_len);
+static int scan_trait_kind(ScannerObj *self, ScanCursor *cur, Py_ssize_t str_pos, int str_len, int *kind);
+static int scan_push(ScannerObj *self, int type, Py_ssize_t count);
+static int scan_skip(ScanCursor *cur, Py_ssize_t len);
+static int scan_int_AMF3(ScanCursor *cur, int *val);
+static int scan_ulong(ScanCursor *cur, unsigned int *val);
+static int scan_ushort(ScanCursor *cur, unsigned short *val);
+
+// SMALL MESSAGES
+#define SMALL_MAX_FLAGS 8
+static int decode_small_message(DecoderObj *context, PyObject *obj, int msg_type);
+static int decode_small_flags(DecoderObj *context, unsigned char *flags);
+static int skip_small_reserved(DecoderObj *context, unsigned char flag, int reserved);
+static int set_small_attr(PyObject *obj, const char *name, PyObject *value);
+static PyObject* decode_small_uid(DecoderObj *context);
+static PyObject* uid_from_value(PyObject *value);
+static PyObject* uid_from_bytes(const char *bytes);
+
+// LIMITS
+static int enter_value(DecoderObj *context);
+static int check_length(DecoderObj *context, int len);
+static int check_string(DecoderObj *context, unsigned int len);
+static PyObject* new_list(int len);
+static PyObject* new_dict(int len);
+
+// STATS
+static PyObject* decode_stats(DecoderObj *context, int amf3);
+static int record_alias(DecoderObj *context, PyObject *value, Py_ssize_t bytes, double seconds);
+static void record_ref(DecoderObj *context, PyObject *obj_context, int hit);
 
 // Python EXPOSED FUNCTIONS
 static PyObject* py_decode(PyObject *self, PyObject *args, PyObject *kwargs);
 static PyObject* py_decode_packet(PyObject *self, PyObject *args, PyObject *kwargs);
+static PyObject* py_decode_lazy(PyObject *self, PyObject *args, PyObject *kwargs);
+static PyObject* py_read_small_message(PyObject *self, PyObject *args, PyObject *kwargs);
 
 /*
  * Deserialize an obj.
@@ -140,9 +307,15 @@ static PyObject* deserialize_obj_AMF3(DecoderObj *context, int proxy)
     }
 
     // Instantiate new obj
+    PyObject *fast_class = NULL;
+    if (obj_type == 2)
+        fast_class = PyDict_GetItemString(class_def_dict, "fast_class");
+
     if (obj_type == 0) {
         // Anonymous obj == dict
         obj_val = PyDict_New();
+    } else if (fast_class != NULL && fast_class != Py_None) {
+        obj_val = fast_instance(fast_class);
     } else {
         // Create obj_val for all typed objs.
         obj_val = PyObject_CallMethod(class_def, "getInstance", NULL);
@@ -216,10 +389,21 @@ static PyObject* decode_obj_attrs_AMF3(DecoderObj *context, PyObject *class_def_
         return NULL;
     }
 
+    // Flags for attributes that should be decoded lazily.
+    PyObject *lazy_attrs = NULL;
+    if (context->lazy == Py_True)
+        lazy_attrs = PyDict_GetItemString(class_def_dict, "lazy_attrs");
+
     Py_ssize_t static_attr_len = PyTuple_GET_SIZE(static_attrs);
     int i;
     for (i = 0; i < static_attr_len; i++) {
-        PyObject *obj = decode_AMF3(context);
+        PyObject *obj;
+        if (lazy_attrs != NULL && PyTuple_GET_ITEM(lazy_attrs, i) == Py_True) {
+            obj = decode_lazy_AMF3(context);
+        } else {
+            obj = decode_AMF3(context);
+        }
+
         if (obj == NULL) {
             Py_DECREF(decoded_attrs);
             return NULL;
@@ -263,6 +447,13 @@ static int decode_typed_obj_AMF3(DecoderObj *context, PyObject *obj_val, PyObjec
         return 0;
     }
 
+    PyObject *fast_class = PyDict_GetItemString(class_def_dict, "fast_class");
+    if (fast_class != NULL && fast_class != Py_None) {
+        int result = fast_apply_attr_vals(obj_val, decoded_attrs);
+        Py_DECREF(decoded_attrs);
+        return result;
+    }
+
     PyObject *class_def = PyDict_GetItemString(class_def_dict, "class_def");
     if (!class_def) {
         Py_DECREF(decoded_attrs);
@@ -309,19 +500,20 @@ static PyObject* deserialize_class_def_AMF3(DecoderObj *context, int header)
     if (!class_def_dict)
         return NULL;
 
-    if (class_def_dict != Py_False) {
+    // class_def_dict ref already belongs to the context
+    Py_DECREF(class_def_dict);
+    if (class_def_dict != Py_False)
         return class_def_dict;
-    } else {
-        Py_DECREF(class_def_dict);
-    }
 
     class_def_dict = decode_class_def_AMF3(context, header);
     if (!class_def_dict)
         return NULL;
 
     // Add reference to obj
-    if (Idx_map((IdxObj*)context->class_refs, class_def_dict) == -1)
+    if (Idx_map((IdxObj*)context->class_refs, class_def_dict) == -1) {
+        Py_DECREF(class_def_dict);
         return NULL;
+    }
     // Give class_def_dict ref to context,
     // because it should be DECREFed when
     // the context is destroyed
@@ -341,68 +533,118 @@ static PyObject* decode_class_def_AMF3(DecoderObj *context, int header)
     if (!alias)
         return NULL;
 
-    PyObject *class_def = class_def_from_alias(context, alias);
-    if (!class_def) {
+    PyObject *traits = trait_cache(context);
+    if (!traits) {
         Py_DECREF(alias);
         return NULL;
     }
 
-    // Create a dict with class def information
-    // specific to this decode context.
-    PyObject *class_def_dict = PyDict_New();
-    if (!class_def_dict) {
+    if (traits == Py_None) {
+        Py_DECREF(traits);
+        PyObject *class_def_dict = new_class_def_AMF3(context, header, alias, NULL);
         Py_DECREF(alias);
-        Py_DECREF(class_def);
-        return NULL;
+        return class_def_dict;
     }
 
-    if (PyDict_SetItemString(class_def_dict, "class_def", class_def) == -1) {
+    // Traits decoded from previous packets are
+    // keyed by header, alias and lazy flag.
+    PyObject *key = Py_BuildValue("(iOO)", header, alias, context->lazy);
+    if (!key) {
         Py_DECREF(alias);
-        Py_DECREF(class_def);
-        Py_DECREF(class_def_dict);
+        Py_DECREF(traits);
         return NULL;
     }
 
-    if (PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF") == 1) {
+    PyObject *cached = PyDict_GetItem(traits, key);
+    Py_XINCREF(cached);
+
+    PyObject *class_def_dict = new_class_def_AMF3(context, header, alias, cached);
+    Py_DECREF(alias);
+
+    if (class_def_dict != NULL && class_def_dict != cached) {
+        int max_entries = ((InternTableObj*)context->intern_table)->max_entries;
+        if (PyDict_Size(traits) >= max_entries)
+            PyDict_Clear(traits);
+
+        if (PyDict_SetItem(traits, key, class_def_dict) == -1) {
+            Py_DECREF(class_def_dict);
+            class_def_dict = NULL;
+        }
+    }
+
+    Py_XDECREF(cached);
+    Py_DECREF(key);
+    Py_DECREF(traits);
+    return class_def_dict;
+}
+
+/*
+ * Create a dict with ClassDef information
+ * specific to a decode context.
+ *
+ * If cached is not NULL, it is a dict created
+ * for a previous trait with the same header and alias.
+ * cached is returned if the static attribute names
+ * are the same.
+ */
+static PyObject* new_class_def_AMF3(DecoderObj *context, int header, PyObject *alias, PyObject *cached)
+{
+    PyObject *class_def;
+    if (cached != NULL) {
+        if (PyDict_GetItemString(cached, "static_attrs") == NULL) {
+            // Externalizable ClassDef
+            Py_INCREF(cached);
+            return cached;
+        }
+
+        class_def = PyDict_GetItemString(cached, "class_def");
+        Py_INCREF(class_def);
+    } else {
+        class_def = class_def_from_alias(context, alias);
+        if (!class_def)
+            return NULL;
+    }
+
+    PyObject *class_def_dict;
+    int result;
+    if (cached == NULL && PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF") == 1) {
         // There is nothing else we need to do
         // with externalizable ClassDefs
-        Py_DECREF(alias);
-        Py_DECREF(class_def); // class_def_dict has reference now.
+        class_def_dict = PyDict_New();
+        if (!class_def_dict) {
+            Py_DECREF(class_def);
+            return NULL;
+        }
+
+        result = PyDict_SetItemString(class_def_dict, "class_def", class_def);
+        Py_DECREF(class_def);
+        if (result == -1) {
+            Py_DECREF(class_def_dict);
+            return NULL;
+        }
+
         return class_def_dict;
     }
-    Py_DECREF(class_def); // class_def_dict has reference now.
 
     if ((header & 0x07FFFFFF) == EXTERNALIZABLE) {
         // If the class is externalizable, but the ClassDef isn't,
         // we have a big problem, because we don't know how to read
         // the raw bytes.
-        Py_DECREF(class_def_dict);
-
-        Py_DECREF(alias);        
+        Py_DECREF(class_def);
         PyErr_SetString(amfast_DecodeError, "Encoded class is externalizable, but ClassDef is not.");
         return NULL;
     }
-    Py_DECREF(alias); // We were only keeping this around to use in the externalizable error message.
-
-    // Set dynamic flag
-    if ((header & DYNAMIC) == DYNAMIC) {
-        if (PyDict_SetItemString(class_def_dict, "dynamic", Py_True) == -1) {
-            Py_DECREF(class_def_dict);
-            return NULL;
-        }
-    } else {
-        if (PyDict_SetItemString(class_def_dict, "dynamic", Py_False) == -1) {
-            Py_DECREF(class_def_dict);
-            return NULL;
-        }
-    }
 
     // Decode static attr names
     int static_attr_len = (int)(header >> 4);
+    if (!check_length(context, static_attr_len)) {
+        Py_DECREF(class_def);
+        return NULL;
+    }
 
     PyObject *decoded_attrs = PyTuple_New(static_attr_len);
     if (!decoded_attrs) {
-        Py_DECREF(class_def_dict);
+        Py_DECREF(class_def);
         return NULL;
     }
 
@@ -410,30 +652,268 @@ static PyObject* decode_class_def_AMF3(DecoderObj *context, int header)
     for (i = 0; i < static_attr_len; i++) {
         PyObject *attr_name = deserialize_string_AMF3(context);
         if (!attr_name) {
-            Py_DECREF(class_def_dict);
+            Py_DECREF(class_def);
             Py_DECREF(decoded_attrs);
             return NULL;
         }
 
         // steals ref to attr_name
         if (PyTuple_SetItem(decoded_attrs, i, attr_name) != 0) {
-            Py_DECREF(class_def_dict);
+            Py_DECREF(class_def);
+            Py_DECREF(decoded_attrs);
+            return NULL;
+        }
+    }
+
+    if (cached != NULL) {
+        result = PyObject_RichCompareBool(decoded_attrs,
+            PyDict_GetItemString(cached, "static_attrs"), Py_EQ);
+        if (result == -1) {
+            Py_DECREF(class_def);
             Py_DECREF(decoded_attrs);
             return NULL;
         }
+
+        if (result == 1) {
+            Py_DECREF(class_def);
+            Py_DECREF(decoded_attrs);
+            Py_INCREF(cached);
+            return cached;
+        }
+    }
+
+    class_def_dict = PyDict_New();
+    if (!class_def_dict) {
+        Py_DECREF(class_def);
+        Py_DECREF(decoded_attrs);
+        return NULL;
+    }
+
+    result = PyDict_SetItemString(class_def_dict, "class_def", class_def);
+    Py_DECREF(class_def); // class_def_dict has reference now.
+    if (result == -1) {
+        Py_DECREF(class_def_dict);
+        Py_DECREF(decoded_attrs);
+        return NULL;
+    }
+
+    // Set dynamic flag
+    if ((header & DYNAMIC) == DYNAMIC) {
+        result = PyDict_SetItemString(class_def_dict, "dynamic", Py_True);
+    } else {
+        result = PyDict_SetItemString(class_def_dict, "dynamic", Py_False);
+    }
+
+    if (result == -1) {
+        Py_DECREF(class_def_dict);
+        Py_DECREF(decoded_attrs);
+        return NULL;
     }
 
     // Set decoded attrs onto ClassDef
-    int result = PyDict_SetItemString(class_def_dict, "static_attrs", decoded_attrs);
+    result = PyDict_SetItemString(class_def_dict, "static_attrs", decoded_attrs);
+    if (result == -1) {
+        Py_DECREF(class_def_dict);
+        Py_DECREF(decoded_attrs);
+        return NULL;
+    }
+
+    if (context->lazy == Py_True && class_def != Py_None) {
+        result = decode_lazy_attrs(class_def_dict, class_def, decoded_attrs);
+    }
+
     Py_DECREF(decoded_attrs);
     if (result == -1) {
         Py_DECREF(class_def_dict);
         return NULL;
     }
 
+    if (class_def != Py_None) {
+        // Check if objs can be created without calling the ClassDef.
+        PyObject *fast_class = fast_class_from_class_def(class_def);
+        if (!fast_class) {
+            Py_DECREF(class_def_dict);
+            return NULL;
+        }
+
+        result = PyDict_SetItemString(class_def_dict, "fast_class", fast_class);
+        Py_DECREF(fast_class);
+        if (result == -1) {
+            Py_DECREF(class_def_dict);
+            return NULL;
+        }
+    }
+
     return class_def_dict;
 }
 
+/*
+ * Get the dict of decoded traits stored in the ClassDefMapper.
+ *
+ * Traits are only stored when the context has an InternTable.
+ * They are stored in the ClassDefMapper, so they are
+ * discarded when classes are mapped or unmapped.
+ *
+ * Returns new ref, Py_None if traits are not stored, or NULL on error.
+ */
+static PyObject* trait_cache(DecoderObj *context)
+{
+    int has_table = intern_table_check(context);
+    if (has_table == 0)
+        return NULL;
+
+    if (has_table == -1)
+        Py_RETURN_NONE;
+
+    PyObject *traits = PyObject_GetAttr(context->class_mapper, traits_name);
+    if (!traits) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            return NULL;
+        PyErr_Clear();
+        Py_RETURN_NONE;
+    }
+
+    if (!PyDict_Check(traits)) {
+        Py_DECREF(traits);
+        Py_RETURN_NONE;
+    }
+
+    return traits;
+}
+
+/*
+ * Flag static attributes that are listed in ClassDef.lazy_attrs.
+ *
+ * Sets a tuple of bools in the same order as static_attrs.
+ * Returns 0 on success, -1 on failure.
+ */
+static int decode_lazy_attrs(PyObject *class_def_dict, PyObject *class_def, PyObject *static_attrs)
+{
+    if (!PyObject_HasAttrString(class_def, "lazy_attrs"))
+        return 0;
+
+    PyObject *lazy_names = PyObject_GetAttrString(class_def, "lazy_attrs");
+    if (lazy_names == NULL)
+        return -1;
+
+    Py_ssize_t lazy_len = PySequence_Size(lazy_names);
+    if (lazy_len < 1) {
+        Py_DECREF(lazy_names);
+        if (lazy_len == -1)
+            return -1;
+        return 0;
+    }
+
+    Py_ssize_t static_attr_len = PyTuple_GET_SIZE(static_attrs);
+    PyObject *lazy_attrs = PyTuple_New(static_attr_len);
+    if (lazy_attrs == NULL) {
+        Py_DECREF(lazy_names);
+        return -1;
+    }
+
+    int i;
+    for (i = 0; i < static_attr_len; i++) {
+        int contains = PySequence_Contains(lazy_names, PyTuple_GET_ITEM(static_attrs, i));
+        if (contains == -1) {
+            Py_DECREF(lazy_names);
+            Py_DECREF(lazy_attrs);
+            return -1;
+        }
+
+        PyObject *flag = contains ? Py_True : Py_False;
+        Py_INCREF(flag);
+        PyTuple_SET_ITEM(lazy_attrs, i, flag);
+    }
+    Py_DECREF(lazy_names);
+
+    int result = PyDict_SetItemString(class_def_dict, "lazy_attrs", lazy_attrs);
+    Py_DECREF(lazy_attrs);
+    return result;
+}
+
+/*
+ * Returns 1 if a ClassDef method is not overridden,
+ * 0 if it is, and -1 on error.
+ */
+static int is_default_method(PyObject *class_def, const char *name, PyObject *default_func)
+{
+    PyObject *method = PyObject_GetAttrString(class_def, name);
+    if (!method)
+        return -1;
+
+    int result = PyMethod_Check(method) && PyMethod_GET_FUNCTION(method) == default_func;
+    Py_DECREF(method);
+    return result;
+}
+
+/*
+ * Get the class that can be instantiated
+ * and populated without calling the ClassDef.
+ *
+ * Returns the class if the ClassDef uses the default
+ * getInstance and applyAttrVals, and does not convert types.
+ * Returns Py_None if the ClassDef must be called.
+ */
+static PyObject* fast_class_from_class_def(PyObject *class_def)
+{
+    int result = is_default_method(class_def, "getInstance", default_get_instance);
+    if (result == 1)
+        result = is_default_method(class_def, "applyAttrVals", default_apply_attr_vals);
+    if (result == -1)
+        return NULL;
+
+    if (result == 0)
+        Py_RETURN_NONE;
+
+    PyObject *decode_types = PyObject_GetAttrString(class_def, "decode_types");
+    if (!decode_types)
+        return NULL;
+
+    result = decode_types == Py_None;
+    Py_DECREF(decode_types);
+    if (!result)
+        Py_RETURN_NONE;
+
+    PyObject *class_ = PyObject_GetAttrString(class_def, "class_");
+    if (!class_)
+        return NULL;
+
+    if (!PyType_Check(class_) || ((PyTypeObject*)class_)->tp_new == NULL) {
+        // Leave anything that is not a new-style class to getInstance.
+        Py_DECREF(class_);
+        Py_RETURN_NONE;
+    }
+
+    return class_;
+}
+
+/* Create an instance the same way as ClassDef.getInstance. */
+static PyObject* fast_instance(PyObject *class_)
+{
+    PyObject *args = PyTuple_New(0);
+    if (!args)
+        return NULL;
+
+    PyObject *obj_val = ((PyTypeObject*)class_)->tp_new((PyTypeObject*)class_, args, NULL);
+    Py_DECREF(args);
+    return obj_val;
+}
+
+/* Set attributes the same way as ClassDef.applyAttrVals. */
+static int fast_apply_attr_vals(PyObject *obj_val, PyObject *decoded_attrs)
+{
+    PyObject *key;
+    PyObject *val;
+    Py_ssize_t idx = 0;
+
+    while (PyDict_Next(decoded_attrs, &idx, &key, &val)) {
+        if (PyObject_SetAttr(obj_val, key, val) == -1)
+            return 0;
+    }
+
+    return 1;
+}
+
 /* Retrieve a ClassDef from a class alias string. */
 static PyObject* class_def_from_alias(DecoderObj *context, PyObject *alias)
 {
@@ -449,6 +929,7 @@ static PyObject* class_def_from_alias(DecoderObj *context, PyObject *alias)
 /* Add the dynamic attributes of an encoded obj to a dict. */
 static int decode_dynamic_dict_AMF3(DecoderObj *context, PyObject *dict)
 {
+    int count = 0;
     while (1) {
         PyObject *key = deserialize_string_AMF3(context);
         if (!key)
@@ -460,6 +941,12 @@ static int decode_dynamic_dict_AMF3(DecoderObj *context, PyObject *dict)
             return 1;
         }
 
+        count++;
+        if (context->max_length > 0 && !check_length(context, count)) {
+            Py_DECREF(key);
+            return 0;
+        }
+
         PyObject *val = decode_AMF3(context);
         if (!val) {
             Py_DECREF(key);
@@ -506,8 +993,9 @@ static PyObject* deserialize_array_AMF3(DecoderObj *context, int collection)
     }
 
     int array_len = (int)(header >> 1);
-    // Can't use array_len to create a list of known
-    // length, see ticket #46
+    int prealloc = check_length(context, array_len);
+    if (!prealloc)
+        return NULL;
 
     // Determine if array is mixed (associative) or not
     int mixed = 0;
@@ -516,12 +1004,25 @@ static PyObject* deserialize_array_AMF3(DecoderObj *context, int collection)
         return NULL;
     if (byte_ref[0] == EMPTY_STRING_TYPE) {
         // Dense array
-        list_val = PyList_New(0);
+        if (context->compact_arrays == Py_True && array_len > 0)
+            return decode_numeric_array_AMF3(context, array_len, prealloc, collection);
+
+        if (prealloc == 1) {
+            list_val = new_list(array_len);
+        } else {
+            list_val = PyList_New(0);
+        }
+        if (list_val == NULL)
+            return NULL;
     } else {
         if (!Decoder_skipBytes(context, -1))
             return NULL;
 
-        list_val = PyDict_New();
+        if (prealloc == 1) {
+            list_val = new_dict(array_len);
+        } else {
+            list_val = PyDict_New();
+        }
         if (list_val == NULL)
             return NULL;
         
@@ -535,39 +1036,236 @@ static PyObject* deserialize_array_AMF3(DecoderObj *context, int collection)
     }
 
     // Reference must be added before children (to allow for recursion).
-    if (Idx_map((IdxObj*)context->obj_refs, list_val) == -1) {
+    if (!add_array_refs(context, list_val, collection)) {
         Py_DECREF(list_val);
         return NULL;
     }
 
+    // Populate list
+    if (decode_dynamic_array_AMF3(context, list_val, 0, array_len, mixed) == 0) {
+        Py_DECREF(list_val);
+        return NULL;
+    }
+
+    return list_val;
+}
+
+/*
+ * Add the references to a decoded array.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int add_array_refs(DecoderObj *context, PyObject *list_val, int collection)
+{
+    if (Idx_map((IdxObj*)context->obj_refs, list_val) == -1)
+        return 0;
+
     // If this is an ArrayCollection,
     // we need to add another reference,
     // so there is one that
     // points to the array and one that points
     // to the collection.
     if (collection) {
-        if (Idx_map((IdxObj*)context->obj_refs, list_val) == -1) {
-            Py_DECREF(list_val);
-            return NULL;
-        }
-    }
-
-    // Populate list
-    if (decode_dynamic_array_AMF3(context, list_val, array_len, mixed) == 0) {
-        Py_DECREF(list_val);
-        return NULL;
+        if (Idx_map((IdxObj*)context->obj_refs, list_val) == -1)
+            return 0;
     }
 
-    return list_val;
+    return 1;
 }
 
-/* Populate an array with vals from the buffer. */
-static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, int array_len, int dict)
+/*
+ * Decode the items of a dense array of numbers to an array.array.
+ *
+ * Returns array('i') if all items are ints, array('d')
+ * if items are ints and doubles. If an item is any other type,
+ * the numbers already decoded are kept, and a list is returned.
+ * The references to the result are added to the context.
+ *
+ * The input is never rewound, so file-like-objects
+ * that can only be read are supported.
+ */
+static PyObject* decode_numeric_array_AMF3(DecoderObj *context, int array_len, int prealloc, int collection)
 {
-    int i;
-    if (dict) {
-        // Object is a dict, set item index as key.
+    // array_len comes from the input,
+    // don't trust it for the initial allocation.
+    int items_len = array_len < 1024 ? array_len : 1024;
+    double *items = (double*)malloc(sizeof(double) * (size_t)items_len);
+    char *is_int = (char*)malloc((size_t)items_len);
+    if (items == NULL || is_int == NULL) {
+        free(items);
+        free(is_int);
+        PyErr_SetNone(PyExc_MemoryError);
+        return NULL;
+    }
+
+    int all_ints = 1;
+    int i;
+    for (i = 0; i < array_len; i++) {
+        const char *byte_ref = Decoder_readByte(context);
+        if (!byte_ref) {
+            free(items);
+            free(is_int);
+            return NULL;
+        }
+
+        double item;
+        const char byte = byte_ref[0];
+        if (byte == INT_TYPE) {
+            int int_item;
+            if (!_decode_int_AMF3(context, &int_item)) {
+                free(items);
+                free(is_int);
+                return NULL;
+            }
+            item = (double)int_item;
+        } else if (byte == DOUBLE_TYPE) {
+            if (!_decode_double(context, &item)) {
+                free(items);
+                free(is_int);
+                return NULL;
+            }
+            all_ints = 0;
+        } else {
+            // Not a numeric array, move the numbers to a list.
+            PyObject *list_val;
+            if (prealloc == 1) {
+                list_val = new_list(array_len);
+            } else {
+                list_val = PyList_New(0);
+            }
+            if (list_val == NULL) {
+                free(items);
+                free(is_int);
+                return NULL;
+            }
+
+            int j;
+            for (j = 0; j < i; j++) {
+                PyObject *number;
+                if (is_int[j]) {
+                    number = PyInt_FromLong((long)items[j]);
+                } else {
+                    number = PyFloat_FromDouble(items[j]);
+                }
+                if (!number || !set_list_item(list_val, j, number)) {
+                    free(items);
+                    free(is_int);
+                    Py_DECREF(list_val);
+                    return NULL;
+                }
+            }
+            free(items);
+            free(is_int);
+
+            // Reference must be added before children (to allow for recursion).
+            if (!add_array_refs(context, list_val, collection)) {
+                Py_DECREF(list_val);
+                return NULL;
+            }
+
+            // The type marker of this item has already been read.
+            PyObject *val = decode_item_AMF3(context, byte);
+            if (!val || !set_list_item(list_val, i, val)) {
+                Py_DECREF(list_val);
+                return NULL;
+            }
+
+            if (decode_dynamic_array_AMF3(context, list_val, i + 1, array_len, 0) == 0) {
+                Py_DECREF(list_val);
+                return NULL;
+            }
+
+            return list_val;
+        }
+
+        if (i == items_len) {
+            items_len *= 2;
+            double *new_items = (double*)realloc(items, sizeof(double) * (size_t)items_len);
+            if (new_items != NULL)
+                items = new_items;
+            char *new_is_int = (char*)realloc(is_int, (size_t)items_len);
+            if (new_is_int != NULL)
+                is_int = new_is_int;
+            if (new_items == NULL || new_is_int == NULL) {
+                free(items);
+                free(is_int);
+                PyErr_SetNone(PyExc_MemoryError);
+                return NULL;
+            }
+        }
+        items[i] = item;
+        is_int[i] = byte == INT_TYPE;
+    }
+    free(is_int);
+
+    PyObject *str_val;
+    const char *typecode;
+    if (all_ints) {
+        int *int_items = (int*)malloc(sizeof(int) * (size_t)array_len);
+        if (int_items == NULL) {
+            free(items);
+            PyErr_SetNone(PyExc_MemoryError);
+            return NULL;
+        }
+
         for (i = 0; i < array_len; i++) {
+            int_items[i] = (int)items[i];
+        }
+
+        typecode = "i";
+        str_val = PyString_FromStringAndSize((char*)int_items, (Py_ssize_t)(sizeof(int) * (size_t)array_len));
+        free(int_items);
+    } else {
+        typecode = "d";
+        str_val = PyString_FromStringAndSize((char*)items, (Py_ssize_t)(sizeof(double) * (size_t)array_len));
+    }
+    free(items);
+    if (!str_val)
+        return NULL;
+
+    PyObject *array_val = PyObject_CallFunction((PyObject*)array_type, "sO", typecode, str_val);
+    Py_DECREF(str_val);
+    if (!array_val)
+        return NULL;
+
+    // Numbers are not referenced, so the array
+    // can be referenced after its items are decoded.
+    if (!add_array_refs(context, array_val, collection)) {
+        Py_DECREF(array_val);
+        return NULL;
+    }
+
+    return array_val;
+}
+
+/*
+ * Set an item of a list that is being decoded.
+ *
+ * Steals a reference to val.
+ * Returns 1 on success, 0 on error.
+ */
+static int set_list_item(PyObject *list_val, int i, PyObject *val)
+{
+    if (i < PyList_GET_SIZE(list_val)) {
+        // Replace the placeholder of a preallocated list.
+        PyObject *placeholder = PyList_GET_ITEM(list_val, i);
+        PyList_SET_ITEM(list_val, i, val);
+        Py_DECREF(placeholder);
+        return 1;
+    }
+
+    int result = PyList_Append(list_val, val);
+    Py_DECREF(val);
+    return result == 0;
+}
+
+/* Populate an array with vals from the buffer, starting with item start. */
+static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, int start, int array_len, int dict)
+{
+    int i;
+    if (dict) {
+        // Object is a dict, set item index as key.
+        for (i = start; i < array_len; i++) {
             PyObject *val = decode_AMF3(context);
             if (!val)
                 return 0;
@@ -586,14 +1284,9 @@ static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, in
         }
     } else {
         // Standard array.
-        for (i = 0; i < array_len; i++) {
+        for (i = start; i < array_len; i++) {
             PyObject *val = decode_AMF3(context);
-            if (!val)
-                return 0;
-
-            int result = PyList_Append(list_val, val);
-            Py_DECREF(val);
-            if (result < 0)
+            if (!val || !set_list_item(list_val, i, val))
                 return 0;
         }
     }
@@ -601,6 +1294,203 @@ static int decode_dynamic_array_AMF3(DecoderObj *context, PyObject *list_val, in
     return 1;
 }
 
+/*
+ * Deserialize a Vector.
+ *
+ * Numeric Vectors are decoded to array.array objects,
+ * Vector.<Object> is decoded to a list.
+ */
+static PyObject* deserialize_vector_AMF3(DecoderObj *context, char vector_type)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return NULL;
+
+    // Check for reference
+    PyObject *vector_val = decode_reference_AMF3(context, context->obj_refs, header);
+    if (!vector_val)
+        return NULL;
+
+    if (vector_val != Py_False) {
+        return vector_val;
+    } else {
+        Py_DECREF(Py_False);
+    }
+
+    int count = (int)(header >> 1);
+    if (!check_length(context, count))
+        return NULL;
+
+    // Fixed length flag has no Python equivalent.
+    if (!Decoder_skipBytes(context, 1))
+        return NULL;
+
+    if (vector_type == VECTOR_OBJECT_TYPE)
+        return decode_object_vector_AMF3(context, count);
+
+    vector_val = decode_numeric_vector_AMF3(context, vector_type, count);
+    if (!vector_val)
+        return NULL;
+
+    // Add reference
+    if (Idx_map((IdxObj*)context->obj_refs, vector_val) == -1) {
+        Py_DECREF(vector_val);
+        return NULL;
+    }
+
+    return vector_val;
+}
+
+/*
+ * Decode the items of a numeric Vector to an array.array.
+ *
+ * Items are copied and byte swapped in bulk.
+ */
+static PyObject* decode_numeric_vector_AMF3(DecoderObj *context, char vector_type, int count)
+{
+    const char *typecode;
+    int item_size;
+    if (vector_type == VECTOR_INT_TYPE) {
+        typecode = "i";
+        item_size = 4;
+    } else if (vector_type == VECTOR_UINT_TYPE) {
+        typecode = "I";
+        item_size = 4;
+    } else {
+        typecode = "d";
+        item_size = 8;
+    }
+
+    PyObject *str_val = Decoder_readPyString(context, count * item_size);
+    if (!str_val)
+        return NULL;
+
+    PyObject *array_val = PyObject_CallFunction((PyObject*)array_type, "sO", typecode, str_val);
+    Py_DECREF(str_val);
+    if (!array_val)
+        return NULL;
+
+    if (!big_endian) {
+        PyObject *result = PyObject_CallMethod(array_val, "byteswap", NULL);
+        if (!result) {
+            Py_DECREF(array_val);
+            return NULL;
+        }
+        Py_DECREF(result);
+    }
+
+    return array_val;
+}
+
+/* Decode the items of a Vector.<Object> to a list. */
+static PyObject* decode_object_vector_AMF3(DecoderObj *context, int count)
+{
+    // Item type name
+    PyObject *type_name = deserialize_string_AMF3(context);
+    if (!type_name)
+        return NULL;
+    Py_DECREF(type_name);
+
+    PyObject *list_val;
+    if (check_length(context, count) == 1) {
+        list_val = new_list(count);
+    } else {
+        list_val = PyList_New(0);
+    }
+    if (!list_val)
+        return NULL;
+
+    // Reference must be added before children (to allow for recursion).
+    if (Idx_map((IdxObj*)context->obj_refs, list_val) == -1) {
+        Py_DECREF(list_val);
+        return NULL;
+    }
+
+    if (decode_dynamic_array_AMF3(context, list_val, 0, count, 0) == 0) {
+        Py_DECREF(list_val);
+        return NULL;
+    }
+
+    return list_val;
+}
+
+/*
+ * Deserialize a Dictionary.
+ *
+ * Dictionaries are decoded to dicts,
+ * the weak keys flag has no Python equivalent.
+ */
+static PyObject* deserialize_dictionary_AMF3(DecoderObj *context)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return NULL;
+
+    // Check for reference
+    PyObject *dict_val = decode_reference_AMF3(context, context->obj_refs, header);
+    if (!dict_val)
+        return NULL;
+
+    if (dict_val != Py_False) {
+        return dict_val;
+    } else {
+        Py_DECREF(Py_False);
+    }
+
+    int count = (int)(header >> 1);
+    int prealloc = check_length(context, count);
+    if (!prealloc)
+        return NULL;
+
+    // Weak keys flag
+    if (!Decoder_skipBytes(context, 1))
+        return NULL;
+
+    if (prealloc == 1) {
+        dict_val = new_dict(count);
+    } else {
+        dict_val = PyDict_New();
+    }
+    if (!dict_val)
+        return NULL;
+
+    // Reference must be added before children (to allow for recursion).
+    if (Idx_map((IdxObj*)context->obj_refs, dict_val) == -1) {
+        Py_DECREF(dict_val);
+        return NULL;
+    }
+
+    int i;
+    for (i = 0; i < count; i++) {
+        PyObject *key = decode_AMF3(context);
+        if (!key) {
+            Py_DECREF(dict_val);
+            return NULL;
+        }
+
+        PyObject *val = decode_AMF3(context);
+        if (!val) {
+            Py_DECREF(key);
+            Py_DECREF(dict_val);
+            return NULL;
+        }
+
+        int result = PyDict_SetItem(dict_val, key, val);
+        Py_DECREF(key);
+        Py_DECREF(val);
+        if (result == -1) {
+            if (PyErr_ExceptionMatches(PyExc_TypeError)) {
+                PyErr_Clear();
+                PyErr_SetString(amfast_DecodeError, "Dictionary key is not hashable.");
+            }
+            Py_DECREF(dict_val);
+            return NULL;
+        }
+    }
+
+    return dict_val;
+}
+
 /* Deserialize date. */
 static PyObject* deserialize_date(DecoderObj *context)
 {
@@ -693,15 +1583,117 @@ static PyObject* deserialize_byte_array_AMF3(DecoderObj *context)
 static PyObject* decode_byte_array_AMF3(DecoderObj *context, int byte_len)
 {
     PyObject *byte_array_val;
-    PyObject *str_val = Decoder_readPyString(context, (long)byte_len);
+    PyObject *str_val;
+
+    if (byte_len < 0) {
+        PyErr_SetString(amfast_DecodeError, "Invalid ByteArray length.");
+        return NULL;
+    }
+
+    if (!check_string(context, (unsigned int)byte_len))
+        return NULL;
+
+    if (context->use_byte_views == Py_True) {
+        str_val = Decoder_readView(context, byte_len);
+    } else {
+        str_val = Decoder_readPyString(context, byte_len);
+    }
     if (!str_val)
         return NULL;
 
+    if (context->uncompress_byte_arrays == Py_True) {
+        PyObject *uncompressed = uncompress_byte_string(context, str_val);
+        Py_DECREF(str_val);
+        if (!uncompressed)
+            return NULL;
+        str_val = uncompressed;
+    }
+
     byte_array_val = byte_array_from_string(str_val);
+    Py_DECREF(str_val);
 
     return byte_array_val;
 }
 
+/*
+ * Inflate ByteArray contents that start with a zlib header.
+ *
+ * zlib.decompress releases the GIL while it inflates.
+ * If max_string is set, the inflated size is checked first,
+ * without inflating more than max_string + 1 bytes.
+ *
+ * Returns a new reference to the inflated bytes,
+ * or to byte_string if it is not zlib compressed.
+ */
+static PyObject* uncompress_byte_string(DecoderObj *context, PyObject *byte_string)
+{
+    const void *c_buf;
+    Py_ssize_t byte_len;
+    if (PyObject_AsReadBuffer(byte_string, &c_buf, &byte_len) == -1)
+        return NULL;
+
+    // zlib header: deflate method, and a check value that is a multiple of 31
+    const unsigned char *bytes = (const unsigned char*)c_buf;
+    if (byte_len < 2 || (bytes[0] & 0x0F) != 8 || ((bytes[0] << 8) | bytes[1]) % 31 != 0) {
+        Py_INCREF(byte_string);
+        return byte_string;
+    }
+
+    if (zlib_decompress == NULL) {
+        PyObject *zlib_mod = PyImport_ImportModule("zlib");
+        if (!zlib_mod)
+            return NULL;
+
+        zlib_error = PyObject_GetAttrString(zlib_mod, "error");
+        zlib_decompress = PyObject_GetAttrString(zlib_mod, "decompress");
+        zlib_decompressobj = PyObject_GetAttrString(zlib_mod, "decompressobj");
+        Py_DECREF(zlib_mod);
+        if (!zlib_error || !zlib_decompress || !zlib_decompressobj) {
+            Py_CLEAR(zlib_error);
+            Py_CLEAR(zlib_decompress);
+            Py_CLEAR(zlib_decompressobj);
+            return NULL;
+        }
+    }
+
+    PyObject *result;
+    if (context->max_string > 0) {
+        PyObject *inflater = PyObject_CallObject(zlib_decompressobj, NULL);
+        if (!inflater)
+            return NULL;
+
+        result = PyObject_CallMethod(inflater, "decompress", "Oi",
+            byte_string, context->max_string + 1);
+        Py_DECREF(inflater);
+        if (result) {
+            Py_ssize_t inflated_len = PyString_Size(result);
+            Py_DECREF(result);
+            if (inflated_len == -1)
+                return NULL;
+
+            if (inflated_len > context->max_string) {
+                PyErr_Format(amfast_LimitError,
+                    "Inflated ByteArray exceeds max_string (%d).", context->max_string);
+                return NULL;
+            }
+        } else if (!PyErr_ExceptionMatches(zlib_error)) {
+            return NULL;
+        } else {
+            PyErr_Clear();
+        }
+    }
+
+    result = PyObject_CallFunctionObjArgs(zlib_decompress, byte_string, NULL);
+    if (!result && PyErr_ExceptionMatches(zlib_error)) {
+        // Bytes that happen to look like a zlib header.
+        PyErr_Clear();
+        Py_INCREF(byte_string);
+        return byte_string;
+    }
+
+    return result;
+}
+
 /* Deserialize an XML Doc. */
 static PyObject* deserialize_xml_AMF3(DecoderObj *context)
 {
@@ -805,9 +1797,23 @@ static PyObject* deserialize_string_AMF3(DecoderObj *context)
 /* Decode a string. */
 static PyObject* decode_string(DecoderObj *context, unsigned int string_size)
 {
+    if (!check_string(context, string_size))
+        return NULL;
+
     const char *str = Decoder_read(context, (long)string_size);
     if (!str)
         return NULL;
+
+    int has_table = intern_table_check(context);
+    if (has_table == 0)
+        return NULL;
+
+    if (has_table == 1) {
+        InternTableObj *table = (InternTableObj*)context->intern_table;
+        if (string_size <= (unsigned int)table->max_len)
+            return InternTable_get(table, str, (int)string_size);
+    }
+
     PyObject *unicode_val = PyUnicode_DecodeUTF8(str, (Py_ssize_t)string_size, NULL);
     if (!unicode_val)
         return NULL;
@@ -826,9 +1832,25 @@ static PyObject* decode_reference_AMF3(DecoderObj *context, PyObject *obj_contex
 {
     // Check for index reference
     if ((val & REFERENCE_BIT) == 0) {
-        return Idx_ret((IdxObj*)obj_context, val >> 1);
+        PyObject *ref = Idx_ret((IdxObj*)obj_context, val >> 1);
+        if (ref == NULL)
+            return NULL;
+
+        if (context->stats != Py_None)
+            record_ref(context, obj_context, 1);
+
+        if (ref->ob_type == &LazyValueType && obj_context == context->obj_refs) {
+            // Reference points into the span of a lazy value.
+            PyObject *result = LazyValue_ret(ref, val >> 1);
+            Py_DECREF(ref);
+            return result;
+        }
+
+        return ref;
     }
 
+    if (context->stats != Py_None)
+        record_ref(context, obj_context, 0);
     Py_RETURN_FALSE;
 }
 
@@ -1023,6 +2045,9 @@ static PyObject* decode_reference_AMF0(DecoderObj *context)
     unsigned short *idx_p = &idx;
     if(!_decode_ushort(context, idx_p))
         return NULL;
+
+    if (context->stats != Py_None)
+        record_ref(context, context->obj_refs, 1);
     return Idx_ret((IdxObj*)context->obj_refs, (int)idx);
 }
 
@@ -1038,6 +2063,8 @@ static PyObject* decode_dict_AMF0(DecoderObj *context)
         Py_DECREF(obj_val);
         return NULL;
     }
+    if (context->stats != Py_None)
+        record_ref(context, context->obj_refs, 0);
 
     if (decode_dynamic_dict_AMF0(context, obj_val) == 0) {
         Py_DECREF(obj_val);
@@ -1050,6 +2077,7 @@ static PyObject* decode_dict_AMF0(DecoderObj *context)
 /* Decode an dynamic AMF0 dict. */
 static int decode_dynamic_dict_AMF0(DecoderObj *context, PyObject *dict)
 {
+    int count = 0;
     while (1) {
         PyObject *key = decode_string_AMF0(context);
         if (key == NULL)
@@ -1061,6 +2089,12 @@ static int decode_dynamic_dict_AMF0(DecoderObj *context, PyObject *dict)
             return Decoder_skipBytes(context, 1); // Skip end marker
         }
 
+        count++;
+        if (context->max_length > 0 && !check_length(context, count)) {
+            Py_DECREF(key);
+            return 0;
+        }
+
         PyObject *val = decode_AMF0(context);
         if (val == NULL) {
             Py_DECREF(key);
@@ -1090,10 +2124,16 @@ static PyObject* decode_array_AMF0(DecoderObj *context, short map_reference)
     if(!_decode_ulong(context, array_len_p))
         return NULL;
 
-    // Can't use array_len to create list
-    // of known length. See ticket #46.
+    int prealloc = check_length(context, (int)array_len);
+    if (!prealloc)
+        return NULL;
 
-    PyObject *list_val = PyList_New(0);
+    PyObject *list_val;
+    if (prealloc == 1) {
+        list_val = new_list((int)array_len);
+    } else {
+        list_val = PyList_New(0);
+    }
     if (!list_val)
         return NULL;
 
@@ -1103,21 +2143,33 @@ static PyObject* decode_array_AMF0(DecoderObj *context, short map_reference)
             Py_DECREF(list_val);
             return NULL;
         }
+        if (context->stats != Py_None)
+            record_ref(context, context->obj_refs, 0);
     }
 
     // Add each item to the list
-    unsigned int i;
-    for (i = 0; i < array_len; i++) {
+    int i;
+    for (i = 0; i < (int)array_len; i++) {
         PyObject *val = decode_AMF0(context);
         if (!val) {
             Py_DECREF(list_val);
             return NULL;
         }
 
+        if (i < PyList_GET_SIZE(list_val)) {
+            // Replace the placeholder of a preallocated list.
+            PyObject *placeholder = PyList_GET_ITEM(list_val, i);
+            PyList_SET_ITEM(list_val, i, val);
+            Py_DECREF(placeholder);
+            continue;
+        }
+
         int result = PyList_Append(list_val, val);
         Py_DECREF(val);
-        if (result < 0)
+        if (result < 0) {
+            Py_DECREF(list_val);
             return NULL;
+        }
     }
 
     return list_val;
@@ -1138,6 +2190,8 @@ static PyObject* decode_date_AMF0(DecoderObj *context)
         Py_DECREF(date_val);
         return NULL;
     }
+    if (context->stats != Py_None)
+        record_ref(context, context->obj_refs, 0);
 
     return date_val;
 }
@@ -1186,6 +2240,8 @@ static PyObject* decode_typed_obj_AMF0(DecoderObj *context)
         Py_DECREF(obj_val);
         return NULL;
     }
+    if (context->stats != Py_None)
+        record_ref(context, context->obj_refs, 0);
 
     // Put decoded attributes in this dict
     PyObject *decoded_attrs = PyDict_New();
@@ -1314,8 +2370,12 @@ static PyObject* decode_headers_AMF0(DecoderObj *context)
         // Read byte length, but don't do anything with it.
         unsigned int byte_len;
         unsigned int *byte_len_p = &byte_len;
-        if(!_decode_ulong(context, byte_len_p))
-            return NULL;
+        if(!_decode_ulong(context, byte_len_p)) {
+            Py_DECREF(header_list);
+            Py_DECREF(header_name);
+            Py_DECREF(required);
+            return NULL;
+        }
 
         // We need a new context for each header
         DecoderObj *new_context = (DecoderObj*)Decoder_copy(context, 0);
@@ -1327,6 +2387,7 @@ static PyObject* decode_headers_AMF0(DecoderObj *context)
         }
 
         PyObject *header_obj = decode_AMF0(new_context);
+        context->bytes_read = new_context->bytes_read;
         Py_XDECREF(new_context);
         if (!header_obj) {
             Py_DECREF(header_list);
@@ -1391,8 +2452,12 @@ static PyObject* decode_messages_AMF0(DecoderObj *context)
         // Read byte length, but don't do anything with it.
         unsigned int byte_len;
         unsigned int *byte_len_p = &byte_len;
-        if(!_decode_ulong(context, byte_len_p))
+        if(!_decode_ulong(context, byte_len_p)) {
+            Py_DECREF(message_list);
+            Py_DECREF(target);
+            Py_DECREF(response);
             return NULL;
+        }
 
         // We need a new context for each message
         // so that reference indexes are reset
@@ -1415,12 +2480,15 @@ static PyObject* decode_messages_AMF0(DecoderObj *context)
                 Py_DECREF(message_list);
                 Py_DECREF(target);
                 Py_DECREF(response);
+                Py_DECREF(new_context);
+                return NULL;
             }
 
             message_obj = decode_array_AMF0(new_context, 0);
         } else {
             message_obj = decode_AMF0(new_context);
         }
+        context->bytes_read = new_context->bytes_read;
         Py_XDECREF(new_context);
 
         if (!message_obj) {
@@ -1457,14 +2525,40 @@ static PyObject* decode_messages_AMF0(DecoderObj *context)
     return message_list;
 }
 
-/* Decode individual AMF0 objs from buffer. */
+/*
+ * Decode an AMF0 value, checking max_depth
+ * and recording stats if they are enabled.
+ */
 static PyObject* decode_AMF0(DecoderObj *context)
+{
+    if (context->max_depth == 0 && context->stats == Py_None)
+        return decode_value_AMF0(context);
+
+    if (!enter_value(context))
+        return NULL;
+
+    PyObject *result;
+    if (context->stats != Py_None) {
+        result = decode_stats(context, 0);
+    } else {
+        result = decode_value_AMF0(context);
+    }
+
+    context->depth--;
+    return result;
+}
+
+/* Decode individual AMF0 objs from buffer. */
+static PyObject* decode_value_AMF0(DecoderObj *context)
 {
     const char *byte_ref = Decoder_readByte(context);
     if (!byte_ref)
         return NULL;
     const char byte = byte_ref[0];
 
+    if (context->stats_marker == STATS_PENDING)
+        context->stats_marker = (unsigned char)byte;
+
     switch(byte) {
         case NUMBER_AMF0:
             return decode_double(context);
@@ -1505,8 +2599,12 @@ static PyObject* decode_AMF0(DecoderObj *context)
         case AMF3_AMF0:
             {
                 DecoderObj *new_context = (DecoderObj*)Decoder_copy(context, 1);
+                if (!new_context)
+                    return NULL;
+
                 PyObject *result = decode_AMF3(new_context);
-                Py_XDECREF(new_context);
+                context->bytes_read = new_context->bytes_read;
+                Py_DECREF(new_context);
                 return result;
             }
         default:
@@ -1514,18 +2612,67 @@ static PyObject* decode_AMF0(DecoderObj *context)
     }
 
     char error_str[100];
-    sprintf(error_str, "Unknown AMF0 type marker byte: '%X' at position: %d", byte, Decoder_tell(context) - 1);
+    sprintf(error_str, "Unknown AMF0 type marker byte: '%X' at position: %ld", byte, (long)Decoder_tell(context) - 1);
     PyErr_SetString(amfast_DecodeError, error_str);
     return NULL;
 }
 
-/* Decode individual AMF3 objs from buffer. */
+/*
+ * Decode an AMF3 value, checking max_depth
+ * and recording stats if they are enabled.
+ */
 static PyObject* decode_AMF3(DecoderObj *context)
+{
+    if (context->max_depth == 0 && context->stats == Py_None)
+        return decode_value_AMF3(context);
+
+    if (!enter_value(context))
+        return NULL;
+
+    PyObject *result;
+    if (context->stats != Py_None) {
+        result = decode_stats(context, 1);
+    } else {
+        result = decode_value_AMF3(context);
+    }
+
+    context->depth--;
+    return result;
+}
+
+/*
+ * Decode an AMF3 value whose type marker has already been read.
+ *
+ * Same as decode_AMF3, except that the value is not recorded in CodecStats.
+ */
+static PyObject* decode_item_AMF3(DecoderObj *context, char byte)
+{
+    if (context->max_depth == 0)
+        return decode_type_AMF3(context, byte);
+
+    if (!enter_value(context))
+        return NULL;
+
+    PyObject *result = decode_type_AMF3(context, byte);
+    context->depth--;
+    return result;
+}
+
+/* Decode individual AMF3 objs from buffer. */
+static PyObject* decode_value_AMF3(DecoderObj *context)
 {
     const char *byte_ref = Decoder_readByte(context);
     if (!byte_ref)
         return NULL;
-    const char byte = byte_ref[0];
+
+    return decode_type_AMF3(context, byte_ref[0]);
+}
+
+/* Decode an AMF3 value after its type marker. */
+static PyObject* decode_type_AMF3(DecoderObj *context, char byte)
+{
+    if (context->stats_marker == STATS_PENDING)
+        context->stats_marker = (unsigned char)byte;
 
     switch(byte) {
         case UNDEFINED_TYPE:
@@ -1554,172 +2701,2448 @@ static PyObject* decode_AMF3(DecoderObj *context)
            return deserialize_xml_AMF3(context);
         case BYTE_ARRAY_TYPE:
             return deserialize_byte_array_AMF3(context);
-        case AMF3_AMF0:
-            return decode_AMF3(context);
+        case VECTOR_INT_TYPE:
+        case VECTOR_UINT_TYPE:
+        case VECTOR_DOUBLE_TYPE:
+        case VECTOR_OBJECT_TYPE:
+            return deserialize_vector_AMF3(context, byte);
+        case DICTIONARY_TYPE:
+            return deserialize_dictionary_AMF3(context);
         default:
             break;
     }
 
     char error_str[100];
-    sprintf(error_str, "Unknown AMF3 type marker byte: '%X' at position: %d", byte, Decoder_tell(context) - 1);
+    sprintf(error_str, "Unknown AMF3 type marker byte: '%X' at position: %ld", byte, (long)Decoder_tell(context) - 1);
     PyErr_SetString(amfast_DecodeError, error_str);
     return NULL;
 }
 
-// ---- Python EXPOSED FUNCTIONS
+// ---- LAZY VALUES
 
-/* Decode an AMF stream to a Python obj. */
-static PyObject* py_decode(PyObject *self, PyObject *args, PyObject *kwargs)
+/*
+ * Create a LazyValue starting at the current position.
+ *
+ * Returns a new reference.
+ */
+static PyObject* LazyValue_create(DecoderObj *context)
 {
-    PyObject *context;
-    DecoderObj *dec_context;
+    PyObject *source = Decoder_getSource(context);
+    if (source == NULL) {
+        PyErr_SetString(amfast_DecodeError, "Lazy values can only be decoded from strings or buffers.");
+        return NULL;
+    }
 
-    if (!PyArg_ParseTuple(args, "O", &context))
+    LazyValueObj *self = PyObject_GC_New(LazyValueObj, &LazyValueType);
+    if (self == NULL)
         return NULL;
 
-    // If input is a string, create a context object.
-    if (PyString_Check(context) == 1) {
-        PyObject *cls = PyObject_GetAttrString(context_mod, "DecoderContext");
-        if (cls == NULL)
-            return NULL;
+    Py_INCREF(source);
+    self->source = source;
+    Py_INCREF(context->class_mapper);
+    self->class_mapper = context->class_mapper;
+    Py_INCREF(context->use_byte_views);
+    self->use_byte_views = context->use_byte_views;
+    Py_INCREF(context->obj_refs);
+    self->obj_refs = context->obj_refs;
+    Py_INCREF(context->string_refs);
+    self->string_refs = context->string_refs;
+    Py_INCREF(context->class_refs);
+    self->class_refs = context->class_refs;
+    self->obj_len = ((IdxObj*)context->obj_refs)->pos;
+    self->string_len = ((IdxObj*)context->string_refs)->pos;
+    self->class_len = ((IdxObj*)context->class_refs)->pos;
+    self->start = Decoder_tell(context);
+    self->end = -1;
+    self->value = NULL;
+    self->refs = NULL;
+    self->spliceable = 0;
+    self->obj_count = 0;
+    self->string_count = 0;
+    self->class_count = 0;
+
+    PyObject_GC_Track((PyObject*)self);
+    return (PyObject*)self;
+}
 
-        dec_context = (DecoderObj*)PyObject_CallFunctionObjArgs(cls, context, NULL);
-        Py_DECREF(cls);
-        if (dec_context == NULL)
-            return NULL;
-    } else if (Decoder_check(context) == 1) {
-        dec_context = (DecoderObj*)context;
-        Py_INCREF(dec_context);
-    } else {
-        PyErr_SetString(amfast_DecodeError, "Argument must be a string or type amfast.context.DecoderContext");
-        return NULL;
-    }
+static int LazyValue_traverse(LazyValueObj *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->source);
+    Py_VISIT(self->class_mapper);
+    Py_VISIT(self->obj_refs);
+    Py_VISIT(self->string_refs);
+    Py_VISIT(self->class_refs);
+    Py_VISIT(self->value);
+    Py_VISIT(self->refs);
+    return 0;
+}
 
-    PyObject *result;
-    if (dec_context->amf3 == Py_True) {
-        result = decode_AMF3(dec_context);
-    } else {
-        result = decode_AMF0(dec_context);
+static int LazyValue_clear(LazyValueObj *self)
+{
+    Py_CLEAR(self->source);
+    Py_CLEAR(self->class_mapper);
+    Py_CLEAR(self->use_byte_views);
+    Py_CLEAR(self->obj_refs);
+    Py_CLEAR(self->string_refs);
+    Py_CLEAR(self->class_refs);
+    Py_CLEAR(self->value);
+    Py_CLEAR(self->refs);
+    return 0;
+}
+
+static void LazyValue_dealloc(LazyValueObj *self)
+{
+    PyObject_GC_UnTrack(self);
+    LazyValue_clear(self);
+    PyObject_GC_Del(self);
+}
+
+/* Copy the first len indexes of an Idx to another Idx. */
+static int copy_idx(PyObject *src, PyObject *dest, int len)
+{
+    if (len > ((IdxObj*)src)->pos) {
+        PyErr_SetString(amfast_DecodeError, "Reference index was reset before lazy value was decoded.");
+        return 0;
     }
 
-    Py_DECREF(dec_context);
-    return result;
+    int i;
+    for (i = 0; i < len; i++) {
+        if (Idx_map((IdxObj*)dest, ((IdxObj*)src)->objs[i]) == -1)
+            return 0;
+    }
+    return 1;
 }
 
-/* Decode an AMF Packet from a stream. */
-static PyObject* py_decode_packet(PyObject *self, PyObject *args, PyObject *kwargs)
+/*
+ * Decode the value of a LazyValue.
+ *
+ * Returns a new reference.
+ */
+static PyObject* LazyValue_decode(PyObject *self_raw)
 {
-    PyObject *context;
-    DecoderObj *dec_context;
+    LazyValueObj *self = (LazyValueObj*)self_raw;
 
-    if (!PyArg_ParseTuple(args, "O", &context))
+    if (self->value != NULL) {
+        Py_INCREF(self->value);
+        return self->value;
+    }
+
+    if (self->end == -1 || self->obj_refs == NULL) {
+        PyErr_SetString(amfast_DecodeError, "Lazy value is not complete.");
         return NULL;
+    }
 
-    // If input is a string, create a context object.
-    if (PyString_Check(context) == 1) {
-        PyObject *cls = PyObject_GetAttrString(context_mod, "DecoderContext");
-        if (cls == NULL)
-            return NULL;
+    PyObject *cls = PyObject_GetAttrString(context_mod, "DecoderContext");
+    if (cls == NULL)
+        return NULL;
 
-        dec_context = (DecoderObj*)PyObject_CallFunctionObjArgs(cls, context, NULL);
-        Py_DECREF(cls);
-        if (dec_context == NULL)
-            return NULL;
-    } else if (Decoder_check(context) == 1) {
-        dec_context = (DecoderObj*)context;
-        Py_INCREF(dec_context);
-    } else {
-        PyErr_SetString(amfast_DecodeError, "Argument must be a string or type amfast.context.DecoderContext");
+    DecoderObj *context = (DecoderObj*)PyObject_CallFunctionObjArgs(cls, self->source,
+        self->class_mapper, Py_True, self->use_byte_views, NULL);
+    Py_DECREF(cls);
+    if (context == NULL)
+        return NULL;
+
+    // Restore the reference tables as they
+    // were at the start of the span.
+    if (!copy_idx(self->obj_refs, context->obj_refs, self->obj_len) ||
+        !copy_idx(self->string_refs, context->string_refs, self->string_len) ||
+        !copy_idx(self->class_refs, context->class_refs, self->class_len)) {
+        Py_DECREF(context);
         return NULL;
     }
 
-    PyObject *result = decode_packet(dec_context);
-    Py_DECREF(dec_context);
-    return result;
+    if (!Decoder_skipBytes(context, self->start)) {
+        Py_DECREF(context);
+        return NULL;
+    }
+
+    PyObject *value = decode_AMF3(context);
+    if (value == NULL) {
+        Py_DECREF(context);
+        return NULL;
+    }
+
+    if (Decoder_tell(context) != self->end) {
+        Py_DECREF(value);
+        Py_DECREF(context);
+        PyErr_SetString(amfast_DecodeError, "Lazy value does not match encoded length.");
+        return NULL;
+    }
+
+    self->value = value;
+    self->refs = context->obj_refs;
+    Py_INCREF(self->refs);
+    Py_DECREF(context);
+
+    // Snapshot is no longer needed.
+    Py_CLEAR(self->obj_refs);
+    Py_CLEAR(self->string_refs);
+    Py_CLEAR(self->class_refs);
+
+    Py_INCREF(value);
+    return value;
 }
 
-// ---- Module init
+/*
+ * Retrieve an object reference that was
+ * mapped to a LazyValue while skipping its span.
+ *
+ * Returns a new reference.
+ */
+static PyObject* LazyValue_ret(PyObject *self_raw, int idx)
+{
+    LazyValueObj *self = (LazyValueObj*)self_raw;
 
-/* Expose functions as Python module functions. */
-static PyMethodDef decode_methods[] = {
-    {"decode", (PyCFunction)py_decode, METH_VARARGS | METH_KEYWORDS,
-    "Description:\n"
-    "=============\n"
-    "Decode an AMF stream to Python objs.\n\n"
-    "Useage:\n"
-    "===========\n"
-    "py_obj = decode(context)\n\n"
-    "arguments:\n"
-    "============\n"
-    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"},
-    {"decode_packet", (PyCFunction)py_decode_packet, METH_VARARGS | METH_KEYWORDS,
-    "Description:\n"
-    "=============\n"
-    "Decode an AMF packet stream.\n\n"
-    "Useage:\n"
-    "=========\n"
-    "py_obj = decode_packet(context)\n\n"
-    "arguments:\n"
-    "===========\n"
-    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"},
-    {NULL, NULL, 0, NULL}   /* sentinel */
+    if (self->value == NULL) {
+        PyObject *value = LazyValue_decode(self_raw);
+        if (value == NULL)
+            return NULL;
+        Py_DECREF(value);
+    }
+
+    return Idx_ret((IdxObj*)self->refs, idx);
+}
+
+/*
+ * Python exposed version of LazyValue_decode.
+ */
+static PyObject* PyLazyValue_decode(PyObject *self, PyObject *args)
+{
+    return LazyValue_decode(self);
+}
+
+/*
+ * Python exposed flag.
+ */
+static PyObject* PyLazyValue_getDecoded(LazyValueObj *self, void *closure)
+{
+    if (self->value != NULL) {
+        Py_RETURN_TRUE;
+    }
+
+    Py_RETURN_FALSE;
+}
+
+static PyMethodDef LazyValue_methods[] = {
+    {"decode", (PyCFunction)PyLazyValue_decode, METH_NOARGS,
+     "Decode the value. The decoded value is cached, so subsequent calls return the same object."},
+    {NULL}  /* Sentinel */
 };
 
-PyMODINIT_FUNC
-initdecode(void)
+static PyMemberDef LazyValue_members[] = {
+    {"source", T_OBJECT_EX, offsetof(LazyValueObj, source), READONLY,
+     "str or buffer - The object the value is decoded from."},
+    {"start", T_PYSSIZET, offsetof(LazyValueObj, start), READONLY,
+     "int - Position of the first byte of the encoded value."},
+    {"end", T_PYSSIZET, offsetof(LazyValueObj, end), READONLY,
+     "int - Position after the last byte of the encoded value."},
+    {NULL}  /* Sentinel */
+};
+
+static PyGetSetDef LazyValue_getset[] = {
+    {"decoded", (getter)PyLazyValue_getDecoded, NULL,
+     "bool - True if the value has been decoded.", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject LazyValueType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "amfast.decode.LazyValue", /*tp_name*/
+    sizeof(LazyValueObj),      /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)LazyValue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC, /*tp_flags*/
+    "An encoded AMF3 value that is decoded when it is accessed.\n\n"
+    "LazyValues are created when decoding attributes listed in\n"
+    "ClassDef.lazy_attrs with a DecoderContext created with lazy=True.\n"
+    "The input must not be modified until all LazyValues are decoded.", /* tp_doc */
+    (traverseproc)LazyValue_traverse, /* tp_traverse */
+    (inquiry)LazyValue_clear,  /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    LazyValue_methods,         /* tp_methods */
+    LazyValue_members,         /* tp_members */
+    LazyValue_getset,          /* tp_getset */
+};
+
+/*
+ * Decode a value lazily.
+ *
+ * Objects and arrays are skipped over and returned
+ * as a LazyValue. All other values are decoded normally.
+ */
+static PyObject* decode_lazy_AMF3(DecoderObj *context)
 {
-    PyObject *m;
+    if (context->lazy != Py_True || context->amf3 != Py_True || Decoder_getSource(context) == NULL)
+        return decode_AMF3(context);
 
-    // Create module
-    m = Py_InitModule3("decode", decode_methods,
-        "Tools for decoding AMF streams.");
-    if (m == NULL)
-        return;
+    Py_ssize_t start = Decoder_tell(context);
+    if (start == -1)
+        return NULL;
 
-    // import all required external modules
-    if (!amfast_mod) {
-        amfast_mod = PyImport_ImportModule("amfast");
-        if(!amfast_mod)
-            return;
-    }
+    char *byte_ref = Decoder_readByte(context);
+    if (byte_ref == NULL)
+        return NULL;
+    char byte = byte_ref[0];
 
-    if (!remoting_mod) {
-        remoting_mod = PyImport_ImportModule("amfast.remoting");
-        if (!remoting_mod)
-            return;
+    int header = 0;
+    if (byte == OBJECT_TYPE || byte == ARRAY_TYPE) {
+        if (!_decode_int_AMF3(context, &header))
+            return NULL;
     }
 
-    if (context_mod == NULL) {
-        context_mod = import_context_mod();
-        if (context_mod == NULL)
-            return;
-    }
+    if (!Decoder_skipBytes(context, start - Decoder_tell(context)))
+        return NULL;
 
-    if (!xml_dom_mod) {
-        xml_dom_mod = PyImport_ImportModule("xml.dom.minidom");
-        if (!xml_dom_mod)
-            return;
+    if ((byte != OBJECT_TYPE && byte != ARRAY_TYPE) || (header & REFERENCE_BIT) == 0) {
+        // Nothing to gain by deferring scalars and references.
+        return decode_AMF3(context);
     }
 
-    if (!as_types_mod) {
-        as_types_mod = PyImport_ImportModule("amfast.class_def.as_types");
-        if (!as_types_mod)
-            return;
-    }
+    PyObject *lazy = LazyValue_create(context);
+    if (lazy == NULL)
+        return NULL;
 
-    // Setup exceptions
-    amfast_Error = PyObject_GetAttrString(amfast_mod, "AmFastError");
-    if (amfast_Error == NULL) {
-        return;
+    int result = skip_AMF3(context, lazy);
+    if (result == 0) {
+        Py_DECREF(lazy);
+        return NULL;
     }
 
-    amfast_DecodeError = PyErr_NewException("amfast.decode.DecodeError", amfast_Error, NULL);
-    if (amfast_DecodeError == NULL) {
-        return;
+    if (result == -1) {
+        // Value can not be skipped,
+        // rewind and decode normally.
+        LazyValueObj *lazy_obj = (LazyValueObj*)lazy;
+        if (!Idx_truncate((IdxObj*)context->obj_refs, lazy_obj->obj_len) ||
+            !Idx_truncate((IdxObj*)context->string_refs, lazy_obj->string_len) ||
+            !Idx_truncate((IdxObj*)context->class_refs, lazy_obj->class_len)) {
+            Py_DECREF(lazy);
+            return NULL;
+        }
+        Py_DECREF(lazy);
+
+        if (!Decoder_skipBytes(context, start - Decoder_tell(context)))
+            return NULL;
+
+        return decode_AMF3(context);
     }
 
-    Py_INCREF(amfast_DecodeError);
-    if (PyModule_AddObject(m, "DecodeError", amfast_DecodeError) == -1) {
+    ((LazyValueObj*)lazy)->end = Decoder_tell(context);
+    return lazy;
+}
+
+/*
+ * Skip over an encoded value.
+ *
+ * Strings and ClassDefs are decoded and indexed as usual,
+ * because values after the span may reference them.
+ * Objects are indexed with placeholder, so references
+ * into the span can be resolved by decoding the span.
+ *
+ * Returns 1 on success, 0 on failure,
+ * and -1 if the value contains externalizable objects,
+ * which can only be read by decoding them.
+ */
+static int skip_AMF3(DecoderObj *context, PyObject *placeholder)
+{
+    const char *byte_ref = Decoder_readByte(context);
+    if (!byte_ref)
+        return 0;
+    const char byte = byte_ref[0];
+
+    PyObject *str_val;
+    switch(byte) {
+        case UNDEFINED_TYPE:
+        case NULL_TYPE:
+        case FALSE_TYPE:
+        case TRUE_TYPE:
+            return 1;
+        case INT_TYPE:
+            {
+                int val;
+                return _decode_int_AMF3(context, &val);
+            }
+        case DOUBLE_TYPE:
+            return Decoder_skipBytes(context, 8);
+        case STRING_TYPE:
+            str_val = deserialize_string_AMF3(context);
+            if (str_val == NULL)
+                return 0;
+            Py_DECREF(str_val);
+            return 1;
+        case DATE_TYPE:
+            return skip_sized_AMF3(context, placeholder, 8);
+        case XML_DOC_TYPE:
+        case XML_TYPE:
+        case BYTE_ARRAY_TYPE:
+            return skip_sized_AMF3(context, placeholder, -1);
+        case ARRAY_TYPE:
+            return skip_array_AMF3(context, placeholder, 0);
+        case OBJECT_TYPE:
+            return skip_obj_AMF3(context, placeholder, 0);
+        case VECTOR_INT_TYPE:
+        case VECTOR_UINT_TYPE:
+        case VECTOR_DOUBLE_TYPE:
+        case VECTOR_OBJECT_TYPE:
+            return skip_vector_AMF3(context, placeholder, byte);
+        case DICTIONARY_TYPE:
+            return skip_dictionary_AMF3(context, placeholder);
+        default:
+            break;
+    }
+
+    char error_str[100];
+    sprintf(error_str, "Unknown AMF3 type marker byte: '%X' at position: %ld", byte, (long)Decoder_tell(context) - 1);
+    PyErr_SetString(amfast_DecodeError, error_str);
+    return 0;
+}
+
+/*
+ * Skip over a date, xml or byte array.
+ *
+ * fixed_len is the length of the encoded value,
+ * or -1 if the length is encoded in the header.
+ */
+static int skip_sized_AMF3(DecoderObj *context, PyObject *placeholder, int fixed_len)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return 0;
+
+    if ((header & REFERENCE_BIT) == 0)
+        return 1;
+
+    if (fixed_len == -1)
+        fixed_len = header >> 1;
+
+    if (!Decoder_skipBytes(context, fixed_len))
+        return 0;
+
+    if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+        return 0;
+
+    return 1;
+}
+
+/* Skip over a Vector. */
+static int skip_vector_AMF3(DecoderObj *context, PyObject *placeholder, char vector_type)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return 0;
+
+    if ((header & REFERENCE_BIT) == 0)
+        return 1;
+
+    int count = header >> 1;
+
+    // Fixed length flag
+    if (!Decoder_skipBytes(context, 1))
+        return 0;
+
+    if (vector_type != VECTOR_OBJECT_TYPE) {
+        int item_size = vector_type == VECTOR_DOUBLE_TYPE ? 8 : 4;
+        if (!Decoder_skipBytes(context, count * item_size))
+            return 0;
+
+        if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+            return 0;
+
+        return 1;
+    }
+
+    // Item type name
+    PyObject *type_name = deserialize_string_AMF3(context);
+    if (type_name == NULL)
+        return 0;
+    Py_DECREF(type_name);
+
+    if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+        return 0;
+
+    int i;
+    for (i = 0; i < count; i++) {
+        int result = skip_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+
+    return 1;
+}
+
+/* Skip over a Dictionary. */
+static int skip_dictionary_AMF3(DecoderObj *context, PyObject *placeholder)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return 0;
+
+    if ((header & REFERENCE_BIT) == 0)
+        return 1;
+
+    int count = header >> 1;
+
+    // Weak keys flag
+    if (!Decoder_skipBytes(context, 1))
+        return 0;
+
+    if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+        return 0;
+
+    // Keys and values
+    int i;
+    for (i = 0; i < count * 2; i++) {
+        int result = skip_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+
+    return 1;
+}
+
+/* Skip over the name/value pairs of an obj or mixed array. */
+static int skip_dynamic_dict_AMF3(DecoderObj *context, PyObject *placeholder)
+{
+    while (1) {
+        PyObject *key = deserialize_string_AMF3(context);
+        if (!key)
+            return 0;
+
+        Py_ssize_t key_len = PyUnicode_GET_SIZE(key);
+        Py_DECREF(key);
+        if (key_len == 0) {
+            // Empty string marks end of name/value pairs
+            return 1;
+        }
+
+        int result = skip_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+}
+
+/*
+ * Skip over an array.
+ *
+ * References are indexed in the same order as deserialize_array_AMF3.
+ */
+static int skip_array_AMF3(DecoderObj *context, PyObject *placeholder, int collection)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return 0;
+
+    if ((header & REFERENCE_BIT) == 0) {
+        if (collection) {
+            if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+                return 0;
+        }
+        return 1;
+    }
+
+    int array_len = (int)(header >> 1);
+
+    char *byte_ref = Decoder_readByte(context);
+    if (byte_ref == NULL)
+        return 0;
+    if (byte_ref[0] != EMPTY_STRING_TYPE) {
+        if (!Decoder_skipBytes(context, -1))
+            return 0;
+
+        int result = skip_dynamic_dict_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+
+    if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+        return 0;
+
+    if (collection) {
+        if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+            return 0;
+    }
+
+    int i;
+    for (i = 0; i < array_len; i++) {
+        int result = skip_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+
+    return 1;
+}
+
+/*
+ * Skip over an obj.
+ *
+ * References are indexed in the same order as deserialize_obj_AMF3.
+ */
+static int skip_obj_AMF3(DecoderObj *context, PyObject *placeholder, int proxy)
+{
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return 0;
+
+    if ((header & REFERENCE_BIT) == 0) {
+        if (proxy) {
+            if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+                return 0;
+        }
+        return 1;
+    }
+
+    // class_def_dict ref belongs to the context
+    PyObject *class_def_dict = deserialize_class_def_AMF3(context, header);
+    if (class_def_dict == NULL)
+        return 0;
+
+    PyObject *class_def = PyDict_GetItemString(class_def_dict, "class_def");
+    if (class_def == NULL)
+        return 0;
+
+    if (class_def != Py_None && PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF")) {
+        if (PyObject_HasAttrString(class_def, "ARRAY_COLLECTION_CLASS_DEF")) {
+            if (Decoder_skipBytes(context, 1) == 0) // Skip array type marker
+                return 0;
+            return skip_array_AMF3(context, placeholder, 1);
+        }
+
+        if (PyObject_HasAttrString(class_def, "OBJECT_PROXY_CLASS_DEF")) {
+            if (Decoder_skipBytes(context, 1) == 0) // Skip object type marker
+                return 0;
+            return skip_obj_AMF3(context, placeholder, 1);
+        }
+
+        // Length of externalized data is unknown.
+        return -1;
+    }
+
+    if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+        return 0;
+
+    if (proxy) {
+        if (Idx_map((IdxObj*)context->obj_refs, placeholder) == -1)
+            return 0;
+    }
+
+    PyObject *static_attrs = PyDict_GetItemString(class_def_dict, "static_attrs");
+    if (static_attrs == NULL)
+        return 0;
+
+    Py_ssize_t static_attr_len = PyTuple_GET_SIZE(static_attrs);
+    int i;
+    for (i = 0; i < static_attr_len; i++) {
+        int result = skip_AMF3(context, placeholder);
+        if (result != 1)
+            return result;
+    }
+
+    PyObject *dynamic = PyDict_GetItemString(class_def_dict, "dynamic");
+    if (dynamic == NULL)
+        return 0;
+
+    if (dynamic == Py_True)
+        return skip_dynamic_dict_AMF3(context, placeholder);
+
+    return 1;
+}
+
+// ---- INTERN TABLE
+
+/*
+ * Returns 1 if the context has an InternTable,
+ * -1 if it does not, and 0 on error.
+ */
+static int intern_table_check(DecoderObj *context)
+{
+    if (context->intern_table == Py_None)
+        return -1;
+
+    if (context->intern_table->ob_type != &InternTableType) {
+        PyErr_SetString(PyExc_TypeError, "intern_table must be an amfast.decode.InternTable.");
+        return 0;
+    }
+
+    return 1;
+}
+
+/*
+ * Retrieve the shared string for a sequence of UTF8 bytes.
+ *
+ * Strings that are not in the table are decoded and added.
+ * The table is emptied when it is full.
+ * Returns new ref.
+ */
+static PyObject* InternTable_get(InternTableObj *self, const char *str, int len)
+{
+    // FNV-1a
+    unsigned long hash = 2166136261UL;
+    int i;
+    for (i = 0; i < len; i++) {
+        hash = (hash ^ (unsigned char)str[i]) * 16777619UL;
+    }
+
+    int slot = (int)(hash & (unsigned long)self->mask);
+    InternEntry *entry;
+    while (1) {
+        entry = &self->entries[slot];
+        if (entry->value == NULL)
+            break;
+
+        if (entry->hash == hash && PyString_GET_SIZE(entry->bytes) == len &&
+            memcmp(PyString_AS_STRING(entry->bytes), str, (size_t)len) == 0) {
+            Py_INCREF(entry->value);
+            return entry->value;
+        }
+
+        slot = (slot + 1) & self->mask;
+    }
+
+    PyObject *value = PyUnicode_DecodeUTF8(str, (Py_ssize_t)len, NULL);
+    if (!value)
+        return NULL;
+
+    PyObject *bytes = PyString_FromStringAndSize(str, (Py_ssize_t)len);
+    if (!bytes) {
+        Py_DECREF(value);
+        return NULL;
+    }
+
+    if (self->count >= self->max_entries) {
+        InternTable_clear(self);
+        entry = &self->entries[hash & (unsigned long)self->mask];
+    }
+
+    entry->hash = hash;
+    entry->bytes = bytes;
+    entry->value = value;
+    Py_INCREF(value);
+    self->count++;
+
+    return value;
+}
+
+/* Release all strings, but keep allocated memory. */
+static void InternTable_clear(InternTableObj *self)
+{
+    int i;
+    for (i = 0; i <= self->mask && self->count > 0; i++) {
+        InternEntry *entry = &self->entries[i];
+        if (entry->value != NULL) {
+            Py_DECREF(entry->bytes);
+            Py_DECREF(entry->value);
+            entry->bytes = NULL;
+            entry->value = NULL;
+            self->count--;
+        }
+    }
+}
+
+static PyObject* InternTable_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    InternTableObj *self = (InternTableObj *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->entries = NULL;
+        self->mask = -1;
+        self->count = 0;
+        self->max_entries = 0;
+        self->max_len = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int InternTable_init(InternTableObj *self, PyObject *args, PyObject *kwargs)
+{
+    int max_entries = 1024;
+    int max_len = 64;
+
+    static char *kwlist[] = {"max_entries", "max_len", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|ii", kwlist,
+        &max_entries, &max_len))
+        return -1;
+
+    if (max_entries < 1 || max_entries > 0x100000) {
+        PyErr_SetString(PyExc_ValueError, "max_entries must be between 1 and 1048576.");
+        return -1;
+    }
+
+    if (max_len < 0) {
+        PyErr_SetString(PyExc_ValueError, "max_len must be non-negative.");
+        return -1;
+    }
+
+    // Keep the table at most half full,
+    // so probe sequences stay short.
+    int size = 2;
+    while (size < max_entries * 2) {
+        size *= 2;
+    }
+
+    InternEntry *entries = (InternEntry*)calloc((size_t)size, sizeof(InternEntry));
+    if (entries == NULL) {
+        PyErr_SetNone(PyExc_MemoryError);
+        return -1;
+    }
+
+    if (self->entries != NULL) {
+        InternTable_clear(self);
+        free(self->entries);
+    }
+
+    self->entries = entries;
+    self->mask = size - 1;
+    self->max_entries = max_entries;
+    self->max_len = max_len;
+    return 0;
+}
+
+static void InternTable_dealloc(InternTableObj *self)
+{
+    if (self->entries != NULL) {
+        InternTable_clear(self);
+        free(self->entries);
+    }
+
+    self->ob_type->tp_free((PyObject*)self);
+}
+
+/* Python exposed version of InternTable_clear. */
+static PyObject* PyInternTable_clear(InternTableObj *self)
+{
+    if (self->entries != NULL)
+        InternTable_clear(self);
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef InternTable_methods[] = {
+    {"clear", (PyCFunction)PyInternTable_clear, METH_NOARGS,
+     "Remove all strings from the table."},
+    {NULL}  /* Sentinel */
+};
+
+static PyMemberDef InternTable_members[] = {
+    {"count", T_INT, offsetof(InternTableObj, count), READONLY,
+     "int - Number of strings in the table."},
+    {"max_entries", T_INT, offsetof(InternTableObj, max_entries), READONLY,
+     "int - Number of strings or traits stored before the table is emptied."},
+    {"max_len", T_INT, offsetof(InternTableObj, max_len), READONLY,
+     "int - Strings longer than this many bytes are not stored."},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject InternTableType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "amfast.decode.InternTable", /*tp_name*/
+    sizeof(InternTableObj),    /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)InternTable_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "Shares decoded strings and traits between DecoderContexts.\n\n"
+    "Class aliases, attribute names and header keys are repeated\n"
+    "in every packet. Pass the same InternTable to each DecoderContext\n"
+    "to decode them to shared strings, and to reuse traits\n"
+    "decoded from previous packets.\n\n"
+    "InternTable\n"
+    "============\n"
+    " * max_entries - int - Number of strings stored before the table\n"
+    "    is emptied. Also limits the number of cached traits. Default = 1024\n"
+    " * max_len - int - Strings longer than this many bytes\n"
+    "    are not stored. Default = 64\n", /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    InternTable_methods,       /* tp_methods */
+    InternTable_members,       /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)InternTable_init, /* tp_init */
+    0,                         /* tp_alloc */
+    InternTable_new,           /* tp_new */
+};
+
+// ---- SCANNER
+
+#define SCAN_TRY(x) { int scan_result = (x); if (scan_result != SCAN_DONE) return scan_result; }
+
+/*
+ * Make room for one more item in a growable array.
+ *
+ * Returns SCAN_DONE on success, SCAN_ERROR on failure.
+ */
+static int scan_grow(void **array, int *size, int len, size_t item_size)
+{
+    if (len < *size)
+        return SCAN_DONE;
+
+    if (*size > INT_MAX / 2) {
+        PyErr_NoMemory();
+        return SCAN_ERROR;
+    }
+
+    int new_size = *size < 16 ? 16 : *size * 2;
+    void *tmp = realloc(*array, item_size * (size_t)new_size);
+    if (tmp == NULL) {
+        PyErr_NoMemory();
+        return SCAN_ERROR;
+    }
+
+    *array = tmp;
+    *size = new_size;
+    return SCAN_DONE;
+}
+
+/* Push a frame of values left to scan. */
+static int scan_push(ScannerObj *self, int type, Py_ssize_t count)
+{
+    // Each level of nesting uses at most 3 frames.
+    if (self->max_depth > 0 && self->frame_len >= self->max_depth * 3 + 3)
+        return SCAN_FAIL;
+
+    SCAN_TRY(scan_grow((void**)&self->frames, &self->frame_size,
+        self->frame_len, sizeof(ScanFrame)));
+
+    self->frames[self->frame_len].type = type;
+    self->frames[self->frame_len].count = count;
+    self->frame_len++;
+    return SCAN_DONE;
+}
+
+/* Move past len bytes. */
+static int scan_skip(ScanCursor *cur, Py_ssize_t len)
+{
+    if (len < 0 || len > PY_SSIZE_T_MAX - cur->pos)
+        return SCAN_FAIL;
+
+    if (len > cur->len - cur->pos) {
+        cur->need = cur->pos + len;
+        return SCAN_MORE;
+    }
+
+    cur->pos += len;
+    return SCAN_DONE;
+}
+
+/* Read a big endian unsigned short. */
+static int scan_ushort(ScanCursor *cur, unsigned short *val)
+{
+    const unsigned char *bytes = (const unsigned char*)cur->buf + cur->pos;
+    SCAN_TRY(scan_skip(cur, 2));
+
+    *val = (unsigned short)((bytes[0] << 8) | bytes[1]);
+    return SCAN_DONE;
+}
+
+/* Read a big endian unsigned long. */
+static int scan_ulong(ScanCursor *cur, unsigned int *val)
+{
+    const unsigned char *bytes = (const unsigned char*)cur->buf + cur->pos;
+    SCAN_TRY(scan_skip(cur, 4));
+
+    *val = ((unsigned int)bytes[0] << 24) | ((unsigned int)bytes[1] << 16) |
+        ((unsigned int)bytes[2] << 8) | (unsigned int)bytes[3];
+    return SCAN_DONE;
+}
+
+/* Read an AMF3 int, the same way as _decode_int_AMF3. */
+static int scan_int_AMF3(ScanCursor *cur, int *val)
+{
+    Py_ssize_t pos = cur->pos;
+    int result = 0;
+    int byte_cnt = 0;
+
+    if (pos >= cur->len) {
+        cur->need = pos + 1;
+        return SCAN_MORE;
+    }
+    char byte = cur->buf[pos++];
+
+    while ((byte & 0x80) && (byte_cnt < 3)) {
+        result <<= 7;
+        result |= byte & 0x7F;
+
+        if (pos >= cur->len) {
+            cur->need = pos + 1;
+            return SCAN_MORE;
+        }
+        byte = cur->buf[pos++];
+        byte_cnt++;
+    }
+
+    if (byte_cnt < 3) {
+        result <<= 7;
+        result |= byte & 0x7F;
+    } else {
+        result <<= 8;
+        result |= byte & 0xff;
+    }
+
+    if (result & 0x10000000) {
+        result -= 0x20000000;
+    }
+
+    cur->pos = pos;
+    *val = result;
+    return SCAN_DONE;
+}
+
+/*
+ * Read an AMF3 header.
+ *
+ * len is set to the length encoded in the header,
+ * or -1 if the header is a reference.
+ */
+static int scan_header_AMF3(ScanCursor *cur, int *len)
+{
+    int header;
+    SCAN_TRY(scan_int_AMF3(cur, &header));
+
+    if (header < 0)
+        return SCAN_FAIL;
+
+    if ((header & REFERENCE_BIT) == 0) {
+        *len = -1;
+    } else {
+        *len = header >> 1;
+    }
+
+    return SCAN_DONE;
+}
+
+/*
+ * Read an AMF3 string.
+ *
+ * str_pos and str_len are set to the location of the string's bytes.
+ * Strings are indexed, because traits may reference them.
+ */
+static int scan_string_AMF3(ScannerObj *self, ScanCursor *cur, Py_ssize_t *str_pos, int *str_len)
+{
+    int header;
+    SCAN_TRY(scan_int_AMF3(cur, &header));
+
+    if (header == EMPTY_STRING_TYPE) {
+        *str_pos = cur->pos;
+        *str_len = 0;
+        return SCAN_DONE;
+    }
+
+    if (header < 0)
+        return SCAN_FAIL;
+
+    if ((header & REFERENCE_BIT) == 0) {
+        int idx = header >> 1;
+        if (idx >= self->string_len)
+            return SCAN_FAIL;
+
+        *str_pos = self->strings[idx].pos;
+        *str_len = self->strings[idx].len;
+        return SCAN_DONE;
+    }
+
+    int len = header >> 1;
+    if (self->max_string > 0 && len > self->max_string)
+        return SCAN_FAIL;
+
+    Py_ssize_t pos = cur->pos;
+    SCAN_TRY(scan_skip(cur, len));
+
+    SCAN_TRY(scan_grow((void**)&self->strings, &self->string_size,
+        self->string_len, sizeof(ScanString)));
+
+    self->strings[self->string_len].pos = pos;
+    self->strings[self->string_len].len = len;
+    self->string_len++;
+
+    *str_pos = pos;
+    *str_len = len;
+    return SCAN_DONE;
+}
+
+/*
+ * Find out how the body of an object with a class alias is encoded.
+ *
+ * The ClassDef is retrieved the same way as class_def_from_alias.
+ * Objects of externalizable classes other than ArrayCollection
+ * and ObjectProxy can only be read by decoding them.
+ */
+static int scan_trait_kind(ScannerObj *self, ScanCursor *cur, Py_ssize_t str_pos, int str_len, int *kind)
+{
+    *kind = SCAN_TRAIT_OBJECT;
+    if (str_len == 0)
+        return SCAN_DONE;
+
+    if (self->class_mapper == Py_None)
+        return SCAN_FAIL;
+
+    PyObject *alias = PyUnicode_DecodeUTF8(cur->buf + str_pos, (Py_ssize_t)str_len, NULL);
+    if (alias == NULL) {
+        // Let the decoder report the error.
+        PyErr_Clear();
+        return SCAN_FAIL;
+    }
+
+    PyObject *class_def = PyObject_CallMethod(self->class_mapper, "getClassDefByAlias", "O", alias);
+    Py_DECREF(alias);
+    if (class_def == NULL) {
+        PyErr_Clear();
+        return SCAN_FAIL;
+    }
+
+    int result = SCAN_DONE;
+    if (class_def != Py_None && PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF")) {
+        if (PyObject_HasAttrString(class_def, "ARRAY_COLLECTION_CLASS_DEF")) {
+            *kind = SCAN_TRAIT_COLLECTION;
+        } else if (PyObject_HasAttrString(class_def, "OBJECT_PROXY_CLASS_DEF")) {
+            *kind = SCAN_TRAIT_PROXY;
+        } else {
+            result = SCAN_FAIL;
+        }
+    }
+
+    Py_DECREF(class_def);
+    return result;
+}
+
+/* Scan an AMF3 object, the same way as deserialize_obj_AMF3. */
+static int scan_obj_AMF3(ScannerObj *self, ScanCursor *cur)
+{
+    int header;
+    SCAN_TRY(scan_int_AMF3(cur, &header));
+
+    if (header < 0)
+        return SCAN_FAIL;
+
+    if ((header & REFERENCE_BIT) == 0)
+        return SCAN_DONE;
+
+    ScanTrait trait;
+    if (((header >> 1) & REFERENCE_BIT) == 0) {
+        int idx = header >> 2;
+        if (idx >= self->trait_len)
+            return SCAN_FAIL;
+        trait = self->traits[idx];
+    } else {
+        Py_ssize_t alias_pos;
+        int alias_len;
+        SCAN_TRY(scan_string_AMF3(self, cur, &alias_pos, &alias_len));
+        SCAN_TRY(scan_trait_kind(self, cur, alias_pos, alias_len, &trait.kind));
+
+        trait.static_len = 0;
+        trait.dynamic = 0;
+        if (trait.kind == SCAN_TRAIT_OBJECT) {
+            if ((header & 0x07FFFFFF) == EXTERNALIZABLE)
+                return SCAN_FAIL;
+
+            trait.static_len = header >> 4;
+            if (self->max_length > 0 && trait.static_len > self->max_length)
+                return SCAN_FAIL;
+
+            // Static attr names
+            int i;
+            for (i = 0; i < trait.static_len; i++) {
+                Py_ssize_t name_pos;
+                int name_len;
+                SCAN_TRY(scan_string_AMF3(self, cur, &name_pos, &name_len));
+            }
+
+            trait.dynamic = (header & DYNAMIC) == DYNAMIC;
+        }
+
+        SCAN_TRY(scan_grow((void**)&self->traits, &self->trait_size,
+            self->trait_len, sizeof(ScanTrait)));
+        self->traits[self->trait_len] = trait;
+        self->trait_len++;
+    }
+
+    if (trait.kind == SCAN_TRAIT_COLLECTION)
+        return scan_push(self, SCAN_AMF3_MARKER, ARRAY_TYPE);
+
+    if (trait.kind == SCAN_TRAIT_PROXY)
+        return scan_push(self, SCAN_AMF3_MARKER, OBJECT_TYPE);
+
+    // Static values are scanned before dynamic values.
+    if (trait.dynamic)
+        SCAN_TRY(scan_push(self, SCAN_AMF3_DICT, 0));
+
+    return scan_push(self, SCAN_AMF3, trait.static_len);
+}
+
+/* Scan the next AMF3 value. */
+static int scan_value_AMF3(ScannerObj *self, ScanCursor *cur)
+{
+    if (cur->pos >= cur->len) {
+        cur->need = cur->pos + 1;
+        return SCAN_MORE;
+    }
+    const char byte = cur->buf[cur->pos++];
+
+    int len;
+    Py_ssize_t str_pos;
+    int str_len;
+    switch(byte) {
+        case UNDEFINED_TYPE:
+        case NULL_TYPE:
+        case FALSE_TYPE:
+        case TRUE_TYPE:
+            return SCAN_DONE;
+        case INT_TYPE:
+            return scan_int_AMF3(cur, &len);
+        case DOUBLE_TYPE:
+            return scan_skip(cur, 8);
+        case STRING_TYPE:
+            return scan_string_AMF3(self, cur, &str_pos, &str_len);
+        case XML_DOC_TYPE:
+        case XML_TYPE:
+        case BYTE_ARRAY_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            if (self->max_string > 0 && len > self->max_string)
+                return SCAN_FAIL;
+            return scan_skip(cur, len);
+        case DATE_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            return scan_skip(cur, 8);
+        case ARRAY_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            if (self->max_length > 0 && len > self->max_length)
+                return SCAN_FAIL;
+
+            // Associative portion is scanned before the dense portion.
+            SCAN_TRY(scan_push(self, SCAN_AMF3, len));
+            return scan_push(self, SCAN_AMF3_DICT, 0);
+        case OBJECT_TYPE:
+            return scan_obj_AMF3(self, cur);
+        case VECTOR_INT_TYPE:
+        case VECTOR_UINT_TYPE:
+        case VECTOR_DOUBLE_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            if (self->max_length > 0 && len > self->max_length)
+                return SCAN_FAIL;
+
+            // Fixed length flag and items
+            return scan_skip(cur, 1 + (Py_ssize_t)len * (byte == VECTOR_DOUBLE_TYPE ? 8 : 4));
+        case VECTOR_OBJECT_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            if (self->max_length > 0 && len > self->max_length)
+                return SCAN_FAIL;
+
+            // Fixed length flag and item type name
+            SCAN_TRY(scan_skip(cur, 1));
+            SCAN_TRY(scan_string_AMF3(self, cur, &str_pos, &str_len));
+            return scan_push(self, SCAN_AMF3, len);
+        case DICTIONARY_TYPE:
+            SCAN_TRY(scan_header_AMF3(cur, &len));
+            if (len == -1)
+                return SCAN_DONE;
+            if (self->max_length > 0 && len > self->max_length)
+                return SCAN_FAIL;
+
+            // Weak keys flag, then keys and values
+            SCAN_TRY(scan_skip(cur, 1));
+            return scan_push(self, SCAN_AMF3, (Py_ssize_t)len * 2);
+        default:
+            break;
+    }
+
+    return SCAN_FAIL;
+}
+
+/* Scan the next AMF0 value. */
+static int scan_value_AMF0(ScannerObj *self, ScanCursor *cur)
+{
+    if (cur->pos >= cur->len) {
+        cur->need = cur->pos + 1;
+        return SCAN_MORE;
+    }
+    const char byte = cur->buf[cur->pos++];
+
+    unsigned short short_len;
+    unsigned int long_len;
+    switch(byte) {
+        case NUMBER_AMF0:
+            return scan_skip(cur, 8);
+        case BOOL_AMF0:
+            return scan_skip(cur, 1);
+        case STRING_AMF0:
+            SCAN_TRY(scan_ushort(cur, &short_len));
+            if (self->max_string > 0 && short_len > self->max_string)
+                return SCAN_FAIL;
+            return scan_skip(cur, short_len);
+        case OBJECT_AMF0:
+            return scan_push(self, SCAN_AMF0_DICT, 0);
+        case NULL_AMF0:
+        case UNDEFINED_AMF0:
+            return SCAN_DONE;
+        case REF_AMF0:
+            return scan_skip(cur, 2);
+        case MIXED_ARRAY_AMF0:
+            // Max index
+            SCAN_TRY(scan_skip(cur, 4));
+            return scan_push(self, SCAN_AMF0_DICT, 0);
+        case ARRAY_AMF0:
+            SCAN_TRY(scan_ulong(cur, &long_len));
+            if (long_len > INT_MAX ||
+                (self->max_length > 0 && long_len > (unsigned int)self->max_length))
+                return SCAN_FAIL;
+            return scan_push(self, SCAN_AMF0, (Py_ssize_t)long_len);
+        case DATE_AMF0:
+            // Date and timezone
+            return scan_skip(cur, 10);
+        case LONG_STRING_AMF0:
+        case XML_DOC_AMF0:
+            SCAN_TRY(scan_ulong(cur, &long_len));
+            if (long_len > INT_MAX ||
+                (self->max_string > 0 && long_len > (unsigned int)self->max_string))
+                return SCAN_FAIL;
+            return scan_skip(cur, (Py_ssize_t)long_len);
+        case TYPED_OBJ_AMF0:
+            // Class alias
+            SCAN_TRY(scan_ushort(cur, &short_len));
+            SCAN_TRY(scan_skip(cur, short_len));
+            return scan_push(self, SCAN_AMF0_DICT, 0);
+        case AMF3_AMF0:
+            // Each AMF3 value is decoded with new reference tables.
+            self->string_len = 0;
+            self->trait_len = 0;
+            return scan_push(self, SCAN_AMF3, 1);
+        default:
+            break;
+    }
+
+    return SCAN_FAIL;
+}
+
+/* Scan the next part of the frame on top of the stack. */
+static int scan_step(ScannerObj *self, ScanCursor *cur)
+{
+    ScanFrame *frame = &self->frames[self->frame_len - 1];
+    unsigned short key_len;
+    Py_ssize_t str_pos;
+    int str_len;
+
+    switch (frame->type) {
+        case SCAN_AMF0:
+        case SCAN_AMF3:
+            if (frame->count == 0) {
+                self->frame_len--;
+                return SCAN_DONE;
+            }
+
+            // frame is not valid after values are pushed.
+            frame->count--;
+            if (frame->type == SCAN_AMF0)
+                return scan_value_AMF0(self, cur);
+            return scan_value_AMF3(self, cur);
+        case SCAN_AMF0_DICT:
+            SCAN_TRY(scan_ushort(cur, &key_len));
+            if (key_len == 0) {
+                // End marker
+                SCAN_TRY(scan_skip(cur, 1));
+                self->frame_len--;
+                return SCAN_DONE;
+            }
+
+            SCAN_TRY(scan_skip(cur, key_len));
+            return scan_push(self, SCAN_AMF0, 1);
+        case SCAN_AMF3_DICT:
+            SCAN_TRY(scan_string_AMF3(self, cur, &str_pos, &str_len));
+            if (str_len == 0) {
+                self->frame_len--;
+                return SCAN_DONE;
+            }
+
+            return scan_push(self, SCAN_AMF3, 1);
+        case SCAN_AMF3_MARKER:
+            if (cur->pos >= cur->len) {
+                cur->need = cur->pos + 1;
+                return SCAN_MORE;
+            }
+
+            if (cur->buf[cur->pos] != (char)frame->count)
+                return SCAN_FAIL;
+
+            frame->type = SCAN_AMF3;
+            frame->count = 1;
+            return SCAN_DONE;
+        default:
+            break;
+    }
+
+    return SCAN_FAIL;
+}
+
+static PyObject* Scanner_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    ScannerObj *self = (ScannerObj *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->class_mapper = NULL;
+        self->amf3 = 0;
+        self->max_depth = 0;
+        self->max_length = 0;
+        self->max_string = 0;
+        self->pos = 0;
+        self->frames = NULL;
+        self->frame_len = 0;
+        self->frame_size = 0;
+        self->strings = NULL;
+        self->string_len = 0;
+        self->string_size = 0;
+        self->traits = NULL;
+        self->trait_len = 0;
+        self->trait_size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int Scanner_init(ScannerObj *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *amf3 = Py_False;
+    PyObject *class_mapper = Py_None;
+    int max_depth = 0;
+    int max_length = 0;
+    int max_string = 0;
+
+    static char *kwlist[] = {"amf3", "class_def_mapper", "max_depth",
+        "max_length", "max_string", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOiii", kwlist,
+        &amf3, &class_mapper, &max_depth, &max_length, &max_string))
+        return -1;
+
+    int is_amf3 = PyObject_IsTrue(amf3);
+    if (is_amf3 == -1)
+        return -1;
+
+    Py_INCREF(class_mapper);
+    Py_XDECREF(self->class_mapper);
+    self->class_mapper = class_mapper;
+    self->amf3 = is_amf3;
+    self->max_depth = max_depth > 0 ? max_depth : 0;
+    self->max_length = max_length > 0 ? max_length : 0;
+    self->max_string = max_string > 0 ? max_string : 0;
+    self->pos = 0;
+    self->frame_len = 0;
+    self->string_len = 0;
+    self->trait_len = 0;
+
+    if (scan_push(self, is_amf3 ? SCAN_AMF3 : SCAN_AMF0, 1) != SCAN_DONE)
+        return -1;
+
+    return 0;
+}
+
+static void Scanner_dealloc(ScannerObj *self)
+{
+    Py_XDECREF(self->class_mapper);
+    free(self->frames);
+    free(self->strings);
+    free(self->traits);
+    self->ob_type->tp_free((PyObject*)self);
+}
+
+/*
+ * Scan as much of the value as possible.
+ *
+ * A step that runs out of data is undone,
+ * and scanned again when more data is available.
+ */
+static PyObject* Scanner_scan(ScannerObj *self, PyObject *args)
+{
+    PyObject *data;
+    long start;
+    if (!PyArg_ParseTuple(args, "Ol", &data, &start))
+        return NULL;
+
+    if (!PyString_Check(data)) {
+        PyErr_SetString(PyExc_TypeError, "data must be a string.");
+        return NULL;
+    }
+
+    if (start < 0 || (Py_ssize_t)start + self->pos > PyString_GET_SIZE(data)) {
+        PyErr_SetString(PyExc_ValueError, "data does not contain the scanned bytes.");
+        return NULL;
+    }
+
+    ScanCursor cur;
+    cur.buf = PyString_AS_STRING(data) + start;
+    cur.len = PyString_GET_SIZE(data) - (Py_ssize_t)start;
+    cur.pos = self->pos;
+    cur.need = 0;
+
+    int result = SCAN_DONE;
+    while (self->frame_len > 0) {
+        int frame_len = self->frame_len;
+        ScanFrame top = self->frames[frame_len - 1];
+        int string_len = self->string_len;
+        int trait_len = self->trait_len;
+
+        result = scan_step(self, &cur);
+        if (result != SCAN_DONE) {
+            self->frame_len = frame_len;
+            self->frames[frame_len - 1] = top;
+            self->string_len = string_len;
+            self->trait_len = trait_len;
+            break;
+        }
+
+        self->pos = cur.pos;
+    }
+
+    if (result == SCAN_DONE)
+        return Py_BuildValue("(Ol)", Py_True, (long)(start + self->pos));
+
+    if (result == SCAN_MORE)
+        return Py_BuildValue("(Ol)", Py_False, (long)(start + cur.need));
+
+    if (result == SCAN_FAIL)
+        Py_RETURN_NONE;
+
+    return NULL;
+}
+
+static PyMethodDef Scanner_methods[] = {
+    {"scan", (PyCFunction)Scanner_scan, METH_VARARGS,
+     "Scan as much of the value as possible.\n\n"
+     "arguments\n"
+     "==========\n"
+     " * data - string, the bytes received so far.\n"
+     " * start - int, position of the value in data.\n\n"
+     "Returns (True, end) when the value is complete, where end\n"
+     "is the position after the value, or (False, needed) when\n"
+     "data must be at least needed bytes long to scan further.\n"
+     "Returns None if the value can only be read by decoding it.\n\n"
+     "Each call must be passed the same bytes from start,\n"
+     "followed by any bytes that have been received since."},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject ScannerType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "amfast.decode.Scanner",   /*tp_name*/
+    sizeof(ScannerObj),        /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)Scanner_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "Finds the end of an encoded value without decoding it.\n\n"
+    "Scanning resumes where it stopped when more data arrives,\n"
+    "so a value received in many chunks is only scanned once.\n"
+    "Used by amfast.decoder.PushDecoder to decode a value as soon\n"
+    "as it is complete, without decoding it again for every chunk.\n\n"
+    "Scanner\n"
+    "========\n"
+    " * amf3 - bool - True to scan an AMF3 value. Default = False\n"
+    " * class_def_mapper - amfast.class_def.ClassDefMapper - Used to find\n"
+    "    externalizable classes. Default = None\n"
+    " * max_depth - int - Same as DecoderContext. Default = 0\n"
+    " * max_length - int - Same as DecoderContext. Default = 0\n"
+    " * max_string - int - Same as DecoderContext. Default = 0\n\n"
+    "Values that exceed a limit, or that contain externalizable objects\n"
+    "other than ArrayCollections and ObjectProxies, can not be scanned.\n", /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    Scanner_methods,           /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)Scanner_init,    /* tp_init */
+    0,                         /* tp_alloc */
+    Scanner_new,               /* tp_new */
+};
+
+// ---- SMALL MESSAGES
+
+/*
+ * Attributes set from the first flag byte of an ISmallMessage,
+ * in the order of the flag bits.
+ */
+static const char *small_msg_attrs[] = {"body", "clientId", "destination",
+    "headers", "messageId", "timestamp", "timeToLive"};
+
+/*
+ * Decode the fields of an ISmallMessage (DSA, DSC or DSK) into obj.
+ *
+ * Each level of the message class hierarchy writes its own group of flags,
+ * followed by the values the flags mark.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int decode_small_message(DecoderObj *context, PyObject *obj, int msg_type)
+{
+    unsigned char flags[SMALL_MAX_FLAGS];
+    int flag_count;
+    int i;
+    int j;
+    PyObject *value;
+
+    // AbstractMessage
+    flag_count = decode_small_flags(context, flags);
+    if (!flag_count)
+        return 0;
+
+    for (j = 0; j < 7; j++) {
+        if ((flags[0] >> j) & 1) {
+            if (j == 0) {
+                value = decode_lazy_AMF3(context);
+            } else {
+                value = decode_AMF3(context);
+            }
+        } else {
+            Py_INCREF(Py_None);
+            value = Py_None;
+        }
+
+        if (!set_small_attr(obj, small_msg_attrs[j], value))
+            return 0;
+    }
+
+    if (flag_count > 1) {
+        if (flags[1] & SMALL_CLIENT_ID_BYTES_FLAG) {
+            if (!set_small_attr(obj, "clientId", decode_small_uid(context)))
+                return 0;
+        }
+
+        if (flags[1] & SMALL_MESSAGE_ID_BYTES_FLAG) {
+            if (!set_small_attr(obj, "messageId", decode_small_uid(context)))
+                return 0;
+        }
+
+        if (!skip_small_reserved(context, flags[1], 2))
+            return 0;
+    }
+
+    for (i = 2; i < flag_count; i++) {
+        if (!skip_small_reserved(context, flags[i], 0))
+            return 0;
+    }
+
+    // AsyncMessage
+    flag_count = decode_small_flags(context, flags);
+    if (!flag_count)
+        return 0;
+
+    if (flags[0] & SMALL_CORRELATION_ID_FLAG) {
+        value = decode_AMF3(context);
+    } else {
+        Py_INCREF(Py_None);
+        value = Py_None;
+    }
+    if (!set_small_attr(obj, "correlationId", value))
+        return 0;
+
+    if (flags[0] & SMALL_CORRELATION_ID_BYTES_FLAG) {
+        if (!set_small_attr(obj, "correlationId", decode_small_uid(context)))
+            return 0;
+    }
+
+    if (!skip_small_reserved(context, flags[0], 2))
+        return 0;
+
+    for (i = 1; i < flag_count; i++) {
+        if (!skip_small_reserved(context, flags[i], 0))
+            return 0;
+    }
+
+    if (msg_type == SMALL_ASYNC_MSG)
+        return 1;
+
+    // CommandMessage or AcknowledgeMessage
+    flag_count = decode_small_flags(context, flags);
+    if (!flag_count)
+        return 0;
+
+    i = 0;
+    if (msg_type == SMALL_COMMAND_MSG) {
+        // Operation 0 is implied by a missing flag.
+        if (flags[0] & SMALL_OPERATION_FLAG) {
+            value = decode_AMF3(context);
+        } else {
+            value = PyInt_FromLong(0);
+        }
+        if (!set_small_attr(obj, "operation", value))
+            return 0;
+
+        if (!skip_small_reserved(context, flags[0], 1))
+            return 0;
+        i = 1;
+    }
+
+    for (; i < flag_count; i++) {
+        if (!skip_small_reserved(context, flags[i], 0))
+            return 0;
+    }
+
+    return 1;
+}
+
+/*
+ * Read a group of flag bytes.
+ *
+ * Returns the number of flag bytes read, 0 on error.
+ */
+static int decode_small_flags(DecoderObj *context, unsigned char *flags)
+{
+    int count = 0;
+    unsigned char flag = SMALL_HAS_NEXT_FLAG;
+
+    while (flag & SMALL_HAS_NEXT_FLAG) {
+        if (count == SMALL_MAX_FLAGS) {
+            PyErr_SetString(amfast_DecodeError, "Too many ISmallMessage flag bytes.");
+            return 0;
+        }
+
+        const char *byte_ref = Decoder_readByte(context);
+        if (!byte_ref)
+            return 0;
+
+        flag = (unsigned char)byte_ref[0];
+        flags[count] = flag;
+        count++;
+    }
+
+    return count;
+}
+
+/*
+ * Skip values marked by flag bits this decoder does not know about.
+ *
+ * Bits below 'reserved' have already been handled.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int skip_small_reserved(DecoderObj *context, unsigned char flag, int reserved)
+{
+    int j;
+    for (j = reserved; j < 6; j++) {
+        if ((flag >> j) & 1) {
+            PyObject *value = decode_AMF3(context);
+            if (!value)
+                return 0;
+            Py_DECREF(value);
+        }
+    }
+
+    return 1;
+}
+
+/*
+ * Set an attribute and release the value.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int set_small_attr(PyObject *obj, const char *name, PyObject *value)
+{
+    if (!value)
+        return 0;
+
+    int return_value = PyObject_SetAttrString(obj, name, value);
+    Py_DECREF(value);
+    if (return_value == -1)
+        return 0;
+
+    return 1;
+}
+
+/*
+ * Decode a UID sent as a 16 byte ByteArray.
+ *
+ * The bytes are converted straight to a 36 char UID string
+ * without creating a ByteArray object.
+ *
+ * Returns a new reference to the UID, or None if the value is not 16 bytes.
+ */
+static PyObject* decode_small_uid(DecoderObj *context)
+{
+    const char *byte_ref = Decoder_readByte(context);
+    if (!byte_ref)
+        return NULL;
+
+    if (byte_ref[0] != BYTE_ARRAY_TYPE) {
+        // Some other type, decode it the normal way.
+        if (!Decoder_skipBytes(context, -1))
+            return NULL;
+
+        PyObject *value = decode_AMF3(context);
+        if (!value)
+            return NULL;
+
+        PyObject *uid = uid_from_value(value);
+        Py_DECREF(value);
+        return uid;
+    }
+
+    int header;
+    if (!_decode_int_AMF3(context, &header))
+        return NULL;
+
+    if ((header & REFERENCE_BIT) == 0) {
+        PyObject *value = decode_reference_AMF3(context, context->obj_refs, header);
+        if (!value)
+            return NULL;
+
+        PyObject *uid = uid_from_value(value);
+        Py_DECREF(value);
+        return uid;
+    }
+
+    PyObject *uid;
+    if ((header >> 1) == UID_BYTES) {
+        const char *bytes = Decoder_read(context, UID_BYTES);
+        if (!bytes)
+            return NULL;
+
+        uid = uid_from_bytes(bytes);
+    } else {
+        uid = decode_byte_array_AMF3(context, header >> 1);
+    }
+    if (!uid)
+        return NULL;
+
+    // The UID takes the place of the ByteArray in the reference table.
+    if (Idx_map((IdxObj*)context->obj_refs, uid) == -1) {
+        Py_DECREF(uid);
+        return NULL;
+    }
+
+    if ((header >> 1) != UID_BYTES) {
+        Py_DECREF(uid);
+        Py_RETURN_NONE;
+    }
+
+    return uid;
+}
+
+/*
+ * Convert a decoded ByteArray, or any object
+ * that supports the buffer interface, to a UID.
+ *
+ * Returns a new reference to the UID, or None if the value is not 16 bytes.
+ */
+static PyObject* uid_from_value(PyObject *value)
+{
+    if (PyString_Check(value) && PyString_GET_SIZE(value) == UID_LEN) {
+        // Already converted by decode_small_uid
+        Py_INCREF(value);
+        return value;
+    }
+
+    PyObject *byte_str;
+    if (PyObject_HasAttrString(value, "bytes")) {
+        // amfast.class_def.as_types.ByteArray
+        byte_str = PyObject_GetAttrString(value, "bytes");
+        if (!byte_str)
+            return NULL;
+    } else {
+        Py_INCREF(value);
+        byte_str = value;
+    }
+
+    const void *bytes;
+    Py_ssize_t byte_len;
+    if (PyObject_AsReadBuffer(byte_str, &bytes, &byte_len) == -1) {
+        Py_DECREF(byte_str);
+        PyErr_Clear();
+        Py_RETURN_NONE;
+    }
+
+    PyObject *uid;
+    if (byte_len == UID_BYTES) {
+        uid = uid_from_bytes((const char*)bytes);
+    } else {
+        Py_INCREF(Py_None);
+        uid = Py_None;
+    }
+
+    Py_DECREF(byte_str);
+    return uid;
+}
+
+/* Format 16 bytes as a 36 char UID string. */
+static PyObject* uid_from_bytes(const char *bytes)
+{
+    static const char hex_chars[] = "0123456789ABCDEF";
+    char uid[UID_LEN];
+    int idx = 0;
+    int i;
+
+    for (i = 0; i < UID_BYTES; i++) {
+        if (i == 4 || i == 6 || i == 8 || i == 10) {
+            uid[idx] = '-';
+            idx++;
+        }
+
+        unsigned char byte = (unsigned char)bytes[i];
+        uid[idx] = hex_chars[byte >> 4];
+        idx++;
+        uid[idx] = hex_chars[byte & 0x0F];
+        idx++;
+    }
+
+    return PyString_FromStringAndSize(uid, UID_LEN);
+}
+
+// ---- LIMITS
+
+/*
+ * Increment the nesting depth before a value is decoded.
+ *
+ * Returns 1 on success, 0 if max_depth is exceeded.
+ */
+static int enter_value(DecoderObj *context)
+{
+    if (context->max_depth > 0 && context->depth >= context->max_depth) {
+        PyErr_Format(amfast_LimitError,
+            "Decoding exceeds max_depth (%d).", context->max_depth);
+        return 0;
+    }
+
+    context->depth++;
+    return 1;
+}
+
+/*
+ * Check the number of items declared for a collection.
+ *
+ * Every item takes at least 1 byte, so a length
+ * that fits in the rest of the input, or within
+ * max_length, is safe to preallocate.
+ *
+ * Returns 1 if a collection of len items can be preallocated,
+ * -1 if it can't, 0 if len is invalid or exceeds max_length.
+ */
+static int check_length(DecoderObj *context, int len)
+{
+    if (len < 0) {
+        PyErr_SetString(amfast_DecodeError, "Invalid collection length.");
+        return 0;
+    }
+
+    if (context->max_length > 0 && len > context->max_length) {
+        PyErr_Format(amfast_LimitError,
+            "Collection of %d items exceeds max_length (%d).", len, context->max_length);
+        return 0;
+    }
+
+    Py_ssize_t remaining = Decoder_remaining(context);
+    if (remaining != -1)
+        return len <= remaining ? 1 : -1;
+
+    return context->max_length > 0 ? 1 : -1;
+}
+
+/*
+ * Check the length of a string or ByteArray against max_string.
+ *
+ * Returns 1 on success, 0 if the limit is exceeded.
+ */
+static int check_string(DecoderObj *context, unsigned int len)
+{
+    if (context->max_string > 0 && len > (unsigned int)context->max_string) {
+        PyErr_Format(amfast_LimitError,
+            "String of %u bytes exceeds max_string (%d).", len, context->max_string);
+        return 0;
+    }
+
+    return 1;
+}
+
+/*
+ * Create a list of len items, all None.
+ *
+ * A list is referenced before its items are decoded,
+ * so it can't contain NULL items (ticket #46).
+ */
+static PyObject* new_list(int len)
+{
+    PyObject *list_val = PyList_New(len);
+    if (!list_val)
+        return NULL;
+
+    int i;
+    for (i = 0; i < len; i++) {
+        Py_INCREF(Py_None);
+        PyList_SET_ITEM(list_val, i, Py_None);
+    }
+
+    return list_val;
+}
+
+/* Create a dict with room for len items. */
+static PyObject* new_dict(int len)
+{
+#if PY_VERSION_HEX >= 0x02070000
+    return _PyDict_NewPresized((Py_ssize_t)len);
+#else
+    return PyDict_New();
+#endif
+}
+
+// ---- STATS
+
+/*
+ * Decode a value and record it in the context's CodecStats.
+ *
+ * The type marker is the first byte read for the value.
+ */
+static PyObject* decode_stats(DecoderObj *context, int amf3)
+{
+    int prev_marker = context->stats_marker;
+    Py_ssize_t start = Decoder_tell(context);
+    if (start == -1)
+        PyErr_Clear();
+    double start_time = Stats_clock();
+
+    context->stats_marker = STATS_PENDING;
+    PyObject *result;
+    if (amf3) {
+        result = decode_value_AMF3(context);
+    } else {
+        result = decode_value_AMF0(context);
+    }
+    int marker = context->stats_marker;
+    context->stats_marker = prev_marker;
+    if (!result)
+        return NULL;
+
+    double seconds = Stats_clock() - start_time;
+    Py_ssize_t bytes = 0;
+    if (start != -1) {
+        Py_ssize_t end = Decoder_tell(context);
+        if (end == -1) {
+            PyErr_Clear();
+        } else {
+            bytes = end - start;
+        }
+    }
+
+    Stats_record((CodecStatsObj*)context->stats, amf3, marker, bytes, seconds);
+
+    if ((amf3 && marker == OBJECT_TYPE) || (!amf3 && marker == TYPED_OBJ_AMF0)) {
+        if (!record_alias(context, result, bytes, seconds)) {
+            Py_DECREF(result);
+            return NULL;
+        }
+    }
+
+    return result;
+}
+
+/*
+ * Record a decoded object under its ClassDef's alias.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int record_alias(DecoderObj *context, PyObject *value, Py_ssize_t bytes, double seconds)
+{
+    PyObject *class_def = PyObject_CallMethod(context->class_mapper,
+        "getClassDefByClass", "(O)", (PyObject*)value->ob_type);
+    if (!class_def)
+        return 0;
+
+    if (class_def == Py_None) {
+        Py_DECREF(class_def);
+        return 1;
+    }
+
+    PyObject *alias = PyObject_GetAttrString(class_def, "alias");
+    Py_DECREF(class_def);
+    if (!alias)
+        return 0;
+
+    int result = 1;
+    if (PyString_Check(alias) && PyString_GET_SIZE(alias) > 0)
+        result = Stats_recordAlias((CodecStatsObj*)context->stats, alias, bytes, seconds);
+    Py_DECREF(alias);
+    return result;
+}
+
+/* Record a reference table lookup. */
+static void record_ref(DecoderObj *context, PyObject *obj_context, int hit)
+{
+    CodecStatsObj *stats = (CodecStatsObj*)context->stats;
+    int table = STATS_OBJ_REFS;
+    if (obj_context == context->string_refs) {
+        table = STATS_STRING_REFS;
+    } else if (obj_context == context->class_refs) {
+        table = STATS_CLASS_REFS;
+    }
+
+    if (hit) {
+        stats->ref_hits[table]++;
+    } else {
+        stats->ref_misses[table]++;
+    }
+}
+
+// ---- Python EXPOSED FUNCTIONS
+
+/* Decode an AMF stream to a Python obj. */
+static PyObject* py_decode(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *context;
+    DecoderObj *dec_context;
+
+    if (!PyArg_ParseTuple(args, "O", &context))
+        return NULL;
+
+    // If input is a string or buffer, create a context object.
+    if (Decoder_checkSource(context) == 1) {
+        PyObject *cls = PyObject_GetAttrString(context_mod, "DecoderContext");
+        if (cls == NULL)
+            return NULL;
+
+        dec_context = (DecoderObj*)PyObject_CallFunctionObjArgs(cls, context, NULL);
+        Py_DECREF(cls);
+        if (dec_context == NULL)
+            return NULL;
+    } else if (Decoder_check(context) == 1) {
+        dec_context = (DecoderObj*)context;
+        Py_INCREF(dec_context);
+    } else {
+        PyErr_SetString(amfast_DecodeError, "Argument must be a string, buffer or type amfast.context.DecoderContext");
+        return NULL;
+    }
+
+    PyObject *result;
+    if (dec_context->amf3 == Py_True) {
+        result = decode_AMF3(dec_context);
+    } else {
+        result = decode_AMF0(dec_context);
+    }
+
+    if (dec_context->stats != Py_None)
+        ((CodecStatsObj*)dec_context->stats)->calls++;
+
+    Py_DECREF(dec_context);
+    return result;
+}
+
+/* Decode an AMF Packet from a stream. */
+static PyObject* py_decode_packet(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *context;
+    DecoderObj *dec_context;
+
+    if (!PyArg_ParseTuple(args, "O", &context))
+        return NULL;
+
+    // If input is a string or buffer, create a context object.
+    if (Decoder_checkSource(context) == 1) {
+        PyObject *cls = PyObject_GetAttrString(context_mod, "DecoderContext");
+        if (cls == NULL)
+            return NULL;
+
+        dec_context = (DecoderObj*)PyObject_CallFunctionObjArgs(cls, context, NULL);
+        Py_DECREF(cls);
+        if (dec_context == NULL)
+            return NULL;
+    } else if (Decoder_check(context) == 1) {
+        dec_context = (DecoderObj*)context;
+        Py_INCREF(dec_context);
+    } else {
+        PyErr_SetString(amfast_DecodeError, "Argument must be a string, buffer or type amfast.context.DecoderContext");
+        return NULL;
+    }
+
+    PyObject *result = decode_packet(dec_context);
+    if (dec_context->stats != Py_None)
+        ((CodecStatsObj*)dec_context->stats)->calls++;
+    Py_DECREF(dec_context);
+    return result;
+}
+
+/* Decode a value lazily from a DecoderContext. */
+static PyObject* py_decode_lazy(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *context;
+
+    if (!PyArg_ParseTuple(args, "O", &context))
+        return NULL;
+
+    if (Decoder_check(context) != 1) {
+        PyErr_SetString(amfast_DecodeError, "Argument must be type amfast.context.DecoderContext");
+        return NULL;
+    }
+
+    DecoderObj *dec_context = (DecoderObj*)context;
+    if (dec_context->amf3 != Py_True)
+        return decode_AMF0(dec_context);
+
+    return decode_lazy_AMF3(dec_context);
+}
+
+/* Decode the fields of an ISmallMessage. */
+static PyObject* py_read_small_message(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *obj;
+    PyObject *context;
+    int msg_type;
+
+    if (!PyArg_ParseTuple(args, "OOi", &obj, &context, &msg_type))
+        return NULL;
+
+    if (Decoder_check(context) != 1) {
+        PyErr_SetString(amfast_DecodeError, "Argument must be type amfast.context.DecoderContext");
+        return NULL;
+    }
+
+    if (msg_type < SMALL_ASYNC_MSG || msg_type > SMALL_ACKNOWLEDGE_MSG) {
+        PyErr_SetString(amfast_DecodeError, "Unknown ISmallMessage type.");
+        return NULL;
+    }
+
+    if (!decode_small_message((DecoderObj*)context, obj, msg_type))
+        return NULL;
+
+    if (PyObject_SetAttrString(obj, "_small_msg", Py_True) == -1)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+// ---- Module init
+
+/* Expose functions as Python module functions. */
+static PyMethodDef decode_methods[] = {
+    {"decode", (PyCFunction)py_decode, METH_VARARGS | METH_KEYWORDS,
+    "Description:\n"
+    "=============\n"
+    "Decode an AMF stream to Python objs.\n\n"
+    "Useage:\n"
+    "===========\n"
+    "py_obj = decode(context)\n\n"
+    "arguments:\n"
+    "============\n"
+    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"},
+    {"decode_packet", (PyCFunction)py_decode_packet, METH_VARARGS | METH_KEYWORDS,
+    "Description:\n"
+    "=============\n"
+    "Decode an AMF packet stream.\n\n"
+    "Useage:\n"
+    "=========\n"
+    "py_obj = decode_packet(context)\n\n"
+    "arguments:\n"
+    "===========\n"
+    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"},
+    {"decode_lazy", (PyCFunction)py_decode_lazy, METH_VARARGS | METH_KEYWORDS,
+    "Description:\n"
+    "=============\n"
+    "Decode an AMF value. If the context was created with lazy=True,\n"
+    "AMF3 objects and arrays are returned as a LazyValue, which is\n"
+    "decoded when LazyValue.decode() is called.\n\n"
+    "Useage:\n"
+    "=========\n"
+    "py_obj = decode_lazy(context)\n\n"
+    "arguments:\n"
+    "===========\n"
+    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"},
+    {"read_small_message", (PyCFunction)py_read_small_message, METH_VARARGS | METH_KEYWORDS,
+    "Description:\n"
+    "=============\n"
+    "Decode the fields of a Flex ISmallMessage (DSA, DSC or DSK)\n"
+    "and set them as attributes of a message object.\n"
+    "UIDs sent as 16 byte ByteArrays are converted to 36 char strings.\n\n"
+    "Useage:\n"
+    "=========\n"
+    "read_small_message(obj, context, msg_type)\n\n"
+    "arguments:\n"
+    "===========\n"
+    " * obj - AbstractMessage, The message to set attributes on.\n"
+    " * context - amfast.context.DecoderContext, Holds options valid for a single decode session.\n"
+    " * msg_type - int, 1 for AsyncMessage, 2 for CommandMessage, 3 for AcknowledgeMessage.\n"},
+    {NULL, NULL, 0, NULL}   /* sentinel */
+};
+
+PyMODINIT_FUNC
+initdecode(void)
+{
+    PyObject *m;
+
+    // Create module
+    m = Py_InitModule3("decode", decode_methods,
+        "Tools for decoding AMF streams.");
+    if (m == NULL)
+        return;
+
+    if (PyType_Ready(&LazyValueType) < 0)
+        return;
+
+    Py_INCREF(&LazyValueType);
+    PyModule_AddObject(m, "LazyValue", (PyObject *)&LazyValueType);
+
+    if (PyType_Ready(&InternTableType) < 0)
+        return;
+
+    Py_INCREF(&InternTableType);
+    PyModule_AddObject(m, "InternTable", (PyObject *)&InternTableType);
+
+    if (PyType_Ready(&ScannerType) < 0)
+        return;
+
+    Py_INCREF(&ScannerType);
+    PyModule_AddObject(m, "Scanner", (PyObject *)&ScannerType);
+
+    // import all required external modules
+    if (!amfast_mod) {
+        amfast_mod = PyImport_ImportModule("amfast");
+        if(!amfast_mod)
+            return;
+    }
+
+    if (!remoting_mod) {
+        remoting_mod = PyImport_ImportModule("amfast.remoting");
+        if (!remoting_mod)
+            return;
+    }
+
+    if (context_mod == NULL) {
+        context_mod = import_context_mod();
+        if (context_mod == NULL)
+            return;
+    }
+
+    if (!xml_dom_mod) {
+        xml_dom_mod = PyImport_ImportModule("xml.dom.minidom");
+        if (!xml_dom_mod)
+            return;
+    }
+
+    if (!as_types_mod) {
+        as_types_mod = PyImport_ImportModule("amfast.class_def.as_types");
+        if (!as_types_mod)
+            return;
+    }
+
+    if (!class_def_mod) {
+        class_def_mod = PyImport_ImportModule("amfast.class_def");
+        if (!class_def_mod)
+            return;
+    }
+
+    // Default ClassDef methods, used to
+    // check if a ClassDef can be skipped.
+    PyObject *class_def_class = PyObject_GetAttrString(class_def_mod, "ClassDef");
+    if (class_def_class == NULL)
+        return;
+
+    PyObject *method = PyObject_GetAttrString(class_def_class, "getInstance");
+    if (method == NULL) {
+        Py_DECREF(class_def_class);
+        return;
+    }
+    default_get_instance = PyMethod_GET_FUNCTION(method);
+    Py_INCREF(default_get_instance);
+    Py_DECREF(method);
+
+    method = PyObject_GetAttrString(class_def_class, "applyAttrVals");
+    Py_DECREF(class_def_class);
+    if (method == NULL)
+        return;
+    default_apply_attr_vals = PyMethod_GET_FUNCTION(method);
+    Py_INCREF(default_apply_attr_vals);
+    Py_DECREF(method);
+
+    traits_name = PyString_InternFromString("_decode_traits");
+    if (traits_name == NULL)
+        return;
+
+    PyObject *array_mod = PyImport_ImportModule("array");
+    if (array_mod == NULL)
+        return;
+
+    array_type = (PyTypeObject*)PyObject_GetAttrString(array_mod, "array");
+    Py_DECREF(array_mod);
+    if (array_type == NULL)
+        return;
+
+    // Setup exceptions
+    amfast_Error = PyObject_GetAttrString(amfast_mod, "AmFastError");
+    if (amfast_Error == NULL) {
+        return;
+    }
+
+    amfast_DecodeError = PyErr_NewException("amfast.decode.DecodeError", amfast_Error, NULL);
+    if (amfast_DecodeError == NULL) {
+        return;
+    }
+
+    Py_INCREF(amfast_DecodeError);
+    if (PyModule_AddObject(m, "DecodeError", amfast_DecodeError) == -1) {
+        return;
+    }
+
+    amfast_LimitError = PyObject_GetAttrString(context_mod, "LimitError");
+    if (amfast_LimitError == NULL) {
         return;
     }
 
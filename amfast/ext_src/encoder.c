@@ -13,6 +13,14 @@ static PyObject *amfast_mod;
 static PyObject *context_mod;
 static PyObject *class_def_mod;
 static PyObject *as_types_mod;
+static PyObject *decode_mod;
+static PyTypeObject *lazy_value_type; // amfast.decode.LazyValue
+static PyTypeObject *array_type; // array.array
+static PyTypeObject *ndarray_type; // numpy.ndarray, once numpy has been imported
+static PyObject *zlib_compress; // zlib.compress, once zlib has been imported
+static PyObject *numpy_name; // Name of numpy module
+static PyObject *plans_name; // Name of ClassDefMapper attribute that stores EncodePlans
+static PyObject *default_static_attr_vals; // Function of ClassDef.getStaticAttrVals
 static PyObject *amfast_Error;
 static PyObject *amfast_EncodeError;
 static int big_endian; // Flag == 1 if architecture is big_endian, == 0 if not
@@ -29,6 +37,7 @@ static int big_endian; // Flag == 1 if architecture is big_endian, == 0 if not
 
 // COMMON
 static int encode_packet(EncoderObj *context, PyObject *value);
+static int enter_value(EncoderObj *context);
 static int encode_ushort(EncoderObj *context, unsigned short value);
 static int encode_ulong(EncoderObj *context, unsigned int value);
 static int _encode_double(EncoderObj *context, double value);
@@ -39,6 +48,7 @@ static int check_xml(PyObject *value);
 static int check_byte_array(PyObject *value);
 static int check_proxy(PyObject *value);
 static int check_no_proxy(PyObject *value);
+static int check_encoded(PyObject *value);
 static PyObject* class_def_from_class(EncoderObj *context, PyObject *value);
 static PyObject* attributes_from_object(EncoderObj *context, PyObject *value);
 static PyObject* static_attr_vals_from_class_def(EncoderObj *context,
@@ -66,11 +76,14 @@ static int write_object_AMF0(EncoderObj *context, PyObject *value);
 static int write_anonymous_object_AMF0(EncoderObj *context, PyObject *value);
 static int encode_packet_header_AMF0(EncoderObj *context, PyObject *value);
 static int encode_packet_message_AMF0(EncoderObj *context, PyObject *value);
+static int encode_packet_body_AMF0(EncoderObj *context, PyObject *value, int amf3, int arg_list);
 static int write_proxy_AMF0(EncoderObj *context, PyObject *value);
 static int encode_AMF0(EncoderObj *context, PyObject *value);
+static int encode_value_AMF0(EncoderObj *context, PyObject *value);
 
 // AMF3
 static int encode_long_AMF3(EncoderObj *context, PyObject *value);
+static size_t _pack_int_AMF3(int value, char *tmp);
 static int _encode_int_AMF3(EncoderObj *context, int value);
 static int write_int_AMF3(EncoderObj *context, PyObject *value);
 static int encode_none_AMF3(EncoderObj *context);
@@ -87,6 +100,10 @@ static int write_dict_AMF3(EncoderObj *context, PyObject *value);
 static int serialize_dict_AMF3(EncoderObj *context, PyObject *value);
 static int encode_dict_AMF3(EncoderObj *context, PyObject *value);
 static int encode_dynamic_dict_AMF3(EncoderObj *context, PyObject *value);
+static int write_shared_trait_dict_AMF3(EncoderObj *context, PyObject *value, PyObject **trait);
+static int dict_has_string_keys(PyObject *value);
+static int check_dictionary(PyObject *value);
+static int write_dictionary_AMF3(EncoderObj *context, PyObject *value);
 static int encode_object_proxy_header_AMF3(EncoderObj *context);
 static int serialize_date_AMF3(EncoderObj *context, PyObject *value);
 static int encode_reference_AMF3(EncoderObj *context, RefObj *ref_context, PyObject *value, int bit);
@@ -94,17 +111,113 @@ static int write_xml_AMF3(EncoderObj *context, PyObject *value);
 static int serialize_xml_AMF3(EncoderObj *context, PyObject *value);
 static int serialize_object_AMF3(EncoderObj *context, PyObject *value);
 static int encode_object_AMF3(EncoderObj *context, PyObject *value);
+static int encode_external_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value);
+static int encode_static_attrs_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value);
+static int encode_dynamic_attrs_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value);
 static int serialize_class_def_AMF3(EncoderObj *context, PyObject *value);
 static int encode_class_def_AMF3(EncoderObj *context, PyObject *value);
 static int serialize_byte_array_AMF3(EncoderObj *context, PyObject *value);
 static int encode_byte_array_AMF3(EncoderObj *context, PyObject *value);
+static PyObject* compress_byte_array(PyObject *value, PyObject *byte_string);
 static int write_proxy_AMF3(EncoderObj *context, PyObject *value);
 static int write_no_proxy_AMF3(EncoderObj *context, PyObject *value);
 static int encode_AMF3(EncoderObj *context, PyObject *value);
+static int encode_value_AMF3(EncoderObj *context, PyObject *value);
+
+// VECTORS
+static PyTypeObject* numpy_array_type(void);
+static int check_vector(PyObject *value);
+static int write_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type);
+static int encode_array_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type);
+static int encode_numpy_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type);
+static int encode_object_vector_AMF3(EncoderObj *context, PyObject *value);
+
+// RECORD ARRAYS
+static int check_record_array(PyObject *value);
+static int write_record_array_AMF3(EncoderObj *context, PyObject *value);
+static int encode_record_array_AMF3(EncoderObj *context, PyObject *value);
+
+// SMALL MESSAGES
+static int encode_small_message(EncoderObj *context, PyObject *value, int msg_type, PyObject *raw_attrs);
+static PyObject* small_msg_attr(PyObject *value, const char *name);
+static PyObject* raw_attr_name(PyObject *raw_attrs, PyObject *attr);
+static int _uid_to_bytes(PyObject *value, char *bytes);
+static int write_small_uid_AMF3(EncoderObj *context, char *bytes);
+
+// ENCODE PLANS
+/*
+ * A ClassDef compiled for encoding.
+ *
+ * Plans are stored in ClassDefMapper._encode_plans keyed by class,
+ * the ClassDefMapper discards them when a class is mapped or unmapped.
+ */
+typedef struct {
+    PyObject_HEAD
+    PyObject *class_def; // ClassDef the plan was compiled from
+    int externalizable; // 1 if ClassDef is externalizable
+    int dynamic; // 1 if ClassDef is dynamic
+    int direct; // 1 if static attr values can be retrieved without calling the ClassDef
+    PyObject *header; // Encoded trait header
+    PyObject *strings; // Alias and static attr names, as indexed in the string reference table
+    PyObject *encoded_strings; // Encoded alias and static attr names
+    PyObject *attrs; // Static attr names
+    PyObject *read_attrs; // Names static attr values are read from, with ClassDef.raw_attrs applied
+} EncodePlanObj;
+
+static PyObject* compile_plan(PyObject *class_def);
+static int plan_from_class(EncoderObj *context, PyObject *value, PyObject **plan);
+static int write_plan_trait_AMF3(EncoderObj *context, EncodePlanObj *plan);
+static int encode_planned_object_AMF3(EncoderObj *context, EncodePlanObj *plan, PyObject *value);
+
+// SPLICING
+/*
+ * State of a walk through an encoded AMF3 value.
+ *
+ * References in the encoded bytes are numbered from base,
+ * they are re-numbered from offset when they are written,
+ * so that they match the reference tables of the output.
+ */
+typedef struct {
+    char *data; // Encoded bytes
+    int len; // Length of encoded bytes
+    int pos; // Current position
+    int copied; // Position of first byte that has not been written, -1 to only validate
+    int bases[3]; // Index of the first reference defined in the encoded bytes
+    int offsets[3]; // Index of the first reference in the output
+    int counts[3]; // Number of references defined so far
+    int *strings; // Position and length of each string defined
+    int *traits; // Kind, static attribute count and dynamic flag of each trait defined
+    int strings_len; // Allocated length of strings
+    int traits_len; // Allocated length of traits
+} SpliceState;
+
+// Reference tables
+#define SPLICE_OBJ 0
+#define SPLICE_STRING 1
+#define SPLICE_CLASS 2
+
+// Trait kinds
+#define SPLICE_TRAIT_TYPED 0
+#define SPLICE_TRAIT_COLLECTION 1
+
+static int splice_value(EncoderObj *context, SpliceState *state);
+static int splice_value_AMF0(EncoderObj *context, SpliceState *state);
+static int splice_encoded(EncoderObj *context, char *data, int len, int amf3, int *bases, int *counts);
+static int splice_source(EncoderObj *context, PyObject *source, Py_ssize_t start, Py_ssize_t end,
+    int amf3, int *bases, int *counts);
+static int write_lazy_AMF3(EncoderObj *context, PyObject *value);
+static int write_encoded_AMF3(EncoderObj *context, PyObject *value);
+static int write_encoded_AMF0(EncoderObj *context, PyObject *value);
+
+// Stats
+static int encode_stats(EncoderObj *context, PyObject *value, int amf3);
+static int record_alias(EncoderObj *context, PyObject *value, Py_ssize_t bytes, double seconds);
+static void record_ref(EncoderObj *context, RefObj *ref_context, int hit);
 
 // Python exposed functions
 static PyObject* py_encode(PyObject *self, PyObject *args, PyObject *kwargs);
 static PyObject* py_encode_packet(PyObject *self, PyObject *args, PyObject *kwargs);
+static PyObject* py_write_small_message(PyObject *self, PyObject *args, PyObject *kwargs);
 
 /* Encode a native C double. */
 static int _encode_double(EncoderObj *context, double value)
@@ -143,10 +256,14 @@ static int encode_long_AMF3(EncoderObj *context, PyObject *value)
     return _encode_double(context, n);
 }
 
-/* Encode a native C int. */
-static int _encode_int_AMF3(EncoderObj *context, int value)
+/*
+ * Pack a native C int into AMF3 int bytes.
+ *
+ * tmp must have room for 4 bytes.
+ * Returns the number of bytes packed, or 0 on error.
+ */
+static size_t _pack_int_AMF3(int value, char *tmp)
 {
-    char tmp[4];
     size_t tmp_size;
 
     /*
@@ -185,7 +302,18 @@ static int _encode_int_AMF3(EncoderObj *context, int value)
         return 0;        
     }
 
-    return Encoder_write(context, tmp, tmp_size);
+    return tmp_size;
+}
+
+/* Encode a native C int. */
+static int _encode_int_AMF3(EncoderObj *context, int value)
+{
+    char tmp[4];
+    size_t tmp_size = _pack_int_AMF3(value, tmp);
+    if (tmp_size == 0)
+        return 0;
+
+    return Encoder_write(context, tmp, (int)tmp_size);
 }
 
 /* Writes a PyInt. */
@@ -357,8 +485,11 @@ static int encode_array_collection_header_AMF3(EncoderObj *context)
         return 0;
 
     // Add an extra item to the index for the array following the collection
-    if (Ref_map((RefObj*)context->obj_refs, Py_None) == -1)
+    if (context->use_obj_refs != Py_True) {
+        ((RefObj*)context->obj_refs)->idx++;
+    } else if (Ref_map((RefObj*)context->obj_refs, Py_None) == -1) {
         return 0;
+    }
 
     return 1;
 }
@@ -509,21 +640,35 @@ static int encode_list_AMF3(EncoderObj *context, PyObject *value)
     if (!Encoder_writeByte(context, NULL_TYPE))
         return 0;
 
+    // Dicts are only encoded with shared traits
+    // if they are not encoded as ObjectProxies.
+    int shared_traits = context->use_shared_traits == Py_True &&
+        context->use_proxies != Py_True;
+    PyObject *trait = NULL; // Keys of the current run of dicts
+
     // Encode each value in the list
     int i;
+    int result = 1;
     for (i = 0; i < value_len; i++) {
         // GetItem increments ref count 
         PyObject *list_item = PySequence_GetItem(value, i);
-        if (!list_item)
-            return 0;
+        if (!list_item) {
+            result = 0;
+            break;
+        }
 
-        int result = encode_AMF3(context, list_item);
+        if (shared_traits && PyDict_CheckExact(list_item)) {
+            result = write_shared_trait_dict_AMF3(context, list_item, &trait);
+        } else {
+            result = encode_AMF3(context, list_item);
+        }
         Py_DECREF(list_item);
         if (!result)
-            return 0;
+            break;
     }
 
-    return 1;
+    Py_XDECREF(trait);
+    return result;
 }
 
 /* Encode an ObjectProxy header. */
@@ -557,8 +702,11 @@ static int encode_object_proxy_header_AMF3(EncoderObj *context)
          return 0;
 
     // Add an extra item to the index for the object following the proxy
-    if (Ref_map((RefObj*)context->obj_refs, Py_None) == -1)
+    if (context->use_obj_refs != Py_True) {
+        ((RefObj*)context->obj_refs)->idx++;
+    } else if (Ref_map((RefObj*)context->obj_refs, Py_None) == -1) {
         return 0;
+    }
 
     return 1;
 }
@@ -566,6 +714,10 @@ static int encode_object_proxy_header_AMF3(EncoderObj *context)
 /* Write a PyDict. */
 static int write_dict_AMF3(EncoderObj *context, PyObject *value)
 {
+    if (context->use_dictionaries == Py_True && !dict_has_string_keys(value)) {
+        return write_dictionary_AMF3(context, value);
+    }
+
     if (context->use_proxies == Py_True) {
         return write_proxy_AMF3(context, value);
     }
@@ -576,6 +728,96 @@ static int write_dict_AMF3(EncoderObj *context, PyObject *value)
     return serialize_dict_AMF3(context, value);
 }
 
+/* Returns 1 if all keys of a dict are strings. */
+static int dict_has_string_keys(PyObject *value)
+{
+    PyObject *key;
+    PyObject *val;
+    Py_ssize_t idx = 0;
+
+    while (PyDict_Next(value, &idx, &key, &val)) {
+        if (!PyString_Check(key) && !PyUnicode_Check(key))
+            return 0;
+    }
+
+    return 1;
+}
+
+/* Returns 1 if a PyObject is an AsDictionary. */
+static int check_dictionary(PyObject *value)
+{
+    return PyObject_HasAttrString(value, "AS_DICTIONARY");
+}
+
+/*
+ * Writes a Dictionary.
+ *
+ * value is a dict, or an AsDictionary.
+ */
+static int write_dictionary_AMF3(EncoderObj *context, PyObject *value)
+{
+    if (!Encoder_writeByte(context, DICTIONARY_TYPE))
+        return 0;
+
+    // Check for idx
+    int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+    if (result > -1)
+        return result;
+
+    PyObject *source;
+    int weak_keys = 0;
+    if (PyDict_Check(value)) {
+        source = value;
+        Py_INCREF(source);
+    } else {
+        source = PyObject_GetAttrString(value, "source");
+        if (source == NULL)
+            return 0;
+
+        PyObject *weak_keys_obj = PyObject_GetAttrString(value, "weak_keys");
+        if (weak_keys_obj == NULL) {
+            Py_DECREF(source);
+            return 0;
+        }
+
+        weak_keys = PyObject_IsTrue(weak_keys_obj);
+        Py_DECREF(weak_keys_obj);
+        if (weak_keys == -1) {
+            Py_DECREF(source);
+            return 0;
+        }
+
+        if (!PyDict_Check(source)) {
+            Py_DECREF(source);
+            PyErr_SetString(amfast_EncodeError, "Dictionary source must be a dict.");
+            return 0;
+        }
+    }
+
+    Py_ssize_t count = PyDict_Size(source);
+    if (count >= 0x10000000) {
+        Py_DECREF(source);
+        PyErr_SetString(amfast_EncodeError, "Dictionary has too many items.");
+        return 0;
+    }
+
+    result = _encode_int_AMF3(context, ((int)count) << 1 | REFERENCE_BIT);
+    if (result)
+        result = Encoder_writeByte(context, weak_keys ? 0x01 : 0x00);
+
+    PyObject *key;
+    PyObject *val;
+    Py_ssize_t idx = 0;
+    while (result && PyDict_Next(source, &idx, &key, &val)) {
+        result = encode_AMF3(context, key);
+        if (result)
+            result = encode_AMF3(context, val);
+    }
+
+    Py_DECREF(source);
+    return result;
+}
+
 /* Serialize a PyDict. */
 static int serialize_dict_AMF3(EncoderObj *context, PyObject *value)
 {
@@ -621,6 +863,122 @@ static int encode_dynamic_dict_AMF3(EncoderObj *context, PyObject *value)
     return 1;
 }
 
+/*
+ * Returns the keys of a dict as a tuple, to be used as sealed attributes.
+ *
+ * Returns Py_None if the dict must be encoded as a dynamic object,
+ * or NULL on error.
+ */
+static PyObject* shared_trait_attrs(PyObject *value)
+{
+    if (PyDict_Size(value) == 0) {
+        Py_RETURN_NONE;
+    }
+
+    PyObject *keys = PyDict_Keys(value);
+    if (keys == NULL)
+        return NULL;
+
+    Py_ssize_t i;
+    Py_ssize_t key_len = PyList_GET_SIZE(keys);
+    for (i = 0; i < key_len; i++) {
+        PyObject *key = PyList_GET_ITEM(keys, i);
+        if (!PyString_Check(key) && !PyUnicode_Check(key)) {
+            Py_DECREF(keys);
+            Py_RETURN_NONE;
+        }
+    }
+
+    PyObject *attrs = PyList_AsTuple(keys);
+    Py_DECREF(keys);
+    return attrs;
+}
+
+/* Returns 1 if a dict has exactly the keys in attrs. */
+static int dict_has_attrs(PyObject *value, PyObject *attrs)
+{
+    Py_ssize_t attr_len = PyTuple_GET_SIZE(attrs);
+    if (PyDict_Size(value) != attr_len)
+        return 0;
+
+    Py_ssize_t i;
+    for (i = 0; i < attr_len; i++) {
+        if (PyDict_GetItem(value, PyTuple_GET_ITEM(attrs, i)) == NULL)
+            return 0;
+    }
+
+    return 1;
+}
+
+/*
+ * Writes a dict from a list as a sealed anonymous object.
+ *
+ * trait holds the keys of the previous dict in the list.
+ * Dicts with the same keys share the trait, a dict with
+ * different keys starts a new trait and replaces trait.
+ */
+static int write_shared_trait_dict_AMF3(EncoderObj *context, PyObject *value, PyObject **trait)
+{
+    if (!Encoder_writeByte(context, OBJECT_TYPE))
+       return 0;
+
+    // Check for idx
+    int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+    if (result > -1)
+        return result;
+
+    if (*trait == NULL || *trait == Py_None || !dict_has_attrs(value, *trait)) {
+        // The trait tuple is also the key of the trait in the reference table,
+        // a new tuple is created for each run.
+        Py_XDECREF(*trait);
+        *trait = shared_trait_attrs(value);
+        if (*trait == NULL)
+            return 0;
+    }
+
+    if (*trait == Py_None)
+        return encode_dict_AMF3(context, value);
+
+    Py_ssize_t i;
+    Py_ssize_t attr_len = PyTuple_GET_SIZE(*trait);
+
+    result = encode_reference_AMF3(context, (RefObj*)context->class_refs, *trait, 1);
+    if (result == 0)
+        return 0;
+
+    if (result == -1) {
+        if (attr_len >= 0x8000000) {
+            PyErr_SetString(amfast_EncodeError, "Dict has too many keys.");
+            return 0;
+        }
+
+        if (!_encode_int_AMF3(context, ((int)attr_len) << 4 | STATIC))
+            return 0;
+
+        // Anonymous object
+        if (!Encoder_writeByte(context, EMPTY_STRING_TYPE))
+            return 0;
+
+        for (i = 0; i < attr_len; i++) {
+            if (!serialize_object_as_string_AMF3(context, PyTuple_GET_ITEM(*trait, i)))
+                return 0;
+        }
+    }
+
+    for (i = 0; i < attr_len; i++) {
+        PyObject *item = PyDict_GetItem(value, PyTuple_GET_ITEM(*trait, i));
+        if (item == NULL) {
+            PyErr_SetString(amfast_EncodeError, "Dict changed size during encoding.");
+            return 0;
+        }
+
+        if (!encode_AMF3(context, item))
+            return 0;
+    }
+
+    return 1;
+}
+
 /* Serialize a PyDate. */
 static int serialize_date_AMF3(EncoderObj *context, PyObject *value)
 {
@@ -672,6 +1030,12 @@ static int encode_reference_AMF3(EncoderObj *context, RefObj *ref_context,
         return 0;
     }
 
+    if (context->use_obj_refs != Py_True && ref_context == (RefObj*)context->obj_refs) {
+        // Objects are never referenced, but they still take up an index.
+        ref_context->idx++;
+        return -1;
+    }
+
     // Using references is an option set in the context
     if (context->use_refs == Py_True) {
         int idx = Ref_ret(ref_context, value);
@@ -679,6 +1043,8 @@ static int encode_reference_AMF3(EncoderObj *context, RefObj *ref_context,
             if (idx < MAX_INT) {// Max reference count
                 if (!_encode_int_AMF3(context, (idx << (bit + 1)) | (0x00 + bit)))
                    return 0;
+               if (context->stats != Py_None)
+                   record_ref(context, ref_context, 1);
                return 1;
            }
         }
@@ -688,6 +1054,8 @@ static int encode_reference_AMF3(EncoderObj *context, RefObj *ref_context,
     if (Ref_map(ref_context, value) == -1)
         return 0;
 
+    if (context->stats != Py_None)
+        record_ref(context, ref_context, 0);
     return -1;
 }
 
@@ -700,6 +1068,12 @@ static int encode_reference_AMF3(EncoderObj *context, RefObj *ref_context,
  */
 static int write_reference_AMF0(EncoderObj *context, PyObject *value)
 {
+    if (context->use_obj_refs != Py_True) {
+        // Objects are never referenced, but they still take up an index.
+        ((RefObj*)context->obj_refs)->idx++;
+        return -1;
+    }
+
     // Using references is an option set in the context
     if (context->use_refs == Py_True) {
         int idx = Ref_ret((RefObj*)context->obj_refs, value);
@@ -711,6 +1085,8 @@ static int write_reference_AMF0(EncoderObj *context, PyObject *value)
                 if (!encode_ushort(context, (unsigned short)idx))
                     return 0;
 
+                if (context->stats != Py_None)
+                    record_ref(context, (RefObj*)context->obj_refs, 1);
                 return 1;
             }
         }
@@ -720,10 +1096,12 @@ static int write_reference_AMF0(EncoderObj *context, PyObject *value)
     if (Ref_map((RefObj*)context->obj_refs, value) == -1)
         return 0;
 
+    if (context->stats != Py_None)
+        record_ref(context, (RefObj*)context->obj_refs, 0);
     return -1;
 }
 
-/* Serializes a PyByteArray or a PyString. */
+/* Serializes a PyByteArray or an AsByteArray. */
 static int serialize_byte_array_AMF3(EncoderObj *context, PyObject *value)
 {
     // Check for idx
@@ -731,39 +1109,28 @@ static int serialize_byte_array_AMF3(EncoderObj *context, PyObject *value)
     if (result > -1)
         return result;
 
-    // Length prefix
-    Py_ssize_t value_len;
-    
     #ifdef Py_BYTEARRAYOBJECT_H
     // ByteArray encoding is only available in 2.6+
     if (PyByteArray_Check(value)) {
-        value_len = PyByteArray_GET_SIZE(value);
-
-        if (!_encode_int_AMF3(context, ((int)value_len) << 1 | REFERENCE_BIT)) {
-            return 0;
-        }
-
         return encode_byte_array_AMF3(context, value);
     }
     #endif
-    PyObject *byte_string;
-    if (check_byte_array(value)) {
-        byte_string = PyObject_GetAttrString(value, "bytes");
-        if (!byte_string)
-            return 0;
-        value_len = PyString_GET_SIZE(byte_string);
-        if (value_len < 0) {
-            Py_DECREF(byte_string);
-            return 0;
-        }
-    } else {
+
+    if (!check_byte_array(value)) {
         PyErr_SetString(amfast_EncodeError, "Cannot encode non AsByteArray as byte array.");
         return 0;
     }
 
-    if (!_encode_int_AMF3(context, ((int)value_len) << 1 | REFERENCE_BIT)) {
-        Py_DECREF(byte_string);
+    PyObject *byte_string = PyObject_GetAttrString(value, "bytes");
+    if (!byte_string)
         return 0;
+
+    if (PyObject_HasAttrString(value, "AS_COMPRESSED_BYTE_ARRAY")) {
+        PyObject *compressed = compress_byte_array(value, byte_string);
+        Py_DECREF(byte_string);
+        if (!compressed)
+            return 0;
+        byte_string = compressed;
     }
 
     result = encode_byte_array_AMF3(context, byte_string);
@@ -771,11 +1138,47 @@ static int serialize_byte_array_AMF3(EncoderObj *context, PyObject *value)
     return result; 
 }
 
-/* Encodes a PyByteArray or a PyString. */
+/*
+ * Compress the bytes of an AsCompressedByteArray with zlib,
+ * the format ActionScript ByteArray.uncompress() reads by default.
+ *
+ * zlib.compress releases the GIL while it deflates.
+ */
+static PyObject* compress_byte_array(PyObject *value, PyObject *byte_string)
+{
+    if (zlib_compress == NULL) {
+        PyObject *zlib_mod = PyImport_ImportModule("zlib");
+        if (!zlib_mod)
+            return NULL;
+
+        zlib_compress = PyObject_GetAttrString(zlib_mod, "compress");
+        Py_DECREF(zlib_mod);
+        if (!zlib_compress)
+            return NULL;
+    }
+
+    PyObject *level = PyObject_GetAttrString(value, "level");
+    if (!level)
+        return NULL;
+
+    PyObject *result = PyObject_CallFunctionObjArgs(zlib_compress, byte_string, level, NULL);
+    Py_DECREF(level);
+    return result;
+}
+
+/*
+ * Encodes the length and contents of a
+ * PyString, PyByteArray or buffer object.
+ */
 static int encode_byte_array_AMF3(EncoderObj *context, PyObject *value)
 {
     Py_ssize_t value_len;
     char *byte_value;
+    int result;
+    #ifdef PyBUF_SIMPLE
+    Py_buffer view;
+    int has_view = 0;
+    #endif
     
     if (PyString_CheckExact(value)) {
         value_len = PyString_GET_SIZE(value);
@@ -788,795 +1191,1839 @@ static int encode_byte_array_AMF3(EncoderObj *context, PyObject *value)
         byte_value = PyByteArray_AS_STRING(value);
     }
     #endif
+    #ifdef PyBUF_SIMPLE
+    // memoryview, mmap, etc.
+    else if (PyObject_CheckBuffer(value)) {
+        if (PyObject_GetBuffer(value, &view, PyBUF_SIMPLE) == -1)
+            return 0;
+        has_view = 1;
+        value_len = view.len;
+        byte_value = (char*)view.buf;
+    }
+    #endif
+    else if (!PyUnicode_Check(value) && PyObject_CheckReadBuffer(value)) {
+        const void *c_buf;
+        if (PyObject_AsReadBuffer(value, &c_buf, &value_len) == -1)
+            return 0;
+        byte_value = (char*)c_buf;
+    }
     else {
         PyErr_SetString(amfast_EncodeError, "Cannot encode non ByteArray/String as byte array.");
         return 0;
     }
     
-    if (!byte_value)
-        return 0;
+    result = _encode_int_AMF3(context, ((int)value_len) << 1 | REFERENCE_BIT);
+    if (result && value_len > 0)
+        result = Encoder_write(context, byte_value, (int)value_len);
 
-    return Encoder_write(context, byte_value, (int)value_len);
+    #ifdef PyBUF_SIMPLE
+    if (has_view)
+        PyBuffer_Release(&view);
+    #endif
+    return result;
 }
 
-/* Writes an xml.dom.Document object. */
-static int write_xml_AMF3(EncoderObj *context, PyObject *value)
+// ---- VECTORS
+
+/*
+ * Returns numpy.ndarray, or NULL if numpy has not been imported.
+ *
+ * numpy is not imported by the encoder,
+ * values can only be numpy arrays if it is already loaded.
+ */
+static PyTypeObject* numpy_array_type(void)
 {
-    int byte_marker;
+    if (ndarray_type != NULL)
+        return ndarray_type;
 
-    if (context->use_legacy_xml == Py_True) {
-        byte_marker = XML_DOC_TYPE;
-    } else {
-        byte_marker = XML_TYPE;
+    PyObject *numpy_mod = PyDict_GetItem(PyImport_GetModuleDict(), numpy_name);
+    if (numpy_mod == NULL)
+        return NULL;
+
+    PyObject *array_type_obj = PyObject_GetAttrString(numpy_mod, "ndarray");
+    if (array_type_obj == NULL) {
+        PyErr_Clear();
+        return NULL;
     }
 
-    if (!Encoder_writeByte(context, byte_marker))
-        return 0;
+    if (!PyType_Check(array_type_obj)) {
+        Py_DECREF(array_type_obj);
+        return NULL;
+    }
 
-    return serialize_xml_AMF3(context, value);
+    ndarray_type = (PyTypeObject*)array_type_obj;
+    return ndarray_type;
 }
 
-/* Serializes an xml.dom.Document object. */
-static int serialize_xml_AMF3(EncoderObj *context, PyObject *value)
+/* Returns the Vector type marker for an array.array typecode, or 0. */
+static int vector_type_from_typecode(char typecode)
 {
-    // Check for idx
-    int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
-    if (result > -1)
-        return result;
-
-    PyObject *unicode_value = PyObject_CallMethod(value, "toxml", NULL);
-    if (unicode_value == NULL)
-        return 0;
+    switch (typecode) {
+        case 'b':
+        case 'h':
+        case 'i':
+        case 'l':
+            return VECTOR_INT_TYPE;
+        case 'B':
+        case 'H':
+        case 'I':
+        case 'L':
+            return VECTOR_UINT_TYPE;
+        case 'f':
+        case 'd':
+            return VECTOR_DOUBLE_TYPE;
+        default:
+            break;
+    }
 
-    result = encode_unicode_AMF3(context, unicode_value);
-    Py_DECREF(unicode_value);
-    return result;
+    return 0;
 }
 
-/* Returns 1 if a PyObject is a xml.dom.Document object. */
-static int check_xml(PyObject *value)
+/* Returns the single character string value of an attribute, or 0. */
+static char char_attr(PyObject *value, const char *name)
 {
-    if (!PyObject_HasAttrString(value, "toxml"))
-        return 0;
-    if (!PyObject_HasAttrString(value, "toprettyxml"))
+    PyObject *attr = PyObject_GetAttrString(value, name);
+    if (attr == NULL) {
+        PyErr_Clear();
         return 0;
+    }
 
-    return 1;
+    char result = 0;
+    if (PyString_Check(attr) && PyString_GET_SIZE(attr) == 1)
+        result = PyString_AS_STRING(attr)[0];
+    Py_DECREF(attr);
+    return result;
 }
 
-/* Returns 1 if a PyObject is a amfast.class_def.as_types.AsByteArray object. */
-static int check_byte_array(PyObject *value)
+/* Returns the int value of an attribute, or -1. */
+static int int_attr(PyObject *value, const char *name)
 {
-    return PyObject_HasAttrString(value, "AS_BYTE_ARRAY");
+    PyObject *attr = PyObject_GetAttrString(value, name);
+    if (attr == NULL) {
+        PyErr_Clear();
+        return -1;
+    }
+
+    int result = (int)PyInt_AsLong(attr);
+    Py_DECREF(attr);
+    if (result == -1 && PyErr_Occurred())
+        PyErr_Clear();
+    return result;
 }
 
-/* Returns 1 if a PyObject is an AsProxy. */
-static int check_proxy(PyObject *value)
+/*
+ * Returns the Vector type marker to encode a PyObject with,
+ * or 0 if the PyObject is not encoded as a Vector.
+ *
+ * array.array and 1 dimensional numpy arrays
+ * of ints, uints and floats are numeric Vectors.
+ */
+static int check_vector(PyObject *value)
 {
-    return PyObject_HasAttrString(value, "AS_PROXY");
-}
+    if (PyObject_TypeCheck(value, array_type))
+        return vector_type_from_typecode(char_attr(value, "typecode"));
 
-/* Returns 1 if a PyObject is an AsNoProxy. */
-static int check_no_proxy(PyObject *value)
-{
-    return PyObject_HasAttrString(value, "AS_NO_PROXY");
+    PyTypeObject *ndarray = numpy_array_type();
+    if (ndarray != NULL && PyObject_TypeCheck(value, ndarray)) {
+        int ndim = int_attr(value, "ndim");
+        if (ndim < 1)
+            return 0;
+        if (ndim > 1)
+            return VECTOR_OBJECT_TYPE;
+
+        PyObject *dtype = PyObject_GetAttrString(value, "dtype");
+        if (dtype == NULL) {
+            PyErr_Clear();
+            return 0;
+        }
+
+        char kind = char_attr(dtype, "kind");
+        Py_DECREF(dtype);
+        switch (kind) {
+            case 'i':
+                return VECTOR_INT_TYPE;
+            case 'u':
+                return VECTOR_UINT_TYPE;
+            case 'f':
+                return VECTOR_DOUBLE_TYPE;
+            default:
+                break;
+        }
+
+        return VECTOR_OBJECT_TYPE;
+    }
+
+    if (PyObject_HasAttrString(value, "AS_VECTOR"))
+        return VECTOR_OBJECT_TYPE;
+
+    return 0;
 }
 
-/* Serialize a Python object. */
-static int serialize_object_AMF3(EncoderObj *context, PyObject *value)
+/* Writes a Vector. */
+static int write_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type)
 {
+    if (!Encoder_writeByte(context, (char)vector_type))
+        return 0;
+
     // Check for idx
     int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
     if (result > -1)
         return result;
 
-    return encode_object_AMF3(context, value);
+    if (vector_type == VECTOR_OBJECT_TYPE)
+        return encode_object_vector_AMF3(context, value);
+
+    if (PyObject_TypeCheck(value, array_type))
+        return encode_array_vector_AMF3(context, value, vector_type);
+
+    return encode_numpy_vector_AMF3(context, value, vector_type);
 }
 
-/* Encode a Python object. */
-static int encode_object_AMF3(EncoderObj *context, PyObject *value)
+/* Encode the item count and fixed flag of a Vector. */
+static int encode_vector_header_AMF3(EncoderObj *context, Py_ssize_t count, int fixed)
 {
-    PyObject *class_def = class_def_from_class(context, value);
-    if (!class_def)
+    if (count >= 0x10000000) {
+        PyErr_SetString(amfast_EncodeError, "Vector has too many items.");
         return 0;
+    }
 
-    if (class_def == Py_None) {
-        // No ClassDef was found, encode as an anonymous object
-        Py_DECREF(class_def);
+    if (!_encode_int_AMF3(context, ((int)count) << 1 | REFERENCE_BIT))
+        return 0;
 
-        PyObject *dict = attributes_from_object(context, value);
-        if (!dict)
-            return 0;
+    return Encoder_writeByte(context, fixed ? 0x01 : 0x00);
+}
 
-        int result = encode_dict_AMF3(context, dict);
-        Py_DECREF(dict);
-        return result;
+/* Pack a native C unsigned int into 4 big-endian bytes. */
+static void _pack_uint32(unsigned int value, char *dest)
+{
+    dest[0] = (char)(value >> 24);
+    dest[1] = (char)(value >> 16);
+    dest[2] = (char)(value >> 8);
+    dest[3] = (char)value;
+}
+
+/* Pack a native C double into 8 big-endian bytes. */
+static void _pack_double(double value, char *dest)
+{
+    union aligned {
+        double d_value;
+        char c_value[8];
+    } d_aligned;
+    d_aligned.d_value = value;
+
+    if (big_endian) {
+        memcpy(dest, d_aligned.c_value, 8);
+    } else {
+        int i;
+        for (i = 0; i < 8; i++) {
+            dest[i] = d_aligned.c_value[7 - i];
+        }
     }
+}
 
-    // Class has a ClassDef
-    // encode class definition
-    if (!serialize_class_def_AMF3(context, class_def)) {
-        Py_DECREF(class_def);
+/*
+ * Items of types that always fit in 32 bits
+ * are packed without a range check.
+ */
+#define PACK_VECTOR_ALL(c_type) \
+    for (i = 0; i < count; i++) { \
+        _pack_uint32((unsigned int)((const c_type*)src)[i], dest + i * 4); \
+    } \
+    return 1;
+
+#define PACK_VECTOR_INTS(c_type, min, max) \
+    for (i = 0; i < count; i++) { \
+        c_type item = ((const c_type*)src)[i]; \
+        if (item < min || item > max) \
+            return 0; \
+        _pack_uint32((unsigned int)item, dest + i * 4); \
+    } \
+    return 1;
+
+#define PACK_VECTOR_UINTS(c_type, max) \
+    for (i = 0; i < count; i++) { \
+        c_type item = ((const c_type*)src)[i]; \
+        if (item > max) \
+            return 0; \
+        _pack_uint32((unsigned int)item, dest + i * 4); \
+    } \
+    return 1;
+
+#define PACK_VECTOR_DOUBLES(c_type) \
+    for (i = 0; i < count; i++) { \
+        _pack_double((double)((const c_type*)src)[i], dest + i * 8); \
+    } \
+    return 1;
+
+/*
+ * Pack the items of an array.array into Vector items.
+ *
+ * Returns 1 on success, 0 if an item is out of range.
+ */
+static int pack_vector_items(char typecode, const char *src, int count, char *dest)
+{
+    int i;
+    switch (typecode) {
+        case 'b':
+            PACK_VECTOR_ALL(signed char)
+        case 'h':
+            PACK_VECTOR_ALL(short)
+        case 'i':
+#if INT_MAX > 2147483647
+            PACK_VECTOR_INTS(int, -2147483647 - 1, 2147483647)
+#else
+            PACK_VECTOR_ALL(int)
+#endif
+        case 'l':
+#if LONG_MAX > 2147483647L
+            PACK_VECTOR_INTS(long, -2147483647L - 1, 2147483647L)
+#else
+            PACK_VECTOR_ALL(long)
+#endif
+        case 'B':
+            PACK_VECTOR_ALL(unsigned char)
+        case 'H':
+            PACK_VECTOR_ALL(unsigned short)
+        case 'I':
+#if UINT_MAX > 0xFFFFFFFFU
+            PACK_VECTOR_UINTS(unsigned int, 0xFFFFFFFFU)
+#else
+            PACK_VECTOR_ALL(unsigned int)
+#endif
+        case 'L':
+#if ULONG_MAX > 0xFFFFFFFFUL
+            PACK_VECTOR_UINTS(unsigned long, 0xFFFFFFFFUL)
+#else
+            PACK_VECTOR_ALL(unsigned long)
+#endif
+        case 'f':
+            PACK_VECTOR_DOUBLES(float)
+        case 'd':
+            PACK_VECTOR_DOUBLES(double)
+        default:
+            break;
+    }
+
+    return 0;
+}
+
+/*
+ * Encode an array.array as a numeric Vector.
+ *
+ * Items are converted from the array's buffer in a single pass.
+ */
+static int encode_array_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type)
+{
+    char typecode = char_attr(value, "typecode");
+    int itemsize = int_attr(value, "itemsize");
+    if (itemsize < 1) {
+        PyErr_SetString(amfast_EncodeError, "Cannot determine array item size.");
         return 0;
     }
 
-    if (PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF")) {
-        // Let custom Python function handle the encoding
-        // of Externalizeable objects.
-        PyObject *result = PyObject_CallMethodObjArgs(class_def,
-            context->extern_name, value, (PyObject*)context, NULL);
-        Py_DECREF(class_def);
-        if (result == NULL)
-            return 0;
+    const void *buf;
+    Py_ssize_t buf_len;
+    if (PyObject_AsReadBuffer(value, &buf, &buf_len) == -1)
+        return 0;
+
+    Py_ssize_t count = buf_len / itemsize;
+    if (!encode_vector_header_AMF3(context, count, 0))
+        return 0;
 
-        Py_DECREF(result);
+    if (count == 0)
         return 1;
-    }
 
-    // Encode static attrs
-    PyObject *static_attrs = static_attr_vals_from_class_def(context, class_def, value);
-    if (!static_attrs) {
-        Py_DECREF(class_def);
+    int packed_size = vector_type == VECTOR_DOUBLE_TYPE ? 8 : 4;
+    char *packed = (char*)malloc((size_t)count * (size_t)packed_size);
+    if (packed == NULL) {
+        PyErr_SetNone(PyExc_MemoryError);
         return 0;
     }
 
-    Py_ssize_t static_attr_len = PySequence_Size(static_attrs);
-    if (static_attr_len == -1) {
-        Py_DECREF(class_def);
-        Py_DECREF(static_attrs);
+    if (!pack_vector_items(typecode, (const char*)buf, (int)count, packed)) {
+        free(packed);
+        PyErr_SetString(amfast_EncodeError, "Array item is out of range for Vector.");
         return 0;
     }
 
-    int i;
-    for (i = 0; i < static_attr_len; i++) {
-        PyObject *static_attr = PySequence_GetItem(static_attrs, i);
-        if (!static_attr) {
-            Py_DECREF(static_attrs);
-            Py_DECREF(class_def);
-            return 0;
-        }
+    int result = Encoder_write(context, packed, (int)count * packed_size);
+    free(packed);
+    return result;
+}
 
-        int result = encode_AMF3(context, static_attr);
-        Py_DECREF(static_attr);
-        if (!result) {
-            Py_DECREF(static_attrs);
-            Py_DECREF(class_def);
-            return 0;
-        }
+/*
+ * Encode a 1 dimensional numpy array as a numeric Vector.
+ *
+ * The array is converted to big-endian items by numpy.
+ */
+static int encode_numpy_vector_AMF3(EncoderObj *context, PyObject *value, int vector_type)
+{
+    const char *dtype;
+    int packed_size;
+    if (vector_type == VECTOR_INT_TYPE) {
+        dtype = ">i4";
+        packed_size = 4;
+    } else if (vector_type == VECTOR_UINT_TYPE) {
+        dtype = ">u4";
+        packed_size = 4;
+    } else {
+        dtype = ">f8";
+        packed_size = 8;
     }
-    Py_DECREF(static_attrs);
 
-    // Encode dynamic attrs
-    if (PyObject_HasAttrString(class_def, "DYNAMIC_CLASS_DEF")) {
-        PyObject *dynamic_attrs = dynamic_attrs_from_class_def(context, class_def, value);
-        if (!dynamic_attrs) {
-            Py_DECREF(class_def);
+    PyObject *converted = PyObject_CallMethod(value, "astype", "s", dtype);
+    if (converted == NULL)
+        return 0;
+
+    if (vector_type != VECTOR_DOUBLE_TYPE) {
+        PyObject *dtype_obj = PyObject_GetAttrString(value, "dtype");
+        if (dtype_obj == NULL) {
+            Py_DECREF(converted);
             return 0;
         }
 
-        int result = encode_dynamic_dict_AMF3(context, dynamic_attrs);
-        Py_DECREF(dynamic_attrs);
-        if (!result) {
-            Py_DECREF(class_def);
-            return 0;
+        int itemsize = int_attr(dtype_obj, "itemsize");
+        Py_DECREF(dtype_obj);
+
+        if (itemsize > 4) {
+            // astype() wraps items that are out of range.
+            PyObject *same = PyObject_RichCompare(converted, value, Py_EQ);
+            if (same == NULL) {
+                Py_DECREF(converted);
+                return 0;
+            }
+
+            PyObject *all_same = PyObject_CallMethod(same, "all", NULL);
+            Py_DECREF(same);
+            if (all_same == NULL) {
+                Py_DECREF(converted);
+                return 0;
+            }
+
+            int result = PyObject_IsTrue(all_same);
+            Py_DECREF(all_same);
+            if (result != 1) {
+                Py_DECREF(converted);
+                if (result == 0)
+                    PyErr_SetString(amfast_EncodeError, "Array item is out of range for Vector.");
+                return 0;
+            }
         }
     }
 
-    Py_DECREF(class_def);
-    return 1;
-}
+    PyObject *packed = PyObject_CallMethod(converted, "tostring", NULL);
+    Py_DECREF(converted);
+    if (packed == NULL)
+        return 0;
 
-/* Serialize a class definition. */
-static int serialize_class_def_AMF3(EncoderObj *context, PyObject *value)
-{
-    // Check for idx
-    int result = encode_reference_AMF3(context, (RefObj*)context->class_refs, value, 1);
-    if (result > -1)
-        return result;
+    if (!PyString_Check(packed)) {
+        Py_DECREF(packed);
+        PyErr_SetString(amfast_EncodeError, "numpy array did not convert to a string.");
+        return 0;
+    }
 
-    return encode_class_def_AMF3(context, value);
+    Py_ssize_t packed_len = PyString_GET_SIZE(packed);
+    int result = encode_vector_header_AMF3(context, packed_len / packed_size, 0);
+    if (result && packed_len > 0)
+        result = Encoder_write(context, PyString_AS_STRING(packed), (int)packed_len);
+    Py_DECREF(packed);
+    return result;
 }
 
-/* Encode a class definition. */
-static int encode_class_def_AMF3(EncoderObj *context, PyObject *value)
+/*
+ * Encode a Vector.<Object>.
+ *
+ * value is an AsVector, or a numpy array
+ * that can not be encoded as a numeric Vector.
+ */
+static int encode_object_vector_AMF3(EncoderObj *context, PyObject *value)
 {
-    if (value == Py_None) {
-        // Encode as anonymous object
-        if (!Encoder_writeByte(context, DYNAMIC))
+    PyObject *items;
+    PyObject *type_name;
+    int fixed = 0;
+
+    PyTypeObject *ndarray = numpy_array_type();
+    if (ndarray != NULL && PyObject_TypeCheck(value, ndarray)) {
+        if (int_attr(value, "ndim") == 1) {
+            // Convert numpy scalars to Python objects
+            items = PyObject_CallMethod(value, "tolist", NULL);
+            if (items == NULL)
+                return 0;
+        } else {
+            items = value;
+            Py_INCREF(items);
+        }
+
+        type_name = PyString_FromString("");
+        if (type_name == NULL) {
+            Py_DECREF(items);
+            return 0;
+        }
+    } else {
+        items = PyObject_GetAttrString(value, "source");
+        if (items == NULL)
             return 0;
 
-        // Anonymous object alias is an empty string
-        if (!Encoder_writeByte(context, EMPTY_STRING_TYPE))
+        type_name = PyObject_GetAttrString(value, "type_name");
+        if (type_name == NULL) {
+            Py_DECREF(items);
             return 0;
-        return 1;
+        }
+
+        PyObject *fixed_obj = PyObject_GetAttrString(value, "fixed");
+        if (fixed_obj == NULL) {
+            Py_DECREF(items);
+            Py_DECREF(type_name);
+            return 0;
+        }
+
+        fixed = PyObject_IsTrue(fixed_obj);
+        Py_DECREF(fixed_obj);
+        if (fixed == -1) {
+            Py_DECREF(items);
+            Py_DECREF(type_name);
+            return 0;
+        }
     }
 
-    // Encode class type
-    if (!PyObject_HasAttrString(value, "CLASS_DEF")) {
-        PyErr_SetString(amfast_EncodeError, "Invalid class definition object.");
+    Py_ssize_t count = PySequence_Size(items);
+    if (count < 0) {
+        Py_DECREF(items);
+        Py_DECREF(type_name);
         return 0;
     }
 
-    // Determine header type
-    int header;
-    if (PyObject_HasAttrString(value, "EXTERNALIZABLE_CLASS_DEF")) {
-        header = EXTERNALIZABLE;
-    } else if (PyObject_HasAttrString(value, "DYNAMIC_CLASS_DEF")) {
-        header = DYNAMIC;
-    } else {
-        header = STATIC;
+    int result = encode_vector_header_AMF3(context, count, fixed);
+    if (result) {
+        if (PyUnicode_Check(type_name)) {
+            result = serialize_unicode_AMF3(context, type_name);
+        } else if (PyString_Check(type_name)) {
+            result = serialize_string_AMF3(context, type_name);
+        } else {
+            PyErr_SetString(amfast_EncodeError, "Vector type_name must be a string.");
+            result = 0;
+        }
     }
+    Py_DECREF(type_name);
 
-    PyObject *class_alias = PyObject_GetAttrString(value, "alias");
-    if (!class_alias)
-       return 0;
+    int i;
+    for (i = 0; result && i < count; i++) {
+        // GetItem increments ref count
+        PyObject *item = PySequence_GetItem(items, i);
+        if (!item) {
+            result = 0;
+            break;
+        }
 
-    // Don't need to encode static attrs of externalizeable.
-    if (header == EXTERNALIZABLE) {
-       if (!_encode_int_AMF3(context, header)) {
-           Py_DECREF(class_alias);
-           return 0;
-       }
-       
-       int result = serialize_object_as_string_AMF3(context, class_alias);
-       Py_DECREF(class_alias);
-       return result;
+        result = encode_AMF3(context, item);
+        Py_DECREF(item);
     }
 
-    // Encode number of static attrs in header.
-    PyObject *static_attrs = PyObject_GetAttrString(value, "static_attrs");
-    if (!static_attrs) {
-       Py_DECREF(class_alias);
-       return 0;
-    }
+    Py_DECREF(items);
+    return result;
+}
 
-    Py_ssize_t static_attr_len = PySequence_Size(static_attrs);
-    if (static_attr_len == -1) {
-       Py_DECREF(class_alias);
-       Py_DECREF(static_attrs);
-       return 0;
-    }
+// ---- RECORD ARRAYS
 
-    if (static_attr_len > (MAX_INT >> 4)) {
-       Py_DECREF(class_alias);
-       Py_DECREF(static_attrs);
-       PyErr_SetString(amfast_EncodeError, "ClassDef has too many attributes.");
-       return 0;
-    }
-    header |= ((int)static_attr_len) << 4;
+/* A field of a numpy structured array. */
+typedef struct {
+    PyObject *name; // Field name
+    char kind; // numpy dtype kind, 0 if values are read from items
+    int size; // Size of field in bytes
+    int offset; // Offset of field from the start of a record
+    int swap; // 1 if field bytes are not in native order
+    PyObject *items; // Field values as a list, if they can not be read from the buffer
+} RecordField;
 
-    if (!_encode_int_AMF3(context, header)) {
-       Py_DECREF(class_alias);
-       Py_DECREF(static_attrs);
-       return 0;
-    }
+/* Returns 1 if a PyObject is a 1 dimensional numpy structured array. */
+static int is_structured_array(PyObject *value)
+{
+    PyTypeObject *ndarray = numpy_array_type();
+    if (ndarray == NULL || !PyObject_TypeCheck(value, ndarray))
+        return 0;
 
-    int result = serialize_object_as_string_AMF3(context, class_alias);
-    Py_DECREF(class_alias);
-    if (!result) {
-       Py_DECREF(static_attrs);
-       return 0;
-    }
+    if (int_attr(value, "ndim") != 1)
+        return 0;
 
-    // Encode static attr names
-    int i;
-    for (i = 0; i < static_attr_len; i++) {
-        PyObject *attr_name = PySequence_GetItem(static_attrs, i);
-        if (!attr_name) {
-            Py_DECREF(static_attrs);
-            return 0;
+    int result = 0;
+    PyObject *dtype = PyObject_GetAttrString(value, "dtype");
+    if (dtype != NULL) {
+        PyObject *names = PyObject_GetAttrString(dtype, "names");
+        if (names != NULL) {
+            result = PyTuple_Check(names);
+            Py_DECREF(names);
         }
-        
-        int result = serialize_object_as_string_AMF3(context, attr_name);
-        Py_DECREF(attr_name);
-        if (!result)
-            return 0;
+        Py_DECREF(dtype);
     }
+    PyErr_Clear();
+    return result;
+}
 
-    Py_DECREF(static_attrs);
-    return 1;
+/*
+ * Returns 1 if a PyObject is encoded as an array of records.
+ *
+ * 1 dimensional numpy structured arrays are record arrays,
+ * AsRecordArray wraps a structured array to give its records an alias.
+ */
+static int check_record_array(PyObject *value)
+{
+    if (PyObject_HasAttrString(value, "AS_RECORD_ARRAY"))
+        return 1;
+
+    return is_structured_array(value);
 }
 
-/* Encode a Python boolean in AMF0. */
-static int encode_bool_AMF0(EncoderObj *context, PyObject *value)
+/* Writes an array of records. */
+static int write_record_array_AMF3(EncoderObj *context, PyObject *value)
 {
     int result;
-    if (value == Py_True) {
-        result = Encoder_writeByte(context, TRUE_AMF0);
-    } else {
-        result = Encoder_writeByte(context, FALSE_AMF0);
+
+    if (context->use_collections == Py_True) {
+        if (!Encoder_writeByte(context, OBJECT_TYPE))
+            return 0;
+
+        // Check for idx
+        result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+        if (result > -1)
+            return result;
+
+        if (!encode_array_collection_header_AMF3(context))
+            return 0;
+
+        if (!Encoder_writeByte(context, ARRAY_TYPE))
+            return 0;
+
+        return encode_record_array_AMF3(context, value);
     }
 
-    return result;
+    if (!Encoder_writeByte(context, ARRAY_TYPE))
+        return 0;
+
+    // Check for idx
+    result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+    if (result > -1)
+        return result;
+
+    return encode_record_array_AMF3(context, value);
 }
 
-/* Encode a PyInt in AMF0. */
-static int encode_int_AMF0(EncoderObj *context, PyObject *value)
+/*
+ * Describe a field of a structured array.
+ *
+ * Fields that can not be read directly from the buffer
+ * are converted to a list of Python values.
+ */
+static int record_field(PyObject *source, PyObject *fields, PyObject *name, RecordField *field)
 {
-    long long_val = PyInt_AsLong(value);
-    PyObject *py_long_val = PyLong_FromLong(long_val);
-    if (!py_long_val)
+    field->name = name;
+
+    PyObject *info = PyObject_GetItem(fields, name);
+    if (info == NULL)
         return 0;
 
-    int result = encode_long_AMF0(context, py_long_val);
-    Py_DECREF(py_long_val);
-    return result;
-}
+    if (!PyTuple_Check(info) || PyTuple_GET_SIZE(info) < 2) {
+        Py_DECREF(info);
+        PyErr_SetString(amfast_EncodeError, "Cannot determine record field type.");
+        return 0;
+    }
 
-/* Encode a PyLong in AMF0. */
-static int encode_long_AMF0(EncoderObj *context, PyObject *value)
-{
-    return _encode_double(context, PyLong_AsDouble(value));
-}
+    PyObject *dtype = PyTuple_GET_ITEM(info, 0);
+    field->offset = (int)PyInt_AsLong(PyTuple_GET_ITEM(info, 1));
+    if (field->offset == -1 && PyErr_Occurred()) {
+        Py_DECREF(info);
+        return 0;
+    }
 
-/* Encode a PyFloat in AMF0. */
-static int encode_float_AMF0(EncoderObj *context, PyObject *value)
-{
-    return _encode_double(context, PyFloat_AsDouble(value));
-}
+    field->kind = char_attr(dtype, "kind");
+    field->size = int_attr(dtype, "itemsize");
 
-/* Encode a native C unsigned short. */
-static int encode_ushort(EncoderObj *context, unsigned short value)
-{
-   // Put bytes from short into byte array
-   union aligned { // use the same memory for d_value and c_value
-       unsigned short d_value;
-       char c_value[2];
-   } d;
-   char *char_value = d.c_value;
-   d.d_value = value;
+    char byteorder = char_attr(dtype, "byteorder");
+    field->swap = (byteorder == '>' && !big_endian) || (byteorder == '<' && big_endian);
 
-   // AMF numbers are encoded in big endianness
-   if (big_endian) {
-       return Encoder_write(context, char_value, 2);
-   } else {
-       // Flip endianness
-       char flipped[2] = {char_value[1], char_value[0]};
-       return Encoder_write(context, flipped, 2);
-   }
-}
+    // Nested and sub-array fields are not read from the buffer.
+    PyObject *shape = PyObject_GetAttrString(dtype, "shape");
+    Py_DECREF(info);
+    if (shape == NULL)
+        return 0;
+    int has_shape = !PyTuple_Check(shape) || PyTuple_GET_SIZE(shape) > 0;
+    Py_DECREF(shape);
+
+    int direct = 0;
+    if (!has_shape) {
+        switch (field->kind) {
+            case 'b':
+                direct = field->size == 1;
+                break;
+            case 'i':
+            case 'u':
+                direct = field->size == 1 || field->size == 2 ||
+                    field->size == 4 || field->size == 8;
+                break;
+            case 'f':
+                direct = field->size == 4 || field->size == 8;
+                break;
+            case 'S':
+            case 'U':
+                direct = field->size >= 0;
+                break;
+            default:
+                break;
+        }
+    }
 
-/* Encode a native C unsigned int. */
-static int encode_ulong(EncoderObj *context, unsigned int value)
-{
-   // Put bytes from long into byte array
-   union aligned { // use the same memory for d_value and c_value
-       unsigned int d_value;
-       char c_value[4];
-   } d;
-   char *char_value = d.c_value;
-   d.d_value = value;
+    if (direct)
+        return 1;
 
-   // AMF numbers are encoded in big endianness
-   if (big_endian) {
-       return Encoder_write(context, char_value, 4);
-   } else {
-       // Flip endianness
-       char flipped[4] = {char_value[3], char_value[2], char_value[1], char_value[0]};
-       return Encoder_write(context, flipped, 4);
-   }
-}
+    field->kind = 0;
+    PyObject *column = PyObject_GetItem(source, name);
+    if (column == NULL)
+        return 0;
 
-/* Write a PyString. */
-static int write_string_AMF0(EncoderObj *context, PyObject *value)
-{
-    PyObject *unicode_value = PyUnicode_FromObject(value);
-    if (!unicode_value)
+    field->items = PyObject_CallMethod(column, "tolist", NULL);
+    Py_DECREF(column);
+    if (field->items == NULL)
         return 0;
 
-    int result = write_unicode_AMF0(context, unicode_value);
-    Py_DECREF(unicode_value);
-    return result;
+    if (!PyList_Check(field->items)) {
+        PyErr_SetString(amfast_EncodeError, "Record field did not convert to a list.");
+        return 0;
+    }
+
+    return 1;
 }
 
-/* Write a PyUnicode in AMF0. */
-static int write_unicode_AMF0(EncoderObj *context, PyObject *value)
+/* Copy the bytes of a field to native order. */
+static void _read_field(const char *src, int size, int swap, char *dest)
 {
-    Py_ssize_t string_len = PyUnicode_GET_SIZE(value);
+    if (swap) {
+        int i;
+        for (i = 0; i < size; i++) {
+            dest[i] = src[size - 1 - i];
+        }
+    } else {
+        memcpy(dest, src, size);
+    }
+}
 
-    if (string_len > 65536) {
-        if (!Encoder_writeByte(context, LONG_STRING_AMF0))
+/* Write a native C integer in the smallest AMF3 number type that holds it. */
+static int _write_int_AMF3(EncoderObj *context, PY_LONG_LONG value)
+{
+    if (value < MAX_INT && value > MIN_INT) {
+        if (!Encoder_writeByte(context, INT_TYPE))
             return 0;
-        return encode_unicode_AMF0(context, value, 1);
+        return _encode_int_AMF3(context, (int)value);
     }
 
-    if (!Encoder_writeByte(context, STRING_AMF0))
+    if (!Encoder_writeByte(context, DOUBLE_TYPE))
         return 0;
-
-    return encode_unicode_AMF0(context, value, 0);
+    return _encode_double(context, (double)value);
 }
 
 /*
- * Encode a PyUnicode in AMF0.
+ * Write a string read from a record.
  *
- * allow_long
- * 1 = allow long values
- * 0 = don't allow long values
- * -1 = force long value
+ * Strings are not looked up in the reference table,
+ * but they still take up an index.
  */
-static int encode_unicode_AMF0(EncoderObj *context, PyObject *value, int allow_long)
+static int write_record_string_AMF3(EncoderObj *context, RecordField *field, const char *src)
 {
-    PyObject *PyString_value = PyUnicode_AsUTF8String(value);
-    if (!PyString_value)
+    if (!Encoder_writeByte(context, STRING_TYPE))
         return 0;
 
-    int result = encode_string_AMF0(context, PyString_value, allow_long);
-    Py_DECREF(PyString_value);
-    return result;
-}
+    int result;
+    if (field->kind == 'S') {
+        int len = 0;
+        while (len < field->size && src[len] != '\0')
+            len++;
 
-/*
- * Encode a PyString in AMF0.
- *
- * allow_long
- * 1 = allow long values
- * 0 = don't allow long values
- * -1 = force long value
- */
-static int encode_string_AMF0(EncoderObj *context, PyObject *value, int allow_long)
-{
-    char *char_value = PyString_AS_STRING(value);
-    Py_ssize_t string_len = PyString_GET_SIZE(value);
-    if (!char_value)
-        return 0;
+        if (len == 0)
+            return Encoder_writeByte(context, EMPTY_STRING_TYPE);
 
-    if (string_len > MAX_USHORT && allow_long == 0) {
-        PyErr_SetString(amfast_EncodeError, "Long string not allowed.");
-        return 0;
-    } else if (string_len > MAX_USHORT || allow_long == -1) {
-        if (!encode_ulong(context, (unsigned int)string_len))
+        if (!_encode_int_AMF3(context, len << 1 | REFERENCE_BIT))
             return 0;
+        result = Encoder_write(context, (char*)src, len);
     } else {
-        if (!encode_ushort(context, (unsigned short)string_len))
+        // UCS4 characters, trailing nulls are padding.
+        int len = field->size / 4;
+        while (len > 0 && memcmp(src + (len - 1) * 4, "\0\0\0\0", 4) == 0)
+            len--;
+
+        if (len == 0)
+            return Encoder_writeByte(context, EMPTY_STRING_TYPE);
+
+        int byteorder = (big_endian ^ field->swap) ? 1 : -1;
+        PyObject *unicode_value = PyUnicode_DecodeUTF32(src, len * 4, NULL, &byteorder);
+        if (unicode_value == NULL)
             return 0;
+
+        result = encode_unicode_AMF3(context, unicode_value);
+        Py_DECREF(unicode_value);
     }
 
-    return Encoder_write(context, char_value, (int)string_len);
+    if (result)
+        ((RefObj*)context->string_refs)->idx++;
+    return result;
 }
 
-/* Write a PyList to AMF0. */
-static int write_list_AMF0(EncoderObj *context, PyObject *value, int write_reference)
+/* Write a field of a record. */
+static int write_record_field_AMF3(EncoderObj *context, RecordField *field,
+    const char *record, Py_ssize_t row)
 {
-    if (write_reference) {
-        int result = write_reference_AMF0(context, value);
-        if (result == 0 || result == 1) {
-            return result;
-        }
+    if (field->kind == 0)
+        return encode_AMF3(context, PyList_GET_ITEM(field->items, row));
+
+    const char *src = record + field->offset;
+    if (field->kind == 'S' || field->kind == 'U')
+        return write_record_string_AMF3(context, field, src);
+
+    union {
+        signed char i8;
+        short i16;
+        int i32;
+        PY_LONG_LONG i64;
+        unsigned char u8;
+        unsigned short u16;
+        unsigned int u32;
+        unsigned PY_LONG_LONG u64;
+        float f32;
+        double f64;
+        char bytes[8];
+    } item;
+    _read_field(src, field->size, field->swap, item.bytes);
+
+    switch (field->kind) {
+        case 'b':
+            return Encoder_writeByte(context, item.u8 ? TRUE_TYPE : FALSE_TYPE);
+        case 'i':
+            if (field->size == 1)
+                return _write_int_AMF3(context, item.i8);
+            if (field->size == 2)
+                return _write_int_AMF3(context, item.i16);
+            if (field->size == 4)
+                return _write_int_AMF3(context, item.i32);
+            return _write_int_AMF3(context, item.i64);
+        case 'u':
+            if (field->size == 1)
+                return _write_int_AMF3(context, item.u8);
+            if (field->size == 2)
+                return _write_int_AMF3(context, item.u16);
+            if (field->size == 4)
+                return _write_int_AMF3(context, item.u32);
+            if (item.u64 < MAX_INT)
+                return _write_int_AMF3(context, (PY_LONG_LONG)item.u64);
+            if (!Encoder_writeByte(context, DOUBLE_TYPE))
+                return 0;
+            return _encode_double(context, (double)item.u64);
+        default:
+            break;
     }
 
-    // No reference
-    if (!Encoder_writeByte(context, ARRAY_AMF0))
+    if (!Encoder_writeByte(context, DOUBLE_TYPE))
         return 0;
+    if (field->size == 4)
+        return _encode_double(context, (double)item.f32);
+    return _encode_double(context, item.f64);
+}
 
-    Py_ssize_t array_len = PySequence_Size(value);
-    if (array_len < 0)
+/* Write the trait shared by all records of an array. */
+static int encode_record_trait_AMF3(EncoderObj *context, PyObject *alias,
+    RecordField *fields, Py_ssize_t field_len)
+{
+    if (field_len >= 0x8000000) {
+        PyErr_SetString(amfast_EncodeError, "Record has too many fields.");
         return 0;
+    }
 
-    if (!encode_ulong(context, (unsigned int)array_len))
+    if (!_encode_int_AMF3(context, ((int)field_len) << 4 | STATIC))
         return 0;
 
-    int i;
-    for (i = 0; i < array_len; i++) {
-        // Increment ref count in case 
-        // list is modified by someone else.
-        PyObject *list_item = PySequence_GetItem(value, (Py_ssize_t)i);
-        if (!list_item)
-            return 0;
+    if (!serialize_object_as_string_AMF3(context, alias))
+        return 0;
 
-        int result = encode_AMF0(context, list_item);
-        Py_DECREF(list_item);
-        if (!result)
+    Py_ssize_t i;
+    for (i = 0; i < field_len; i++) {
+        if (!serialize_object_as_string_AMF3(context, fields[i].name))
             return 0;
     }
 
     return 1;
 }
 
-/* Write a PyDict to AMF0. */
-static int write_dict_AMF0(EncoderObj *context, PyObject *value)
-{
-    int result = write_reference_AMF0(context, value);
-    if (result == 0 || result == 1) {
-        return result;
-    }
-
-    // No reference
-    if (!Encoder_writeByte(context, OBJECT_AMF0))
-        return 0;
-
-    return encode_dynamic_dict_AMF0(context, value);
-}
-
-/* Write the contents of a Dict to AMF0. */
-static int encode_dynamic_dict_AMF0(EncoderObj *context, PyObject *value)
+/*
+ * Encode a numpy structured array as an array of typed objects.
+ *
+ * Every record shares the same trait.
+ * Numbers, booleans and strings are read column by column
+ * from the array's buffer, without creating a Python object per record.
+ */
+static int encode_record_array_AMF3(EncoderObj *context, PyObject *value)
 {
-    PyObject *key;
-    PyObject *val;
-    Py_ssize_t idx = 0;
+    PyObject *source;
+    PyObject *alias;
+    if (PyObject_HasAttrString(value, "AS_RECORD_ARRAY")) {
+        source = PyObject_GetAttrString(value, "source");
+        if (source == NULL)
+            return 0;
 
-    while (PyDict_Next(value, &idx, &key, &val)) {
-        if (!encode_object_as_string_AMF0(context, key, 0))
+        alias = PyObject_GetAttrString(value, "alias");
+        if (alias == NULL) {
+            Py_DECREF(source);
             return 0;
+        }
+    } else {
+        source = value;
+        Py_INCREF(source);
 
-        if (!encode_AMF0(context, val)) {
+        alias = PyString_FromString("");
+        if (alias == NULL) {
+            Py_DECREF(source);
             return 0;
         }
     }
 
-    // Terminate key/value pairs.
-    char terminator[3] = {0x00, 0x00, 0x09};
-    if (Encoder_write(context, terminator, 3) == 0)
+    if (!is_structured_array(source)) {
+        Py_DECREF(source);
+        Py_DECREF(alias);
+        PyErr_SetString(amfast_EncodeError,
+            "Record array source must be a 1 dimensional numpy structured array.");
         return 0;
+    }
 
-    return 1;
-}
+    // Records are read from a contiguous copy, if the source is not contiguous.
+    PyObject *numpy_mod = PyDict_GetItem(PyImport_GetModuleDict(), numpy_name);
+    PyObject *contiguous = NULL;
+    if (numpy_mod != NULL)
+        contiguous = PyObject_CallMethod(numpy_mod, "ascontiguousarray", "O", source);
+    Py_DECREF(source);
+    if (contiguous == NULL) {
+        Py_DECREF(alias);
+        if (!PyErr_Occurred())
+            PyErr_SetString(amfast_EncodeError, "numpy is not loaded.");
+        return 0;
+    }
 
-/* Encode a Date object to AMF0 .*/
-static int write_date_AMF0(EncoderObj *context, PyObject *value)
-{
-    // Dates can use references
-    /*int wrote_ref = write_reference_AMF0(context, value);
-    if (wrote_ref == 0 || wrote_ref == 1) {
-        return wrote_ref;
-    }*/
+    RecordField *fields = NULL;
+    Py_ssize_t field_len = 0;
+    Py_ssize_t i;
+    PyObject *trait_key = NULL;
+    int result = 0;
+
+    PyObject *dtype = PyObject_GetAttrString(contiguous, "dtype");
+    if (dtype == NULL)
+        goto done;
+
+    PyObject *names = PyObject_GetAttrString(dtype, "names");
+    PyObject *dtype_fields = PyObject_GetAttrString(dtype, "fields");
+    int record_size = int_attr(dtype, "itemsize");
+    Py_DECREF(dtype);
+    if (names == NULL || dtype_fields == NULL || !PyTuple_Check(names)) {
+        Py_XDECREF(names);
+        Py_XDECREF(dtype_fields);
+        if (!PyErr_Occurred())
+            PyErr_SetString(amfast_EncodeError, "Record array source must be a numpy structured array.");
+        goto done;
+    }
 
-    if (!Encoder_writeByte(context, DATE_AMF0))
-        return 0;
- 
-    // Call python function to get datetime
-    PyObject *epoch_func = PyObject_GetAttrString(amfast_mod, "epoch_from_date");
-    if (!epoch_func)
-        return 0;
+    // A new key for each array, so that records
+    // share a trait reference only within the array.
+    trait_key = PyTuple_Pack(2, alias, names);
+    if (trait_key == NULL) {
+        Py_DECREF(names);
+        Py_DECREF(dtype_fields);
+        goto done;
+    }
 
-    PyObject *epoch_time = PyObject_CallFunctionObjArgs(epoch_func, value, NULL);
-    Py_DECREF(epoch_func);
-    if (!epoch_time)
-        return 0;
+    field_len = PyTuple_GET_SIZE(names);
+    fields = (RecordField*)calloc(field_len > 0 ? field_len : 1, sizeof(RecordField));
+    if (fields == NULL) {
+        Py_DECREF(names);
+        Py_DECREF(dtype_fields);
+        PyErr_SetNone(PyExc_MemoryError);
+        goto done;
+    }
 
-    double micro_time = PyLong_AsDouble(epoch_time);
-    Py_DECREF(epoch_time);
+    for (i = 0; i < field_len; i++) {
+        if (!record_field(contiguous, dtype_fields, PyTuple_GET_ITEM(names, i), &fields[i]))
+            break;
+    }
+    // Field names are borrowed from trait_key.
+    Py_DECREF(names);
+    Py_DECREF(dtype_fields);
+    if (i < field_len)
+        goto done;
+
+    const void *buf;
+    Py_ssize_t buf_len;
+    if (PyObject_AsReadBuffer(contiguous, &buf, &buf_len) == -1)
+        goto done;
+
+    Py_ssize_t count = PySequence_Size(contiguous);
+    if (count < 0)
+        goto done;
+
+    if (count > 0 && (record_size < 1 || buf_len < count * record_size)) {
+        PyErr_SetString(amfast_EncodeError, "Cannot determine record size.");
+        goto done;
+    }
 
-    if (!_encode_double(context, micro_time))
-        return 0;
-    
-    // UTC time zone
-    return encode_ushort(context, 0);
-}
+    if (count >= 0x10000000) {
+        PyErr_SetString(amfast_EncodeError, "Record array has too many items.");
+        goto done;
+    }
 
-/* Write an XML object in AMF0. */
-static int write_xml_AMF0(EncoderObj *context, PyObject *value)
-{
-    if (!Encoder_writeByte(context, XML_DOC_AMF0))
-        return 0;
+    if (!_encode_int_AMF3(context, ((int)count) << 1 | REFERENCE_BIT))
+        goto done;
 
-    PyObject *unicode_value = PyObject_CallMethod(value, "toxml", NULL);
-    if (!unicode_value)
-        return 0;
+    // We're never writing associative array items
+    if (!Encoder_writeByte(context, NULL_TYPE))
+        goto done;
 
-    int result = encode_unicode_AMF0(context, unicode_value, -1);
-    Py_DECREF(unicode_value);
-    return result;
-}
+    Py_ssize_t row;
+    for (row = 0; row < count; row++) {
+        if (!Encoder_writeByte(context, OBJECT_TYPE))
+            goto done;
 
-/* Get an object's class def. */
-static PyObject* class_def_from_class(EncoderObj *context, PyObject *value)
-{
-    // Use object's class to get ClassDef
-    PyObject *class_ = PyObject_GetAttrString(value, "__class__");
-    if (!class_)
-        return NULL;
+        // Records are never referenced, but they still take up an index.
+        ((RefObj*)context->obj_refs)->idx++;
 
-    PyObject *class_def = PyObject_CallMethodObjArgs(context->class_mapper, context->class_def_name,
-        class_, NULL);
-    Py_DECREF(class_);
-    return class_def;
-}
+        int trait_result = encode_reference_AMF3(context,
+            (RefObj*)context->class_refs, trait_key, 1);
+        if (trait_result == 0)
+            goto done;
 
-/* Write an anonymous object in AMF0. */
-static int write_anonymous_object_AMF0(EncoderObj *context, PyObject *value)
-{
-    if (!Encoder_writeByte(context, OBJECT_AMF0))
-        return 0;
+        if (trait_result == -1) {
+            if (!encode_record_trait_AMF3(context, alias, fields, field_len))
+                goto done;
+        }
 
-    PyObject *dict = attributes_from_object(context, value);
-    if (!dict)
-        return 0;
+        const char *record = (const char*)buf + row * record_size;
+        for (i = 0; i < field_len; i++) {
+            if (!write_record_field_AMF3(context, &fields[i], record, row))
+                goto done;
+        }
+    }
 
-    int result = encode_dynamic_dict_AMF0(context, dict);
-    Py_DECREF(dict);
+    result = 1;
+
+done:
+    if (fields != NULL) {
+        for (i = 0; i < field_len; i++) {
+            Py_XDECREF(fields[i].items);
+        }
+        free(fields);
+    }
+    Py_XDECREF(trait_key);
+    Py_DECREF(alias);
+    Py_DECREF(contiguous);
     return result;
 }
 
-/* Get attributes from an anonymous object as a dict. */
-static PyObject* attributes_from_object(EncoderObj *context, PyObject *value)
+/* Writes an xml.dom.Document object. */
+static int write_xml_AMF3(EncoderObj *context, PyObject *value)
 {
-    PyObject *attr_func = PyObject_GetAttrString(class_def_mod, "get_dynamic_attr_vals");
-    if (!attr_func)
-        return NULL;
+    int byte_marker;
 
-    PyObject *dict = PyObject_CallFunctionObjArgs(attr_func, value, Py_None, context->include_private, NULL);
-    Py_DECREF(attr_func);
-    if (!dict)
-        return NULL;
+    if (context->use_legacy_xml == Py_True) {
+        byte_marker = XML_DOC_TYPE;
+    } else {
+        byte_marker = XML_TYPE;
+    }
 
-    return dict;
+    if (!Encoder_writeByte(context, byte_marker))
+        return 0;
+
+    return serialize_xml_AMF3(context, value);
 }
 
-/* Encode a ClassDef in AMF0. */
-static int encode_class_def_AMF0(EncoderObj *context, PyObject *value)
+/* Serializes an xml.dom.Document object. */
+static int serialize_xml_AMF3(EncoderObj *context, PyObject *value)
 {
-    PyObject *alias = PyObject_GetAttrString(value, "alias");
-    if (!alias)
+    // Check for idx
+    int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+    if (result > -1)
+        return result;
+
+    PyObject *unicode_value = PyObject_CallMethod(value, "toxml", NULL);
+    if (unicode_value == NULL)
         return 0;
 
-    int result = encode_object_as_string_AMF0(context, alias, 0);
-    Py_DECREF(alias);
+    result = encode_unicode_AMF3(context, unicode_value);
+    Py_DECREF(unicode_value);
     return result;
 }
 
-/* Get static attrs. */
-static PyObject* static_attr_vals_from_class_def(EncoderObj *context, PyObject *class_def, PyObject *value)
+/* Returns 1 if a PyObject is a xml.dom.Document object. */
+static int check_xml(PyObject *value)
 {
-    PyObject *method_name = PyString_FromString("getStaticAttrVals");
-    if (!method_name)
-        return NULL;
-
-    PyObject *static_attrs = PyObject_CallMethodObjArgs(class_def, method_name, value, NULL);
-    Py_DECREF(method_name);
-    if (!static_attrs)
-        return NULL;
-
-    if (!PySequence_Check(static_attrs)) {
-        PyErr_SetString(amfast_EncodeError, "ClassDef.getStaticAttrVals must return a sequence.");
-        Py_DECREF(static_attrs);
-        return NULL;
-    }
+    if (!PyObject_HasAttrString(value, "toxml"))
+        return 0;
+    if (!PyObject_HasAttrString(value, "toprettyxml"))
+        return 0;
 
-    PyObject *static_names = PyObject_GetAttrString(class_def, "static_attrs");
-    int result = type_list(class_def, context->type_map, static_names, static_attrs, 0);
-    Py_DECREF(static_names);
-    if (result == 0) {
-        Py_DECREF(static_attrs);
-        return NULL;
-    }
+    return 1;
+}
 
-    return static_attrs;
+/* Returns 1 if a PyObject is a amfast.class_def.as_types.AsByteArray object. */
+static int check_byte_array(PyObject *value)
+{
+    return PyObject_HasAttrString(value, "AS_BYTE_ARRAY");
 }
 
-/* Get dynamic attrs. */
-static PyObject* dynamic_attrs_from_class_def(EncoderObj *context, PyObject *class_def, PyObject *value)
+/* Returns 1 if a PyObject is an AsProxy. */
+static int check_proxy(PyObject *value)
 {
-    PyObject *get_func = PyObject_GetAttrString(class_def, "getDynamicAttrVals");
-    if (!get_func)
-        return NULL;
+    return PyObject_HasAttrString(value, "AS_PROXY");
+}
 
-    PyObject *dynamic_attrs = PyObject_CallFunctionObjArgs(get_func, value, context->include_private, NULL);
-    Py_DECREF(get_func);
-    if (!dynamic_attrs)
-        return NULL;
+/* Returns 1 if a PyObject is an AsNoProxy. */
+static int check_no_proxy(PyObject *value)
+{
+    return PyObject_HasAttrString(value, "AS_NO_PROXY");
+}
 
-    if (!PyDict_Check(dynamic_attrs)) {
-        PyErr_SetString(amfast_EncodeError, "ClassDef.getDynamicAttrVals must return a dict.");
-        Py_DECREF(dynamic_attrs);
-        return NULL;
-    }
+/* Returns 1 if a PyObject is an AsEncoded. */
+static int check_encoded(PyObject *value)
+{
+    return PyObject_HasAttrString(value, "AS_ENCODED");
+}
 
-    if (type_dict(class_def, context->type_map, dynamic_attrs, 0) == 0) {
-        Py_DECREF(dynamic_attrs);
-        return NULL;
-    }
+/* Serialize a Python object. */
+static int serialize_object_AMF3(EncoderObj *context, PyObject *value)
+{
+    // Check for idx
+    int result = encode_reference_AMF3(context, (RefObj*)context->obj_refs, value, 0);
+    if (result > -1)
+        return result;
 
-    return dynamic_attrs;
+    return encode_object_AMF3(context, value);
 }
 
-/* Write a Python object in AMF0. */
-static int write_object_AMF0(EncoderObj *context, PyObject *value)
+/* Encode a Python object. */
+static int encode_object_AMF3(EncoderObj *context, PyObject *value)
 {
-    int wrote_ref = write_reference_AMF0(context, value);
-    if (wrote_ref == 0 || wrote_ref == 1) {
-        return wrote_ref;
-    }
-
-    PyObject *class_def = class_def_from_class(context, value);
-    if (!class_def)
+    PyObject *class_def;
+    int result = plan_from_class(context, value, &class_def);
+    if (result == 0)
         return 0;
 
-    if (class_def == Py_None) {
+    if (result == 1 && class_def != Py_None) {
+        // Class has a compiled ClassDef
+        result = encode_planned_object_AMF3(context, (EncodePlanObj*)class_def, value);
         Py_DECREF(class_def);
-        return write_anonymous_object_AMF0(context, value);
+        return result;
     }
 
-    // Check for AMF3 object
-    PyObject *amf3 = PyObject_GetAttrString(class_def, "amf3");
-    if (amf3 == Py_True) {
-        // Encode this object in AMF3
-        Py_DECREF(amf3);
-        Py_DECREF(class_def);
-        if (Encoder_writeByte(context, AMF3_AMF0) == 0)
+    if (result == -1) {
+        // ClassDefMapper does not store plans
+        class_def = class_def_from_class(context, value);
+        if (!class_def)
             return 0;
+    }
 
-        // Create new context for AMF3 encode
-        EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
-        if (new_context == NULL)
+    if (class_def == Py_None) {
+        // No ClassDef was found, encode as an anonymous object
+        Py_DECREF(class_def);
+
+        PyObject *dict = attributes_from_object(context, value);
+        if (!dict)
             return 0;
 
-        int result = encode_AMF3(new_context, value);
-        Py_DECREF(new_context);
+        result = encode_dict_AMF3(context, dict);
+        Py_DECREF(dict);
         return result;
-    } else {
-        Py_DECREF(amf3);
-    }
-
-    // Write marker byte
-    if (!Encoder_writeByte(context, TYPED_OBJ_AMF0)) {
-        Py_DECREF(class_def);
-        return 0;
     }
 
     // Class has a ClassDef
     // encode class definition
-    if (!encode_class_def_AMF0(context, class_def)) {
+    if (!serialize_class_def_AMF3(context, class_def)) {
         Py_DECREF(class_def);
         return 0;
     }
 
-    // Get all attributes to encode
-    PyObject *attrs = PyDict_New();
-    if (!attrs) {
+    if (PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF")) {
+        result = encode_external_AMF3(context, class_def, value);
         Py_DECREF(class_def);
-        return 0;
+        return result;
     }
 
-    // Get static attrs
-    PyObject *static_attrs = static_attr_vals_from_class_def(context, class_def, value);
-    if (!static_attrs) {
-        Py_DECREF(class_def);
-        Py_DECREF(attrs);
+    result = encode_static_attrs_AMF3(context, class_def, value);
+    if (result && PyObject_HasAttrString(class_def, "DYNAMIC_CLASS_DEF"))
+        result = encode_dynamic_attrs_AMF3(context, class_def, value);
+
+    Py_DECREF(class_def);
+    return result;
+}
+
+/* Encode an Externalizable object. */
+static int encode_external_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value)
+{
+    // Let custom Python function handle the encoding
+    // of Externalizeable objects.
+    PyObject *result = PyObject_CallMethodObjArgs(class_def,
+        context->extern_name, value, (PyObject*)context, NULL);
+    if (result == NULL)
         return 0;
-    }
 
-    // Get static attr names
-    PyObject *static_attr_names = PyObject_GetAttrString(class_def, "static_attrs");
-    if (!static_attr_names) {
-        Py_DECREF(class_def);
-        Py_DECREF(attrs);
-        Py_DECREF(static_attrs);
+    Py_DECREF(result);
+    return 1;
+}
+
+/* Encode the static attributes of an object. */
+static int encode_static_attrs_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value)
+{
+    PyObject *static_attrs = static_attr_vals_from_class_def(context, class_def, value);
+    if (!static_attrs)
         return 0;
-    }
 
     Py_ssize_t static_attr_len = PySequence_Size(static_attrs);
     if (static_attr_len == -1) {
-        Py_DECREF(class_def);
-        Py_DECREF(attrs);
         Py_DECREF(static_attrs);
         return 0;
     }
 
     int i;
     for (i = 0; i < static_attr_len; i++) {
-        PyObject *static_attr_name = PySequence_GetItem(static_attr_names, i);
-        if (!static_attr_name) {
-            Py_DECREF(class_def);
-            Py_DECREF(attrs);
-            Py_DECREF(static_attrs);
-            return 0;
-        }
-
         PyObject *static_attr = PySequence_GetItem(static_attrs, i);
         if (!static_attr) {
-            Py_DECREF(class_def);
-            Py_DECREF(attrs);
             Py_DECREF(static_attrs);
-            Py_DECREF(static_attr_name);
             return 0;
         }
 
-        int result = PyDict_SetItem(attrs, static_attr_name, static_attr);
-        Py_DECREF(static_attr_name);
+        int result = encode_AMF3(context, static_attr);
         Py_DECREF(static_attr);
-        if (result == -1) {
-            Py_DECREF(class_def);
-            Py_DECREF(attrs);
+        if (!result) {
+            Py_DECREF(static_attrs);
+            return 0;
+        }
+    }
+    Py_DECREF(static_attrs);
+
+    return 1;
+}
+
+/* Encode the dynamic attributes of an object. */
+static int encode_dynamic_attrs_AMF3(EncoderObj *context, PyObject *class_def, PyObject *value)
+{
+    PyObject *dynamic_attrs = dynamic_attrs_from_class_def(context, class_def, value);
+    if (!dynamic_attrs)
+        return 0;
+
+    int result = encode_dynamic_dict_AMF3(context, dynamic_attrs);
+    Py_DECREF(dynamic_attrs);
+    return result;
+}
+
+/* Serialize a class definition. */
+static int serialize_class_def_AMF3(EncoderObj *context, PyObject *value)
+{
+    // Check for idx
+    int result = encode_reference_AMF3(context, (RefObj*)context->class_refs, value, 1);
+    if (result > -1)
+        return result;
+
+    return encode_class_def_AMF3(context, value);
+}
+
+/* Encode a class definition. */
+static int encode_class_def_AMF3(EncoderObj *context, PyObject *value)
+{
+    if (value == Py_None) {
+        // Encode as anonymous object
+        if (!Encoder_writeByte(context, DYNAMIC))
+            return 0;
+
+        // Anonymous object alias is an empty string
+        if (!Encoder_writeByte(context, EMPTY_STRING_TYPE))
+            return 0;
+        return 1;
+    }
+
+    // Encode class type
+    if (!PyObject_HasAttrString(value, "CLASS_DEF")) {
+        PyErr_SetString(amfast_EncodeError, "Invalid class definition object.");
+        return 0;
+    }
+
+    // Determine header type
+    int header;
+    if (PyObject_HasAttrString(value, "EXTERNALIZABLE_CLASS_DEF")) {
+        header = EXTERNALIZABLE;
+    } else if (PyObject_HasAttrString(value, "DYNAMIC_CLASS_DEF")) {
+        header = DYNAMIC;
+    } else {
+        header = STATIC;
+    }
+
+    PyObject *class_alias = PyObject_GetAttrString(value, "alias");
+    if (!class_alias)
+       return 0;
+
+    // Don't need to encode static attrs of externalizeable.
+    if (header == EXTERNALIZABLE) {
+       if (!_encode_int_AMF3(context, header)) {
+           Py_DECREF(class_alias);
+           return 0;
+       }
+       
+       int result = serialize_object_as_string_AMF3(context, class_alias);
+       Py_DECREF(class_alias);
+       return result;
+    }
+
+    // Encode number of static attrs in header.
+    PyObject *static_attrs = PyObject_GetAttrString(value, "static_attrs");
+    if (!static_attrs) {
+       Py_DECREF(class_alias);
+       return 0;
+    }
+
+    Py_ssize_t static_attr_len = PySequence_Size(static_attrs);
+    if (static_attr_len == -1) {
+       Py_DECREF(class_alias);
+       Py_DECREF(static_attrs);
+       return 0;
+    }
+
+    if (static_attr_len > (MAX_INT >> 4)) {
+       Py_DECREF(class_alias);
+       Py_DECREF(static_attrs);
+       PyErr_SetString(amfast_EncodeError, "ClassDef has too many attributes.");
+       return 0;
+    }
+    header |= ((int)static_attr_len) << 4;
+
+    if (!_encode_int_AMF3(context, header)) {
+       Py_DECREF(class_alias);
+       Py_DECREF(static_attrs);
+       return 0;
+    }
+
+    int result = serialize_object_as_string_AMF3(context, class_alias);
+    Py_DECREF(class_alias);
+    if (!result) {
+       Py_DECREF(static_attrs);
+       return 0;
+    }
+
+    // Encode static attr names
+    int i;
+    for (i = 0; i < static_attr_len; i++) {
+        PyObject *attr_name = PySequence_GetItem(static_attrs, i);
+        if (!attr_name) {
+            Py_DECREF(static_attrs);
+            return 0;
+        }
+        
+        int result = serialize_object_as_string_AMF3(context, attr_name);
+        Py_DECREF(attr_name);
+        if (!result)
+            return 0;
+    }
+
+    Py_DECREF(static_attrs);
+    return 1;
+}
+
+/* Encode a Python boolean in AMF0. */
+static int encode_bool_AMF0(EncoderObj *context, PyObject *value)
+{
+    int result;
+    if (value == Py_True) {
+        result = Encoder_writeByte(context, TRUE_AMF0);
+    } else {
+        result = Encoder_writeByte(context, FALSE_AMF0);
+    }
+
+    return result;
+}
+
+/* Encode a PyInt in AMF0. */
+static int encode_int_AMF0(EncoderObj *context, PyObject *value)
+{
+    long long_val = PyInt_AsLong(value);
+    PyObject *py_long_val = PyLong_FromLong(long_val);
+    if (!py_long_val)
+        return 0;
+
+    int result = encode_long_AMF0(context, py_long_val);
+    Py_DECREF(py_long_val);
+    return result;
+}
+
+/* Encode a PyLong in AMF0. */
+static int encode_long_AMF0(EncoderObj *context, PyObject *value)
+{
+    return _encode_double(context, PyLong_AsDouble(value));
+}
+
+/* Encode a PyFloat in AMF0. */
+static int encode_float_AMF0(EncoderObj *context, PyObject *value)
+{
+    return _encode_double(context, PyFloat_AsDouble(value));
+}
+
+/* Encode a native C unsigned short. */
+static int encode_ushort(EncoderObj *context, unsigned short value)
+{
+   // Put bytes from short into byte array
+   union aligned { // use the same memory for d_value and c_value
+       unsigned short d_value;
+       char c_value[2];
+   } d;
+   char *char_value = d.c_value;
+   d.d_value = value;
+
+   // AMF numbers are encoded in big endianness
+   if (big_endian) {
+       return Encoder_write(context, char_value, 2);
+   } else {
+       // Flip endianness
+       char flipped[2] = {char_value[1], char_value[0]};
+       return Encoder_write(context, flipped, 2);
+   }
+}
+
+/* Encode a native C unsigned int. */
+static int encode_ulong(EncoderObj *context, unsigned int value)
+{
+   // Put bytes from long into byte array
+   union aligned { // use the same memory for d_value and c_value
+       unsigned int d_value;
+       char c_value[4];
+   } d;
+   char *char_value = d.c_value;
+   d.d_value = value;
+
+   // AMF numbers are encoded in big endianness
+   if (big_endian) {
+       return Encoder_write(context, char_value, 4);
+   } else {
+       // Flip endianness
+       char flipped[4] = {char_value[3], char_value[2], char_value[1], char_value[0]};
+       return Encoder_write(context, flipped, 4);
+   }
+}
+
+/* Write a PyString. */
+static int write_string_AMF0(EncoderObj *context, PyObject *value)
+{
+    PyObject *unicode_value = PyUnicode_FromObject(value);
+    if (!unicode_value)
+        return 0;
+
+    int result = write_unicode_AMF0(context, unicode_value);
+    Py_DECREF(unicode_value);
+    return result;
+}
+
+/* Write a PyUnicode in AMF0. */
+static int write_unicode_AMF0(EncoderObj *context, PyObject *value)
+{
+    Py_ssize_t string_len = PyUnicode_GET_SIZE(value);
+
+    if (string_len > 65536) {
+        if (!Encoder_writeByte(context, LONG_STRING_AMF0))
+            return 0;
+        return encode_unicode_AMF0(context, value, 1);
+    }
+
+    if (!Encoder_writeByte(context, STRING_AMF0))
+        return 0;
+
+    return encode_unicode_AMF0(context, value, 0);
+}
+
+/*
+ * Encode a PyUnicode in AMF0.
+ *
+ * allow_long
+ * 1 = allow long values
+ * 0 = don't allow long values
+ * -1 = force long value
+ */
+static int encode_unicode_AMF0(EncoderObj *context, PyObject *value, int allow_long)
+{
+    PyObject *PyString_value = PyUnicode_AsUTF8String(value);
+    if (!PyString_value)
+        return 0;
+
+    int result = encode_string_AMF0(context, PyString_value, allow_long);
+    Py_DECREF(PyString_value);
+    return result;
+}
+
+/*
+ * Encode a PyString in AMF0.
+ *
+ * allow_long
+ * 1 = allow long values
+ * 0 = don't allow long values
+ * -1 = force long value
+ */
+static int encode_string_AMF0(EncoderObj *context, PyObject *value, int allow_long)
+{
+    char *char_value = PyString_AS_STRING(value);
+    Py_ssize_t string_len = PyString_GET_SIZE(value);
+    if (!char_value)
+        return 0;
+
+    if (string_len > MAX_USHORT && allow_long == 0) {
+        PyErr_SetString(amfast_EncodeError, "Long string not allowed.");
+        return 0;
+    } else if (string_len > MAX_USHORT || allow_long == -1) {
+        if (!encode_ulong(context, (unsigned int)string_len))
+            return 0;
+    } else {
+        if (!encode_ushort(context, (unsigned short)string_len))
+            return 0;
+    }
+
+    return Encoder_write(context, char_value, (int)string_len);
+}
+
+/* Write a PyList to AMF0. */
+static int write_list_AMF0(EncoderObj *context, PyObject *value, int write_reference)
+{
+    if (write_reference) {
+        int result = write_reference_AMF0(context, value);
+        if (result == 0 || result == 1) {
+            return result;
+        }
+    }
+
+    // No reference
+    if (!Encoder_writeByte(context, ARRAY_AMF0))
+        return 0;
+
+    Py_ssize_t array_len = PySequence_Size(value);
+    if (array_len < 0)
+        return 0;
+
+    if (!encode_ulong(context, (unsigned int)array_len))
+        return 0;
+
+    int i;
+    for (i = 0; i < array_len; i++) {
+        // Increment ref count in case 
+        // list is modified by someone else.
+        PyObject *list_item = PySequence_GetItem(value, (Py_ssize_t)i);
+        if (!list_item)
+            return 0;
+
+        int result = encode_AMF0(context, list_item);
+        Py_DECREF(list_item);
+        if (!result)
+            return 0;
+    }
+
+    return 1;
+}
+
+/* Write a PyDict to AMF0. */
+static int write_dict_AMF0(EncoderObj *context, PyObject *value)
+{
+    int result = write_reference_AMF0(context, value);
+    if (result == 0 || result == 1) {
+        return result;
+    }
+
+    // No reference
+    if (!Encoder_writeByte(context, OBJECT_AMF0))
+        return 0;
+
+    return encode_dynamic_dict_AMF0(context, value);
+}
+
+/* Write the contents of a Dict to AMF0. */
+static int encode_dynamic_dict_AMF0(EncoderObj *context, PyObject *value)
+{
+    PyObject *key;
+    PyObject *val;
+    Py_ssize_t idx = 0;
+
+    while (PyDict_Next(value, &idx, &key, &val)) {
+        if (!encode_object_as_string_AMF0(context, key, 0))
+            return 0;
+
+        if (!encode_AMF0(context, val)) {
+            return 0;
+        }
+    }
+
+    // Terminate key/value pairs.
+    char terminator[3] = {0x00, 0x00, 0x09};
+    if (Encoder_write(context, terminator, 3) == 0)
+        return 0;
+
+    return 1;
+}
+
+/* Encode a Date object to AMF0 .*/
+static int write_date_AMF0(EncoderObj *context, PyObject *value)
+{
+    // Dates can use references
+    /*int wrote_ref = write_reference_AMF0(context, value);
+    if (wrote_ref == 0 || wrote_ref == 1) {
+        return wrote_ref;
+    }*/
+
+    if (!Encoder_writeByte(context, DATE_AMF0))
+        return 0;
+ 
+    // Call python function to get datetime
+    PyObject *epoch_func = PyObject_GetAttrString(amfast_mod, "epoch_from_date");
+    if (!epoch_func)
+        return 0;
+
+    PyObject *epoch_time = PyObject_CallFunctionObjArgs(epoch_func, value, NULL);
+    Py_DECREF(epoch_func);
+    if (!epoch_time)
+        return 0;
+
+    double micro_time = PyLong_AsDouble(epoch_time);
+    Py_DECREF(epoch_time);
+
+    if (!_encode_double(context, micro_time))
+        return 0;
+    
+    // UTC time zone
+    return encode_ushort(context, 0);
+}
+
+/* Write an XML object in AMF0. */
+static int write_xml_AMF0(EncoderObj *context, PyObject *value)
+{
+    if (!Encoder_writeByte(context, XML_DOC_AMF0))
+        return 0;
+
+    PyObject *unicode_value = PyObject_CallMethod(value, "toxml", NULL);
+    if (!unicode_value)
+        return 0;
+
+    int result = encode_unicode_AMF0(context, unicode_value, -1);
+    Py_DECREF(unicode_value);
+    return result;
+}
+
+/* Get an object's class def. */
+static PyObject* class_def_from_class(EncoderObj *context, PyObject *value)
+{
+    // Use object's class to get ClassDef
+    PyObject *class_ = PyObject_GetAttrString(value, "__class__");
+    if (!class_)
+        return NULL;
+
+    PyObject *class_def = PyObject_CallMethodObjArgs(context->class_mapper, context->class_def_name,
+        class_, NULL);
+    Py_DECREF(class_);
+    return class_def;
+}
+
+/* Write an anonymous object in AMF0. */
+static int write_anonymous_object_AMF0(EncoderObj *context, PyObject *value)
+{
+    if (!Encoder_writeByte(context, OBJECT_AMF0))
+        return 0;
+
+    PyObject *dict = attributes_from_object(context, value);
+    if (!dict)
+        return 0;
+
+    int result = encode_dynamic_dict_AMF0(context, dict);
+    Py_DECREF(dict);
+    return result;
+}
+
+/* Get attributes from an anonymous object as a dict. */
+static PyObject* attributes_from_object(EncoderObj *context, PyObject *value)
+{
+    PyObject *attr_func = PyObject_GetAttrString(class_def_mod, "get_dynamic_attr_vals");
+    if (!attr_func)
+        return NULL;
+
+    PyObject *dict = PyObject_CallFunctionObjArgs(attr_func, value, Py_None, context->include_private, NULL);
+    Py_DECREF(attr_func);
+    if (!dict)
+        return NULL;
+
+    return dict;
+}
+
+/* Encode a ClassDef in AMF0. */
+static int encode_class_def_AMF0(EncoderObj *context, PyObject *value)
+{
+    PyObject *alias = PyObject_GetAttrString(value, "alias");
+    if (!alias)
+        return 0;
+
+    int result = encode_object_as_string_AMF0(context, alias, 0);
+    Py_DECREF(alias);
+    return result;
+}
+
+/* Get static attrs. */
+static PyObject* static_attr_vals_from_class_def(EncoderObj *context, PyObject *class_def, PyObject *value)
+{
+    PyObject *method_name = PyString_FromString("getStaticAttrVals");
+    if (!method_name)
+        return NULL;
+
+    PyObject *static_attrs = PyObject_CallMethodObjArgs(class_def, method_name, value, NULL);
+    Py_DECREF(method_name);
+    if (!static_attrs)
+        return NULL;
+
+    if (!PySequence_Check(static_attrs)) {
+        PyErr_SetString(amfast_EncodeError, "ClassDef.getStaticAttrVals must return a sequence.");
+        Py_DECREF(static_attrs);
+        return NULL;
+    }
+
+    PyObject *static_names = PyObject_GetAttrString(class_def, "static_attrs");
+    int result = type_list(class_def, context->type_map, static_names, static_attrs, 0);
+    Py_DECREF(static_names);
+    if (result == 0) {
+        Py_DECREF(static_attrs);
+        return NULL;
+    }
+
+    return static_attrs;
+}
+
+/* Get dynamic attrs. */
+static PyObject* dynamic_attrs_from_class_def(EncoderObj *context, PyObject *class_def, PyObject *value)
+{
+    PyObject *get_func = PyObject_GetAttrString(class_def, "getDynamicAttrVals");
+    if (!get_func)
+        return NULL;
+
+    PyObject *dynamic_attrs = PyObject_CallFunctionObjArgs(get_func, value, context->include_private, NULL);
+    Py_DECREF(get_func);
+    if (!dynamic_attrs)
+        return NULL;
+
+    if (!PyDict_Check(dynamic_attrs)) {
+        PyErr_SetString(amfast_EncodeError, "ClassDef.getDynamicAttrVals must return a dict.");
+        Py_DECREF(dynamic_attrs);
+        return NULL;
+    }
+
+    if (type_dict(class_def, context->type_map, dynamic_attrs, 0) == 0) {
+        Py_DECREF(dynamic_attrs);
+        return NULL;
+    }
+
+    return dynamic_attrs;
+}
+
+/* Write a Python object in AMF0. */
+static int write_object_AMF0(EncoderObj *context, PyObject *value)
+{
+    int wrote_ref = write_reference_AMF0(context, value);
+    if (wrote_ref == 0 || wrote_ref == 1) {
+        return wrote_ref;
+    }
+
+    PyObject *class_def = class_def_from_class(context, value);
+    if (!class_def)
+        return 0;
+
+    if (class_def == Py_None) {
+        Py_DECREF(class_def);
+        return write_anonymous_object_AMF0(context, value);
+    }
+
+    // Check for AMF3 object
+    PyObject *amf3 = PyObject_GetAttrString(class_def, "amf3");
+    if (amf3 == Py_True) {
+        // Encode this object in AMF3
+        Py_DECREF(amf3);
+        Py_DECREF(class_def);
+        if (Encoder_writeByte(context, AMF3_AMF0) == 0)
+            return 0;
+
+        // Create new context for AMF3 encode
+        EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
+        if (new_context == NULL)
+            return 0;
+
+        int result = encode_AMF3(new_context, value);
+        Py_DECREF(new_context);
+        return result;
+    } else {
+        Py_DECREF(amf3);
+    }
+
+    // Write marker byte
+    if (!Encoder_writeByte(context, TYPED_OBJ_AMF0)) {
+        Py_DECREF(class_def);
+        return 0;
+    }
+
+    // Class has a ClassDef
+    // encode class definition
+    if (!encode_class_def_AMF0(context, class_def)) {
+        Py_DECREF(class_def);
+        return 0;
+    }
+
+    // Get all attributes to encode
+    PyObject *attrs = PyDict_New();
+    if (!attrs) {
+        Py_DECREF(class_def);
+        return 0;
+    }
+
+    // Get static attrs
+    PyObject *static_attrs = static_attr_vals_from_class_def(context, class_def, value);
+    if (!static_attrs) {
+        Py_DECREF(class_def);
+        Py_DECREF(attrs);
+        return 0;
+    }
+
+    // Get static attr names
+    PyObject *static_attr_names = PyObject_GetAttrString(class_def, "static_attrs");
+    if (!static_attr_names) {
+        Py_DECREF(class_def);
+        Py_DECREF(attrs);
+        Py_DECREF(static_attrs);
+        return 0;
+    }
+
+    Py_ssize_t static_attr_len = PySequence_Size(static_attrs);
+    if (static_attr_len == -1) {
+        Py_DECREF(class_def);
+        Py_DECREF(attrs);
+        Py_DECREF(static_attrs);
+        return 0;
+    }
+
+    int i;
+    for (i = 0; i < static_attr_len; i++) {
+        PyObject *static_attr_name = PySequence_GetItem(static_attr_names, i);
+        if (!static_attr_name) {
+            Py_DECREF(class_def);
+            Py_DECREF(attrs);
+            Py_DECREF(static_attrs);
+            return 0;
+        }
+
+        PyObject *static_attr = PySequence_GetItem(static_attrs, i);
+        if (!static_attr) {
+            Py_DECREF(class_def);
+            Py_DECREF(attrs);
+            Py_DECREF(static_attrs);
+            Py_DECREF(static_attr_name);
+            return 0;
+        }
+
+        int result = PyDict_SetItem(attrs, static_attr_name, static_attr);
+        Py_DECREF(static_attr_name);
+        Py_DECREF(static_attr);
+        if (result == -1) {
+            Py_DECREF(class_def);
+            Py_DECREF(attrs);
             Py_DECREF(static_attrs);
             return 0;
         }
@@ -1584,361 +3031,2083 @@ static int write_object_AMF0(EncoderObj *context, PyObject *value)
     Py_DECREF(static_attrs);
     Py_DECREF(static_attr_names);
 
-    // Get dynamic attrs
-    if (PyObject_HasAttrString(class_def, "DYNAMIC_CLASS_DEF")) {
-        PyObject *dynamic_attrs = dynamic_attrs_from_class_def(context, class_def, value);
-        if (!dynamic_attrs) {
-            Py_DECREF(class_def);
-            Py_DECREF(attrs);
+    // Get dynamic attrs
+    if (PyObject_HasAttrString(class_def, "DYNAMIC_CLASS_DEF")) {
+        PyObject *dynamic_attrs = dynamic_attrs_from_class_def(context, class_def, value);
+        if (!dynamic_attrs) {
+            Py_DECREF(class_def);
+            Py_DECREF(attrs);
+            return 0;
+        }
+
+        int result = PyDict_Merge(attrs, dynamic_attrs, 0);
+        Py_DECREF(dynamic_attrs);
+        if (result == -1) {
+            Py_DECREF(class_def);
+            Py_DECREF(attrs);
+            return 0;
+        }
+    }
+    Py_DECREF(class_def);
+
+    int result = encode_dynamic_dict_AMF0(context, attrs);
+    Py_DECREF(attrs);
+    return result;
+}
+
+/* Encode an AMF packet. */
+static int encode_packet(EncoderObj *context, PyObject *value)
+{
+    // write flash client_type
+    PyObject *client_type = PyObject_GetAttrString(value, "client_type");
+    if (!client_type)
+        return 0;
+
+    short amf_client_type = (short) PyInt_AsLong(client_type);
+    Py_DECREF(client_type); 
+    if (amf_client_type < 0)
+        return 0;
+
+    if (!encode_ushort(context, (unsigned short)amf_client_type))
+        return 0;
+
+    // write headers
+    PyObject *headers = PyObject_GetAttrString(value, "headers");
+    if (!headers)
+        return 0;
+
+    Py_ssize_t header_count = 0;
+    if (PySequence_Check(headers)) {
+        header_count = PySequence_Size(headers);
+        if (header_count == -1) {
+            Py_DECREF(headers);
+            return 0;
+        }
+    }
+
+    if (!encode_ushort(context, (unsigned short)header_count)) {
+        Py_DECREF(headers);
+        return 0;
+    }
+
+    int i;
+    for (i = 0; i < header_count; i++) {
+        PyObject *header = PySequence_GetItem(headers, i);
+        if (!header) {
+            Py_DECREF(headers);
+            return 0;
+        }
+
+        int wrote_header = encode_packet_header_AMF0(context, header);
+        Py_DECREF(header);
+        if (!wrote_header) {
+            Py_DECREF(headers);
+            return 0;
+        }
+    }
+    Py_DECREF(headers);
+
+    // write messages
+    PyObject *messages = PyObject_GetAttrString(value, "messages");
+    if (!messages)
+        return 0;
+
+    Py_ssize_t message_count = PySequence_Size(messages);
+    if (message_count == -1) {
+        Py_DECREF(messages);
+        return 0;
+    }
+    if (!encode_ushort(context, (unsigned short)message_count)) {
+        Py_DECREF(messages);
+        return 0;
+    }
+
+    for (i = 0; i < message_count; i++) {
+        PyObject *message = PySequence_GetItem(messages, i);
+        if (!message) {
+            Py_DECREF(messages);
+            return 0;
+        }
+
+        int wrote_message = encode_packet_message_AMF0(context, message);
+        Py_DECREF(message);
+        if (!wrote_message) {
+            Py_DECREF(messages);
+            return 0;
+        }
+    }
+    Py_DECREF(messages);
+    return 1;
+}
+
+/* Encode a Packet header in AMF0. */
+static int encode_packet_header_AMF0(EncoderObj *context, PyObject *value)
+{
+    PyObject *header_name = PyObject_GetAttrString(value, "name");
+    if (!header_name)
+        return 0;
+
+    int result = encode_object_as_string_AMF0(context, header_name, 0);
+    Py_DECREF(header_name);
+    if (!result)
+        return 0;
+
+    PyObject *required = PyObject_GetAttrString(value, "required");
+    if (!required)
+        return 0;
+
+    result = encode_bool_AMF0(context, required);
+    Py_DECREF(required);
+    if (!result)
+        return 0;
+
+    PyObject *body = PyObject_GetAttrString(value, "value");
+    if (!body)
+        return 0;
+
+    result = encode_packet_body_AMF0(context, body, 0, 0);
+    Py_DECREF(body);
+    return result;
+}
+
+/* Encode a Packet message in AMF0. */
+static int encode_packet_message_AMF0(EncoderObj *context, PyObject *value)
+{
+    PyObject *target = PyObject_GetAttrString(value, "target");
+    if (!target)
+        return 0;
+
+    int result = encode_object_as_string_AMF0(context, target, 0);
+    Py_DECREF(target);
+    if (!result)
+        return 0;
+
+    PyObject *response = PyObject_GetAttrString(value, "response");
+    if (!response)
+        return 0;
+
+    result = encode_object_as_string_AMF0(context, response, 0);
+    if (!result) {
+        Py_DECREF(response);
+        return 0;
+    }
+
+    PyObject *body = PyObject_GetAttrString(value, "body");
+    if (!body) {
+        Py_DECREF(response);
+        return 0;
+    }
+
+    if (PySequence_Size(response) > 0 && (PyList_Check(body) || PyTuple_Check(body))) {
+        // We're encoding a request,
+        // Don't count argument list 
+        // in reference count.
+
+        // Always use AMF0 context!
+        result = encode_packet_body_AMF0(context, body, 0, 1);
+    } else {
+        result = encode_packet_body_AMF0(context, body, context->amf3 == Py_True, 0);
+    }
+    Py_DECREF(response);
+    Py_DECREF(body);
+    return result;
+}
+
+/*
+ * Encode a Packet header value or message body,
+ * preceded by its length in bytes.
+ *
+ * The body is encoded with a new context, so references are reset.
+ *
+ * If the output is streamed, the length is written as unknown,
+ * and the body is encoded directly to the output,
+ * instead of to a new buffer, so it does not need to be held in memory.
+ *
+ * arg_list == 1 to encode the arguments of a request,
+ * which are not counted as a reference.
+ */
+static int encode_packet_body_AMF0(EncoderObj *context, PyObject *value, int amf3, int arg_list)
+{
+    int stream = context->stream;
+    if (stream && !encode_ulong(context, 0xFFFFFFFFU))
+        return 0;
+
+    EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, amf3, !stream);
+    if (!new_context)
+        return 0;
+
+    int result;
+    if (arg_list) {
+        result = write_list_AMF0(new_context, value, 0);
+    } else if (amf3) {
+        result = Encoder_writeByte(new_context, AMF3_AMF0);
+        if (result)
+            result = encode_AMF3(new_context, value);
+    } else {
+        result = encode_AMF0(new_context, value);
+    }
+
+    if (!result || stream) {
+        Py_DECREF(new_context);
+        return result;
+    }
+
+    Py_ssize_t new_len = Encoder_tell(new_context);
+    if (new_len == -1) {
+        Py_DECREF(new_context);
+        return 0;
+    }
+
+    if ((size_t)new_len > 0xFFFFFFFFU) {
+        // Body lengths are written as 32 bit unsigned ints.
+        PyErr_SetString(amfast_EncodeError, "Message body is too large.");
+        Py_DECREF(new_context);
+        return 0;
+    }
+
+    if (!encode_ulong(context, (unsigned int)new_len)) {
+        Py_DECREF(new_context);
+        return 0;
+    }
+
+    result = Encoder_writeEncoder(context, new_context);
+    Py_DECREF(new_context);
+    return result;
+}
+
+/*
+ * Increment the nesting depth before a value is encoded.
+ *
+ * Without object references, a cycle recurses until
+ * the stack overflows, so depth is limited to the
+ * interpreter's recursion limit.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int enter_value(EncoderObj *context)
+{
+    if (context->use_obj_refs != Py_True && context->depth >= Py_GetRecursionLimit()) {
+        PyErr_SetString(amfast_EncodeError, "Value is nested too deeply. "
+            "Values that contain cycles must be encoded with use_object_references=True.");
+        return 0;
+    }
+
+    context->depth++;
+    return 1;
+}
+
+/*
+ * Encode an AMF0 value, checking nesting depth
+ * and recording stats if they are enabled.
+ */
+static int encode_AMF0(EncoderObj *context, PyObject *value)
+{
+    if (context->use_obj_refs == Py_True && context->stats == Py_None)
+        return encode_value_AMF0(context, value);
+
+    if (!enter_value(context))
+        return 0;
+
+    int result;
+    if (context->stats != Py_None) {
+        result = encode_stats(context, value, 0);
+    } else {
+        result = encode_value_AMF0(context, value);
+    }
+
+    context->depth--;
+    return result;
+}
+
+/* Encoding function map for AMF0. */
+static int encode_value_AMF0(EncoderObj *context, PyObject *value)
+{
+
+    // Determine object type
+    if (value == Py_None) {
+        return Encoder_writeByte(context, NULL_AMF0);
+    } else if (PyBool_Check(value)) {
+        if (!Encoder_writeByte(context, BOOL_AMF0))
+            return 0;
+        return encode_bool_AMF0(context, value);
+    } else if (PyInt_Check(value)) {
+        if (!Encoder_writeByte(context, NUMBER_AMF0))
+            return 0;
+        return encode_int_AMF0(context, value);
+    } else if (PyLong_Check(value)) {
+        if (!Encoder_writeByte(context, NUMBER_AMF0))
+            return 0;
+        return encode_long_AMF0(context, value);
+    } else if (PyFloat_Check(value)) {
+        if (!Encoder_writeByte(context, NUMBER_AMF0))
+            return 0;
+        return encode_float_AMF0(context, value);
+    } else if (PyString_Check(value)) {
+        return write_string_AMF0(context, value);
+    } else if (PyUnicode_Check(value)) {
+        return write_unicode_AMF0(context, value);
+    } else if (PyList_Check(value) || PyTuple_Check(value)) {
+        return write_list_AMF0(context, value, 1);
+    } else if (PyDict_Check(value)) {
+        return write_dict_AMF0(context, value);
+    } else if (PyDateTime_Check(value) || PyDate_Check(value)) {
+       return write_date_AMF0(context, value);
+    } else if (value->ob_type == lazy_value_type) {
+        // Force switch to AMF3
+        if (Encoder_writeByte(context, AMF3_AMF0) == 0)
+            return 0;
+
+        // Create new context for AMF3 encode
+        EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
+        if (new_context == NULL)
+            return 0;
+
+        int result = write_lazy_AMF3(new_context, value);
+        Py_DECREF(new_context);
+        return result;
+    } else if (check_xml(value)) {
+        return write_xml_AMF0(context, value);
+    } else if (check_byte_array(value) || check_record_array(value) || check_vector(value) ||
+        check_dictionary(value)) {
+        // Force switch to AMF3
+        if (Encoder_writeByte(context, AMF3_AMF0) == 0)
+            return 0;
+
+        // Create new context for AMF3 encode
+        EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
+        if (new_context == NULL)
+            return 0;
+
+        int result = encode_AMF3(new_context, value);
+        Py_DECREF(new_context);
+        return result;
+    } else if (check_proxy(value)) {
+        return write_proxy_AMF0(context, value);
+    } else if (check_no_proxy(value)) {
+        return write_proxy_AMF0(context, value);
+    } else if (check_encoded(value)) {
+        return write_encoded_AMF0(context, value);
+    }
+
+    return write_object_AMF0(context, value);
+}
+
+/*
+ * Encode an AMF3 value, checking nesting depth
+ * and recording stats if they are enabled.
+ */
+static int encode_AMF3(EncoderObj *context, PyObject *value)
+{
+    if (context->use_obj_refs == Py_True && context->stats == Py_None)
+        return encode_value_AMF3(context, value);
+
+    if (!enter_value(context))
+        return 0;
+
+    int result;
+    if (context->stats != Py_None) {
+        result = encode_stats(context, value, 1);
+    } else {
+        result = encode_value_AMF3(context, value);
+    }
+
+    context->depth--;
+    return result;
+}
+
+/* Encoding function map. */
+static int encode_value_AMF3(EncoderObj *context, PyObject *value)
+{
+    int vector_type;
+
+
+    // Determine object type
+    if (value == Py_None) {
+        return encode_none_AMF3(context);
+    } else if (PyBool_Check(value)) {
+        return encode_bool_AMF3(context, value);
+    } else if (PyInt_Check(value)) {
+        return write_int_AMF3(context, value);
+    } else if (PyString_Check(value)) {
+        if (!Encoder_writeByte(context, STRING_TYPE))
+            return 0;
+        return serialize_string_AMF3(context, value);
+    } else if (PyUnicode_Check(value)) {
+        if (!Encoder_writeByte(context, STRING_TYPE))
+            return 0;
+        return serialize_unicode_AMF3(context, value);
+    } else if (PyFloat_Check(value)) {
+        if (!Encoder_writeByte(context, DOUBLE_TYPE))
+            return 0;
+        return encode_float(context, value);
+    } else if (PyLong_Check(value)) {
+        if (!Encoder_writeByte(context, DOUBLE_TYPE))
+            return 0;
+        return encode_long_AMF3(context, value);
+    } else if (PyList_Check(value) || PyTuple_Check(value)) {
+        return write_list_AMF3(context, value);
+    } else if (PyDict_Check(value)) {
+        return write_dict_AMF3(context, value);
+    } else if (PyDateTime_Check(value) || PyDate_Check(value)) {
+        if (!Encoder_writeByte(context, DATE_TYPE))
+            return 0;
+        return serialize_date_AMF3(context, value);
+    } else if (value->ob_type == lazy_value_type) {
+        return write_lazy_AMF3(context, value);
+    } else if (check_xml(value)) {
+        return write_xml_AMF3(context, value);
+    } else if (check_byte_array(value)) {
+        if (!Encoder_writeByte(context, BYTE_ARRAY_TYPE))
+            return 0;
+        return serialize_byte_array_AMF3(context, value);
+    } else if (check_proxy(value)) {
+        return write_proxy_AMF3(context, value);
+    } else if (check_no_proxy(value)) {
+        return write_no_proxy_AMF3(context, value);
+    } else if (check_encoded(value)) {
+        return write_encoded_AMF3(context, value);
+    } else if (check_record_array(value)) {
+        return write_record_array_AMF3(context, value);
+    } else if (check_dictionary(value)) {
+        return write_dictionary_AMF3(context, value);
+    } else if ((vector_type = check_vector(value)) != 0) {
+        return write_vector_AMF3(context, value, vector_type);
+    }
+
+    #ifdef Py_BYTEARRAYOBJECT_H
+    // ByteArray encoding is only available in 2.6+
+    else if (PyByteArray_Check(value)) {
+        if (!Encoder_writeByte(context, BYTE_ARRAY_TYPE))
+            return 0;
+        return serialize_byte_array_AMF3(context, value);
+    } 
+    #endif
+
+    // Custom object
+    if (!Encoder_writeByte(context, OBJECT_TYPE))
+            return 0;
+
+    return serialize_object_AMF3(context, value);
+}
+
+// ---- STATS
+
+/*
+ * Encode a value and record it in the context's CodecStats.
+ *
+ * The type marker is the first byte written for the value.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int encode_stats(EncoderObj *context, PyObject *value, int amf3)
+{
+    int prev_marker = context->stats_marker;
+    Py_ssize_t start = Encoder_tell(context);
+    if (start == -1)
+        PyErr_Clear();
+    double start_time = Stats_clock();
+
+    context->stats_marker = STATS_PENDING;
+    int result;
+    if (amf3) {
+        result = encode_value_AMF3(context, value);
+    } else {
+        result = encode_value_AMF0(context, value);
+    }
+    int marker = context->stats_marker;
+    context->stats_marker = prev_marker;
+    if (!result)
+        return 0;
+
+    double seconds = Stats_clock() - start_time;
+    Py_ssize_t bytes = 0;
+    if (start != -1) {
+        Py_ssize_t end = Encoder_tell(context);
+        if (end == -1) {
+            PyErr_Clear();
+        } else {
+            bytes = end - start;
+        }
+    }
+
+    Stats_record((CodecStatsObj*)context->stats, amf3, marker, bytes, seconds);
+
+    if ((amf3 && marker == OBJECT_TYPE) || (!amf3 && marker == TYPED_OBJ_AMF0))
+        return record_alias(context, value, bytes, seconds);
+
+    return 1;
+}
+
+/*
+ * Record an encoded object under its ClassDef's alias.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int record_alias(EncoderObj *context, PyObject *value, Py_ssize_t bytes, double seconds)
+{
+    PyObject *class_def = class_def_from_class(context, value);
+    if (!class_def)
+        return 0;
+
+    if (class_def == Py_None) {
+        Py_DECREF(class_def);
+        return 1;
+    }
+
+    PyObject *alias = PyObject_GetAttrString(class_def, "alias");
+    Py_DECREF(class_def);
+    if (!alias)
+        return 0;
+
+    int result = 1;
+    if (PyString_Check(alias) && PyString_GET_SIZE(alias) > 0)
+        result = Stats_recordAlias((CodecStatsObj*)context->stats, alias, bytes, seconds);
+    Py_DECREF(alias);
+    return result;
+}
+
+/* Record a reference table lookup. */
+static void record_ref(EncoderObj *context, RefObj *ref_context, int hit)
+{
+    CodecStatsObj *stats = (CodecStatsObj*)context->stats;
+    int table = STATS_OBJ_REFS;
+    if (ref_context == (RefObj*)context->string_refs) {
+        table = STATS_STRING_REFS;
+    } else if (ref_context == (RefObj*)context->class_refs) {
+        table = STATS_CLASS_REFS;
+    }
+
+    if (hit) {
+        stats->ref_hits[table]++;
+    } else {
+        stats->ref_misses[table]++;
+    }
+}
+
+// ---- SMALL MESSAGES
+
+/*
+ * Encode the fields of a message as an ISmallMessage (DSA, DSC or DSK).
+ *
+ * Each level of the message class hierarchy writes its own group of flags,
+ * followed by the values the flags mark. IDs that are Flex UIDs
+ * are written as 16 byte ByteArrays instead of 36 char strings.
+ *
+ * Returns 1 on success, 0 on error.
+ */
+static int encode_small_message(EncoderObj *context, PyObject *value, int msg_type, PyObject *raw_attrs)
+{
+    static const char *attr_names[] = {"body", "clientId", "destination",
+        "headers", "messageId", "timestamp", "timeToLive", "correlationId"};
+    PyObject *attrs[8] = {NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL};
+    char client_id_bytes[UID_BYTES];
+    char message_id_bytes[UID_BYTES];
+    char correlation_id_bytes[UID_BYTES];
+    int client_id_uid = -1;
+    int message_id_uid = -1;
+    int correlation_id_uid = -1;
+    unsigned char flags = 0;
+    unsigned char id_flags = 0;
+    int return_value = 0;
+    int i;
+
+    // Use the raw body, so lazy values are written without being decoded.
+    PyObject *body_name = PyString_FromString(attr_names[0]);
+    if (!body_name)
+        return 0;
+
+    PyObject *raw_name = raw_attr_name(raw_attrs, body_name);
+    Py_DECREF(body_name);
+    if (!raw_name)
+        return 0;
+
+    attrs[0] = PyObject_GetAttr(value, raw_name);
+    Py_DECREF(raw_name);
+    if (!attrs[0]) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            return 0;
+        PyErr_Clear();
+        attrs[0] = Py_None;
+        Py_INCREF(attrs[0]);
+    }
+
+    for (i = 1; i < 8; i++) {
+        attrs[i] = small_msg_attr(value, attr_names[i]);
+        if (!attrs[i])
+            goto done;
+    }
+
+    // AbstractMessage
+    if (attrs[1] != Py_None) {
+        client_id_uid = _uid_to_bytes(attrs[1], client_id_bytes);
+        if (!client_id_uid)
+            goto done;
+    }
+
+    if (attrs[4] != Py_None) {
+        message_id_uid = _uid_to_bytes(attrs[4], message_id_bytes);
+        if (!message_id_uid)
+            goto done;
+    }
+
+    if (attrs[0] != Py_None)
+        flags |= SMALL_BODY_FLAG;
+    if (attrs[1] != Py_None && client_id_uid == -1)
+        flags |= SMALL_CLIENT_ID_FLAG;
+    if (attrs[2] != Py_None)
+        flags |= SMALL_DESTINATION_FLAG;
+    if (attrs[3] != Py_None)
+        flags |= SMALL_HEADERS_FLAG;
+    if (attrs[4] != Py_None && message_id_uid == -1)
+        flags |= SMALL_MESSAGE_ID_FLAG;
+
+    for (i = 5; i < 7; i++) {
+        // Flex does not send a timestamp or timeToLive of 0.
+        int is_true = PyObject_IsTrue(attrs[i]);
+        if (is_true == -1)
+            goto done;
+        if (is_true)
+            flags |= (i == 5) ? SMALL_TIMESTAMP_FLAG : SMALL_TIME_TO_LIVE_FLAG;
+    }
+
+    if (client_id_uid == 1)
+        id_flags |= SMALL_CLIENT_ID_BYTES_FLAG;
+    if (message_id_uid == 1)
+        id_flags |= SMALL_MESSAGE_ID_BYTES_FLAG;
+    if (id_flags)
+        flags |= SMALL_HAS_NEXT_FLAG;
+
+    if (!Encoder_writeByte(context, (char)flags))
+        goto done;
+    if (id_flags && !Encoder_writeByte(context, (char)id_flags))
+        goto done;
+
+    for (i = 0; i < 7; i++) {
+        if ((flags >> i) & 1) {
+            if (!encode_AMF3(context, attrs[i]))
+                goto done;
+        }
+    }
+
+    if (client_id_uid == 1 && !write_small_uid_AMF3(context, client_id_bytes))
+        goto done;
+    if (message_id_uid == 1 && !write_small_uid_AMF3(context, message_id_bytes))
+        goto done;
+
+    // AsyncMessage
+    flags = 0;
+    if (attrs[7] != Py_None) {
+        correlation_id_uid = _uid_to_bytes(attrs[7], correlation_id_bytes);
+        if (!correlation_id_uid)
+            goto done;
+
+        if (correlation_id_uid == 1) {
+            flags |= SMALL_CORRELATION_ID_BYTES_FLAG;
+        } else {
+            flags |= SMALL_CORRELATION_ID_FLAG;
+        }
+    }
+
+    if (!Encoder_writeByte(context, (char)flags))
+        goto done;
+
+    if (flags & SMALL_CORRELATION_ID_FLAG) {
+        if (!encode_AMF3(context, attrs[7]))
+            goto done;
+    } else if (flags & SMALL_CORRELATION_ID_BYTES_FLAG) {
+        if (!write_small_uid_AMF3(context, correlation_id_bytes))
+            goto done;
+    }
+
+    if (msg_type == SMALL_COMMAND_MSG) {
+        PyObject *operation = small_msg_attr(value, "operation");
+        if (!operation)
+            goto done;
+
+        // Operation 0 is implied by a missing flag.
+        int is_true = PyObject_IsTrue(operation);
+        if (is_true == -1) {
+            Py_DECREF(operation);
+            goto done;
+        }
+
+        flags = is_true ? SMALL_OPERATION_FLAG : 0;
+        if (!Encoder_writeByte(context, (char)flags)) {
+            Py_DECREF(operation);
+            goto done;
+        }
+
+        if (is_true && !encode_AMF3(context, operation)) {
+            Py_DECREF(operation);
+            goto done;
+        }
+        Py_DECREF(operation);
+    } else if (msg_type == SMALL_ACKNOWLEDGE_MSG) {
+        // AcknowledgeMessage has no fields of its own.
+        if (!Encoder_writeByte(context, 0))
+            goto done;
+    }
+
+    return_value = 1;
+
+done:
+    for (i = 0; i < 8; i++) {
+        Py_XDECREF(attrs[i]);
+    }
+    return return_value;
+}
+
+/*
+ * Get a message attribute.
+ *
+ * Returns a new reference, None if the attribute does not exist.
+ */
+static PyObject* small_msg_attr(PyObject *value, const char *name)
+{
+    PyObject *attr = PyObject_GetAttrString(value, name);
+    if (attr)
+        return attr;
+
+    if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+        return NULL;
+
+    PyErr_Clear();
+    Py_RETURN_NONE;
+}
+
+/*
+ * Get the name of the attr that holds an attr's undecoded value.
+ *
+ * raw_attrs is ClassDef.raw_attrs, or NULL.
+ * Names are looked up by value, so str and unicode names match.
+ *
+ * Returns a new reference to the raw attr name,
+ * or to attr if it is not listed in raw_attrs.
+ */
+static PyObject* raw_attr_name(PyObject *raw_attrs, PyObject *attr)
+{
+    if (raw_attrs != NULL && raw_attrs != Py_None) {
+        if (!PyDict_Check(raw_attrs)) {
+            PyErr_SetString(amfast_EncodeError, "ClassDef.raw_attrs must be a dict.");
+            return NULL;
+        }
+
+        PyObject *raw_attr = PyDict_GetItem(raw_attrs, attr);
+        if (raw_attr) {
+            Py_INCREF(raw_attr);
+            return raw_attr;
+        }
+    }
+
+    Py_INCREF(attr);
+    return attr;
+}
+
+/*
+ * Convert a Flex UID string to 16 bytes.
+ *
+ * Only strict UIDs (upper case hex digits, with hyphens after 8, 12, 16 and 20 digits)
+ * are converted, other IDs are sent as strings, so they are not changed on the way back.
+ *
+ * Returns 1 if the value was converted, -1 if the value is not a UID, 0 on error.
+ */
+static int _uid_to_bytes(PyObject *value, char *bytes)
+{
+    Py_UNICODE *unicode_chars = NULL;
+    char *str_chars = NULL;
+    Py_ssize_t len;
+
+    if (PyString_Check(value)) {
+        str_chars = PyString_AS_STRING(value);
+        len = PyString_GET_SIZE(value);
+    } else if (PyUnicode_Check(value)) {
+        unicode_chars = PyUnicode_AS_UNICODE(value);
+        len = PyUnicode_GET_SIZE(value);
+    } else {
+        return -1;
+    }
+
+    if (len != UID_LEN)
+        return -1;
+
+    int i;
+    int digit = 0;
+    for (i = 0; i < UID_LEN; i++) {
+        Py_UNICODE c = str_chars ? (Py_UNICODE)(unsigned char)str_chars[i] : unicode_chars[i];
+
+        if (i == 8 || i == 13 || i == 18 || i == 23) {
+            if (c != '-')
+                return -1;
+            continue;
+        }
+
+        int nibble;
+        if (c >= '0' && c <= '9') {
+            nibble = c - '0';
+        } else if (c >= 'A' && c <= 'F') {
+            nibble = c - 'A' + 10;
+        } else {
+            return -1;
+        }
+
+        if (digit & 1) {
+            bytes[digit >> 1] |= (char)nibble;
+        } else {
+            bytes[digit >> 1] = (char)(nibble << 4);
+        }
+        digit++;
+    }
+
+    return 1;
+}
+
+/* Write a UID as a ByteArray. */
+static int write_small_uid_AMF3(EncoderObj *context, char *bytes)
+{
+    if (!Encoder_writeByte(context, BYTE_ARRAY_TYPE))
+        return 0;
+
+    if (!_encode_int_AMF3(context, (UID_BYTES << 1) | REFERENCE_BIT))
+        return 0;
+
+    if (!Encoder_write(context, bytes, UID_BYTES))
+        return 0;
+
+    // The ByteArray is never referenced, but it still takes up an index.
+    ((RefObj*)context->obj_refs)->idx++;
+    return 1;
+}
+
+// ---- ENCODE PLANS
+
+static void EncodePlan_dealloc(EncodePlanObj *self)
+{
+    Py_XDECREF(self->class_def);
+    Py_XDECREF(self->header);
+    Py_XDECREF(self->strings);
+    Py_XDECREF(self->encoded_strings);
+    Py_XDECREF(self->attrs);
+    Py_XDECREF(self->read_attrs);
+    self->ob_type->tp_free((PyObject*)self);
+}
+
+static PyTypeObject EncodePlanType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "amfast.encode.EncodePlan", /*tp_name*/
+    sizeof(EncodePlanObj),     /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)EncodePlan_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "A ClassDef compiled for encoding.", /* tp_doc */
+};
+
+/*
+ * Encode a trait string for an EncodePlan.
+ *
+ * key is set to the object that is indexed
+ * in the string reference table.
+ *
+ * Returns the encoded string, an empty
+ * string is returned for an empty string.
+ */
+static PyObject* plan_string(PyObject *value, PyObject **key)
+{
+    PyObject *utf8;
+    if (PyString_Check(value)) {
+        utf8 = value;
+        Py_INCREF(utf8);
+        *key = value;
+    } else if (PyUnicode_Check(value)) {
+        utf8 = PyUnicode_AsUTF8String(value);
+        if (!utf8)
+            return NULL;
+        *key = value;
+    } else {
+        utf8 = PyObject_Str(value);
+        if (!utf8)
+            return NULL;
+        *key = utf8;
+    }
+
+    Py_ssize_t utf8_len = PyString_GET_SIZE(utf8);
+    if (utf8_len == 0) {
+        Py_INCREF(*key);
+        return utf8;
+    }
+
+    char tmp[4];
+    size_t tmp_size = _pack_int_AMF3(((int)utf8_len) << 1 | REFERENCE_BIT, tmp);
+    if (tmp_size == 0) {
+        Py_DECREF(utf8);
+        return NULL;
+    }
+
+    PyObject *encoded = PyString_FromStringAndSize(NULL, (Py_ssize_t)tmp_size + utf8_len);
+    if (!encoded) {
+        Py_DECREF(utf8);
+        return NULL;
+    }
+
+    char *encoded_value = PyString_AS_STRING(encoded);
+    memcpy(encoded_value, tmp, tmp_size);
+    memcpy(encoded_value + tmp_size, PyString_AS_STRING(utf8), (size_t)utf8_len);
+
+    Py_INCREF(*key);
+    Py_DECREF(utf8);
+    return encoded;
+}
+
+/* Compile a ClassDef into an EncodePlan. */
+static PyObject* compile_plan(PyObject *class_def)
+{
+    if (!PyObject_HasAttrString(class_def, "CLASS_DEF")) {
+        PyErr_SetString(amfast_EncodeError, "Invalid class definition object.");
+        return NULL;
+    }
+
+    EncodePlanObj *plan = PyObject_New(EncodePlanObj, &EncodePlanType);
+    if (!plan)
+        return NULL;
+
+    Py_INCREF(class_def);
+    plan->class_def = class_def;
+    plan->header = NULL;
+    plan->strings = NULL;
+    plan->encoded_strings = NULL;
+    plan->attrs = NULL;
+    plan->read_attrs = NULL;
+    plan->externalizable = PyObject_HasAttrString(class_def, "EXTERNALIZABLE_CLASS_DEF");
+    plan->dynamic = PyObject_HasAttrString(class_def, "DYNAMIC_CLASS_DEF");
+    plan->direct = 0;
+
+    // Determine header type
+    int header;
+    if (plan->externalizable) {
+        // Don't need to encode static attrs of externalizeable.
+        header = EXTERNALIZABLE;
+        plan->attrs = PyTuple_New(0);
+    } else {
+        if (plan->dynamic) {
+            header = DYNAMIC;
+        } else {
+            header = STATIC;
+        }
+
+        PyObject *static_attrs = PyObject_GetAttrString(class_def, "static_attrs");
+        if (!static_attrs) {
+            Py_DECREF(plan);
+            return NULL;
+        }
+
+        plan->attrs = PySequence_Tuple(static_attrs);
+        Py_DECREF(static_attrs);
+    }
+
+    if (!plan->attrs) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    Py_ssize_t attr_len = PyTuple_GET_SIZE(plan->attrs);
+    if (attr_len > (MAX_INT >> 4)) {
+        Py_DECREF(plan);
+        PyErr_SetString(amfast_EncodeError, "ClassDef has too many attributes.");
+        return NULL;
+    }
+    header |= ((int)attr_len) << 4;
+
+    char tmp[4];
+    size_t tmp_size = _pack_int_AMF3(header, tmp);
+    if (tmp_size == 0) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    plan->header = PyString_FromStringAndSize(tmp, (Py_ssize_t)tmp_size);
+    if (!plan->header) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    // Encode alias and static attr names
+    plan->strings = PyTuple_New(attr_len + 1);
+    if (!plan->strings) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    plan->encoded_strings = PyTuple_New(attr_len + 1);
+    if (!plan->encoded_strings) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    PyObject *class_alias = PyObject_GetAttrString(class_def, "alias");
+    if (!class_alias) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    Py_ssize_t i;
+    for (i = 0; i <= attr_len; i++) {
+        PyObject *value;
+        if (i == 0) {
+            value = class_alias;
+        } else {
+            value = PyTuple_GET_ITEM(plan->attrs, i - 1);
+        }
+
+        PyObject *key;
+        PyObject *encoded = plan_string(value, &key);
+        if (!encoded) {
+            Py_DECREF(class_alias);
+            Py_DECREF(plan);
+            return NULL;
+        }
+
+        PyTuple_SET_ITEM(plan->strings, i, key);
+        PyTuple_SET_ITEM(plan->encoded_strings, i, encoded);
+    }
+    Py_DECREF(class_alias);
+
+    if (plan->externalizable)
+        return (PyObject*)plan;
+
+    // Static attr values can be retrieved directly,
+    // if getStaticAttrVals is not overridden,
+    // and values do not need to be type converted.
+    PyObject *encode_types = PyObject_GetAttrString(class_def, "encode_types");
+    if (!encode_types) {
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    PyObject *get_func = PyObject_GetAttrString(class_def, "getStaticAttrVals");
+    if (!get_func) {
+        Py_DECREF(encode_types);
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    if (encode_types == Py_None && PyMethod_Check(get_func) &&
+        PyMethod_GET_FUNCTION(get_func) == default_static_attr_vals) {
+        plan->direct = 1;
+    }
+    Py_DECREF(encode_types);
+    Py_DECREF(get_func);
+
+    if (!plan->direct)
+        return (PyObject*)plan;
+
+    // Attrs listed in ClassDef.raw_attrs are read from the attrs
+    // holding their undecoded values, so lazy values are not decoded.
+    PyObject *raw_attrs = NULL;
+    if (PyObject_HasAttrString(class_def, "raw_attrs")) {
+        raw_attrs = PyObject_GetAttrString(class_def, "raw_attrs");
+        if (!raw_attrs) {
+            Py_DECREF(plan);
+            return NULL;
+        }
+    }
+
+    plan->read_attrs = PyTuple_New(attr_len);
+    if (!plan->read_attrs) {
+        Py_XDECREF(raw_attrs);
+        Py_DECREF(plan);
+        return NULL;
+    }
+
+    for (i = 0; i < attr_len; i++) {
+        PyObject *read_attr = raw_attr_name(raw_attrs, PyTuple_GET_ITEM(plan->attrs, i));
+        if (!read_attr) {
+            Py_XDECREF(raw_attrs);
+            Py_DECREF(plan);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(plan->read_attrs, i, read_attr);
+    }
+    Py_XDECREF(raw_attrs);
+
+    return (PyObject*)plan;
+}
+
+/*
+ * Get the EncodePlan for an object's class.
+ *
+ * plan is set to the EncodePlan, or Py_None
+ * if the class does not have a ClassDef.
+ *
+ * Plans are stored in the ClassDefMapper,
+ * so they are compiled once per mapping.
+ *
+ * Returns 1 on success, 0 on error,
+ * and -1 if the ClassDefMapper does not store plans.
+ */
+static int plan_from_class(EncoderObj *context, PyObject *value, PyObject **plan)
+{
+    PyObject *plans = PyObject_GetAttr(context->class_mapper, plans_name);
+    if (!plans) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            return 0;
+        PyErr_Clear();
+        return -1;
+    }
+
+    if (!PyDict_Check(plans)) {
+        Py_DECREF(plans);
+        return -1;
+    }
+
+    PyObject *class_;
+    if (PyInstance_Check(value)) {
+        // Old-style class
+        class_ = PyObject_GetAttrString(value, "__class__");
+        if (!class_) {
+            Py_DECREF(plans);
+            return 0;
+        }
+    } else {
+        class_ = (PyObject*)value->ob_type;
+        Py_INCREF(class_);
+    }
+
+    *plan = PyDict_GetItem(plans, class_);
+    if (*plan != NULL) {
+        Py_INCREF(*plan);
+        Py_DECREF(class_);
+        Py_DECREF(plans);
+        return 1;
+    }
+
+    PyObject *class_def = PyObject_CallMethodObjArgs(context->class_mapper,
+        context->class_def_name, class_, NULL);
+    if (!class_def) {
+        Py_DECREF(class_);
+        Py_DECREF(plans);
+        return 0;
+    }
+
+    if (class_def == Py_None) {
+        *plan = class_def;
+    } else {
+        *plan = compile_plan(class_def);
+        Py_DECREF(class_def);
+        if (*plan == NULL) {
+            Py_DECREF(class_);
+            Py_DECREF(plans);
+            return 0;
+        }
+    }
+
+    int result = PyDict_SetItem(plans, class_, *plan);
+    Py_DECREF(class_);
+    Py_DECREF(plans);
+    if (result == -1) {
+        Py_DECREF(*plan);
+        return 0;
+    }
+
+    return 1;
+}
+
+/* Write the trait of an EncodePlan. */
+static int write_plan_trait_AMF3(EncoderObj *context, EncodePlanObj *plan)
+{
+    if (!Encoder_write(context, PyString_AS_STRING(plan->header),
+        (int)PyString_GET_SIZE(plan->header)))
+        return 0;
+
+    Py_ssize_t i;
+    Py_ssize_t string_len = PyTuple_GET_SIZE(plan->strings);
+    for (i = 0; i < string_len; i++) {
+        PyObject *encoded = PyTuple_GET_ITEM(plan->encoded_strings, i);
+        if (PyString_GET_SIZE(encoded) == 0) {
+            // References are never used for empty strings.
+            if (!Encoder_writeByte(context, EMPTY_STRING_TYPE))
+                return 0;
+            continue;
+        }
+
+        // Check for idx
+        int result = encode_reference_AMF3(context, (RefObj*)context->string_refs,
+            PyTuple_GET_ITEM(plan->strings, i), 0);
+        if (result == 0)
+            return 0;
+
+        if (result == -1) {
+            if (!Encoder_write(context, PyString_AS_STRING(encoded),
+                (int)PyString_GET_SIZE(encoded)))
+                return 0;
+        }
+    }
+
+    return 1;
+}
+
+/* Encode a Python object with an EncodePlan. */
+static int encode_planned_object_AMF3(EncoderObj *context, EncodePlanObj *plan, PyObject *value)
+{
+    // Encode class definition
+    int result = encode_reference_AMF3(context, (RefObj*)context->class_refs, plan->class_def, 1);
+    if (result == 0)
+        return 0;
+
+    if (result == -1) {
+        if (!write_plan_trait_AMF3(context, plan))
+            return 0;
+    }
+
+    if (plan->externalizable)
+        return encode_external_AMF3(context, plan->class_def, value);
+
+    if (plan->direct) {
+        // Get static attr values without calling the ClassDef.
+        Py_ssize_t i;
+        Py_ssize_t attr_len = PyTuple_GET_SIZE(plan->attrs);
+        for (i = 0; i < attr_len; i++) {
+            PyObject *static_attr = PyObject_GetAttr(value, PyTuple_GET_ITEM(plan->read_attrs, i));
+
+            if (!static_attr) {
+                if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+                    return 0;
+                PyErr_Clear();
+                static_attr = Py_None;
+                Py_INCREF(static_attr);
+            }
+
+            result = encode_AMF3(context, static_attr);
+            Py_DECREF(static_attr);
+            if (!result)
+                return 0;
+        }
+    } else {
+        if (!encode_static_attrs_AMF3(context, plan->class_def, value))
+            return 0;
+    }
+
+    if (plan->dynamic)
+        return encode_dynamic_attrs_AMF3(context, plan->class_def, value);
+
+    return 1;
+}
+
+// ---- SPLICING
+
+/* Append 3 ints to a growable int array. */
+static int splice_append(int **array, int *array_len, int count, int a, int b, int c)
+{
+    if ((count + 1) * 3 > *array_len) {
+        int new_len = *array_len * 2;
+        if (new_len < 24)
+            new_len = 24;
+
+        int *tmp = (int*)realloc(*array, sizeof(int) * (size_t)new_len);
+        if (tmp == NULL) {
+            PyErr_SetNone(PyExc_MemoryError);
             return 0;
         }
+        *array = tmp;
+        *array_len = new_len;
+    }
 
-        int result = PyDict_Merge(attrs, dynamic_attrs, 0);
-        Py_DECREF(dynamic_attrs);
-        if (result == -1) {
-            Py_DECREF(class_def);
-            Py_DECREF(attrs);
+    (*array)[count * 3] = a;
+    (*array)[count * 3 + 1] = b;
+    (*array)[count * 3 + 2] = c;
+    return 1;
+}
+
+/* Move the position forward, checking for the end of the encoded bytes. */
+static int splice_skip(SpliceState *state, int len)
+{
+    if (len < 0 || state->pos + len > state->len) {
+        PyErr_SetString(amfast_EncodeError, "Encoded value is truncated.");
+        return 0;
+    }
+
+    state->pos += len;
+    return 1;
+}
+
+/* Read an AMF3 int. */
+static int splice_int(SpliceState *state, int *val)
+{
+    int result = 0;
+    int byte_cnt = 0;
+    char byte;
+
+    do {
+        if (!splice_skip(state, 1))
             return 0;
+        byte = state->data[state->pos - 1];
+
+        if (byte_cnt == 3) {
+            result = (result << 8) | (byte & 0xff);
+        } else {
+            result = (result << 7) | (byte & 0x7f);
         }
-    }
-    Py_DECREF(class_def);
+        byte_cnt++;
+    } while (byte_cnt < 4 && (byte & 0x80));
 
-    int result = encode_dynamic_dict_AMF0(context, attrs);
-    Py_DECREF(attrs);
-    return result;
+    *val = result;
+    return 1;
 }
 
-/* Encode an AMF packet. */
-static int encode_packet(EncoderObj *context, PyObject *value)
+/*
+ * Re-number a reference.
+ *
+ * header_pos is the position of the reference header.
+ * shift is the number of flag bits below the reference index.
+ *
+ * Returns 1 on success, 0 on error, -1 if the reference
+ * points outside of the encoded bytes.
+ */
+static int splice_ref(EncoderObj *context, SpliceState *state, int table,
+    int header_pos, int header, int shift)
 {
-    // write flash client_type
-    PyObject *client_type = PyObject_GetAttrString(value, "client_type");
-    if (!client_type)
+    int idx = (header >> shift) - state->bases[table];
+    if (idx < 0 || idx >= state->counts[table])
+        return -1;
+
+    if (state->copied == -1)
+        return 1;
+
+    // Write everything before the reference as-is.
+    if (!Encoder_write(context, state->data + state->copied, header_pos - state->copied))
         return 0;
+    state->copied = state->pos;
 
-    short amf_client_type = (short) PyInt_AsLong(client_type);
-    Py_DECREF(client_type); 
-    if (amf_client_type < 0)
+    return _encode_int_AMF3(context,
+        ((idx + state->offsets[table]) << shift) | (header & ((1 << shift) - 1)));
+}
+
+/*
+ * Walk a string.
+ *
+ * str_idx is set to the index of the string
+ * in state->strings, or -1 for the empty string.
+ */
+static int splice_string(EncoderObj *context, SpliceState *state, int *str_idx)
+{
+    int header_pos = state->pos;
+    int header;
+    if (!splice_int(state, &header))
         return 0;
 
-    if (!encode_ushort(context, (unsigned short)amf_client_type))
+    if (header == EMPTY_STRING_TYPE) {
+        *str_idx = -1;
+        return 1;
+    }
+
+    if ((header & REFERENCE_BIT) == 0) {
+        *str_idx = (header >> 1) - state->bases[SPLICE_STRING];
+        return splice_ref(context, state, SPLICE_STRING, header_pos, header, 1);
+    }
+
+    int str_len = header >> 1;
+    if (!splice_append(&state->strings, &state->strings_len,
+        state->counts[SPLICE_STRING], state->pos, str_len, 0))
         return 0;
+    *str_idx = state->counts[SPLICE_STRING];
+    state->counts[SPLICE_STRING]++;
 
-    // write headers
-    PyObject *headers = PyObject_GetAttrString(value, "headers");
-    if (!headers)
+    return splice_skip(state, str_len);
+}
+
+/* Returns 1 if the string at str_idx is equal to a C string. */
+static int splice_string_equals(SpliceState *state, int str_idx, const char *value)
+{
+    if (str_idx < 0)
         return 0;
 
-    Py_ssize_t header_count = 0;
-    if (PySequence_Check(headers)) {
-        header_count = PySequence_Size(headers);
-        if (header_count == -1) {
-            Py_DECREF(headers);
-            return 0;
+    int str_len = state->strings[str_idx * 3 + 1];
+    if (str_len != (int)strlen(value))
+        return 0;
+
+    return memcmp(state->data + state->strings[str_idx * 3], value, (size_t)str_len) == 0;
+}
+
+/*
+ * Walk the header of a value that can be referenced.
+ *
+ * Returns 1 if the value is defined in the encoded bytes,
+ * 2 if it is a reference, 0 on error, -1 if the value can not be spliced.
+ */
+static int splice_obj_header(EncoderObj *context, SpliceState *state, int *header)
+{
+    int header_pos = state->pos;
+    if (!splice_int(state, header))
+        return 0;
+
+    if ((*header & REFERENCE_BIT) == 0) {
+        int result = splice_ref(context, state, SPLICE_OBJ, header_pos, *header, 1);
+        if (result != 1)
+            return result;
+        return 2;
+    }
+
+    state->counts[SPLICE_OBJ]++;
+    return 1;
+}
+
+/* Walk the name/value pairs of an obj or mixed array. */
+static int splice_dynamic_dict(EncoderObj *context, SpliceState *state)
+{
+    while (1) {
+        int str_idx;
+        int result = splice_string(context, state, &str_idx);
+        if (result != 1)
+            return result;
+
+        if (str_idx == -1) {
+            // Empty string marks end of name/value pairs
+            return 1;
         }
+
+        result = splice_value(context, state);
+        if (result != 1)
+            return result;
     }
+}
 
-    if (!encode_ushort(context, (unsigned short)header_count)) {
-        Py_DECREF(headers);
+/* Walk an array. */
+static int splice_array(EncoderObj *context, SpliceState *state)
+{
+    int header;
+    int result = splice_obj_header(context, state, &header);
+    if (result != 1)
+        return result == 2 ? 1 : result;
+
+    result = splice_dynamic_dict(context, state);
+    if (result != 1)
+        return result;
+
+    int i;
+    int array_len = header >> 1;
+    for (i = 0; i < array_len; i++) {
+        result = splice_value(context, state);
+        if (result != 1)
+            return result;
+    }
+
+    return 1;
+}
+
+/* Walk a Vector.<Object>. */
+static int splice_object_vector(EncoderObj *context, SpliceState *state)
+{
+    int header;
+    int result = splice_obj_header(context, state, &header);
+    if (result != 1)
+        return result == 2 ? 1 : result;
+
+    // Fixed flag
+    if (!splice_skip(state, 1))
         return 0;
+
+    // Item type name
+    int str_idx;
+    result = splice_string(context, state, &str_idx);
+    if (result != 1)
+        return result;
+
+    int i;
+    int count = header >> 1;
+    for (i = 0; i < count; i++) {
+        result = splice_value(context, state);
+        if (result != 1)
+            return result;
     }
 
+    return 1;
+}
+
+/* Walk a Dictionary. */
+static int splice_dictionary(EncoderObj *context, SpliceState *state)
+{
+    int header;
+    int result = splice_obj_header(context, state, &header);
+    if (result != 1)
+        return result == 2 ? 1 : result;
+
+    // Weak keys flag
+    if (!splice_skip(state, 1))
+        return 0;
+
+    // Keys and values
     int i;
-    for (i = 0; i < header_count; i++) {
-        PyObject *header = PySequence_GetItem(headers, i);
-        if (!header) {
-            Py_DECREF(headers);
-            return 0;
+    int count = header >> 1;
+    for (i = 0; i < count * 2; i++) {
+        result = splice_value(context, state);
+        if (result != 1)
+            return result;
+    }
+
+    return 1;
+}
+
+/* Walk an obj. */
+static int splice_obj(EncoderObj *context, SpliceState *state)
+{
+    int header_pos = state->pos;
+    int header;
+    int result = splice_obj_header(context, state, &header);
+    if (result != 1)
+        return result == 2 ? 1 : result;
+
+    int trait_idx;
+    if ((header & 0x02) == 0) {
+        // Trait reference
+        result = splice_ref(context, state, SPLICE_CLASS, header_pos, header, 2);
+        if (result != 1)
+            return result;
+        trait_idx = (header >> 2) - state->bases[SPLICE_CLASS];
+    } else {
+        int str_idx;
+        result = splice_string(context, state, &str_idx); // Alias
+        if (result != 1)
+            return result;
+
+        int kind = SPLICE_TRAIT_TYPED;
+        int static_len = header >> 4;
+        if ((header & EXTERNALIZABLE) == EXTERNALIZABLE) {
+            // Only proxies can be walked without their ClassDef.
+            if (!splice_string_equals(state, str_idx, "flex.messaging.io.ArrayCollection") &&
+                !splice_string_equals(state, str_idx, "flex.messaging.io.ObjectProxy"))
+                return -1;
+            kind = SPLICE_TRAIT_COLLECTION;
+            static_len = 0;
         }
 
-        int wrote_header = encode_packet_header_AMF0(context, header);
-        Py_DECREF(header);
-        if (!wrote_header) {
-            Py_DECREF(headers);
-            return 0;
+        int i;
+        for (i = 0; i < static_len; i++) {
+            result = splice_string(context, state, &str_idx);
+            if (result != 1)
+                return result;
         }
+
+        trait_idx = state->counts[SPLICE_CLASS];
+        if (!splice_append(&state->traits, &state->traits_len, trait_idx,
+            kind, static_len, (header & DYNAMIC) == DYNAMIC))
+            return 0;
+        state->counts[SPLICE_CLASS]++;
     }
-    Py_DECREF(headers);
 
-    // write messages
-    PyObject *messages = PyObject_GetAttrString(value, "messages");
-    if (!messages)
-        return 0;
+    int *trait = state->traits + trait_idx * 3;
+    if (trait[0] == SPLICE_TRAIT_COLLECTION)
+        return splice_value(context, state);
 
-    Py_ssize_t message_count = PySequence_Size(messages);
-    if (message_count == -1) {
-        Py_DECREF(messages);
+    int i;
+    int static_len = trait[1];
+    for (i = 0; i < static_len; i++) {
+        result = splice_value(context, state);
+        if (result != 1)
+            return result;
+    }
+
+    if (trait[2])
+        return splice_dynamic_dict(context, state);
+
+    return 1;
+}
+
+/*
+ * Walk an encoded AMF3 value.
+ *
+ * Returns 1 on success, 0 on error, and -1 if the
+ * value contains something that can not be spliced.
+ */
+static int splice_value(EncoderObj *context, SpliceState *state)
+{
+    if (!splice_skip(state, 1))
         return 0;
+    char byte = state->data[state->pos - 1];
+
+    int header;
+    int result;
+    switch(byte) {
+        case UNDEFINED_TYPE:
+        case NULL_TYPE:
+        case FALSE_TYPE:
+        case TRUE_TYPE:
+            return 1;
+        case INT_TYPE:
+            return splice_int(state, &header);
+        case DOUBLE_TYPE:
+            return splice_skip(state, 8);
+        case STRING_TYPE:
+            return splice_string(context, state, &result);
+        case DATE_TYPE:
+            result = splice_obj_header(context, state, &header);
+            if (result != 1)
+                return result == 2 ? 1 : result;
+            return splice_skip(state, 8);
+        case XML_DOC_TYPE:
+        case XML_TYPE:
+        case BYTE_ARRAY_TYPE:
+            result = splice_obj_header(context, state, &header);
+            if (result != 1)
+                return result == 2 ? 1 : result;
+            return splice_skip(state, header >> 1);
+        case ARRAY_TYPE:
+            return splice_array(context, state);
+        case OBJECT_TYPE:
+            return splice_obj(context, state);
+        case VECTOR_INT_TYPE:
+        case VECTOR_UINT_TYPE:
+            result = splice_obj_header(context, state, &header);
+            if (result != 1)
+                return result == 2 ? 1 : result;
+            return splice_skip(state, 1 + (header >> 1) * 4);
+        case VECTOR_DOUBLE_TYPE:
+            result = splice_obj_header(context, state, &header);
+            if (result != 1)
+                return result == 2 ? 1 : result;
+            return splice_skip(state, 1 + (header >> 1) * 8);
+        case VECTOR_OBJECT_TYPE:
+            return splice_object_vector(context, state);
+        case DICTIONARY_TYPE:
+            return splice_dictionary(context, state);
+        default:
+            break;
     }
-    if (!encode_ushort(context, (unsigned short)message_count)) {
-        Py_DECREF(messages);
+
+    return -1;
+}
+
+/* Read a big-endian unsigned int of byte_len bytes. */
+static int splice_uint(SpliceState *state, int byte_len, unsigned int *val)
+{
+    if (!splice_skip(state, byte_len))
         return 0;
+
+    unsigned int result = 0;
+    int i;
+    for (i = state->pos - byte_len; i < state->pos; i++) {
+        result = (result << 8) | (unsigned char)state->data[i];
     }
 
-    for (i = 0; i < message_count; i++) {
-        PyObject *message = PySequence_GetItem(messages, i);
-        if (!message) {
-            Py_DECREF(messages);
+    *val = result;
+    return 1;
+}
+
+/* Walk the name/value pairs of an AMF0 obj. */
+static int splice_dynamic_dict_AMF0(EncoderObj *context, SpliceState *state)
+{
+    while (1) {
+        unsigned int key_len;
+        if (!splice_uint(state, 2, &key_len))
             return 0;
+
+        if (key_len == 0) {
+            // Empty key marks end of name/value pairs
+            if (!splice_skip(state, 1))
+                return 0;
+            if (state->data[state->pos - 1] != OBJECT_END_AMF0)
+                return -1;
+            return 1;
         }
 
-        int wrote_message = encode_packet_message_AMF0(context, message);
-        Py_DECREF(message);
-        if (!wrote_message) {
-            Py_DECREF(messages);
+        if (!splice_skip(state, (int)key_len))
             return 0;
-        }
+
+        int result = splice_value_AMF0(context, state);
+        if (result != 1)
+            return result;
     }
-    Py_DECREF(messages);
-    return 1;
 }
 
-/* Encode a Packet header in AMF0. */
-static int encode_packet_header_AMF0(EncoderObj *context, PyObject *value)
+/*
+ * Walk an encoded AMF0 value.
+ *
+ * Returns 1 on success, 0 on error, and -1 if the
+ * value contains something that can not be spliced.
+ */
+static int splice_value_AMF0(EncoderObj *context, SpliceState *state)
 {
-    PyObject *header_name = PyObject_GetAttrString(value, "name");
-    if (!header_name)
+    if (!splice_skip(state, 1))
         return 0;
+    char byte = state->data[state->pos - 1];
 
-    int result = encode_object_as_string_AMF0(context, header_name, 0);
-    Py_DECREF(header_name);
-    if (!result)
-        return 0;
+    unsigned int val;
+    int result;
+    switch(byte) {
+        case NULL_AMF0:
+        case UNDEFINED_AMF0:
+            return 1;
+        case NUMBER_AMF0:
+            return splice_skip(state, 8);
+        case BOOL_AMF0:
+            return splice_skip(state, 1);
+        case DATE_AMF0:
+            return splice_skip(state, 10);
+        case STRING_AMF0:
+            if (!splice_uint(state, 2, &val))
+                return 0;
+            return splice_skip(state, (int)val);
+        case LONG_STRING_AMF0:
+        case XML_DOC_AMF0:
+            if (!splice_uint(state, 4, &val))
+                return 0;
+            return splice_skip(state, (int)val);
+        case REF_AMF0:
+        {
+            int header_pos = state->pos - 1;
+            if (!splice_uint(state, 2, &val))
+                return 0;
 
-    PyObject *required = PyObject_GetAttrString(value, "required");
-    if (!required)
-        return 0;
+            int idx = (int)val - state->bases[SPLICE_OBJ];
+            if (idx < 0 || idx >= state->counts[SPLICE_OBJ])
+                return -1;
 
-    result = encode_bool_AMF0(context, required);
-    Py_DECREF(required);
-    if (!result)
-        return 0;
+            if (state->copied == -1)
+                return 1;
 
-    PyObject *body = PyObject_GetAttrString(value, "value");
-    if (!body)
-        return 0;
+            idx += state->offsets[SPLICE_OBJ];
+            if (idx >= MAX_USHORT)
+                return -1;
+
+            if (!Encoder_write(context, state->data + state->copied, header_pos - state->copied))
+                return 0;
+            state->copied = state->pos;
+
+            if (!Encoder_writeByte(context, REF_AMF0))
+                return 0;
+            return encode_ushort(context, (unsigned short)idx);
+        }
+        case OBJECT_AMF0:
+            state->counts[SPLICE_OBJ]++;
+            return splice_dynamic_dict_AMF0(context, state);
+        case MIXED_ARRAY_AMF0:
+            state->counts[SPLICE_OBJ]++;
+            if (!splice_skip(state, 4)) // Max index
+                return 0;
+            return splice_dynamic_dict_AMF0(context, state);
+        case TYPED_OBJ_AMF0:
+            state->counts[SPLICE_OBJ]++;
+            if (!splice_uint(state, 2, &val)) // Alias
+                return 0;
+            if (!splice_skip(state, (int)val))
+                return 0;
+            return splice_dynamic_dict_AMF0(context, state);
+        case ARRAY_AMF0:
+        {
+            state->counts[SPLICE_OBJ]++;
+            if (!splice_uint(state, 4, &val))
+                return 0;
+
+            unsigned int i;
+            for (i = 0; i < val; i++) {
+                result = splice_value_AMF0(context, state);
+                if (result != 1)
+                    return result;
+            }
+            return 1;
+        }
+        case AMF3_AMF0:
+        {
+            // AMF3 values use their own reference tables,
+            // they are copied without re-numbering.
+            SpliceState amf3_state;
+            memset(&amf3_state, 0, sizeof(SpliceState));
+            amf3_state.data = state->data;
+            amf3_state.len = state->len;
+            amf3_state.pos = state->pos;
+            amf3_state.copied = -1;
+
+            result = splice_value(context, &amf3_state);
+            if (amf3_state.strings != NULL)
+                free(amf3_state.strings);
+            if (amf3_state.traits != NULL)
+                free(amf3_state.traits);
+
+            state->pos = amf3_state.pos;
+            return result;
+        }
+        default:
+            break;
+    }
+
+    return -1;
+}
+
+/*
+ * Write an encoded value to the output.
+ *
+ * References within the encoded value are re-numbered
+ * to match the reference tables of the output,
+ * and the reference tables are advanced past
+ * the references defined in the encoded value.
+ *
+ * bases is the first reference index of each table in the
+ * encoded bytes, counts is set to the number of references
+ * defined in the encoded bytes. If counts are already known
+ * (not -1), the encoded bytes are not validated again.
+ *
+ * AMF0 values only use the first table.
+ *
+ * Returns 1 on success, 0 on error, and -1 if the
+ * value can not be spliced and must be encoded normally.
+ */
+static int splice_encoded(EncoderObj *context, char *data, int len, int amf3, int *bases, int *counts)
+{
+    SpliceState state;
+    state.data = data;
+    state.len = len;
+    state.strings = NULL;
+    state.traits = NULL;
+    state.strings_len = 0;
+    state.traits_len = 0;
+
+    RefObj *tables[3] = {(RefObj*)context->obj_refs,
+        (RefObj*)context->string_refs, (RefObj*)context->class_refs};
+    int table_count = 3;
+    if (!amf3)
+        table_count = 1;
 
-    // Encode header value with a new context, so references are reset
-    EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 0, 1);
-    if (!new_context) {
-        Py_DECREF(body);
-        return 0;
+    int i;
+    int result = 1;
+    int rebase = 0;
+    for (i = 0; i < 3; i++) {
+        state.bases[i] = bases[i];
+        state.offsets[i] = bases[i];
+        if (i < table_count) {
+            state.offsets[i] = tables[i]->idx;
+            if (state.offsets[i] != bases[i])
+                rebase = 1;
+        }
     }
 
-    result = encode_AMF0(new_context, body);
-    Py_DECREF(body);
-    if (!result) {
-        Py_DECREF(new_context);
-        return 0;
+    if (counts[0] == -1) {
+        // Validate
+        state.pos = 0;
+        state.copied = -1;
+        state.counts[0] = state.counts[1] = state.counts[2] = 0;
+        if (amf3) {
+            result = splice_value(context, &state);
+        } else {
+            result = splice_value_AMF0(context, &state);
+        }
+
+        if (result == 1 && state.pos != len) {
+            PyErr_SetString(amfast_EncodeError, "Encoded value has extra bytes.");
+            result = 0;
+        }
+
+        if (result == 1) {
+            for (i = 0; i < 3; i++) {
+                counts[i] = state.counts[i];
+            }
+        }
     }
 
-    int new_len = Encoder_tell(new_context);
-    char *new_buf = Encoder_read(new_context); // Don't decref new_context until we've used new_buf
-    if (new_buf == NULL) {
-        Py_DECREF(new_context);
-        return 0;
+    if (result == 1) {
+        if (rebase) {
+            // Re-number references while writing.
+            state.pos = 0;
+            state.copied = 0;
+            state.counts[0] = state.counts[1] = state.counts[2] = 0;
+            if (amf3) {
+                result = splice_value(context, &state);
+            } else {
+                result = splice_value_AMF0(context, &state);
+            }
+
+            if (result == 1)
+                result = Encoder_write(context, data + state.copied, len - state.copied);
+        } else {
+            result = Encoder_write(context, data, len);
+        }
     }
 
-    if (!encode_ulong(context, (unsigned int)new_len)) {
-        Py_DECREF(new_context);
-        return 0;
+    if (state.strings != NULL)
+        free(state.strings);
+    if (state.traits != NULL)
+        free(state.traits);
+
+    if (result == 1) {
+        for (i = 0; i < table_count; i++) {
+            tables[i]->idx += counts[i];
+        }
     }
 
-    result = Encoder_write(context, new_buf, new_len);
-    Py_DECREF(new_context);
     return result;
 }
 
-/* Encode a Packet message in AMF0. */
-static int encode_packet_message_AMF0(EncoderObj *context, PyObject *value)
+/*
+ * Write part of an object supporting the buffer protocol.
+ *
+ * end == -1 writes to the end of the buffer.
+ *
+ * See splice_encoded for return values.
+ */
+static int splice_source(EncoderObj *context, PyObject *source, Py_ssize_t start, Py_ssize_t end,
+    int amf3, int *bases, int *counts)
 {
-    PyObject *target = PyObject_GetAttrString(value, "target");
-    if (!target)
-        return 0;
-
-    int result = encode_object_as_string_AMF0(context, target, 0);
-    Py_DECREF(target);
-    if (!result)
-        return 0;
+    char *data = NULL;
+    Py_ssize_t data_len = 0;
+    int has_view = 0;
+#ifdef PyBUF_SIMPLE
+    Py_buffer view;
+    if (PyObject_CheckBuffer(source)) {
+        if (PyObject_GetBuffer(source, &view, PyBUF_SIMPLE) == -1)
+            return 0;
+        has_view = 1;
+        data = (char*)view.buf;
+        data_len = view.len;
+    } else
+#endif
+    {
+        const void *c_buf;
+        if (PyObject_AsReadBuffer(source, &c_buf, &data_len) == -1)
+            return 0;
+        data = (char*)c_buf;
+    }
 
-    PyObject *response = PyObject_GetAttrString(value, "response");
-    if (!response)
-        return 0;
+    if (end == -1)
+        end = data_len;
 
-    result = encode_object_as_string_AMF0(context, response, 0);
-    if (!result) {
-        Py_DECREF(response);
-        return 0;
+    int result = 0;
+    if (start < 0 || end < start || end > data_len) {
+        PyErr_SetString(amfast_EncodeError, "Encoded value is out of range of its source.");
+    } else if (end - start > INT_MAX) {
+        // Spans are walked with int positions,
+        // encode values this large normally.
+        result = -1;
+    } else {
+        result = splice_encoded(context, data + start, (int)(end - start), amf3, bases, counts);
     }
 
-    PyObject *body = PyObject_GetAttrString(value, "body");
-    if (!body) {
-        Py_DECREF(response);
-        return 0;
-    }
+#ifdef PyBUF_SIMPLE
+    if (has_view)
+        PyBuffer_Release(&view);
+#endif
 
-    // Encode message body with a new context, so references are reset
-    EncoderObj *new_context;
-    if (PySequence_Size(response) > 0 && (PyList_Check(body) || PyTuple_Check(body))) {
-        // We're encoding a request,
-        // Don't count argument list 
-        // in reference count.
+    return result;
+}
 
-        // Always use AMF0 context!
-        new_context = (EncoderObj*)Encoder_copy(context, 0, 1);
-        result = write_list_AMF0(new_context, body, 0);
-    } else {
-        if (context->amf3 == Py_True) {
-            new_context = (EncoderObj*)Encoder_copy(context, 1, 1);
-            if (!Encoder_writeByte(new_context, AMF3_AMF0))
-                return 0;
-            result = encode_AMF3(new_context, body);
-        } else {
-            new_context = (EncoderObj*)Encoder_copy(context, 0, 1);
-            result = encode_AMF0(new_context, body);
+/* Write a LazyValue that has not been decoded. */
+static int write_lazy_AMF3(EncoderObj *context, PyObject *value)
+{
+    LazyValueObj *lazy = (LazyValueObj*)value;
+
+    if (lazy->value == NULL && lazy->spliceable != -1 && lazy->end != -1) {
+        int bases[3] = {lazy->obj_len, lazy->string_len, lazy->class_len};
+        int counts[3] = {-1, -1, -1};
+        if (lazy->spliceable == 1) {
+            counts[0] = lazy->obj_count;
+            counts[1] = lazy->string_count;
+            counts[2] = lazy->class_count;
+        }
+
+        int result = splice_source(context, lazy->source, lazy->start, lazy->end,
+            1, bases, counts);
+        if (result == 1) {
+            lazy->spliceable = 1;
+            lazy->obj_count = counts[0];
+            lazy->string_count = counts[1];
+            lazy->class_count = counts[2];
+            return 1;
+        } else if (result == 0) {
+            return 0;
         }
+        lazy->spliceable = -1;
     }
-    Py_DECREF(response);
-    Py_DECREF(body);
 
-    if (!result) {
-        Py_DECREF(new_context);
+    // Value has been decoded, or can not be spliced.
+    PyObject *decoded = PyObject_CallMethod(value, "decode", NULL);
+    if (decoded == NULL)
         return 0;
-    }
 
-    int new_len = Encoder_tell(new_context);
-    char *new_buf = Encoder_read(new_context); // Don't decref new_context until we've used new_buf
-    if (new_buf == NULL) {
-        Py_DECREF(new_context);
+    int result = encode_AMF3(context, decoded);
+    Py_DECREF(decoded);
+    return result;
+}
+
+/* Returns 1 if an AsEncoded value is AMF3 encoded, 0 if not, -1 on error. */
+static int encoded_is_amf3(PyObject *value)
+{
+    PyObject *amf3 = PyObject_GetAttrString(value, "amf3");
+    if (amf3 == NULL)
+        return -1;
+
+    int result = PyObject_IsTrue(amf3);
+    Py_DECREF(amf3);
+    return result;
+}
+
+/* Write the bytes of an AsEncoded value. */
+static int splice_as_encoded(EncoderObj *context, PyObject *value, int amf3)
+{
+    PyObject *bytes = PyObject_GetAttrString(value, "bytes");
+    if (bytes == NULL)
         return 0;
-    }
 
-    if (!encode_ulong(context, (unsigned int)new_len)) {
-        Py_DECREF(new_context);
+    // Encoded values are encoded with their own reference tables.
+    int bases[3] = {0, 0, 0};
+    int counts[3] = {-1, -1, -1};
+    int result = splice_source(context, bytes, 0, -1, amf3, bases, counts);
+    Py_DECREF(bytes);
+
+    if (result == -1) {
+        PyErr_SetString(amfast_EncodeError, "AsEncoded bytes contain a value that can not be spliced.");
         return 0;
     }
 
-    result = Encoder_write(context, new_buf, new_len);
-    Py_DECREF(new_context);
     return result;
 }
 
-/* Encoding function map for AMF0. */
-static int encode_AMF0(EncoderObj *context, PyObject *value)
+/* Write an AsEncoded value in AMF3. */
+static int write_encoded_AMF3(EncoderObj *context, PyObject *value)
 {
-    // Determine object type
-    if (value == Py_None) {
-        return Encoder_writeByte(context, NULL_AMF0);
-    } else if (PyBool_Check(value)) {
-        if (!Encoder_writeByte(context, BOOL_AMF0))
-            return 0;
-        return encode_bool_AMF0(context, value);
-    } else if (PyInt_Check(value)) {
-        if (!Encoder_writeByte(context, NUMBER_AMF0))
-            return 0;
-        return encode_int_AMF0(context, value);
-    } else if (PyLong_Check(value)) {
-        if (!Encoder_writeByte(context, NUMBER_AMF0))
-            return 0;
-        return encode_long_AMF0(context, value);
-    } else if (PyFloat_Check(value)) {
-        if (!Encoder_writeByte(context, NUMBER_AMF0))
-            return 0;
-        return encode_float_AMF0(context, value);
-    } else if (PyString_Check(value)) {
-        return write_string_AMF0(context, value);
-    } else if (PyUnicode_Check(value)) {
-        return write_unicode_AMF0(context, value);
-    } else if (PyList_Check(value) || PyTuple_Check(value)) {
-        return write_list_AMF0(context, value, 1);
-    } else if (PyDict_Check(value)) {
-        return write_dict_AMF0(context, value);
-    } else if (PyDateTime_Check(value) || PyDate_Check(value)) {
-       return write_date_AMF0(context, value);
-    } else if (check_xml(value)) {
-        return write_xml_AMF0(context, value);
-    } else if (check_byte_array(value)) {
-        // Force switch to AMF3
-        if (Encoder_writeByte(context, AMF3_AMF0) == 0)
-            return 0;
-
-        // Create new context for AMF3 encode
-        EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
-        if (new_context == NULL)
-            return 0;
+    int amf3 = encoded_is_amf3(value);
+    if (amf3 == -1)
+        return 0;
 
-        int result = encode_AMF3(new_context, value);
-        Py_DECREF(new_context);
-        return result;
-    } else if (check_proxy(value)) {
-        return write_proxy_AMF0(context, value);
-    } else if (check_no_proxy(value)) {
-        return write_proxy_AMF0(context, value);
+    if (!amf3) {
+        PyErr_SetString(amfast_EncodeError, "AMF0 encoded AsEncoded can not be written in AMF3.");
+        return 0;
     }
 
-    return write_object_AMF0(context, value);
+    return splice_as_encoded(context, value, 1);
 }
 
-/* Encoding function map. */
-static int encode_AMF3(EncoderObj *context, PyObject *value)
+/* Write an AsEncoded value in AMF0. */
+static int write_encoded_AMF0(EncoderObj *context, PyObject *value)
 {
-    // Determine object type
-    if (value == Py_None) {
-        return encode_none_AMF3(context);
-    } else if (PyBool_Check(value)) {
-        return encode_bool_AMF3(context, value);
-    } else if (PyInt_Check(value)) {
-        return write_int_AMF3(context, value);
-    } else if (PyString_Check(value)) {
-        if (!Encoder_writeByte(context, STRING_TYPE))
-            return 0;
-        return serialize_string_AMF3(context, value);
-    } else if (PyUnicode_Check(value)) {
-        if (!Encoder_writeByte(context, STRING_TYPE))
-            return 0;
-        return serialize_unicode_AMF3(context, value);
-    } else if (PyFloat_Check(value)) {
-        if (!Encoder_writeByte(context, DOUBLE_TYPE))
-            return 0;
-        return encode_float(context, value);
-    } else if (PyLong_Check(value)) {
-        if (!Encoder_writeByte(context, DOUBLE_TYPE))
-            return 0;
-        return encode_long_AMF3(context, value);
-    } else if (PyList_Check(value) || PyTuple_Check(value)) {
-        return write_list_AMF3(context, value);
-    } else if (PyDict_Check(value)) {
-        return write_dict_AMF3(context, value);
-    } else if (PyDateTime_Check(value) || PyDate_Check(value)) {
-        if (!Encoder_writeByte(context, DATE_TYPE))
-            return 0;
-        return serialize_date_AMF3(context, value);
-    } else if (check_xml(value)) {
-        return write_xml_AMF3(context, value);
-    } else if (check_byte_array(value)) {
-        if (!Encoder_writeByte(context, BYTE_ARRAY_TYPE))
-            return 0;
-        return serialize_byte_array_AMF3(context, value);
-    } else if (check_proxy(value)) {
-        return write_proxy_AMF3(context, value);
-    } else if (check_no_proxy(value)) {
-        return write_no_proxy_AMF3(context, value);
-    }
+    int amf3 = encoded_is_amf3(value);
+    if (amf3 == -1)
+        return 0;
 
-    #ifdef Py_BYTEARRAYOBJECT_H
-    // ByteArray encoding is only available in 2.6+
-    else if (PyByteArray_Check(value)) {
-        if (!Encoder_writeByte(context, BYTE_ARRAY_TYPE))
-            return 0;
-        return serialize_byte_array_AMF3(context, value);
-    } 
-    #endif
+    if (!amf3)
+        return splice_as_encoded(context, value, 0);
 
-    // Custom object
-    if (!Encoder_writeByte(context, OBJECT_TYPE))
-            return 0;
+    // Force switch to AMF3
+    if (Encoder_writeByte(context, AMF3_AMF0) == 0)
+        return 0;
 
-    return serialize_object_AMF3(context, value);
+    // Create new context for AMF3 encode
+    EncoderObj *new_context = (EncoderObj*)Encoder_copy(context, 1, 0);
+    if (new_context == NULL)
+        return 0;
+
+    int result = splice_as_encoded(new_context, value, 1);
+    Py_DECREF(new_context);
+    return result;
 }
 
 /* Encode a Python object in AMF. */
@@ -1972,6 +5141,10 @@ static PyObject* py_encode(PyObject *self, PyObject *args, PyObject *kwargs)
     }
     EncoderObj *enc_context = (EncoderObj*)context;
 
+    long grows = 0;
+    if (enc_context->stats != Py_None)
+        grows = Stats_bufferGrows(enc_context->buf, enc_context->int_buf);
+
     int result;
     if (enc_context->amf3 == Py_True) {
         result = encode_AMF3(enc_context, value);
@@ -1979,6 +5152,12 @@ static PyObject* py_encode(PyObject *self, PyObject *args, PyObject *kwargs)
         result = encode_AMF0(enc_context, value);
     }
 
+    if (enc_context->stats != Py_None) {
+        CodecStatsObj *stats = (CodecStatsObj*)enc_context->stats;
+        stats->buffer_grows += Stats_bufferGrows(enc_context->buf, enc_context->int_buf) - grows;
+        stats->calls++;
+    }
+
     if (result == 0) {
         Py_DECREF(context);
         return NULL;
@@ -2020,7 +5199,17 @@ static PyObject* py_encode_packet(PyObject *self, PyObject *args, PyObject *kwar
     }
     EncoderObj *enc_context = (EncoderObj*)context;
 
+    long grows = 0;
+    if (enc_context->stats != Py_None)
+        grows = Stats_bufferGrows(enc_context->buf, enc_context->int_buf);
+
     int result = encode_packet(enc_context, value);
+
+    if (enc_context->stats != Py_None) {
+        CodecStatsObj *stats = (CodecStatsObj*)enc_context->stats;
+        stats->buffer_grows += Stats_bufferGrows(enc_context->buf, enc_context->int_buf) - grows;
+        stats->calls++;
+    }
     if (result == 0) {
         Py_DECREF(context);
         return NULL;
@@ -2031,6 +5220,33 @@ static PyObject* py_encode_packet(PyObject *self, PyObject *args, PyObject *kwar
     return return_val;
 }
 
+/* Encode the fields of an ISmallMessage. */
+static PyObject* py_write_small_message(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *value;
+    PyObject *context;
+    int msg_type;
+    PyObject *raw_attrs = NULL;
+
+    if (!PyArg_ParseTuple(args, "OOi|O", &value, &context, &msg_type, &raw_attrs))
+        return NULL;
+
+    if (Encoder_check(context) != 1) {
+        PyErr_SetString(amfast_EncodeError, "Argument must be type amfast.context.EncoderContext");
+        return NULL;
+    }
+
+    if (msg_type < SMALL_ASYNC_MSG || msg_type > SMALL_ACKNOWLEDGE_MSG) {
+        PyErr_SetString(amfast_EncodeError, "Unknown ISmallMessage type.");
+        return NULL;
+    }
+
+    if (!encode_small_message((EncoderObj*)context, value, msg_type, raw_attrs))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 /* Expose functions as Python module functions. */
 static PyMethodDef encode_methods[] = {
     {"encode", (PyCFunction)py_encode, METH_VARARGS | METH_KEYWORDS,
@@ -2056,6 +5272,21 @@ static PyMethodDef encode_methods[] = {
     " * packet - amfast.remoting.Packet, The AMF packet to encode.\n"
     " * contest - amfast.context.EncoderObj, Holds options valid for a single encode session.\n"},
 
+    {"write_small_message", (PyCFunction)py_write_small_message, METH_VARARGS | METH_KEYWORDS,
+    "Description:\n"
+    "=============\n"
+    "Encode the fields of a message as a Flex ISmallMessage (DSA, DSC or DSK).\n"
+    "UIDs are written as 16 byte ByteArrays.\n\n"
+    "Useage:\n"
+    "===========\n"
+    "write_small_message(obj, context, msg_type, raw_attrs=None)\n\n"
+    "arguments:\n"
+    "===========\n"
+    " * obj - AbstractMessage, The message to encode.\n"
+    " * context - amfast.context.EncoderContext, Holds options valid for a single encode session.\n"
+    " * msg_type - int, 1 for AsyncMessage, 2 for CommandMessage, 3 for AcknowledgeMessage.\n"
+    " * raw_attrs - dict, ClassDef.raw_attrs, keys = attribute names, values = undecoded attribute names.\n"},
+
     {NULL, NULL, 0, NULL}   /* sentinel */
 };
 
@@ -2099,6 +5330,57 @@ initencode(void)
         }
     }
 
+    if (!decode_mod) {
+        decode_mod = PyImport_ImportModule("amfast.decode");
+        if (!decode_mod)
+            return;
+    }
+
+    lazy_value_type = (PyTypeObject*)PyObject_GetAttrString(decode_mod, "LazyValue");
+    if (lazy_value_type == NULL)
+        return;
+
+    // Setup Vectors
+    PyObject *array_mod = PyImport_ImportModule("array");
+    if (array_mod == NULL)
+        return;
+
+    array_type = (PyTypeObject*)PyObject_GetAttrString(array_mod, "array");
+    Py_DECREF(array_mod);
+    if (array_type == NULL)
+        return;
+
+    numpy_name = PyString_InternFromString("numpy");
+    if (numpy_name == NULL)
+        return;
+
+    // Setup encode plans
+    if (PyType_Ready(&EncodePlanType) < 0)
+        return;
+
+    plans_name = PyString_InternFromString("_encode_plans");
+    if (plans_name == NULL)
+        return;
+
+    PyObject *class_def_class = PyObject_GetAttrString(class_def_mod, "ClassDef");
+    if (class_def_class == NULL)
+        return;
+
+    PyObject *get_func = PyObject_GetAttrString(class_def_class, "getStaticAttrVals");
+    Py_DECREF(class_def_class);
+    if (get_func == NULL)
+        return;
+
+    if (!PyMethod_Check(get_func)) {
+        Py_DECREF(get_func);
+        PyErr_SetString(PyExc_TypeError, "ClassDef.getStaticAttrVals is not a method.");
+        return;
+    }
+
+    default_static_attr_vals = PyMethod_GET_FUNCTION(get_func);
+    Py_INCREF(default_static_attr_vals);
+    Py_DECREF(get_func);
+
     amfast_Error = PyObject_GetAttrString(amfast_mod, "AmFastError");
     if (amfast_Error == NULL) {
         return;
@@ -167,6 +167,8 @@ class Connection(object):
         else:
             headers = None
 
-        return msg.__class__(headers=headers, body=msg.body,
+        # Use the raw body, so that a lazily decoded
+        # body can be passed through without being decoded.
+        return msg.__class__(headers=headers, body=msg.getRawBody(),
             timeToLive=msg.timeToLive, clientId=client_id,
             destination=msg.destination, timestamp=msg.timestamp)
@@ -50,9 +50,15 @@ class DjangoChannel(HttpChannel):
             response_packet = self.invoke(request_packet)
             raw_response = self.encode(response_packet)
 
+            if not isinstance(raw_response, list):
+                raw_response = [raw_response]
+
             http_response = http.HttpResponse(mimetype=self.CONTENT_TYPE)
-            http_response['Content-Length'] = str(len(raw_response))
-            http_response.write(raw_response)
+            content_length = 0
+            for chunk in raw_response:
+                content_length += len(chunk)
+                http_response.write(chunk)
+            http_response['Content-Length'] = str(content_length)
             return http_response
         except amfast.AmFastError, exc:
             return http.HttpResponseServerError(mimetype='text/plain', content=self.getBadServerMsg())
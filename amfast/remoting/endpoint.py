@@ -8,6 +8,78 @@ class Endpoint(object):
             amfast.logger.debug("<%s>%s</%s>" %
                     (label, repr(raw), label))
 
+class ContextPool(object):
+    """A thread-safe pool of re-usable encoder or decoder contexts.
+
+    Contexts are reset when they are returned to the pool,
+    so they do not hold references to encoded or decoded objects
+    between uses. Internal output buffers keep the memory they
+    have allocated.
+
+    Contexts are keyed on the settings they were created with.
+    When a new key is added and the pool already holds max_keys keys,
+    idle contexts for every other key are dropped, so contexts created
+    with out of date settings are not kept forever.
+
+    arguments
+    ==========
+     * max_size - int, maximum number of idle contexts to keep for each key. Default = 8
+     * max_keys - int, maximum number of keys to keep idle contexts for. Default = 4
+    """
+
+    def __init__(self, max_size=8, max_keys=4):
+        self.max_size = max_size
+        self.max_keys = max_keys
+        self._lock = amfast.mutex_cls()
+        self._contexts = {}
+
+    def get(self, key):
+        """Returns an idle context, or None if there are none available.
+
+        arguments
+        ==========
+         * key - object, identifies the type of context to retrieve.
+        """
+        self._lock.acquire()
+        try:
+            contexts = self._contexts.get(key, None)
+            if contexts:
+                return contexts.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Drops all idle contexts."""
+        self._lock.acquire()
+        try:
+            self._contexts.clear()
+        finally:
+            self._lock.release()
+
+    def put(self, key, context):
+        """Resets a context and returns it to the pool.
+
+        arguments
+        ==========
+         * key - object, identifies the type of context being returned.
+         * context - EncoderContext or DecoderContext, context to return.
+        """
+        context.reset()
+
+        self._lock.acquire()
+        try:
+            contexts = self._contexts.get(key, None)
+            if contexts is None:
+                if len(self._contexts) >= self.max_keys:
+                    self._contexts.clear()
+                contexts = self._contexts[key] = []
+
+            if len(contexts) < self.max_size:
+                contexts.append(context)
+        finally:
+            self._lock.release()
+
 class AmfEndpoint(Endpoint):
     """An Endpoint that can encode/decode AMF packets.
 
@@ -15,9 +87,14 @@ class AmfEndpoint(Endpoint):
     ==========
      * encoder - amfast.encoder.Encoder, object used to encode AMF Packets.
      * decoder - amfast.decoder.Decoder, object used to decode AMF Packets.
+     * context_pool_size - int, number of idle contexts to keep for re-use.
+         Set to 0 to create a new context for every call. Default = 8
+     * collect_stats - bool, True to aggregate CodecStats for every packet
+         handled by this endpoint in encode_stats and decode_stats. Default = False
     """
 
-    def __init__(self, encoder=None, decoder=None):
+    def __init__(self, encoder=None, decoder=None, context_pool_size=8,
+        collect_stats=False):
         if encoder is None:
             from amfast.encoder import Encoder
             encoder = Encoder()
@@ -28,16 +105,79 @@ class AmfEndpoint(Endpoint):
             decoder = Decoder()
         self.decoder = decoder
 
+        if collect_stats is True:
+            from amfast.context import CodecStats
+            if getattr(self.encoder, 'stats', None) is None:
+                self.encoder.stats = CodecStats()
+            if getattr(self.decoder, 'stats', None) is None:
+                self.decoder.stats = CodecStats()
+        self.encode_stats = getattr(self.encoder, 'stats', None)
+        self.decode_stats = getattr(self.decoder, 'stats', None)
+
+        self.context_pool_size = context_pool_size
+        self._encoder_pool = ContextPool(context_pool_size)
+        self._decoder_pool = ContextPool(context_pool_size)
+
+    def _usePool(self, coder):
+        if self.context_pool_size < 1 or not hasattr(coder, '_getContext') or \
+            not hasattr(coder, '_getContextKey'):
+            return False
+
+        # Contexts writing to a user supplied buffer can not be re-used.
+        return getattr(coder, 'buffer', None) is None
+
+    def _getEncoderContext(self, amf3):
+        # Key on every setting, so changes to the encoder
+        # are not ignored by pooled contexts.
+        key = self.encoder._getContextKey(amf3)
+
+        context = self._encoder_pool.get(key)
+        if context is None:
+            context = self.encoder._getContext(amf3)
+        return (key, context)
+
+    def _getDecoderContext(self, raw, amf3):
+        key = self.decoder._getContextKey(amf3)
+
+        context = self._decoder_pool.get(key)
+        if context is None:
+            context = self.decoder._getContext(raw, amf3)
+        else:
+            context.reset(raw)
+        return (key, context)
+
+    def _decode(self, decode_func, raw, amf3=None):
+        key, context = self._getDecoderContext(raw, amf3)
+        try:
+            return decode_func(context)
+        finally:
+            self._decoder_pool.put(key, context)
+
+    def _encode(self, encode_func, obj, amf3=None):
+        key, context = self._getEncoderContext(amf3)
+        try:
+            return encode_func(obj, context)
+        finally:
+            self._encoder_pool.put(key, context)
+
     def decodePacket(self, raw_packet, *args, **kwargs):
         """Decode an AMF packet."""
         if amfast.log_raw:
             self.logRaw('rawDecodePacket', raw_packet)
 
-        return self.decoder.decode_packet(raw_packet)
+        if not self._usePool(self.decoder):
+            return self.decoder.decode_packet(raw_packet)
+
+        from amfast.decode import decode_packet
+        return self._decode(decode_packet, raw_packet)
 
     def encodePacket(self, packet):
         """Encode an AMF packet."""
-        raw_packet = self.encoder.encode_packet(packet)
+        if self._usePool(self.encoder):
+            from amfast.encode import encode_packet
+            raw_packet = self._encode(encode_packet, packet)
+        else:
+            raw_packet = self.encoder.encode_packet(packet)
 
         if amfast.log_raw:
             self.logRaw('rawEncodePacket', raw_packet)
@@ -49,11 +189,19 @@ class AmfEndpoint(Endpoint):
         if amfast.log_raw:
             self.logRaw('rawDecodeObject', raw_obj)
 
-        return self.decoder.decode(raw_obj, amf3)
+        if not self._usePool(self.decoder):
+            return self.decoder.decode(raw_obj, amf3)
+
+        from amfast.decode import decode
+        return self._decode(decode, raw_obj, amf3)
 
     def encode(self, obj, amf3=None):
         """Encode an AMF object."""
-        raw_obj = self.encoder.encode(obj, amf3)
+        if self._usePool(self.encoder):
+            from amfast.encode import encode
+            raw_obj = self._encode(encode, obj, amf3)
+        else:
+            raw_obj = self.encoder.encode(obj, amf3)
 
         if amfast.log_raw:
             self.logRaw('rawEncodeObject', raw_obj)
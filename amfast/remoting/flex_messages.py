@@ -10,9 +10,11 @@ from amfast.class_def.as_types import AsError
 try:
     # Use decode module if available.
     # Users may be using PyAmf instead.
-    from amfast.decode import decode
+    from amfast.decode import decode, decode_lazy, LazyValue, read_small_message
+    from amfast.encode import write_small_message
 except ImportError:
-    pass
+    # No lazy values without the decode module.
+    LazyValue = ()
 
 class FlexMessageError(remoting.RemotingError):
     """Errors raised by this module."""
@@ -63,6 +65,35 @@ class AbstractMessage(object):
             messageId = self._getId()
         self.messageId = messageId
 
+    def _getBody(self):
+        body = self._body
+        if isinstance(body, LazyValue):
+            # Body was decoded lazily,
+            # decode it on first access.
+            body = self._body = body.decode()
+        return body
+
+    def _setBody(self, body):
+        self._body = body
+
+    body = property(_getBody, _setBody)
+
+    def getRawBody(self):
+        """Returns the body without decoding a lazily decoded body."""
+        return self._body
+
+    def __getstate__(self):
+        # Make sure lazy body is decoded before pickling.
+        self._getBody()
+        return self.__dict__
+
+    def __setstate__(self, state):
+        # Messages pickled before body was a
+        # property store it as 'body'.
+        if 'body' in state:
+            state['_body'] = state.pop('body')
+        self.__dict__.update(state)
+
     def invoke(self, packet, msg):
         """Invoke all message headers."""
         if amfast.log_debug:
@@ -90,6 +121,9 @@ class AbstractMessage(object):
     def acknowledge(self, packet, msg):
         """Return a successful result message."""
         class_ = self.getAcknowledgeClass()
+        if class_ is AcknowledgeMessage and getattr(self, '_small_msg', False):
+            # The client sent an ISmallMessage, so it can read one.
+            class_ = AcknowledgeMessageExt
         response = class_()
         self._matchAcknowledge(packet, msg, response)
         return response
@@ -113,7 +147,7 @@ class AbstractMessage(object):
         
         attrs = {}
         for key, val in self.__dict__.iteritems():
-            if key == 'body':
+            if key == '_body':
                 continue
             if key == 'headers':
                 continue
@@ -140,15 +174,22 @@ class AbstractMessage(object):
 
 class_def.assign_attrs(AbstractMessage, 'flex.messaging.messages.AbstractMessage',
     ('body', 'clientId', 'destination', 'headers',
-        'messageId', 'timestamp', 'timeToLive'), True)
+        'messageId', 'timestamp', 'timeToLive'), True, ('body',), {'body': '_body'})
 
 class AbstractSmallMsgDef(class_def.ExternClassDef):
     """Encodes and decodes messages using ISmallMessage.
 
     ISmallMessages use a more compact representation
     of mx.messaging.messages.
+
+    Fields are read and written by amfast.decode.read_small_message
+    and amfast.encode.write_small_message.
     """
 
+    ASYNC_MSG_TYPE = 1
+    COMMAND_MSG_TYPE = 2
+    ACKNOWLEDGE_MSG_TYPE = 3
+
     HAS_NEXT_FLAG = 0x80
     BODY_FLAG = 0x01
     CLIENT_ID_FLAG = 0x02
@@ -205,59 +246,10 @@ class AbstractSmallMsgDef(class_def.ExternClassDef):
         return flags
 
     def readExternal(self, obj, context):
-        flags = self._readFlags(context)
-
-        for i, flag in enumerate(flags):
-            if i == 0:
-                if flag & self.BODY_FLAG:
-                    obj.body = decode(context)
-                else:
-                    obj.body = None
-
-                if flag & self.CLIENT_ID_FLAG:
-                    obj.clientId = decode(context)
-                else:
-                    obj.clientId = None
-
-                if flag & self.DESTINATION_FLAG:
-                    obj.destination = decode(context)
-                else:
-                   obj.destination = None
-
-                if flag & self.HEADERS_FLAG:
-                    obj.headers = decode(context)
-                else:
-                    obj.headers = None
-
-                if flag & self.MESSAGE_ID_FLAG:
-                    obj.messageId = decode(context)
-                else:
-                    obj.messageId = None
-
-                if flag & self.TIMESTAMP_FLAG:
-                    obj.timestamp = decode(context)
-                else:
-                    obj.timestamp = None
-
-                if flag & self.TIME_TO_LIVE_FLAG:
-                    obj.timeToLive = decode(context)
-                else:
-                    obj.timeToLive = None
-
-            if i == 1:
-                if flag & self.CLIENT_ID_BYTES_FLAG:
-                    clientIdBytes = decode(context)
-                    obj.clientId = self._readUid(clientIdBytes)
-                else:
-                    if not hasattr(obj, 'clientId'):
-                        obj.clientId = None
-
-                if flag & self.MESSAGE_ID_BYTES_FLAG:
-                    messageIdBytes = decode(context)
-                    obj.messageId = self._readUid(messageIdBytes)
-                else:
-                    if not hasattr(obj, 'messageId'):
-                        obj.messageId = None
+        read_small_message(obj, context, self.SMALL_MSG_TYPE)
+
+    def writeExternal(self, obj, context):
+        write_small_message(obj, context, self.SMALL_MSG_TYPE, self.raw_attrs)
 
 class RemotingMessage(AbstractMessage):
 
@@ -331,28 +323,12 @@ class_def.assign_attrs(AsyncMessage, 'flex.messaging.messages.AsyncMessage',
         'messageId', 'timestamp', 'timeToLive', 'correlationId'), True)
 
 class AsyncSmallMsgDef(AbstractSmallMsgDef):
-    """Decodes messages that were encoded using ISmallMessage."""
+    """Encodes and decodes AsyncMessages using ISmallMessage."""
 
     CORRELATION_ID_FLAG = 0x01
     CORRELATION_ID_BYTES_FLAG = 0x02
 
-    def readExternal(self, obj, context):
-        AbstractSmallMsgDef.readExternal(self, obj, context)
-
-        flags = self._readFlags(context)
-        for i, flag in enumerate(flags):
-            if i == 0:
-                if flag & self.CORRELATION_ID_FLAG:
-                    obj.correlationId = decode(context)
-                else:
-                    obj.correlationId = None
-
-                if flag & self.CORRELATION_ID_BYTES_FLAG:
-                    correlationIdBytes = decode(context)
-                    obj.correlationId = self._readUid(correlationIdBytes)
-                else:
-                    if not hasattr(obj, 'correlationId'):
-                        obj.correlationId = None
+    SMALL_MSG_TYPE = AbstractSmallMsgDef.ASYNC_MSG_TYPE
 
 class CommandMessage(AsyncMessage):
     """A Flex CommandMessage. Operations are integers instead of strings.
@@ -419,20 +395,11 @@ class_def.assign_attrs(CommandMessage, 'flex.messaging.messages.CommandMessage',
         'operation'), True)
 
 class CommandSmallMsgDef(AsyncSmallMsgDef):
-    """Decodes messages that were encoded using ISmallMessage."""
+    """Encodes and decodes CommandMessages using ISmallMessage."""
 
     OPERATION_FLAG = 0x01
 
-    def readExternal(self, obj, context):
-        AsyncSmallMsgDef.readExternal(self, obj, context)
-
-        flags = self._readFlags(context)
-        for i, flag in enumerate(flags):
-            if i == 0:
-                if flag & self.OPERATION_FLAG:
-                    obj.operation = decode(context)
-                else:
-                    obj.operation = None
+    SMALL_MSG_TYPE = AbstractSmallMsgDef.COMMAND_MSG_TYPE
 
 class AcknowledgeMessage(AsyncMessage):
     """A response message sent back to the client."""
@@ -443,6 +410,18 @@ class_def.assign_attrs(AcknowledgeMessage, 'flex.messaging.messages.AcknowledgeM
     ('body', 'clientId', 'destination', 'headers',
         'messageId', 'timestamp', 'timeToLive', 'correlationId'), True)
 
+class AcknowledgeMessageExt(AcknowledgeMessage):
+    """An AcknowledgeMessage that is encoded as an ISmallMessage (DSK).
+
+    Sent in response to clients that send ISmallMessages.
+    """
+    pass
+
+class AcknowledgeSmallMsgDef(AsyncSmallMsgDef):
+    """Encodes and decodes AcknowledgeMessages using ISmallMessage."""
+
+    SMALL_MSG_TYPE = AbstractSmallMsgDef.ACKNOWLEDGE_MSG_TYPE
+
 class ErrorMessage(AcknowledgeMessage):
     """A response message sent back to the client after a failure."""
 
@@ -29,6 +29,13 @@ def client_ping(packet, msg, *args):
     command = msg.body[0]
     response.headers[command.FLEX_CLIENT_ID_HEADER] = command.connection.id
 
+    # Clients that advertise a messaging version >= 1
+    # send ISmallMessages once the server does the same.
+    if isinstance(packet.channel.endpoint, AmfEndpoint) and \
+        command.headers is not None and \
+        command.headers.get(command.MESSAGING_VERSION, 0) >= 1:
+        response.headers[command.MESSAGING_VERSION] = 1
+
 def login_operation(packet, msg, raw_creds):
     """RemoteObject style authentication."""
 
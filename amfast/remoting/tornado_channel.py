@@ -148,7 +148,14 @@ class TornadoChannel(HttpChannel):
             return
 
         # Message is complete, encode and return
-        request_handler.finish(self.encode(response))
+        raw_response = self.encode(response)
+        if isinstance(raw_response, list):
+            # Chunked encoder output
+            for chunk in raw_response:
+                request_handler.write(chunk)
+            request_handler.finish()
+        else:
+            request_handler.finish(raw_response)
 
     def setupPollRequest(self, packet):
         """Setup a request for a long-poll operation."""
@@ -70,12 +70,21 @@ class WsgiChannel(HttpChannel):
         return self.getResponse(start_response, response)
 
     def getResponse(self, start_response, response):
+        if isinstance(response, list):
+            # Chunked encoder output
+            content_length = 0
+            for chunk in response:
+                content_length += len(chunk)
+        else:
+            content_length = len(response)
+            response = [response]
+
         start_response('200 OK', [
             ('Content-Type', self.CONTENT_TYPE),
-            ('Content-Length', str(len(response)))
+            ('Content-Length', str(content_length))
         ])
 
-        return [response]
+        return response
 
     def badMethod(self, start_response):
         response = self.getBadMethodMsg()
@@ -15,6 +15,8 @@ def suite():
     import connection_test
     import subscription_test
     import messaging_test
+    import push_decoder_test
+    import memory_test
 
     return unittest.TestSuite((
         amf3_decoder_test.suite(),
@@ -27,7 +29,9 @@ def suite():
         context_test.suite(),
         connection_test.suite(),
         subscription_test.suite(),
-        messaging_test.suite()
+        messaging_test.suite(),
+        push_decoder_test.suite(),
+        memory_test.suite()
     ))
 
 if __name__ == '__main__':
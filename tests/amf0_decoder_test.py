@@ -3,7 +3,8 @@ import unittest
 
 from StringIO import StringIO
 
-from amfast.context import DecoderContext
+from amfast import AmFastError
+from amfast.context import DecoderContext, LimitError
 import amfast.decode as decode
 from amfast.decoder import Decoder
 import amfast.class_def as class_def
@@ -158,6 +159,41 @@ class Amf0DecoderTestCase(unittest.TestCase):
     def testUnkownByteRaisesException(self):
         self.assertRaises(decode.DecodeError, decode.decode, DecoderContext('\xFF'))
 
+    def testLimits(self):
+        encoded = '\x0A\x00\x00\x00\x02' # 2 element array header
+        encoded += '\x0A\x00\x00\x00\x00' # element 1, empty array
+        encoded += '\x02\x00\x04spam' # element 2
+
+        self.assertEquals([[], u'spam'], Decoder(max_depth=2, max_length=2,
+            max_string=4, max_bytes=len(encoded)).decode(encoded))
+
+        for decoder in (Decoder(max_depth=1), Decoder(max_length=1),
+            Decoder(max_string=3), Decoder(max_bytes=len(encoded) - 1)):
+            self.assertRaises(LimitError, decoder.decode, encoded)
+
+        # Object keys are counted as they are decoded
+        encoded = '\x03\x00\x01a\x05\x00\x01b\x05\x00\x00\x09'
+        self.assertRaises(LimitError, Decoder(max_length=1).decode, encoded)
+
+        # AMF3 values inherit limits
+        self.assertRaises(LimitError, Decoder(max_depth=2).decode, '\x0A\x00\x00\x00\x01\x11\x09\x01\x01')
+
+    def testTruncatedPacket(self):
+        encoded = '\x00\x03' # Client type
+        encoded += '\x00\x01' # Header count
+        encoded += '\x00\x04spam\x00' # Header name, not required
+        encoded += '\x00\x00\x00\x01\x05' # Header byte length, null value
+        encoded += '\x00\x01' # Message count
+        encoded += '\x00\x04null\x00\x02/1' # Target and response
+        encoded += '\x00\x00\x00\x06' # Byte length
+        encoded += '\x0A\x00\x00\x00\x00' # Empty argument list
+
+        packet = Decoder().decode_packet(encoded)
+        self.assertEquals([], packet.messages[0].body)
+
+        for i in xrange(len(encoded)):
+            self.assertRaises(AmFastError, Decoder().decode_packet, encoded[:i])
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(Amf0DecoderTestCase)
 
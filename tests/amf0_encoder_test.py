@@ -192,6 +192,21 @@ class Amf0EncoderTestCase(unittest.TestCase):
 
         self.assertEquals(encoded, encode.encode(decoded))
 
+    def testObjectRefsOff(self):
+        obj = {'spam': 'eggs'}
+
+        encoded = '\x0A\x00\x00\x00\x02' # 2 element array header
+        encoded += '\x03\x00\x04spam\x02\x00\x04eggs\x00\x00\t' # obj 1
+        encoded += '\x03\x00\x04spam\x02\x00\x04eggs\x00\x00\t' # obj 1 encoded again
+
+        self.assertEquals(encoded, encode.encode([obj, obj],
+            EncoderContext(use_object_references=False)))
+
+        cycle = [obj]
+        cycle.append(cycle)
+        self.assertRaises(encode.EncodeError, encode.encode, cycle,
+            EncoderContext(use_object_references=False))
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(Amf0EncoderTestCase)
 
@@ -3,7 +3,7 @@ import unittest
 
 from StringIO import StringIO
 
-from amfast.context import DecoderContext
+from amfast.context import DecoderContext, ContextError, LimitError
 import amfast.decode as decode
 import amfast.buffer as buffer
 import amfast.class_def as class_def
@@ -243,6 +243,65 @@ class Amf3DecoderTestCase(unittest.TestCase):
 
         self.class_mapper.unmapClass(self.Spam)
 
+    def testSlotsObj(self):
+        class Slots(object):
+            __slots__ = ('spam',)
+
+        self.class_mapper.mapClass(class_def.ClassDef(Slots, 'alias.slots', ('spam',)))
+
+        encoded = '\x0A\x13\x17alias.slots'
+        encoded += '\x09spam' # static attr definition
+        encoded += '\x06\x09eggs' # static attrs
+
+        result = decode.decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.assertEquals(Slots, result.__class__)
+        self.assertEquals('eggs', result.spam)
+
+        self.class_mapper.unmapClass(Slots)
+
+    def testCustomClassDefObj(self):
+        class CustomClassDef(class_def.ClassDef):
+            def getInstance(self):
+                obj = class_def.ClassDef.getInstance(self)
+                obj.created = True
+                return obj
+
+            def applyAttrVals(self, obj, vals):
+                obj.applied = vals
+
+        self.class_mapper.mapClass(CustomClassDef(self.Spam, 'alias.spam', ('spam',)))
+
+        encoded = '\x09\x05\x01' # array header
+        encoded += '\x0A\x13\x15alias.spam'
+        encoded += '\x09spam' # static attr definition
+        encoded += '\x06\x09eggs' # static attrs
+        encoded += '\x0A\x01\x06\x07foo' # class def reference
+
+        result = decode.decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True))
+        for obj in result:
+            self.assertTrue(obj.created)
+            self.assertFalse(hasattr(obj, 'spam'))
+        self.assertEquals({'spam': 'eggs'}, result[0].applied)
+        self.assertEquals({'spam': 'foo'}, result[1].applied)
+
+        self.class_mapper.unmapClass(self.Spam)
+
+    def testDecodeTypesObj(self):
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.spam', ('spam',),
+            decode_types={'spam': int}))
+
+        encoded = '\x0A\x13\x15alias.spam'
+        encoded += '\x09spam' # static attr definition
+        encoded += '\x06\x03' + '1' # static attrs
+
+        result = decode.decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.assertEquals(1, result.spam)
+
+        self.class_mapper.unmapClass(self.Spam)
+
     def testExternizeable(self):
         custom_encoding = '\x01\x02\x03\x04\x05'
 
@@ -280,6 +339,63 @@ class Amf3DecoderTestCase(unittest.TestCase):
         self.assertEquals(12, result.month)
         self.assertEquals(1, result.day)
 
+    def testBufferInput(self):
+        import __builtin__
+
+        encoded = '\x06\x09spam'
+        sources = [bytearray(encoded), __builtin__.buffer(encoded), memoryview(encoded)]
+        for source in sources:
+            self.assertEquals('spam', decode.decode(DecoderContext(source, amf3=True)))
+
+        self.assertEquals(None, decode.decode(bytearray('\x05')))
+
+    def testMmapInput(self):
+        import mmap
+        import tempfile
+
+        encoded = '\x09\x05\x01\x06\x09spam\x06\x00'
+        tmp = tempfile.TemporaryFile()
+        try:
+            tmp.write(encoded)
+            tmp.flush()
+            mapped = mmap.mmap(tmp.fileno(), len(encoded), access=mmap.ACCESS_READ)
+            result = decode.decode(DecoderContext(mapped, amf3=True))
+            self.assertEquals(['spam', 'spam'], result)
+            mapped.close()
+        finally:
+            tmp.close()
+
+    def testByteArray(self):
+        encoded = '\x09\x05\x01\x0C\x09spam\x0C\x02'
+        result = decode.decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals('spam', result[0].bytes)
+        self.assertTrue(result[0] is result[1])
+
+    def testByteArrayViews(self):
+        encoded = '\x0C\x09spam'
+        result = decode.decode(DecoderContext(encoded, amf3=True, use_byte_views=True))
+        self.assertEquals('spam', str(result.bytes))
+
+        result = decode.decode(DecoderContext(memoryview(encoded), amf3=True, use_byte_views=True))
+        self.assertEquals('spam', result.bytes.tobytes())
+
+    def testUncompressByteArray(self):
+        import zlib
+
+        compressed = zlib.compress('spam' * 100)
+        encoded = '\x0C' + chr(len(compressed) << 1 | 0x01) + compressed
+        result = decode.decode(DecoderContext(encoded, amf3=True, uncompress_byte_arrays=True))
+        self.assertEquals('spam' * 100, result.bytes)
+
+        result = decode.decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals(compressed, result.bytes)
+
+        # Not compressed, or only looks compressed
+        for bytes in ('spam', 'x\x9cspam'):
+            encoded = '\x0C' + chr(len(bytes) << 1 | 0x01) + bytes
+            result = decode.decode(DecoderContext(encoded, amf3=True, uncompress_byte_arrays=True))
+            self.assertEquals(bytes, result.bytes)
+
     def testUnkownByteRaisesException(self):
         self.assertRaises(decode.DecodeError, decode.decode, DecoderContext('\x0D'))
 
@@ -296,7 +412,232 @@ class Amf3DecoderTestCase(unittest.TestCase):
         result = decode.decode(ct)
         assert result == pre
 
-        self.assertRaises(buffer.BufferError, decode.decode, ct) 
+        self.assertRaises(buffer.BufferError, decode.decode, ct)
+
+    def testInternTable(self):
+        table = decode.InternTable(max_entries=2, max_len=4)
+        encoded = '\x09\x09\x01\x06\x07spa\x06\x09spam\x06\x0Beggs!\x06\x01'
+
+        first = decode.decode(DecoderContext(encoded, amf3=True, intern_table=table))
+        second = decode.decode(DecoderContext(encoded, amf3=True, intern_table=table))
+        self.assertEquals([u'spa', u'spam', u'eggs!', u''], second)
+        self.assertEquals(2, table.count)
+        self.assert_(first[0] is second[0])
+        self.assert_(first[1] is second[1])
+        self.assert_(first[2] is not second[2])
+
+        # Table is emptied when full
+        decode.decode(DecoderContext('\x06\x03a', amf3=True, intern_table=table))
+        self.assertEquals(1, table.count)
+        third = decode.decode(DecoderContext(encoded, amf3=True, intern_table=table))
+        self.assert_(first[0] is not third[0])
+
+        table.clear()
+        self.assertEquals(0, table.count)
+
+    def testInternTableBadArg(self):
+        self.assertRaises(TypeError, decode.decode,
+            DecoderContext('\x06\x03a', amf3=True, intern_table={}))
+        self.assertRaises(ValueError, decode.InternTable, max_entries=0)
+
+    def testInternTableTraits(self):
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.spam', ('spam',)))
+        table = decode.InternTable()
+
+        encoded = '\x0A\x13\x15alias.spam'
+        encoded += '\x09spam' # static attr definition
+        encoded += '\x06\x09eggs' # static attrs
+
+        for i in range(2):
+            result = decode.decode(DecoderContext(encoded,
+                class_def_mapper=self.class_mapper, amf3=True, intern_table=table))
+            self.assertEquals(self.Spam, result.__class__)
+            self.assertEquals('eggs', result.spam)
+        self.assertEquals(1, len(self.class_mapper._decode_traits))
+
+        # Same alias with different attributes
+        encoded = '\x0A\x13\x15alias.spam'
+        encoded += '\x07ham' # static attr definition
+        encoded += '\x06\x09eggs' # static attrs
+
+        result = decode.decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True, intern_table=table))
+        self.assertEquals('eggs', result.ham)
+
+        # Mapping classes discards stored traits
+        class Ham(object):
+            pass
+        self.class_mapper.mapClass(class_def.ClassDef(Ham, 'alias.spam', ('ham',)))
+        self.assertEquals(0, len(self.class_mapper._decode_traits))
+
+        result = decode.decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True, intern_table=table))
+        self.assertEquals(Ham, result.__class__)
+        self.class_mapper.unmapClass(Ham)
+        self.class_mapper.unmapClass(self.Spam)
+
+    def testVector(self):
+        import array
+
+        tests = (
+            (array.array('i', [1, -2]), '\x0D\x05\x00\x00\x00\x00\x01\xff\xff\xff\xfe'),
+            (array.array('I', [1, 0xffffffff]), '\x0E\x05\x01\x00\x00\x00\x01\xff\xff\xff\xff'),
+            (array.array('d', [1.5]), '\x0F\x03\x00\x3f\xf8\x00\x00\x00\x00\x00\x00')
+        )
+
+        for result, encoded in tests:
+            self.assertEquals(result, decode.decode(DecoderContext(encoded, amf3=True)))
+
+    def testCompactArrays(self):
+        import array
+
+        encoded = '\x09\x09\x01' # array header
+        encoded += '\x09\x05\x01\x04\x01\x04\x02' # array of ints
+        encoded += '\x09\x05\x01\x04\x01\x05\x3f\xf8\x00\x00\x00\x00\x00\x00' # array of numbers
+        encoded += '\x09\x05\x01\x04\x01\x06\x07foo' # array of mixed types
+        encoded += '\x09\x04' # reference to array of numbers
+
+        for input in (encoded, StringIO(encoded)):
+            result = decode.decode(DecoderContext(input, amf3=True, compact_arrays=True))
+            self.assertEquals(array.array('i', [1, 2]), result[0])
+            self.assertEquals(array.array('d', [1.0, 1.5]), result[1])
+            self.assertEquals([1, u'foo'], result[2])
+            self.assert_(result[1] is result[3])
+
+        result = decode.decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals([1, 2], result[0])
+
+    def testCompactArraysReadOnly(self):
+        import array
+
+        class ReadOnly(object):
+            """A file-like-object that can't seek or tell."""
+            def __init__(self, encoded):
+                self._input = StringIO(encoded)
+
+            def read(self, size=-1):
+                return self._input.read(size)
+
+        encoded = '\x09\x07\x01' # array header
+        encoded += '\x09\x09\x01\x04\x01\x05\x3f\xf8\x00\x00\x00\x00\x00\x00' # numbers,
+        encoded += '\x09\x02\x06\x07foo' # then a reference to the same array and a string
+        encoded += '\x09\x05\x01\x04\x01\x04\x02' # array of ints
+        encoded += '\x09\x02' # reference to array of mixed types
+
+        result = decode.decode(DecoderContext(ReadOnly(encoded), amf3=True, compact_arrays=True))
+        self.assertEquals(4, len(result[0]))
+        self.assertEquals([1, 1.5], result[0][:2])
+        self.assert_(isinstance(result[0][0], int))
+        self.assert_(result[0] is result[0][2])
+        self.assertEquals(u'foo', result[0][3])
+        self.assertEquals(array.array('i', [1, 2]), result[1])
+        self.assert_(result[0] is result[2])
+
+    def testObjectVector(self):
+        encoded = '\x09\x05\x01' # array header
+        encoded += '\x10\x05\x00\x07foo\x06\x07foo\x10\x02' # Vector with reference to itself
+        encoded += '\x10\x02' # reference to Vector
+
+        result = decode.decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals(u'foo', result[0][0])
+        self.assert_(result[0] is result[0][1])
+        self.assert_(result[0] is result[1])
+
+    def testDictionary(self):
+        encoded = '\x09\x05\x01' # array header
+        encoded += '\x11\x05\x01' # Dictionary header, weak keys
+        encoded += '\x04\x01\x06\x07foo' # int key
+        encoded += '\x06\x00\x11\x02' # string key, value is a reference to the Dictionary
+        encoded += '\x11\x02' # reference to Dictionary
+
+        result = decode.decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals(u'foo', result[0][1])
+        self.assert_(result[0] is result[0][u'foo'])
+        self.assert_(result[0] is result[1])
+
+        # Keys that decode to lists or dicts can not be used in a dict
+        self.assertRaises(decode.DecodeError, decode.decode,
+            DecoderContext('\x11\x03\x00\x09\x01\x01\x04\x01', amf3=True))
+
+    def testMaxDepth(self):
+        encoded = '\x09\x03\x01\x09\x03\x01\x04\x01' # [[1]]
+
+        result = decode.decode(DecoderContext(encoded, amf3=True, max_depth=3))
+        self.assertEquals([[1]], result)
+
+        context = DecoderContext(encoded, amf3=True, max_depth=2)
+        self.assertRaises(LimitError, decode.decode, context)
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext('\x09\x03\x01' * 10000, amf3=True, max_depth=100))
+
+    def testMaxLength(self):
+        encoded = '\x09\x07\x01\x04\x00\x04\x01\x04\x02' # [0, 1, 2]
+        self.assertEquals([0, 1, 2], decode.decode(DecoderContext(encoded, amf3=True, max_length=3)))
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext(encoded, amf3=True, max_length=2))
+
+        # Dynamic keys are counted as they are decoded
+        encoded = '\x0A\x0B\x01\x03a\x04\x01\x03b\x04\x02\x01'
+        self.assertEquals({'a': 1, 'b': 2}, decode.decode(DecoderContext(encoded, amf3=True, max_length=2)))
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext(encoded, amf3=True, max_length=1))
+
+        # Vectors and Dictionaries
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext('\x0D\x07\x00' + '\x00' * 12, amf3=True, max_length=2))
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext('\x11\x05\x00\x04\x01\x04\x01\x04\x02\x04\x02', amf3=True, max_length=1))
+
+    def testMaxString(self):
+        import zlib
+
+        self.assertEquals(u'spam', decode.decode(DecoderContext('\x06\x09spam', amf3=True, max_string=4)))
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext('\x06\x09spam', amf3=True, max_string=3))
+        self.assertRaises(LimitError, decode.decode,
+            DecoderContext('\x0C\x09spam', amf3=True, max_string=3))
+
+        # Inflated size is checked too
+        compressed = zlib.compress('spam' * 100)
+        encoded = '\x0C' + chr(len(compressed) << 1 | 0x01) + compressed
+        result = decode.decode(DecoderContext(encoded, amf3=True,
+            uncompress_byte_arrays=True, max_string=400))
+        self.assertEquals('spam' * 100, result.bytes)
+        self.assertRaises(LimitError, decode.decode, DecoderContext(encoded, amf3=True,
+            uncompress_byte_arrays=True, max_string=399))
+
+    def testMaxBytes(self):
+        encoded = '\x09\x07\x01\x04\x00\x04\x01\x04\x02'
+        for input in (encoded, StringIO(encoded)):
+            context = DecoderContext(input, amf3=True, max_bytes=len(encoded))
+            self.assertEquals([0, 1, 2], decode.decode(context))
+            self.assertEquals(len(encoded), context.bytes_read)
+
+        for input in (encoded, StringIO(encoded)):
+            context = DecoderContext(input, amf3=True, max_bytes=len(encoded) - 1)
+            self.assertRaises(LimitError, decode.decode, context)
+
+        self.assertRaises(ContextError, DecoderContext, encoded, amf3=True, max_bytes=-1)
+
+    def testDeclaredLength(self):
+        # Declared lengths larger than the input fail without preallocating
+        for input in ('\x09\xBF\xFF\xFF\xFF\x01', StringIO('\x09\xBF\xFF\xFF\xFF\x01')):
+            self.assertRaises((buffer.BufferError, ContextError), decode.decode, DecoderContext(input, amf3=True))
+
+        # Preallocated lists can refer to themselves
+        encoded = '\x09\x07\x01\x04\x01\x09\x00\x04\x02'
+        for context in (DecoderContext(encoded, amf3=True),
+            DecoderContext(StringIO(encoded), amf3=True, max_length=3)):
+            result = decode.decode(context)
+            self.assertEquals(3, len(result))
+            self.assertEquals(1, result[0])
+            self.assert_(result is result[1])
+            self.assertEquals(2, result[2])
+
+    def testNegativeReference(self):
+        for marker in ('\x06', '\x09', '\x0A'):
+            self.assertRaises(ContextError, decode.decode,
+                DecoderContext(marker + '\xff\xff\xff\xfe', amf3=True))
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(Amf3DecoderTestCase)
@@ -104,6 +104,47 @@ class Amf3EncoderTestCase(unittest.TestCase):
         buf = encode.encode(test, EncoderContext(use_references=False, amf3=True))
         self.assertEquals(result, buf)
 
+    def testObjectRefsOff(self):
+        item = [1]
+        hello = u'hello'
+        test = [item, item, hello, hello]
+
+        result = '\x09\x09\x01' # array header
+        result += '\x09\x03\x01\x04\x01' # array element 1 ([1] encoded)
+        result += '\x09\x03\x01\x04\x01' # array element 2 ([1] encoded again)
+        result += '\x06\x0bhello' # array element 3 (hello encoded)
+        result += '\x06\x00' # array element 4 (reference to hello)
+
+        buf = encode.encode(test, EncoderContext(use_object_references=False, amf3=True))
+        self.assertEquals(result, buf)
+
+        # Objects still take up an index in the decoder
+        from amfast.decoder import Decoder
+        from amfast.encoder import Encoder
+        test = {'items': [{'a': [1]}, {'a': [2]}], 'collection': ['b', 'b']}
+        for kwargs in ({}, {'use_collections': True, 'use_proxies': True}):
+            encoder = Encoder(amf3=True, use_object_references=False, **kwargs)
+            self.assertEquals(test, Decoder(amf3=True).decode(encoder.encode(test)))
+
+        cycle = []
+        cycle.append(cycle)
+        self.assertRaises(encode.EncodeError, encode.encode, cycle,
+            EncoderContext(use_object_references=False, amf3=True))
+
+    def testMaxSize(self):
+        from amfast.buffer import BufferError
+        test = ['s' * 100] * 3
+        result = encode.encode(test, EncoderContext(use_references=False, amf3=True))
+
+        buf = encode.encode(test, EncoderContext(use_references=False, amf3=True,
+            max_size=len(result)))
+        self.assertEquals(result, buf)
+
+        for chunk_size in (0, 64):
+            self.assertRaises(BufferError, encode.encode, test,
+                EncoderContext(use_references=False, amf3=True,
+                    chunk_size=chunk_size, max_size=len(result) - 1))
+
     def testString(self):
         tests = {
             '': '\x06\x01',
@@ -271,6 +312,27 @@ class Amf3EncoderTestCase(unittest.TestCase):
         buf = encode.encode(test, EncoderContext(amf3=True))
         self.assertEquals(result, buf)
 
+    def testDictSharedTraits(self):
+        test_dict = {'spam': 1}
+        test = [test_dict, {'spam': 2}, {'eggs': 3}, {'spam': 4}, test_dict, {}]
+
+        result = '\x09\x0D\x01' #array header
+        result += '\x0A\x13\x01\x09spam\x04\x01' # sealed object with trait
+        result += '\x0A\x01\x04\x02' # sealed object with trait reference
+        result += '\x0A\x13\x01\x09eggs\x04\x03' # sealed object with new trait
+        result += '\x0A\x13\x01\x00\x04\x04' # sealed object with new trait, key is a string reference
+        result += '\x0A\x02' # reference to test_dict
+        result += '\x0A\x0B\x01\x01' # empty dicts are dynamic
+
+        buf = encode.encode(test, EncoderContext(amf3=True, use_shared_traits=True))
+        self.assertEquals(result, buf)
+
+        # Dicts encoded as ObjectProxies do not share traits
+        buf = encode.encode([{'spam': 1}, {'spam': 2}],
+            EncoderContext(amf3=True, use_shared_traits=True, use_proxies=True))
+        self.assertEquals(buf, encode.encode([{'spam': 1}, {'spam': 2}],
+            EncoderContext(amf3=True, use_proxies=True)))
+
     def testDictAsObjectProxy(self):
         result = '\x0A\x07\x3Bflex.messaging.io.ObjectProxy' # Object header 
         result += '\x0A\x0B\x01' # Object header
@@ -497,8 +559,247 @@ class Amf3EncoderTestCase(unittest.TestCase):
 
         self.assertEquals(result, buf)
 
+    def testStaticObjCustomAttrVals(self):
+        class CustomClassDef(class_def.ClassDef):
+            def getStaticAttrVals(self, obj):
+                return ['ham']
+
+        self.class_mapper.mapClass(CustomClassDef(self.Spam, 'alias.spam', ('spam',)))
+        test = self.Spam()
+
+        result = '\x0A\x13\x15alias.spam'
+        result += '\x09spam' # static attr definition
+        result += '\x06\x07ham' # static attrs
+
+        buf = encode.encode(test, EncoderContext(\
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.class_mapper.unmapClass(self.Spam)
+
+        self.assertEquals(result, buf)
+
+    def testStaticObjMissingAttr(self):
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.spam', ('ham',)))
+        test = self.Spam()
+
+        result = '\x0A\x13\x15alias.spam'
+        result += '\x07ham' # static attr definition
+        result += '\x01' # static attrs
+
+        buf = encode.encode(test, EncoderContext(\
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.class_mapper.unmapClass(self.Spam)
+
+        self.assertEquals(result, buf)
+
+    def testStaticObjStringRef(self):
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.spam', ('spam',)))
+        test = ['spam', self.Spam()]
+
+        result = '\x09\x05\x01' #array header
+        result += '\x06\x09spam' # array element 1
+        result += '\x0A\x13\x15alias.spam\x00\x06\x09eggs' # array element 2
+
+        buf = encode.encode(test, EncoderContext(\
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.class_mapper.unmapClass(self.Spam)
+
+        self.assertEquals(result, buf)
+
+    def testRemapClass(self):
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.spam', ('spam',)))
+        test = self.Spam()
+
+        encode.encode(test, EncoderContext(\
+            class_def_mapper=self.class_mapper, amf3=True))
+
+        # Compiled ClassDef is replaced.
+        self.class_mapper.mapClass(class_def.ClassDef(self.Spam, 'alias.ham', ('spam',)))
+        result = '\x0A\x13\x13alias.ham'
+        result += '\x09spam' # static attr definition
+        result += '\x06\x09eggs' # static attrs
+
+        buf = encode.encode(test, EncoderContext(\
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.class_mapper.unmapClass(self.Spam)
+
+        self.assertEquals(result, buf)
+
+    def testByteArray(self):
+        from amfast.class_def.as_types import AsByteArray
+
+        for bytes in ('spam', bytearray('spam'), buffer('xspam', 1), memoryview('spam')):
+            buf = encode.encode(AsByteArray(bytes), EncoderContext(amf3=True))
+            self.assertEquals('\x0C\x09spam', buf)
+
+    def testCompressedByteArray(self):
+        import zlib
+        from amfast.class_def.as_types import AsCompressedByteArray
+
+        bytes = 'spam' * 100
+        compressed = zlib.compress(bytes, 9)
+        buf = encode.encode(AsCompressedByteArray(bytes, level=9), EncoderContext(amf3=True))
+        self.assertEquals('\x0C' + chr(len(compressed) << 1 | 0x01) + compressed, buf)
+
+    def testIntVector(self):
+        import array
+
+        result = '\x0D\x07\x00' # Vector header, not fixed
+        result += '\x00\x00\x00\x01\xff\xff\xff\xfe\x7f\xff\xff\xff'
+
+        for typecode in ('i', 'l'):
+            buf = encode.encode(array.array(typecode, [1, -2, 0x7fffffff]),
+                EncoderContext(amf3=True))
+            self.assertEquals(result, buf)
+
+        self.assertRaises(encode.EncodeError, encode.encode,
+            array.array('l', [0x80000000]), EncoderContext(amf3=True))
+
+        for typecode in ('b', 'h'):
+            buf = encode.encode(array.array(typecode, [1, -2]), EncoderContext(amf3=True))
+            self.assertEquals('\x0D\x05\x00\x00\x00\x00\x01\xff\xff\xff\xfe', buf)
+
+    def testUIntVector(self):
+        import array
+
+        buf = encode.encode(array.array('H', [1, 0xffff]), EncoderContext(amf3=True))
+        self.assertEquals('\x0E\x05\x00\x00\x00\x00\x01\x00\x00\xff\xff', buf)
+
+        buf = encode.encode(array.array('B', [1, 0xff]), EncoderContext(amf3=True))
+        self.assertEquals('\x0E\x05\x00\x00\x00\x00\x01\x00\x00\x00\xff', buf)
+
+    def testDoubleVector(self):
+        import array
+
+        result = '\x0F\x05\x00' # Vector header, not fixed
+        result += '\x3f\xf8\x00\x00\x00\x00\x00\x00\xc0\x02\x00\x00\x00\x00\x00\x00'
+
+        for typecode in ('f', 'd'):
+            buf = encode.encode(array.array(typecode, [1.5, -2.25]), EncoderContext(amf3=True))
+            self.assertEquals(result, buf)
+
+    def testVectorRefs(self):
+        import array
+
+        test = array.array('i', [1])
+        buf = encode.encode([test, test], EncoderContext(amf3=True))
+        self.assertEquals('\x09\x05\x01\x0D\x03\x00\x00\x00\x00\x01\x0D\x02', buf)
+
+    def testObjectVector(self):
+        from amfast.class_def.as_types import AsVector
+
+        result = '\x10\x05\x01' # Vector header, fixed
+        result += '\x07foo' # Item type name
+        result += '\x06\x00\x04\x01' # Items, 'foo' is a reference
+
+        buf = encode.encode(AsVector(['foo', 1], 'foo', True), EncoderContext(amf3=True))
+        self.assertEquals(result, buf)
+
+    def testDictionary(self):
+        from amfast.class_def.as_types import AsDictionary
+
+        result = '\x11\x03\x01' # Dictionary header, weak keys
+        result += '\x04\x01\x06\x07foo' # key and value
+
+        buf = encode.encode(AsDictionary({1: 'foo'}, True), EncoderContext(amf3=True))
+        self.assertEquals(result, buf)
+
+        # Dictionaries switch AMF0 to AMF3
+        buf = encode.encode(AsDictionary({1: 'foo'}, True), EncoderContext())
+        self.assertEquals('\x11' + result, buf)
+
+    def testDictAsDictionary(self):
+        test_dict = {1: 'foo'}
+        test = [test_dict, test_dict, {'spam': 'eggs'}]
+
+        result = '\x09\x07\x01' # array header
+        result += '\x11\x03\x00\x04\x01\x06\x07foo' # Dictionary
+        result += '\x11\x02' # reference to Dictionary
+        result += '\x0A\x0B\x01\x09spam\x06\x09eggs\x01' # dicts with string keys are objects
+
+        buf = encode.encode(test, EncoderContext(amf3=True, use_dictionaries=True))
+        self.assertEquals(result, buf)
+
+class NumpyEncoderTestCase(unittest.TestCase):
+    def testVector(self):
+        import numpy
+
+        tests = (
+            (numpy.array([1, -2], dtype='int64'), '\x0D\x05\x00\x00\x00\x00\x01\xff\xff\xff\xfe'),
+            (numpy.array([1, 2], dtype='uint8'), '\x0E\x05\x00\x00\x00\x00\x01\x00\x00\x00\x02'),
+            (numpy.array([1.5], dtype='float32'), '\x0F\x03\x00\x3f\xf8\x00\x00\x00\x00\x00\x00'),
+            (numpy.array([True]), '\x10\x03\x00\x01\x03'),
+            (numpy.array([[1]], dtype='int32'), '\x10\x03\x00\x01\x0D\x03\x00\x00\x00\x00\x01')
+        )
+
+        for test, result in tests:
+            self.assertEquals(result, encode.encode(test, EncoderContext(amf3=True)))
+
+    def testVectorOutOfRange(self):
+        import numpy
+
+        self.assertRaises(encode.EncodeError, encode.encode,
+            numpy.array([0x80000000], dtype='int64'), EncoderContext(amf3=True))
+
+    def testRecordArray(self):
+        import numpy
+
+        test = numpy.array([(1, 1.5, 'foo'), (-2, 0.0, '')],
+            dtype=[('a', '>i4'), ('b', '<f8'), ('c', 'S4')])
+
+        result = '\x09\x05\x01' # array header
+        result += '\x0A\x33\x01\x03a\x03b\x03c' # object header with trait
+        result += '\x04\x01\x05\x3f\xf8\x00\x00\x00\x00\x00\x00\x06\x07foo' # values
+        result += '\x0A\x01' # object header with trait reference
+        result += '\x04\xff\xff\xff\xfe\x05\x00\x00\x00\x00\x00\x00\x00\x00\x06\x01' # values
+
+        self.assertEquals(result, encode.encode(test, EncoderContext(amf3=True)))
+
+    def testRecordArrayAlias(self):
+        import numpy
+        from amfast.class_def.as_types import AsRecordArray
+
+        test = numpy.array([(True,), (False,)], dtype=[('a', '?')])
+
+        result = '\x09\x05\x01' # array header
+        result += '\x0A\x13\x07foo\x03a\x03' # object header with trait
+        result += '\x0A\x01\x02' # object header with trait reference
+
+        self.assertEquals(result, encode.encode(AsRecordArray(test, 'foo'),
+            EncoderContext(amf3=True)))
+
+        self.assertRaises(encode.EncodeError, encode.encode,
+            AsRecordArray([1, 2]), EncoderContext(amf3=True))
+
+    def testRecordArrayRefs(self):
+        import numpy
+
+        records = numpy.array([('foo', [1])], dtype=[('a', 'S3'), ('b', 'O')])
+        bar = 'bar'
+        item = [2]
+        test = [records, records, bar, bar, item, item]
+
+        result = '\x09\x0D\x01' # array header
+        result += '\x09\x03\x01' # record array header
+        result += '\x0A\x23\x01\x03a\x03b' # object header with trait
+        result += '\x06\x07foo\x09\x03\x01\x04\x01' # values
+        result += '\x09\x02' # record array reference
+        result += '\x06\x07bar\x06\x06' # string 'bar' is string index 3
+        result += '\x09\x03\x01\x04\x02\x09\x08' # list [2] is object index 4
+
+        self.assertEquals(result, encode.encode(test, EncoderContext(amf3=True)))
+
 def suite():
-    return unittest.TestLoader().loadTestsFromTestCase(Amf3EncoderTestCase)
+    tests = [unittest.TestLoader().loadTestsFromTestCase(Amf3EncoderTestCase)]
+
+    try:
+        import numpy
+    except ImportError:
+        # Skip if numpy is not installed.
+        print "Skipping numpy test."
+    else:
+        tests.append(unittest.TestLoader().loadTestsFromTestCase(NumpyEncoderTestCase))
+
+    return unittest.TestSuite(tests)
 
 if __name__ == "__main__":
     unittest.TextTestRunner().run(suite())
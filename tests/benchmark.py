@@ -0,0 +1,508 @@
+"""Benchmarks for the AmFast encoder and decoder.
+
+Each benchmark times a realistic workload one operation at a time,
+and reports throughput, latency percentiles and peak memory.
+
+Results can be written as JSON and compared against a previous run
+to catch encoder and decoder regressions:
+
+    python benchmark.py --json baseline.json
+    (upgrade or change amfast)
+    python benchmark.py --baseline baseline.json
+
+The exit status is 1 if any benchmark is slower than the baseline
+by more than the tolerance.
+
+Each benchmark runs in its own process, so peak memory
+is reported for that workload alone.
+"""
+import gc
+import optparse
+import os
+import subprocess
+import sys
+import time
+from timeit import default_timer
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import amfast
+from amfast import class_def, remoting
+from amfast.class_def import ClassDefMapper
+from amfast.encoder import Encoder
+from amfast.decoder import Decoder
+from amfast.remoting import flex_messages as messaging
+from amfast.remoting.endpoint import AmfEndpoint
+
+UID = '0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9'
+
+class Customer(object):
+    def __init__(self, id=None, name=None, email=None):
+        self.id = id
+        self.name = name
+        self.email = email
+
+class LineItem(object):
+    def __init__(self, sku=None, description=None, quantity=None, price=None):
+        self.sku = sku
+        self.description = description
+        self.quantity = quantity
+        self.price = price
+
+class Order(object):
+    def __init__(self, id=None, customer=None, items=None, notes=None):
+        self.id = id
+        self.customer = customer
+        self.items = items
+        self.notes = notes
+
+def build_mapper():
+    mapper = ClassDefMapper()
+    mapper.mapClass(class_def.ClassDef(Customer, 'benchmark.Customer',
+        ('id', 'name', 'email')))
+    mapper.mapClass(class_def.ClassDef(LineItem, 'benchmark.LineItem',
+        ('sku', 'description', 'quantity', 'price')))
+    mapper.mapClass(class_def.ClassDef(Order, 'benchmark.Order',
+        ('id', 'customer', 'items', 'notes')))
+    return mapper
+
+def build_orders(count=20, items=5):
+    """A list of value objects, with customers shared between orders."""
+    customers = [Customer(i, u'Customer %i' % i, 'customer%i@example.com' % i)
+        for i in xrange(5)]
+
+    orders = []
+    for i in xrange(count):
+        order_items = [LineItem('SKU-%05i' % j, u'Item number %i' % j, j, j * 1.25)
+            for j in xrange(items)]
+        orders.append(Order(i, customers[i % len(customers)], order_items,
+            u'Deliver to the back door.'))
+    return orders
+
+def build_table(rows=2000):
+    """Rows of a large table, as dicts with the same keys."""
+    return [{'id': i, 'name': 'row %i' % i, 'value': i * 0.5,
+        'active': i % 2 == 0, 'tags': ['spam', 'eggs']} for i in xrange(rows)]
+
+def build_rpc_packet(mapper, count=20):
+    """A Flex RemotingMessage response carrying a list of orders."""
+    msg = messaging.RemotingMessage(body=build_orders(count),
+        destination='orders', operation='getOrders', clientId=UID,
+        headers={'DSEndpoint': 'amf'}, messageId=UID, timestamp=0, timeToLive=0)
+    return remoting.Packet(client_type=remoting.Packet.FLASH_9,
+        messages=[remoting.Message(target='null', response='/1', body=(msg,))])
+
+class Benchmark(object):
+    """Times one operation of a workload.
+
+    Subclasses set name and implement setUp and run.
+    setUp returns the number of bytes handled by each call to run.
+    """
+    name = None
+
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+    def setUp(self):
+        return 0
+
+    def run(self):
+        raise NotImplementedError()
+
+    def measure(self, warmup=3):
+        """Returns a dict of results.
+
+        Peak memory is the peak of the whole process,
+        so measure each benchmark in a new process.
+        """
+        gc.collect()
+        reset_peak_memory()
+        start_memory = current_memory()
+        byte_count = self.setUp()
+        for i in xrange(warmup):
+            self.run()
+
+        gc.collect()
+        latencies = []
+        total_start = default_timer()
+        for i in xrange(self.iterations):
+            start = default_timer()
+            self.run()
+            latencies.append(default_timer() - start)
+        total = default_timer() - total_start
+        latencies.sort()
+
+        result = {
+            'iterations': self.iterations,
+            'seconds': total,
+            'ops_per_sec': self.iterations / total,
+            'bytes': byte_count,
+            'mb_per_sec': byte_count * self.iterations / total / (1024 * 1024),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000
+        }
+
+        end_memory = peak_memory()
+        if end_memory is not None:
+            result['peak_kb'] = end_memory
+            result['peak_growth_kb'] = end_memory - start_memory
+        return result
+
+class RpcEncode(Benchmark):
+    """Encode an RPC response packet with nested value objects."""
+    name = 'rpc_packet_encode'
+
+    def setUp(self):
+        mapper = build_mapper()
+        self.endpoint = AmfEndpoint(encoder=Encoder(class_def_mapper=mapper),
+            decoder=Decoder(class_def_mapper=mapper))
+        self.packet = build_rpc_packet(mapper)
+        return len(self.endpoint.encodePacket(self.packet))
+
+    def run(self):
+        self.endpoint.encodePacket(self.packet)
+
+class RpcDecode(RpcEncode):
+    """Decode an RPC response packet with nested value objects."""
+    name = 'rpc_packet_decode'
+
+    def setUp(self):
+        RpcEncode.setUp(self)
+        self.raw = self.endpoint.encodePacket(self.packet)
+        return len(self.raw)
+
+    def run(self):
+        self.endpoint.decodePacket(self.raw)
+
+class TableEncode(Benchmark):
+    """Encode a large list of dicts."""
+    name = 'table_encode'
+    encoder_kwargs = {}
+
+    def setUp(self):
+        self.encoder = Encoder(amf3=True, **self.encoder_kwargs)
+        self.table = build_table()
+        return len(self.encoder.encode(self.table))
+
+    def run(self):
+        self.encoder.encode(self.table)
+
+class SharedTraitTableEncode(TableEncode):
+    """Encode a large list of dicts with shared traits."""
+    name = 'table_shared_traits_encode'
+    encoder_kwargs = {'use_shared_traits': True}
+
+class TreeTableEncode(TableEncode):
+    """Encode a large list of dicts without object references."""
+    name = 'table_tree_encode'
+    encoder_kwargs = {'use_object_references': False}
+
+class TableDecode(TableEncode):
+    """Decode a large list of dicts."""
+    name = 'table_decode'
+
+    def setUp(self):
+        TableEncode.setUp(self)
+        self.decoder = Decoder(amf3=True)
+        self.raw = self.encoder.encode(self.table)
+        return len(self.raw)
+
+    def run(self):
+        self.decoder.decode(self.raw)
+
+class GraphEncode(Benchmark):
+    """Encode a large graph of value objects, most of them referenced once."""
+    name = 'graph_encode'
+
+    def setUp(self):
+        self.encoder = Encoder(amf3=True, class_def_mapper=build_mapper())
+        self.orders = build_orders(1000, 10)
+        return len(self.encoder.encode(self.orders))
+
+    def run(self):
+        self.encoder.encode(self.orders)
+
+class FanOutEncode(Benchmark):
+    """Encode one streamed message for every subscribed client."""
+    name = 'fan_out_encode'
+    subscribers = 100
+
+    def setUp(self):
+        self.msg = messaging.AsyncMessage(body={'symbol': 'SPAM', 'price': 10.5,
+            'volume': 1000}, destination='quotes', clientId=UID,
+            headers={messaging.AsyncMessage.SUBTOPIC_HEADER: 'nasdaq'},
+            messageId=UID, timestamp=0, timeToLive=0)
+        self.encoder = Encoder(amf3=True)
+        return len(self.encoder.encode(self.msg)) * self.subscribers
+
+    def run(self):
+        for i in xrange(self.subscribers):
+            self.encoder.encode(self.msg)
+
+class SmallMessageEncode(Benchmark):
+    """Encode CommandMessages as ISmallMessages, like Flex clients do."""
+    name = 'small_message_encode'
+
+    def setUp(self):
+        mapper = ClassDefMapper()
+        mapper.mapClass(messaging.CommandSmallMsgDef(messaging.CommandMessage,
+            alias='DSC'))
+        self.msgs = [messaging.CommandMessage(body={}, destination='quotes',
+            clientId=UID, headers={'DSEndpoint': 'amf'}, messageId=UID,
+            correlationId=UID, timestamp=0, timeToLive=0,
+            operation=messaging.CommandMessage.CLIENT_PING_OPERATION)
+            for i in xrange(50)]
+        self.encoder = Encoder(amf3=True, class_def_mapper=mapper)
+        return len(self.encoder.encode(self.msgs))
+
+    def run(self):
+        self.encoder.encode(self.msgs)
+
+class SmallMessageDecode(SmallMessageEncode):
+    """Decode CommandMessages sent as ISmallMessages."""
+    name = 'small_message_decode'
+
+    def setUp(self):
+        SmallMessageEncode.setUp(self)
+        self.decoder = Decoder(amf3=True)
+        self.raw = self.encoder.encode(self.msgs)
+        return len(self.raw)
+
+    def run(self):
+        self.decoder.decode(self.raw)
+
+class RecordedDecode(Benchmark):
+    """Decode recorded Flex packets.
+
+    Each file in packet_dir must contain one raw AMF packet,
+    as sent by a client. Without packet_dir, an RPC packet
+    is recorded from the rpc workload.
+    """
+    name = 'recorded_packet_decode'
+    packet_dir = None
+
+    def setUp(self):
+        self.endpoint = AmfEndpoint(decoder=Decoder(class_def_mapper=build_mapper()))
+        if self.packet_dir is None:
+            self.packets = [Encoder(class_def_mapper=build_mapper()).encode_packet(
+                build_rpc_packet(build_mapper()))]
+        else:
+            self.packets = []
+            for name in sorted(os.listdir(self.packet_dir)):
+                path = os.path.join(self.packet_dir, name)
+                if not os.path.isfile(path):
+                    continue
+                packet_file = open(path, 'rb')
+                try:
+                    self.packets.append(packet_file.read())
+                finally:
+                    packet_file.close()
+
+            if len(self.packets) == 0:
+                raise ValueError("No packets found in '%s'." % self.packet_dir)
+
+        return sum([len(packet) for packet in self.packets])
+
+    def run(self):
+        for packet in self.packets:
+            self.endpoint.decodePacket(packet)
+
+BENCHMARKS = (RpcEncode, RpcDecode, TableEncode, SharedTraitTableEncode,
+    TreeTableEncode, TableDecode, GraphEncode, FanOutEncode, SmallMessageEncode, SmallMessageDecode,
+    RecordedDecode)
+
+def percentile(values, pct):
+    """Returns a percentile of a sorted list."""
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+def peak_memory():
+    """Returns the peak resident memory of the process in KB, or None."""
+    try:
+        status = open('/proc/self/status')
+    except IOError:
+        status = None
+
+    if status is not None:
+        try:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        finally:
+            status.close()
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak / 1024 # Reported in bytes
+    return peak
+
+def reset_peak_memory():
+    """Reset the peak to the current resident memory, where Linux allows it.
+
+    Otherwise the peak includes memory used while importing.
+    """
+    try:
+        clear_refs = open('/proc/self/clear_refs', 'w')
+    except IOError:
+        return
+
+    try:
+        try:
+            clear_refs.write('5')
+        finally:
+            clear_refs.close()
+    except IOError:
+        pass
+
+def current_memory():
+    """Returns the resident memory of the process in KB, or the peak if unavailable."""
+    try:
+        statm = open('/proc/self/statm')
+    except IOError:
+        return peak_memory()
+
+    try:
+        pages = int(statm.read().split()[1])
+    finally:
+        statm.close()
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024
+
+def measure_isolated(cls, iterations, packet_dir=None):
+    """Measure a benchmark in a new process, and return its results."""
+    args = [sys.executable, os.path.abspath(__file__), '--worker',
+        '-n', str(iterations)]
+    if packet_dir is not None:
+        args.extend(['-p', packet_dir])
+    args.append(cls.name)
+
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError("Benchmark '%s' failed with exit status %i." % \
+            (cls.name, proc.returncode))
+    return json.loads(output)
+
+def compare(results, baseline, tolerance):
+    """Compare throughput against a baseline.
+
+    Returns a list of (name, ratio) for benchmarks that
+    are slower than the baseline by more than tolerance percent.
+    """
+    regressions = []
+    for name, result in results.iteritems():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        ratio = result['ops_per_sec'] / base['ops_per_sec']
+        result['baseline_ratio'] = ratio
+        if ratio < 1 - tolerance / 100.0:
+            regressions.append((name, ratio))
+    return regressions
+
+def print_results(results):
+    columns = ('ops_per_sec', 'mb_per_sec', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_kb',
+        'peak_growth_kb', 'baseline_ratio')
+    print '%-28s %s' % ('benchmark', ' '.join(['%14s' % col for col in columns]))
+    for cls in BENCHMARKS:
+        result = results.get(cls.name)
+        if result is None:
+            continue
+
+        row = []
+        for col in columns:
+            if col in result:
+                row.append('%14.3f' % result[col])
+            else:
+                row.append('%14s' % '-')
+        print '%-28s %s' % (cls.name, ' '.join(row))
+
+def main(argv=None):
+    usage = """usage: %prog [options] [benchmark ...]"""
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option("-n", "--iterations", dest="iterations", type="int", default=200,
+        help="Number of times to run each benchmark.")
+    parser.add_option("-j", "--json", dest="json_file",
+        help="Write results as JSON to this file.")
+    parser.add_option("-b", "--baseline", dest="baseline_file",
+        help="Compare results with a JSON file written by a previous run.")
+    parser.add_option("-t", "--tolerance", dest="tolerance", type="float", default=10.0,
+        help="Percent slower than the baseline that is reported as a regression.")
+    parser.add_option("-p", "--packets", dest="packet_dir",
+        help="Directory of recorded raw AMF packets to decode.")
+    parser.add_option("-l", "--list", action="store_true", dest="list",
+        help="List benchmarks and exit.")
+    parser.add_option("--worker", action="store_true", dest="worker",
+        help=optparse.SUPPRESS_HELP)
+    (options, args) = parser.parse_args(argv)
+
+    if options.list:
+        for cls in BENCHMARKS:
+            print '%-28s %s' % (cls.name, cls.__doc__.splitlines()[0])
+        return 0
+
+    RecordedDecode.packet_dir = options.packet_dir
+
+    if options.worker:
+        # Measure a single benchmark for measure_isolated.
+        for cls in BENCHMARKS:
+            if cls.name in args:
+                json.dump(cls(options.iterations).measure(), sys.stdout)
+                return 0
+        return 1
+
+    results = {}
+    for cls in BENCHMARKS:
+        if len(args) > 0 and cls.name not in args:
+            continue
+        results[cls.name] = measure_isolated(cls, options.iterations,
+            options.packet_dir)
+
+    regressions = []
+    if options.baseline_file:
+        baseline_file = open(options.baseline_file)
+        try:
+            baseline = json.load(baseline_file)
+        finally:
+            baseline_file.close()
+        regressions = compare(results, baseline['results'], options.tolerance)
+
+    print_results(results)
+
+    if options.json_file:
+        out_file = open(options.json_file, 'w')
+        try:
+            json.dump({
+                'amfast': amfast.__version__,
+                'python': sys.version.split()[0],
+                'platform': sys.platform,
+                'time': time.time(),
+                'results': results
+            }, out_file, indent=2)
+        finally:
+            out_file.close()
+
+    for name, ratio in regressions:
+        print 'REGRESSION: %s runs at %.1f%% of baseline throughput.' % (name, ratio * 100)
+
+    if len(regressions) > 0:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
+import sys
 import unittest
+from StringIO import StringIO
 
-from amfast.buffer import Buffer, BufferError
+from amfast.buffer import Buffer, BufferError, BufferUnderflowError
 
 class BufferTestCase(unittest.TestCase):
     def setUp(self):
@@ -50,6 +52,125 @@ class BufferTestCase(unittest.TestCase):
         buf = Buffer(self.test_string)
         self.assertRaises(BufferError, buf.read, (len(self.test_string) + 1))
 
+    def testUnderflowNeeded(self):
+        buf = Buffer(self.test_string)
+        buf.read(2)
+        try:
+            buf.read(len(self.test_string))
+        except BufferUnderflowError, exc:
+            self.assertEquals(len(self.test_string) + 2, exc.needed)
+        else:
+            self.fail('BufferUnderflowError not raised.')
+
+    def testChunkedWrite(self):
+        buf = Buffer(chunk_size=8)
+        buf.write(self.test_string)
+        buf.write(self.test_string)
+        self.assertEquals(len(self.test_string) * 2, buf.tell())
+        self.assertEquals(self.test_string * 2, buf.getvalue())
+        self.assertEquals(['testerte', 'ster'], buf.getchunks())
+
+    def testChunkedLastChunk(self):
+        buf = Buffer(chunk_size=8)
+        buf.write(self.test_string)
+        self.assertEquals([self.test_string], buf.getchunks())
+        buf.write(self.test_string)
+        self.assertEquals([self.test_string, self.test_string], buf.getchunks())
+        self.assertEquals(len(self.test_string) * 2, buf.tell())
+
+    def testChunkedLongStringNotCopied(self):
+        tester = 's' * 65537
+        buf = Buffer(chunk_size=1024)
+        buf.write('a')
+        buf.write(tester)
+        chunks = buf.getchunks()
+        self.assertEquals(['a', tester], chunks)
+        self.assertTrue(tester is chunks[1])
+
+    def testChunkedSeek(self):
+        buf = Buffer(chunk_size=8)
+        buf.write(self.test_string)
+        buf.seek(5)
+        buf.write('s')
+        self.assertEquals('testes', buf.getvalue())
+        buf.write(self.test_string)
+        self.assertRaises(BufferError, buf.seek, 3)
+
+    def testChunkedSourceRaisesException(self):
+        self.assertRaises(BufferError, Buffer, self.test_string, 4)
+
+    def testGetChunks(self):
+        buf = Buffer()
+        buf.write(self.test_string)
+        self.assertEquals([self.test_string], buf.getchunks())
+
+    def testMaxSize(self):
+        buf = Buffer(max_size=300)
+        buf.write('s' * 300)
+        self.assertRaises(BufferError, buf.write, 's')
+        self.assertEquals(300, len(buf.getvalue()))
+
+    def testChunkedMaxSize(self):
+        buf = Buffer(chunk_size=8, max_size=20)
+        buf.write('s' * 10)
+        self.assertRaises(BufferError, buf.write, 's' * 11)
+        buf.write('s' * 10)
+        self.assertEquals(20, len(buf.getvalue()))
+
+    def testMaxSizeSourceRaisesException(self):
+        self.assertRaises(BufferError, Buffer, self.test_string, max_size=4)
+
+    def testReadHugeLengthRaisesException(self):
+        buf = Buffer(self.test_string)
+        buf.read(1)
+        self.assertRaises(BufferError, buf.read, sys.maxint)
+        self.assertEquals(1, buf.tell())
+
+    def testSink(self):
+        out = StringIO()
+        buf = Buffer(chunk_size=4, sink=out)
+        buf.write('ss')
+        buf.write('sss')
+        self.assertEquals('ssss', out.getvalue())
+        buf.write(self.test_string * 2)
+        self.assertEquals(5 + len(self.test_string) * 2, buf.tell())
+        buf.flush()
+        self.assertEquals('s' * 5 + self.test_string * 2, out.getvalue())
+        self.assertRaises(BufferError, buf.getvalue)
+        self.assertRaises(BufferError, buf.getchunks)
+
+    def testSinkGetsNewStrings(self):
+        class Sink(object):
+            def __init__(self):
+                self.writes = []
+                self.copies = []
+
+            def write(self, value):
+                self.writes.append(value)
+                self.copies.append(''.join(list(value)))
+
+        sink = Sink()
+        buf = Buffer(chunk_size=4, sink=sink)
+        for c in 'abcdefghij':
+            buf.write(c)
+        buf.flush()
+        self.assertEquals(['abcd', 'efgh', 'ij'], sink.writes)
+        self.assertEquals(sink.copies, sink.writes)
+        for i in range(len(sink.writes) - 1):
+            self.assertFalse(sink.writes[i] is sink.writes[i + 1])
+
+        buf.reset()
+        buf.write('klm')
+        buf.flush()
+        self.assertEquals(3, buf.tell())
+        self.assertEquals('klm', sink.writes[-1])
+        self.assertEquals('abcd', sink.writes[0])
+
+    def testBadSinkRaisesException(self):
+        self.assertRaises(BufferError, Buffer, sink=object())
+        self.assertRaises(BufferError, Buffer, sink=-1)
+        self.assertRaises(BufferError, Buffer, self.test_string, sink=StringIO())
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(BufferTestCase)
 
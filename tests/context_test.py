@@ -3,7 +3,14 @@ import unittest
 import StringIO
 
 from amfast.context import (ContextError, Idx, Ref,
-    DecoderContext, EncoderContext)
+    DecoderContext, EncoderContext, CodecStats)
+from amfast.encode import encode
+from amfast.decode import decode
+from amfast import class_def
+
+class StatsSpam(object):
+    def __init__(self):
+        self.spam = 'eggs'
 
 class ContextTestCase(unittest.TestCase):
     def setUp(self):
@@ -35,6 +42,47 @@ class ContextTestCase(unittest.TestCase):
         for i, val in enumerate(strs):
             self.assertEquals(i, ref.ret(val))
 
+    def testIdxReset(self):
+        idx = Idx()
+        idx.map(self.test_string)
+        idx.reset()
+        self.assertRaises(ContextError, idx.ret, 0)
+        self.assertEquals(0, idx.map(self.test_string))
+
+    def testRefReset(self):
+        ref = Ref()
+        ref.map(self.test_string)
+        ref.reset()
+        self.assertEquals(-1, ref.ret(self.test_string))
+        self.assertEquals(0, ref.map(self.test_string))
+
+    def testRefGrowth(self):
+        import sys
+
+        count = 100000
+        objs = [object() for i in xrange(count)]
+        refcount = sys.getrefcount(objs[0])
+
+        ref = Ref()
+        for i, obj in enumerate(objs):
+            self.assertEquals(i, ref.map(obj))
+        self.assertEquals(refcount + 1, sys.getrefcount(objs[0]))
+
+        # Re-mapped objects point to the latest index,
+        # and only hold one reference.
+        self.assertEquals(count, ref.map(objs[0]))
+        self.assertEquals(refcount + 1, sys.getrefcount(objs[0]))
+
+        self.assertEquals(count, ref.ret(objs[0]))
+        for i in xrange(1, count):
+            self.assertEquals(i, ref.ret(objs[i]))
+        self.assertEquals(-1, ref.ret(object()))
+
+        ref.reset()
+        self.assertEquals(refcount, sys.getrefcount(objs[0]))
+        self.assertEquals(-1, ref.ret(objs[1]))
+        self.assertEquals(0, ref.map(objs[1]))
+
     def testUnmappedObjReturnsNegative(self):
         ref = Ref()
         self.assertEquals(-1, ref.ret(self.test_string))
@@ -95,6 +143,86 @@ class ContextTestCase(unittest.TestCase):
         con_2 = con.copy()
         self._testEncoderContext(con_2)
 
+    def testResetEncoderContext(self):
+        con = EncoderContext(amf3=True)
+        con.write(self.test_string)
+        con.obj_refs.map(self.test_string)
+        buf = con.buffer
+        con.reset()
+        self.assertTrue(buf is con.buffer)
+        self.assertEquals(0, con.buffer.tell())
+        self.assertEquals(-1, con.obj_refs.ret(self.test_string))
+        self._testWrite(con)
+
+    def testResetDecoderContext(self):
+        con = DecoderContext('spam', amf3=True)
+        con.obj_refs.map(self.test_string)
+        con.read(2)
+        con.reset(self.test_string)
+        self.assertRaises(ContextError, con.obj_refs.ret, 0)
+        self._testRead(con)
+
+        con.reset(StringIO.StringIO(self.test_string))
+        self._testRead(con)
+
+        con.reset(self.test_string)
+        self._testDecoderContext(con)
+        self._testRead(con)
+
+    def _statsMapper(self):
+        mapper = class_def.ClassDefMapper()
+        mapper.mapClass(class_def.ClassDef(StatsSpam, 'alias.stats.Spam', ('spam',)))
+        return mapper
+
+    def _testStats(self, stats):
+        types = stats.types
+        self.assertEquals(1, stats.calls)
+        self.assertEquals(1, types['amf3 array'][0])
+        self.assertEquals((4, 15), types['amf3 string'][:2])
+        self.assertEquals(2, types['amf3 object'][0])
+        self.assertEquals(types['amf3 object'], stats.aliases['alias.stats.Spam'])
+        self.assertEquals((2, 4), stats.refs['string'])
+        self.assertEquals((1, 1), stats.refs['class'])
+        self.assertEquals(0.5, stats.hit_rates['class'])
+
+    def testStatsDefaultToNone(self):
+        self.assertEquals(None, EncoderContext().stats)
+        self.assertEquals(None, DecoderContext('').stats)
+
+    def testBadStatsRaisesException(self):
+        self.assertRaises(ContextError, EncoderContext, stats={})
+        self.assertRaises(ContextError, DecoderContext, '', stats={})
+
+    def testEncoderStats(self):
+        stats = CodecStats()
+        encode(['abc', 'abc', StatsSpam(), StatsSpam()],
+            EncoderContext(amf3=True, class_def_mapper=self._statsMapper(), stats=stats))
+        self._testStats(stats)
+
+        stats.reset()
+        self.assertEquals({}, stats.types)
+        self.assertEquals({}, stats.aliases)
+        self.assertEquals(0, stats.calls)
+
+    def testDecoderStats(self):
+        mapper = self._statsMapper()
+        encoded = encode(['abc', 'abc', StatsSpam(), StatsSpam()],
+            EncoderContext(amf3=True, class_def_mapper=mapper))
+
+        stats = CodecStats()
+        decode(DecoderContext(encoded, amf3=True, class_def_mapper=mapper, stats=stats))
+        self._testStats(stats)
+
+    def testAmf0Stats(self):
+        stats = CodecStats()
+        val = [1, 2]
+        encode([val, val], EncoderContext(stats=stats))
+        types = stats.types
+        self.assertEquals(2, types['amf0 strict-array'][0])
+        self.assertEquals((2, 18), types['amf0 number'][:2])
+        self.assertEquals((1, 3), types['amf0 reference'][:2])
+        self.assertEquals((1, 2), stats.refs['object'])
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(ContextTestCase)
 
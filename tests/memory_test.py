@@ -1,92 +1,583 @@
 # -*- coding: utf-8 -*-
+"""Leak and allocation checks for the C extension.
+
+Every codec path, including error paths, is run many times
+and must not leave anything behind. Growth is measured with:
+
+ * the number of objects tracked by the garbage collector
+ * the reference counts of every object in the input,
+   and in the result of one call, which catches leaked references
+   to shared objects like interned strings, that the garbage
+   collector does not track
+ * sys.gettotalrefcount, on debug builds of Python
+ * tracemalloc, if it is available
+ * the resident size of the process, per call, over enough
+   calls to show a leak of one small string per call, which
+   is not visible to the garbage collector on release builds
+
+Set AMFAST_LEAK_ITERATIONS to run each path more times.
+
+Run this file directly to also print the number of allocations
+made for each encoded or decoded object.
+"""
+import array
 import gc
-import json
-import re
+import os
 import sys
 import unittest
+import xml.dom.minidom
+from datetime import datetime
+from StringIO import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import amfast
+from amfast import class_def, remoting
+from amfast.class_def import as_types
+from amfast.context import EncoderContext, DecoderContext, CodecStats
+from amfast.encode import encode, encode_packet, write_small_message
+from amfast.decode import (decode, decode_packet, decode_lazy, read_small_message,
+    InternTable)
+from amfast.remoting import flex_messages as messaging
+
+ITERATIONS = int(os.environ.get('AMFAST_LEAK_ITERATIONS', 200))
+WARMUP = 10
+SLOPE_ITERATIONS = ITERATIONS * 10 # Codec calls used to measure resident memory
+LEAK_LIMIT = 4 # Objects or references a path may grow by
+RSS_SLOPE_LIMIT = 16 # Bytes of resident memory a codec call may grow by
+BALLAST_SIZE = 256 * 1024 # Bytes of free memory of each object size used up before measuring
+
+class MemSpam(object):
+    def __init__(self):
+        self.spam = 'eggs'
+        self.number = 1
+
+class MemEggs(object):
+    def __init__(self):
+        self.spam = u'spam'
+
+class MemBroken(object):
+    def _getSpam(self):
+        raise ValueError('Broken attribute.')
+    spam = property(_getSpam)
+
+class BrokenMapper(class_def.ClassDefMapper):
+    def getClassDefByClass(self, class_):
+        if class_ is MemSpam:
+            raise ValueError('Broken mapper.')
+        return class_def.ClassDefMapper.getClassDefByClass(self, class_)
+
+def build_mapper():
+    mapper = class_def.ClassDefMapper()
+    mapper.mapClass(class_def.ClassDef(MemSpam, 'mem.Spam', ('spam', 'number')))
+    mapper.mapClass(class_def.DynamicClassDef(MemEggs, 'mem.Eggs', ()))
+    mapper.mapClass(class_def.ClassDef(MemBroken, 'mem.Broken', ('spam',)))
+    mapper.mapClass(messaging.CommandSmallMsgDef(messaging.CommandMessage, alias='DSC'))
+    return mapper
+
+def build_values():
+    """Values that exercise each encoder path."""
+    shared = {'shared': [1, 2, 3]}
+    return {
+        'scalars': [None, True, False, 1, 2 ** 40, 1.5, 'str', u'unicod\xe9',
+            datetime(2010, 1, 1, 12, 30)],
+        'containers': [[1, [2, 3]], (4, 'five'), {'a': {'b': [1.5]}}],
+        'objects': [MemSpam(), MemSpam(), MemEggs()],
+        'references': [shared, shared, 'ref', 'ref'],
+        'byte_arrays': [as_types.AsByteArray('x' * 100),
+            as_types.AsCompressedByteArray('y' * 1000)],
+        'xml': xml.dom.minidom.parseString('<spam><eggs>1</eggs></spam>'),
+        'vectors': [array.array('i', [1, 2]), array.array('d', [1.5]),
+            as_types.AsVector(['a', 'b'], 'String')],
+        'dictionary': as_types.AsDictionary({1: 'one', 'two': 2}),
+        'table': [{'id': i, 'name': 'row %i' % i} for i in xrange(20)],
+        'proxy': as_types.AsProxy({'spam': 'eggs'}),
+        'small_message': messaging.CommandMessage(body={'spam': 'eggs'},
+            clientId='client', destination='spam', headers={'DSEndpoint': 'amf'},
+            messageId='0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9', timestamp=1,
+            operation=messaging.CommandMessage.CLIENT_PING_OPERATION)
+    }
+
+def build_packet(values):
+    msg = messaging.RemotingMessage(body=values['objects'], destination='spam',
+        operation='eggs', messageId='0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9')
+    return remoting.Packet(client_type=remoting.Packet.FLASH_9,
+        headers=[remoting.Header('spam', False, 'eggs')],
+        messages=[remoting.Message(target='null', response='/1', body=(msg,)),
+            remoting.Message(target='spam.eggs', response='/2', body=values['containers'])])
+
+class CodecPath(object):
+    """One way of calling the codec.
+
+    arguments
+    ==========
+     * name - string, label of the path.
+     * func - callable, runs the path once and returns its result.
+     * inputs - object, checked for leaked references.
+     * error - Exception class, expected to be raised by func, or None.
+     * calls - int, number of codec calls made by func.
+    """
+    def __init__(self, name, func, inputs, error=None, calls=1):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.error = error
+        self.calls = calls
+
+    def __call__(self):
+        if self.error is None:
+            return self.func()
+
+        try:
+            self.func()
+        except self.error:
+            return None
+        raise AssertionError("%s did not raise %s." % (self.name, self.error.__name__))
+
+def _encodePath(name, value, mapper, **kwargs):
+    def func():
+        return encode(value, EncoderContext(class_def_mapper=mapper, **kwargs))
+    return CodecPath(name, func, value)
+
+def _decodePath(name, encoded, mapper, **kwargs):
+    def func():
+        return decode(DecoderContext(encoded, class_def_mapper=mapper, **kwargs))
+    return CodecPath(name, func, encoded)
+
+def _errorPath(name, func, inputs, error=amfast.AmFastError):
+    return CodecPath(name, func, inputs, error)
+
+def build_paths():
+    """Returns a list of CodecPaths that cover the encoder and decoder."""
+    mapper = build_mapper()
+    values = build_values()
+    paths = []
+
+    encoded = {}
+    for name, value in values.iteritems():
+        for amf3 in (False, True):
+            label = '%s %s' % (name, amf3 and 'amf3' or 'amf0')
+            paths.append(_encodePath('encode ' + label, value, mapper, amf3=amf3))
+            encoded[(name, amf3)] = encode(value,
+                EncoderContext(class_def_mapper=mapper, amf3=amf3))
+            paths.append(_decodePath('decode ' + label, encoded[(name, amf3)],
+                mapper, amf3=amf3))
+            # Decoded strings are shared, so leaked references to them are counted.
+            paths.append(_decodePath('decode %s interned' % label, encoded[(name, amf3)],
+                mapper, amf3=amf3, intern_table=InternTable()))
+
+    # Encoder options
+    for name in ('containers', 'objects', 'references', 'table'):
+        value = values[name]
+        paths.extend([
+            _encodePath('encode %s proxies' % name, value, mapper, amf3=True,
+                use_proxies=True, use_collections=True),
+            _encodePath('encode %s shared traits' % name, value, mapper, amf3=True,
+                use_shared_traits=True),
+            _encodePath('encode %s no references' % name, value, mapper, amf3=True,
+                use_references=False),
+            _encodePath('encode %s chunked' % name, value, mapper, amf3=True,
+                chunk_size=16),
+            _encodePath('encode %s stats' % name, value, mapper, amf3=True,
+                stats=CodecStats())
+        ])
+    paths.append(_encodePath('encode dictionaries', {1: 'one', (2, 3): 'two'},
+        mapper, amf3=True, use_dictionaries=True))
+    objects = values['objects']
+    def file_buffer_func():
+        return encode(objects, EncoderContext(amf3=True, class_def_mapper=mapper,
+            buffer=StringIO()))
+    paths.append(CodecPath('encode file buffer', file_buffer_func, objects))
+    def stream_func():
+        return encode(objects, EncoderContext(amf3=True, class_def_mapper=mapper,
+            buffer=StringIO(), chunk_size=16))
+    paths.append(CodecPath('encode streamed', stream_func, objects))
+
+    # Decoder options
+    table = InternTable()
+    for name in ('containers', 'objects', 'references', 'table', 'vectors', 'byte_arrays'):
+        raw = encoded[(name, True)]
+        paths.extend([
+            _decodePath('decode %s lazy' % name, raw, mapper, amf3=True, lazy=True),
+            _decodePath('decode %s intern table' % name, raw, mapper, amf3=True,
+                intern_table=table),
+            _decodePath('decode %s compact arrays' % name, raw, mapper, amf3=True,
+                compact_arrays=True),
+            _decodePath('decode %s byte views' % name, raw, mapper, amf3=True,
+                use_byte_views=True),
+            _decodePath('decode %s uncompress' % name, raw, mapper, amf3=True,
+                uncompress_byte_arrays=True),
+            _decodePath('decode %s stats' % name, raw, mapper, amf3=True,
+                stats=CodecStats())
+        ])
+
+    raw = encoded[('objects', True)]
+    def decode_lazy_func():
+        return decode_lazy(DecoderContext(raw, amf3=True, class_def_mapper=mapper))
+    paths.append(CodecPath('decode lazy value', decode_lazy_func, raw))
+
+    # Packets
+    packet = build_packet(values)
+    raw_packet = encode_packet(packet, EncoderContext(class_def_mapper=mapper))
+    def encode_packet_func():
+        return encode_packet(packet, EncoderContext(class_def_mapper=mapper))
+    def decode_packet_func():
+        return decode_packet(DecoderContext(raw_packet, class_def_mapper=mapper))
+    paths.append(CodecPath('encode packet', encode_packet_func, packet))
+    def stream_packet_func():
+        return encode_packet(packet, EncoderContext(class_def_mapper=mapper,
+            buffer=StringIO(), chunk_size=16))
+    paths.append(CodecPath('encode streamed packet', stream_packet_func, packet))
+    paths.append(CodecPath('decode packet', decode_packet_func, raw_packet))
+
+    # Every truncation of the packet, so each framing read fails once.
+    def truncated_packet_func():
+        for i in xrange(len(raw_packet)):
+            try:
+                decode_packet(DecoderContext(raw_packet[:i], class_def_mapper=mapper))
+            except amfast.AmFastError:
+                continue
+            raise AssertionError('Truncated packet of %d bytes was decoded.' % i)
+    paths.append(CodecPath('decode truncated packet', truncated_packet_func, raw_packet,
+        calls=len(raw_packet)))
+
+    rpc_packet = '\x00\x03\x00\x00\x00\x01\x00\x04null\x00\x02/1\x00\x00\x00\x01'
+    def bad_rpc_func():
+        return decode_packet(DecoderContext(rpc_packet))
+    paths.append(_errorPath('decode packet missing arguments', bad_rpc_func, rpc_packet))
+
+    # Error paths
+    for (name, amf3), raw in encoded.iteritems():
+        if len(raw) < 2:
+            continue
+        truncated = raw[:len(raw) / 2]
+        def truncated_func(truncated=truncated, amf3=amf3):
+            return decode(DecoderContext(truncated, amf3=amf3, class_def_mapper=mapper))
+        paths.append(_errorPath('decode truncated %s %s' % (name, amf3 and 'amf3' or 'amf0'),
+            truncated_func, truncated))
+
+    def bad_marker_func():
+        return decode(DecoderContext('\xff', amf3=True))
+    paths.append(_errorPath('decode bad marker', bad_marker_func, None))
+
+    def bad_reference_func():
+        return decode(DecoderContext('\x09\x02', amf3=True))
+    paths.append(_errorPath('decode bad reference', bad_reference_func, None))
+
+    bad_refs = [
+        ('\x06\xff\xff\xff\xfe', True), # Negative string reference
+        ('\x09\xff\xff\xff\xfe', True), # Negative object reference
+        ('\x0A\xff\xff\xff\xfd', True), # Negative trait reference
+        ('\x0A\x05', True), # Missing trait reference
+        ('\x09\x03\x01\x06\x04', True), # String reference inside an array
+        ('\x0A\x00\x00\x00\x01\x07\x00\x05', False) # Reference inside an AMF0 array
+    ]
+    for bad_ref, amf3 in bad_refs:
+        def bad_refs_func(bad_ref=bad_ref, amf3=amf3):
+            return decode(DecoderContext(bad_ref, amf3=amf3))
+        paths.append(_errorPath('decode bad reference %r' % bad_ref, bad_refs_func, bad_ref))
+
+    broken = [MemBroken(), MemBroken()]
+    def broken_attr_func():
+        return encode(broken, EncoderContext(amf3=True, class_def_mapper=mapper))
+    paths.append(_errorPath('encode broken attribute', broken_attr_func, broken, ValueError))
+
+    spams = [MemSpam()]
+    broken_mapper = BrokenMapper()
+    def broken_mapper_func():
+        return encode(spams, EncoderContext(amf3=True, class_def_mapper=broken_mapper))
+    paths.append(_errorPath('encode broken mapper', broken_mapper_func, spams, ValueError))
+
+    stats = {}
+    def bad_stats_func():
+        return EncoderContext(stats=stats)
+    paths.append(_errorPath('encode bad stats', bad_stats_func, stats))
+
+    msg = values['small_message']
+    def bad_small_message_func():
+        return write_small_message(msg, EncoderContext(amf3=True), 99)
+    paths.append(_errorPath('encode bad small message', bad_small_message_func, msg))
+
+    def bad_small_read_func():
+        return read_small_message(messaging.CommandMessage(),
+            DecoderContext('\x00', amf3=True), 99)
+    paths.append(_errorPath('decode bad small message', bad_small_read_func, None))
+
+    corrupt = '\x0C\x0B\x78\x9c\x00\x01\x02'
+    paths.append(_decodePath('decode corrupt compressed byte array', corrupt, mapper,
+        amf3=True, uncompress_byte_arrays=True))
 
-from guppy import hpy
+    return paths
 
-from amfast.decoder import Decoder
-from amfast.encoder import Encoder
+def input_objects(inputs):
+    """Returns a list of every object reachable from inputs."""
+    seen = {}
+    stack = [inputs]
+    objs = []
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen[id(obj)] = True
+        objs.append(obj)
+
+        if isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+            stack.extend(obj.__dict__.values())
+    return objs
+
+def total_refcount():
+    """Returns the total reference count on debug builds, or None."""
+    if hasattr(sys, 'gettotalrefcount'):
+        return sys.gettotalrefcount()
+    return None
+
+def traced_memory():
+    """Returns the memory traced by tracemalloc, or None."""
+    if tracemalloc is None:
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return tracemalloc.get_traced_memory()[0]
+
+def current_rss():
+    """Returns the resident size of the process in bytes, or None.
+
+    Where the current size is not available, the peak size is
+    returned instead, which also grows with every leak.
+    """
+    try:
+        statm = open('/proc/self/statm')
+    except IOError:
+        try:
+            import resource
+        except ImportError:
+            return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return peak
+        return peak * 1024
+
+    try:
+        pages = int(statm.read().split()[1])
+    finally:
+        statm.close()
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def fill_free_memory():
+    """Use up memory that has been freed, but is still resident,
+    so memory that leaks afterwards can't re-use it unnoticed.
+
+    Returns a list of objects that must be kept until measuring is done.
+    """
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL(None).malloc_trim(0)
+    except (ImportError, OSError, AttributeError):
+        pass
+
+    # Free blocks are only re-used for objects of the same size,
+    # so strings of every size the object allocator handles are kept.
+    ballast = []
+    for length in xrange(3, 512 - 37, 8):
+        ballast.extend(['x' * length for i in xrange(BALLAST_SIZE / (length + 37))])
+    return ballast
+
+def measure_growth(path, iterations=ITERATIONS, slope_iterations=SLOPE_ITERATIONS):
+    """Run a path many times.
+
+    Returns a dict of measurement -> growth.
+    """
+    for i in xrange(WARMUP):
+        path()
+    gc.collect()
+
+    result = path()
+    objs = input_objects(path.inputs) + input_objects(result)
+    start_refs = [sys.getrefcount(obj) for obj in objs]
+    start = {
+        'gc objects': len(gc.get_objects()),
+        'total refcount': total_refcount(),
+        'traced bytes': traced_memory()
+    }
+
+    for i in xrange(iterations):
+        path()
+    gc.collect()
+
+    end = {
+        'gc objects': len(gc.get_objects()),
+        'total refcount': total_refcount(),
+        'traced bytes': traced_memory()
+    }
+
+    growth = {}
+    for key, val in start.iteritems():
+        if val is not None:
+            growth[key] = end[key] - val
+
+    leaked_refs = 0
+    for i, obj in enumerate(objs):
+        if obj is None or isinstance(obj, (bool, int, long)):
+            continue # Shared by everything
+
+        leaked_refs = max(leaked_refs, sys.getrefcount(obj) - start_refs[i])
+    growth['input refcount'] = leaked_refs
+    del result
+
+    # Resident memory grows a page at a time, so it is measured over
+    # many more calls than the other counts. The first half of the calls
+    # are not measured, so memory that is only allocated once, and memory
+    # that was freed but is still resident, is used up beforehand.
+    if slope_iterations > 0 and current_rss() is not None:
+        slope_iterations = max(1, slope_iterations / path.calls / 2)
+        for i in xrange(slope_iterations):
+            path()
+        gc.collect()
+
+        start_rss = current_rss()
+        for i in xrange(slope_iterations):
+            path()
+        gc.collect()
+
+        growth['rss bytes per call'] = float(current_rss() - start_rss) / \
+            (slope_iterations * path.calls)
+    return growth
+
+def allocations(path):
+    """Returns the number of allocations made by one run of a path,
+    and the number of objects in the encoded or decoded value.
+
+    Memory blocks are counted with tracemalloc if it is available,
+    otherwise objects tracked by the garbage collector are counted.
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        traced_memory()
+        start = tracemalloc.take_snapshot()
+        result = path()
+        stats = tracemalloc.take_snapshot().compare_to(start, 'lineno')
+        allocated = sum([stat.count_diff for stat in stats if stat.count_diff > 0])
+    else:
+        gc.disable()
+        try:
+            start = len(gc.get_objects())
+            result = path()
+            allocated = len(gc.get_objects()) - start
+        finally:
+            gc.enable()
+
+    value = path.inputs
+    if path.name.startswith('decode'):
+        value = result
+    return (allocated, len(input_objects(value)))
 
 class MemTestCase(unittest.TestCase):
-    pattern = re.compile(r'Total size = (.+) bytes')
-
-    def heapSize(self):
-        # There's got to be a better way to do this???
-        hp = hpy()
-        size = str(hp.heap())
-        m = self.pattern.search(size)
-        return int(m.group(1))
-
-    def _testEncoder(self, encoder, json_file):
-         in_file = open(json_file)
-         try:
-             for idx, line in enumerate(in_file):
-                 start = self.heapSize()
-
-                 obj = json.loads(line)
-                 for count in xrange(1000):
-                     out = encoder.encode(obj)
-
-                 obj = None
-                 en = None
-                 out = None
-                 gc.collect()
-
-                 end = self.heapSize()
-                 print '%s (%s): %s - %s' % (idx, line[:10], start, end)
-                 sys.stdout.flush()
-         finally:
-             in_file.close()
-
-    def _testDecoder(self, decoder, encoder, json_file):
-         in_file = open(json_file)
-         try:
-             for idx, line in enumerate(in_file):
-                 if (not line.startswith('{"status"')):
-                     continue
-
-                 start = self.heapSize()
-
-                 obj = json.loads(line)
-                 for count in xrange(1000000):
-                     out = encoder.encode(obj)
-                     new = decoder.decode(out)
-
-                 obj = None
-                 en = None
-                 out = None
-                 new = None
-                 gc.collect()
-
-                 end = self.heapSize()
-                 print '%s (%s): %s - %s' % (idx, line[:10], start, end)
-                 sys.stdout.flush()
-         finally:
-             in_file.close()
-
-         
-
-    def testEncodeAmf0(self):
-         return
-         self._testEncoder(Encoder(), 'sample.log')
-
-    def testEncodeAmf3(self):
-         return
-         self._testEncoder(Encoder(amf3=True), 'sample.log')
-
-    def testDecodeAmf0(self):
-         return
-         self._testDecoder(Decoder(), Encoder(), 'sample.log')
-
-    def testDecodeAmf3(self):
-         return
-         self._testDecoder(Decoder(amf3=True), Encoder(amf3=True), 'sample_2.log')
+    """Each path must not grow memory by one unit per call."""
+
+    def setUp(self):
+        self.ballast = fill_free_memory()
+
+    def tearDown(self):
+        del self.ballast
+
+    def _testPaths(self, prefix):
+        if current_rss() is None and total_refcount() is None and tracemalloc is None:
+            self.fail('Leaks that the garbage collector does not track can not be '
+                'measured. Run on a debug build of Python, or with tracemalloc.')
+
+        leaks = []
+        for path in build_paths():
+            if not path.name.startswith(prefix):
+                continue
+
+            growth = measure_growth(path)
+            for key, val in growth.iteritems():
+                if key == 'rss bytes per call':
+                    if val > RSS_SLOPE_LIMIT:
+                        leaks.append('%s: %s grew by %.1f' % (path.name, key, val))
+                elif key == 'traced bytes':
+                    if val >= ITERATIONS * 8:
+                        leaks.append('%s: %s grew by %s' % (path.name, key, val))
+                elif val > LEAK_LIMIT:
+                    leaks.append('%s: %s grew by %s' % (path.name, key, val))
+
+        self.assertEquals([], leaks, '\n'.join(leaks))
+
+    def testEncode(self):
+        self._testPaths('encode')
+
+    def testDecode(self):
+        self._testPaths('decode')
+
+    def testDetectsLeak(self):
+        leaked = []
+        value = ['spam']
+        def leak():
+            leaked.append([value])
+        growth = measure_growth(CodecPath('leak', leak, value), 50, 0)
+        self.assertTrue(growth['gc objects'] >= 50)
+        self.assertTrue(growth['input refcount'] >= 50)
+
+    def testDetectsStringLeak(self):
+        try:
+            import ctypes
+        except ImportError:
+            return
+
+        # A leaked string is not tracked by the garbage collector,
+        # and is not referenced by the input or the result.
+        value = ['spam']
+        def leak():
+            leaked = ''.join(value * 4)
+            ctypes.pythonapi.Py_IncRef(ctypes.py_object(leaked))
+        growth = measure_growth(CodecPath('leak', leak, value), 50)
+        self.assertTrue(growth['gc objects'] <= LEAK_LIMIT)
+        if 'rss bytes per call' in growth:
+            self.assertTrue(growth['rss bytes per call'] > RSS_SLOPE_LIMIT,
+                growth)
+        elif 'total refcount' in growth:
+            self.assertTrue(growth['total refcount'] >= 50)
+
+    def testDetectsResultLeak(self):
+        try:
+            import ctypes
+        except ImportError:
+            return
+
+        # A leaked reference to a decoded string is only
+        # visible in the refcount of the shared string.
+        raw = encode([u'spam'], EncoderContext(amf3=True))
+        table = InternTable()
+        def leak():
+            result = decode(DecoderContext(raw, amf3=True, intern_table=table))
+            ctypes.pythonapi.Py_IncRef(ctypes.py_object(result[0]))
+            return result
+        growth = measure_growth(CodecPath('leak', leak, raw), 50, 0)
+        self.assertTrue(growth['input refcount'] >= 50)
+
+def report(out=sys.stdout):
+    """Print the allocations per encoded or decoded object for each path."""
+    out.write('%-45s %10s %10s %10s\n' % ('path', 'allocated', 'objects', 'per object'))
+    for path in build_paths():
+        if path.error is not None:
+            continue
+        allocated, count = allocations(path)
+        out.write('%-45s %10d %10d %10.2f\n' % (path.name, allocated, count,
+            float(allocated) / max(count, 1)))
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(MemTestCase)
 
 if __name__ == "__main__":
     unittest.TextTestRunner().run(suite())
+    report()
@@ -0,0 +1,213 @@
+import unittest
+
+import amfast
+from amfast import remoting
+from amfast.encoder import Encoder
+from amfast.decoder import Decoder, PushDecoder
+from amfast import class_def
+from amfast.decode import DecodeError, decode
+from amfast.encode import encode
+from amfast.context import LimitError
+
+class PushDecoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = Encoder(amf3=True)
+        self.decoder = Decoder(amf3=True)
+
+        self.packet = remoting.Packet(client_type=remoting.Packet.FLASH_9)
+        self.packet.headers.append(remoting.Header('spam', False, 'eggs'))
+        self.packet.headers.append(remoting.Header('eggs', True, {'spam': [1, 2, 3]}))
+        self.packet.messages.append(remoting.Message(target='/1/onResult',
+            response='', body={'spam': 'eggs', 'list': ['a' * 1000, 1.5, None]}))
+        self.packet.messages.append(remoting.Message(target='/2/onResult',
+            response='', body=[u'\xe9' * 50, 'spam', 'spam']))
+
+    def _chunk(self, bytes, size):
+        return [bytes[i:i + size] for i in xrange(0, len(bytes), size)]
+
+    def testValueStream(self):
+        values = [1, u'spam', {'eggs': [1, 2, 3]}, ['x' * 300], None, 2.5]
+        encoded = ''.join([self.encoder.encode(value) for value in values])
+
+        for size in (1, 3, 7, 64, len(encoded)):
+            push_decoder = self.decoder.push_decoder()
+            results = []
+            for chunk in self._chunk(encoded, size):
+                results.extend(push_decoder.feed(chunk))
+            push_decoder.close()
+            self.assertEquals(values, results)
+
+    def testValueReturnedWhenComplete(self):
+        encoded = self.encoder.encode('spam' * 10)
+        push_decoder = self.decoder.push_decoder()
+        self.assertEquals([], push_decoder.feed(encoded[:-1]))
+        self.assertEquals(len(encoded) - 1, push_decoder.pending)
+        self.assertEquals(['spam' * 10], push_decoder.feed(encoded[-1:]))
+        self.assertEquals(0, push_decoder.pending)
+
+    def testPacket(self):
+        encoded = self.encoder.encode_packet(self.packet)
+
+        for size in (1, 5, 100, len(encoded)):
+            push_decoder = PushDecoder(packet=True)
+            results = []
+            for chunk in self._chunk(encoded, size):
+                results.extend(push_decoder.feed(chunk))
+            push_decoder.close()
+
+            self.assertEquals(1, len(results))
+            packet = results[0]
+            self.assertEquals(remoting.Packet.FLASH_9, packet.client_type)
+            self.assertEquals(2, len(packet.headers))
+            self.assertEquals('eggs', packet.headers[1].name)
+            self.assertEquals(True, packet.headers[1].required)
+            self.assertEquals({'spam': [1, 2, 3]}, packet.headers[1].value)
+            self.assertEquals(2, len(packet.messages))
+            self.assertEquals('/1/onResult', packet.messages[0].target)
+            self.assertEquals(self.packet.messages[0].body, packet.messages[0].body)
+            self.assertEquals(self.packet.messages[1].body, packet.messages[1].body)
+
+    def testRpcPacket(self):
+        encoded = '\x00\x00' # AMF0 version marker
+        encoded += '\x00\x00' # Header count (0)
+        encoded += '\x00\x01' # Body count (1)
+        encoded += '\x00\x04spam' # Body target
+        encoded += '\x00\x04eggs' # Body response
+        encoded += '\xFF\xFF\xFF\xFF' # Unknown byte length
+        encoded += '\x0A\x00\x00\x00\x02' # 2 element array header
+        encoded += '\x03\x00\x01a\x02\x00\x01b\x00\x00\x09' # Body[0] object
+        encoded += '\x07\x00\x00' # Body[1] reference to Body[0]
+
+        push_decoder = PushDecoder(packet=True)
+        results = []
+        for chunk in self._chunk(encoded, 2):
+            results.extend(push_decoder.feed(chunk))
+
+        self.assertEquals(1, len(results))
+        body = results[0].messages[0].body
+        self.assertEquals({'a': 'b'}, body[0])
+        self.assertTrue(body[0] is body[1])
+
+    def testConsecutivePackets(self):
+        encoded = self.encoder.encode_packet(self.packet)
+        push_decoder = PushDecoder(packet=True)
+        results = push_decoder.feed(encoded * 2 + encoded[:10])
+        self.assertEquals(2, len(results))
+        self.assertRaises(DecodeError, push_decoder.close)
+
+    def testBadVersionRaisesException(self):
+        push_decoder = PushDecoder(packet=True)
+        self.assertRaises(DecodeError, push_decoder.feed, '\x00\x09\x00\x00')
+
+    def testLargeValue(self):
+        class CountingPushDecoder(PushDecoder):
+            decodes = 0
+            def _getContext(self, *args, **kwargs):
+                self.decodes += 1
+                return PushDecoder._getContext(self, *args, **kwargs)
+
+        value = [u'spam', {'eggs': 1.5}] + range(20000)
+        encoded = self.encoder.encode(value)
+
+        # Incomplete values are scanned, not decoded again.
+        push_decoder = CountingPushDecoder(amf3=True)
+        self.assertEquals([value], self._feed(push_decoder, encoded, 64))
+        self.assertEquals(2, push_decoder.decodes)
+
+        # Complete values are returned right away.
+        split = len(encoded) * 2 / 3
+        push_decoder = CountingPushDecoder(amf3=True)
+        self.assertEquals([], push_decoder.feed(encoded[:split]))
+        self.assertEquals([value, 5], push_decoder.feed(encoded[split:] +
+            self.encoder.encode(5)))
+        self.assertEquals(0, push_decoder.pending)
+
+    def testLargeRpcPacket(self):
+        body = ['spam' * 10] * 1000
+        encoded = '\x00\x00\x00\x00\x00\x01' # Version, 0 headers, 1 body
+        encoded += '\x00\x04spam\x00\x04eggs' # Body target and response
+        encoded += '\xFF\xFF\xFF\xFF' # Unknown byte length
+        encoded += Encoder().encode(body)
+
+        push_decoder = PushDecoder(packet=True)
+        results = self._feed(push_decoder, encoded, 100)
+        self.assertEquals(1, len(results))
+        self.assertEquals(body, results[0].messages[0].body)
+        self.assertTrue(push_decoder._scanner is None)
+
+    def testUnscannableValue(self):
+        class ExternObject(object):
+            pass
+
+        class ExternClass(class_def.ExternClassDef):
+            def writeExternal(self, obj, context):
+                encode(obj.value, context)
+
+            def readExternal(self, obj, context):
+                obj.value = decode(context)
+
+        class_mapper = class_def.ClassDefMapper()
+        class_mapper.mapClass(ExternClass(ExternObject, 'test_push.extern'))
+        obj = ExternObject()
+        obj.value = ['eggs' * 100]
+        encoder = Encoder(amf3=True, class_def_mapper=class_mapper)
+        encoded = encoder.encode(obj) + encoder.encode(5)
+
+        # Externalizable objects are decoded again when more data arrives.
+        push_decoder = PushDecoder(amf3=True, class_def_mapper=class_mapper)
+        self.assertEquals([], push_decoder.feed(encoded[:10]))
+        self.assertEquals([], push_decoder.feed(encoded[10:-10]))
+        self.assertTrue(push_decoder._scanner is False)
+
+        results = push_decoder.feed(encoded[-10:])
+        self.assertEquals(2, len(results))
+        self.assertEquals(obj.value, results[0].value)
+        self.assertEquals(5, results[1])
+
+    def testLimits(self):
+        tests = [
+            ({'max_string': 10}, 'x' * 11),
+            ({'max_depth': 2}, [[[1]]]),
+            ({'max_length': 2}, [1, 2, 3]),
+            ({'max_bytes': 8}, 'x' * 20)
+        ]
+
+        for kwargs, value in tests:
+            encoded = self.encoder.encode(value)
+            decoder = Decoder(amf3=True, **kwargs)
+            self.assertRaises(LimitError, decoder.decode, encoded)
+            for size in (1, len(encoded)):
+                push_decoder = decoder.push_decoder()
+                self.assertRaises(LimitError, self._feed, push_decoder, encoded, size)
+
+        # Values within the limit are decoded one at a time
+        push_decoder = Decoder(amf3=True, max_bytes=8).push_decoder()
+        encoded = self.encoder.encode('x' * 5)
+        self.assertEquals(['x' * 5] * 3, self._feed(push_decoder, encoded * 3, 1))
+
+    def testPacketLimits(self):
+        encoded = self.encoder.encode_packet(self.packet)
+        for kwargs in ({'max_bytes': len(encoded) - 1}, {'max_string': 100}):
+            push_decoder = Decoder(**kwargs).push_decoder(packet=True)
+            self.assertRaises(LimitError, self._feed, push_decoder, encoded, 7)
+
+        push_decoder = Decoder(max_bytes=len(encoded)).push_decoder(packet=True)
+        self.assertEquals(2, len(self._feed(push_decoder, encoded * 2, 7)))
+
+        # The declared length of a message body is checked before it is received.
+        push_decoder = Decoder(max_bytes=100).push_decoder(packet=True)
+        self.assertRaises(LimitError, push_decoder.feed,
+            '\x00\x03\x00\x00\x00\x01\x00\x02/1\x00\x00\x00\x10\x00\x00')
+
+    def _feed(self, push_decoder, encoded, size):
+        results = []
+        for chunk in self._chunk(encoded, size):
+            results.extend(push_decoder.feed(chunk))
+        return results
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PushDecoderTestCase)
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -6,8 +6,11 @@ import amfast
 from amfast import remoting, logger
 from amfast.encoder import Encoder
 from amfast.decoder import Decoder
+from amfast.class_def import ClassDefMapper
+from amfast.context import LimitError
 from amfast.remoting import ServiceMapper, flex_messages as messaging
 from amfast.remoting.channel import ChannelSet, Channel
+from amfast.remoting.endpoint import ContextPool
 
 #handler = logging.StreamHandler(sys.stdout)
 #handler.setLevel(logging.DEBUG)
@@ -297,6 +300,103 @@ class RemotingTestCase(unittest.TestCase):
         self.assertEquals(messaging.AcknowledgeMessage, response.messages[0].body.__class__)
         self.assertEquals('123', response.messages[0].body.correlationId)
 
+    def _smallMsgMapper(self):
+        """ClassDefMapper that encodes CommandMessages the way Flex clients do."""
+        class_mapper = ClassDefMapper()
+        class_mapper.mapClass(messaging.CommandSmallMsgDef(messaging.CommandMessage,
+            alias='DSC'))
+        return class_mapper
+
+    def testSmallMessage(self):
+        uid = '0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9'
+        msg = messaging.CommandMessage(body={'spam': 'eggs'},
+            clientId='client', destination=self.service_name,
+            headers={'DSEndpoint': 'amf'}, timestamp=1, timeToLive=0,
+            messageId=uid, correlationId=uid.lower(),
+            operation=messaging.CommandMessage.SUBSCRIBE_OPERATION)
+
+        encoded = Encoder(amf3=True, class_def_mapper=self._smallMsgMapper()).encode(msg)
+        self.assertTrue('DSC' in encoded)
+        self.assertFalse(uid in encoded)
+        self.assertTrue(uid.lower() in encoded)
+
+        result = Decoder(amf3=True).decode(encoded)
+        self.assertEquals(messaging.CommandMessage, result.__class__)
+        self.assertTrue(result._small_msg)
+        self.assertEquals({'spam': 'eggs'}, result.body)
+        self.assertEquals('client', result.clientId)
+        self.assertEquals(self.service_name, result.destination)
+        self.assertEquals({'DSEndpoint': 'amf'}, result.headers)
+        self.assertEquals(uid, result.messageId)
+        self.assertEquals(uid.lower(), result.correlationId)
+        self.assertEquals(1, result.timestamp)
+        self.assertEquals(None, result.timeToLive)
+        self.assertEquals(messaging.CommandMessage.SUBSCRIBE_OPERATION, result.operation)
+
+    def testSmallPing(self):
+        uid = '0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9'
+        inner_msg = messaging.CommandMessage(body=(), destination=self.service_name,
+            headers={'DSEndpoint': 'amf', messaging.CommandMessage.MESSAGING_VERSION: 1},
+            messageId=uid, operation=messaging.CommandMessage.CLIENT_PING_OPERATION)
+        outter_msg = remoting.Message(target='null', response='/1', body=(inner_msg, ))
+
+        packet = remoting.Packet(messages=[outter_msg])
+        encoded_packet = Encoder(class_def_mapper=self._smallMsgMapper()).encode_packet(packet)
+        decoded_packet = self.channel.decode(encoded_packet)
+        response = self.channel.invoke(decoded_packet)
+        encoded_response = self.channel.encode(response)
+        self.assertTrue('DSK' in encoded_response)
+        self.assertFalse(uid in encoded_response)
+
+        response = self.channel.endpoint.decodePacket(encoded_response)
+        body = response.messages[0].body
+        self.assertEquals(messaging.AcknowledgeMessageExt, body.__class__)
+        self.assertEquals(uid, body.correlationId)
+        self.assertEquals(1, body.headers[messaging.CommandMessage.MESSAGING_VERSION])
+
+    def testContextPool(self):
+        endpoint = self.channel.endpoint
+        packet = remoting.Packet(messages=[remoting.Message(target='spam',
+            response='/1', body=[self.arg, self.arg])])
+
+        encoded = endpoint.encodePacket(packet)
+        key = endpoint.encoder._getContextKey()
+        context = endpoint._encoder_pool.get(key)
+        self.assertNotEquals(None, context)
+        endpoint._encoder_pool.put(key, context)
+
+        # Re-used context must not keep references from the previous call
+        self.assertEquals(encoded, endpoint.encodePacket(packet))
+        self.assertTrue(context is endpoint._encoder_pool.get(key))
+
+        decoded = endpoint.decodePacket(encoded)
+        self.assertEquals(self.arg, decoded.messages[0].body[1])
+        decoded = endpoint.decodePacket(encoded)
+        self.assertEquals(self.arg, decoded.messages[0].body[1])
+
+    def testContextPoolSettings(self):
+        endpoint = Channel('settings').endpoint
+        endpoint.encoder.amf3 = True
+        val = [1, 2]
+
+        endpoint.encode(val)
+        endpoint.encoder.use_collections = True
+        self.assertEquals(Encoder(amf3=True, use_collections=True).encode(val),
+            endpoint.encode(val))
+
+        encoded = Encoder(amf3=True).encode('spam' * 10)
+        self.assertEquals('spam' * 10, endpoint.decode(encoded, amf3=True))
+        endpoint.decoder.max_string = 8
+        self.assertRaises(LimitError, endpoint.decode, encoded, True)
+
+        # Contexts for out of date settings are dropped.
+        pool = ContextPool(max_size=2, max_keys=2)
+        for i in range(4):
+            pool.put(i, Encoder()._getContext())
+        self.assertEquals(None, pool.get(0))
+        self.assertEquals(None, pool.get(1))
+        self.assertNotEquals(None, pool.get(3))
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(RemotingTestCase)
 
@@ -1,8 +1,14 @@
+import os
+import tempfile
 import unittest
+from StringIO import StringIO
 
 from amfast.encode import encode
-from amfast.decode import decode
+from amfast.decode import decode, LazyValue
 from amfast.context import EncoderContext, DecoderContext
+from amfast.encoder import Encoder
+from amfast.decoder import Decoder
+from amfast import remoting
 import amfast.class_def as class_def
 
 class RoundTripTestCase(unittest.TestCase):
@@ -20,16 +26,37 @@ class RoundTripTestCase(unittest.TestCase):
         def __init__(self):
             self.number = None
 
+    class TestLazyObject(object):
+        def __init__(self, payload=None, after=None):
+            self.payload = payload
+            self.after = after
+
+    class TestExternObject(object):
+        pass
+
+    class TestExternClassDef(class_def.ExternClassDef):
+        def writeExternal(self, obj, context):
+            encode(obj.value, context)
+
+        def readExternal(self, obj, context):
+            obj.value = decode(context)
+
     def setUp(self):
         self.class_mapper = class_def.ClassDefMapper()
 
         self.class_mapper.mapClass(class_def.DynamicClassDef(self.TestObject,
             'test_complex.test', static_attrs=()))
         self.class_mapper.mapClass(class_def.DynamicClassDef(self.TestSubObject, 'test_complex.sub', ()))
+        self.class_mapper.mapClass(class_def.ClassDef(self.TestLazyObject,
+            'test_complex.lazy', ('payload', 'after'), lazy_attrs=('payload',)))
+        self.class_mapper.mapClass(self.TestExternClassDef(self.TestExternObject,
+            'test_complex.extern'))
 
     def tearDown(self):
         self.class_mapper.unmapClass(self.TestObject)
         self.class_mapper.unmapClass(self.TestSubObject)
+        self.class_mapper.unmapClass(self.TestLazyObject)
+        self.class_mapper.unmapClass(self.TestExternObject)
 
     def buildComplex(self, max=5):
         test_objects = []
@@ -146,6 +173,420 @@ class RoundTripTestCase(unittest.TestCase):
         self.assertEquals('int', decoded[0]._int.__class__.__name__)
         self.assertEquals('str', decoded[0]._str.__class__.__name__)
 
+    def testChunkedAmf3(self):
+        complex = self.buildComplex(max=100)
+        encoded = encode(complex, EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        chunks = encode(complex, EncoderContext(class_def_mapper=self.class_mapper, amf3=True, chunk_size=64))
+        self.assertEquals(list, chunks.__class__)
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks[:-1]:
+            self.assertEquals(64, len(chunk))
+        self.assertEquals(encoded, ''.join(chunks))
+
+    def testChunkedPacket(self):
+        packet = remoting.Packet(client_type=remoting.Packet.FLASH_9)
+        packet.headers.append(remoting.Header('spam', False, 'eggs' * 100))
+        packet.messages.append(remoting.Message(target='/1/onResult',
+            response='', body=self.buildComplex(max=50)))
+        packet.messages.append(remoting.Message(target='/2/onResult',
+            response='', body=['x' * 5000, 'spam']))
+
+        encoded = Encoder(amf3=True, class_def_mapper=self.class_mapper).encode_packet(packet)
+        chunks = Encoder(amf3=True, class_def_mapper=self.class_mapper,
+            chunk_size=256).encode_packet(packet)
+        self.assertEquals(encoded, ''.join(chunks))
+
+        decoded = Decoder(amf3=True, class_def_mapper=self.class_mapper).decode_packet(''.join(chunks))
+        self.resultTest(decoded.messages[0].body)
+        self.assertEquals('x' * 5000, decoded.messages[1].body[0])
+
+    def testStreamAmf3(self):
+        class Sink(object):
+            def __init__(self):
+                self.writes = []
+
+            def write(self, value):
+                self.writes.append(value)
+
+        complex = self.buildComplex(max=100)
+        encoded = encode(complex, EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        sink = Sink()
+        result = encode(complex, EncoderContext(class_def_mapper=self.class_mapper, amf3=True,
+            buffer=sink, chunk_size=64))
+        self.assertTrue(result is sink)
+        self.assertTrue(len(sink.writes) > 1)
+        for value in sink.writes[:-1]:
+            self.assertEquals(64, len(value))
+        self.assertEquals(encoded, ''.join(sink.writes))
+
+        out = tempfile.TemporaryFile()
+        try:
+            fd = out.fileno()
+            self.assertEquals(fd, Encoder(amf3=True, class_def_mapper=self.class_mapper,
+                buffer=fd).encode(complex))
+            out.seek(0)
+            self.assertEquals(encoded, out.read())
+        finally:
+            out.close()
+
+    def testStreamPacket(self):
+        packet = remoting.Packet(client_type=remoting.Packet.FLASH_9)
+        packet.headers.append(remoting.Header('spam', False, 'eggs' * 100))
+        packet.messages.append(remoting.Message(target='/1/onResult',
+            response='', body=self.buildComplex(max=50)))
+        packet.messages.append(remoting.Message(target='/2/onResult',
+            response='', body=['x' * 5000, 'spam']))
+
+        out = StringIO()
+        Encoder(amf3=True, class_def_mapper=self.class_mapper,
+            buffer=out, chunk_size=256).encode_packet(packet)
+        streamed = out.getvalue()
+
+        # Lengths are unknown, so the output is the same size.
+        encoded = Encoder(amf3=True, class_def_mapper=self.class_mapper).encode_packet(packet)
+        self.assertEquals(len(encoded), len(streamed))
+        self.assertTrue('\xff\xff\xff\xff' in streamed)
+
+        decoded = Decoder(amf3=True, class_def_mapper=self.class_mapper).decode_packet(streamed)
+        self.assertEquals('eggs' * 100, decoded.headers[0].value)
+        self.resultTest(decoded.messages[0].body)
+        self.assertEquals('x' * 5000, decoded.messages[1].body[0])
+
+    def testLazyAmf3(self):
+        complex = self.buildComplex()
+        after = [complex[1], complex[1].sub_obj, 'test', complex]
+        encoded = encode(self.TestLazyObject(complex, after),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+        self.assertTrue(isinstance(result.payload, LazyValue))
+
+        # References to objects inside the lazy value
+        # decode the lazy value.
+        self.assertTrue(result.payload.decoded)
+        self.assertEquals(self.TestObject, result.after[0].__class__)
+        self.assertEquals('test', result.after[2])
+
+        payload = result.payload.decode()
+        self.assertTrue(payload is result.payload.decode())
+        self.assertTrue(payload is result.after[3])
+        self.assertTrue(payload[1] is result.after[0])
+        self.assertTrue(payload[1].sub_obj is result.after[1])
+        self.resultTest(payload)
+        self.assertEquals(3, payload[3].number)
+
+    def testLazyNotAccessed(self):
+        complex = self.buildComplex()
+        encoded = encode(self.TestLazyObject(complex, ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+        self.assertTrue(isinstance(result.payload, LazyValue))
+        self.assertFalse(result.payload.decoded)
+        self.assertEquals(['test'], result.after)
+        self.resultTest(result.payload.decode())
+
+    def testLazyExternalizable(self):
+        extern = self.TestExternObject()
+        extern.value = 'spam'
+        obj = self.TestLazyObject([extern, 'eggs'], 'eggs')
+        encoded = encode(obj, EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        # Externalizable objects can not be skipped
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+        self.assertEquals(list, result.payload.__class__)
+        self.assertEquals('spam', result.payload[0].value)
+        self.assertEquals('eggs', result.after)
+
+    def testLazyMessage(self):
+        import pickle
+        from amfast.remoting import flex_messages
+
+        msg = flex_messages.AsyncMessage(body={'spam': ['eggs'] * 3},
+            clientId='client', destination='topic')
+        encoded = encode(msg, EncoderContext(amf3=True))
+
+        result = decode(DecoderContext(encoded, amf3=True, lazy=True))
+        self.assertTrue(isinstance(result._body, LazyValue))
+        self.assertEquals('topic', result.destination)
+
+        self.assertEquals({'spam': ['eggs'] * 3}, result.body)
+        self.assertFalse(isinstance(result._body, LazyValue))
+
+        result = decode(DecoderContext(encoded, amf3=True, lazy=True))
+        result = pickle.loads(pickle.dumps(result))
+        self.assertEquals({'spam': ['eggs'] * 3}, result.body)
+
+    def testOldMessagePickle(self):
+        import pickle
+
+        # Pickled before AbstractMessage.body was a property.
+        pickles = (
+            "ccopy_reg\n_reconstructor\np0\n(camfast.remoting.flex_messages\nAsyncMessage\n"
+            "p1\nc__builtin__\nobject\np2\nNtp3\nRp4\n(dp5\nS'body'\np6\n(dp7\nS'spam'\n"
+            "p8\nS'eggs'\np9\nssS'headers'\np10\n(dp11\nsS'destination'\np12\nS'topic'\n"
+            "p13\nsb.",
+            '\x80\x02camfast.remoting.flex_messages\nAsyncMessage\nq\x00)\x81q\x01}q\x02'
+            '(U\x04bodyq\x03}q\x04U\x04spamq\x05U\x04eggsq\x06sU\x07headersq\x07}q\x08'
+            'U\x0bdestinationq\tU\x05topicq\nub.'
+        )
+
+        for pickled in pickles:
+            result = pickle.loads(pickled)
+            self.assertEquals({'spam': 'eggs'}, result.body)
+            self.assertEquals({'spam': 'eggs'}, result.getRawBody())
+            self.assertEquals('topic', result.destination)
+            self.assertFalse('body' in result.__dict__)
+
+    def testLazyPassthrough(self):
+        complex = self.buildComplex()
+        encoded = encode(self.TestLazyObject(complex, ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        # Undecoded values are written as-is.
+        passthrough = encode(result,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        self.assertFalse(result.payload.decoded)
+        self.assertTrue(encoded[result.payload.start:result.payload.end] in passthrough)
+
+        decoded = decode(DecoderContext(passthrough, class_def_mapper=self.class_mapper,
+            amf3=True))
+        self.resultTest(decoded.payload)
+        self.assertEquals(['test'], decoded.after)
+
+    def testLazyPassthroughReferences(self):
+        complex = self.buildComplex()
+        encoded = encode(self.TestLazyObject(complex, ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        # References inside the value are re-numbered
+        # to match the output.
+        other = self.TestObject()
+        other.number = 'test'
+        encoded = encode(['test', other, result.payload, result.payload, other],
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        self.assertFalse(result.payload.decoded)
+
+        decoded = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True))
+        self.assertEquals('test', decoded[1].number)
+        self.resultTest(decoded[2])
+        self.resultTest(decoded[3])
+        self.assertTrue(decoded[1] is decoded[4])
+
+    def testLazyPassthroughAmf0(self):
+        encoded = encode(self.TestLazyObject(self.buildComplex(), ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        encoded = encode(result.payload,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=False))
+        self.assertFalse(result.payload.decoded)
+        self.resultTest(decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=False)))
+
+    def testLazyPassthroughOutsideReference(self):
+        # 'payload' is a reference to the
+        # attribute name defined before the value.
+        encoded = encode(self.TestLazyObject(['payload', 'spam'], ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        # Value can not be spliced, and is decoded.
+        encoded = encode(['test', result.payload],
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        self.assertTrue(result.payload.decoded)
+        self.assertEquals(['test', ['payload', 'spam']], decode(DecoderContext(encoded,
+            class_def_mapper=self.class_mapper, amf3=True)))
+
+    def testLazyVector(self):
+        import array
+        from amfast.class_def.as_types import AsVector
+
+        ints = array.array('i', [1, 2, 3])
+        payload = [ints, AsVector(['test', ints]), array.array('d', [1.5])]
+        encoded = encode(self.TestLazyObject(payload, ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        passthrough = encode(result,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        self.assertFalse(result.payload.decoded)
+
+        decoded = decode(DecoderContext(passthrough, class_def_mapper=self.class_mapper,
+            amf3=True))
+        self.assertEquals(ints, decoded.payload[0])
+        self.assertEquals(['test', ints], decoded.payload[1])
+        self.assertEquals(array.array('d', [1.5]), decoded.payload[2])
+        self.assertTrue(decoded.payload[0] is decoded.payload[1][1])
+        self.assertEquals(['test'], decoded.after)
+
+    def testLazyDictionary(self):
+        from amfast.class_def.as_types import AsDictionary
+
+        items = ['test']
+        payload = [AsDictionary({1: items, 'test': 2.5}), items]
+        encoded = encode(self.TestLazyObject(payload, ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+
+        passthrough = encode(result,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        self.assertFalse(result.payload.decoded)
+
+        decoded = decode(DecoderContext(passthrough, class_def_mapper=self.class_mapper,
+            amf3=True))
+        self.assertEquals({1: ['test'], 'test': 2.5}, decoded.payload[0])
+        self.assertTrue(decoded.payload[0][1] is decoded.payload[1])
+        self.assertEquals(['test'], decoded.after)
+
+    def testLazyPassthroughDecoded(self):
+        encoded = encode(self.TestLazyObject(self.buildComplex(), ['test']),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True, lazy=True))
+        result.payload.decode()[0].number = 'changed'
+
+        # Decoded values are encoded normally.
+        decoded = decode(DecoderContext(encode(result.payload,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True)),
+            class_def_mapper=self.class_mapper, amf3=True))
+        self.assertEquals('changed', decoded[0].number)
+
+    def testLazyMessagePassthrough(self):
+        from amfast.remoting import flex_messages, connection
+
+        msg = flex_messages.AsyncMessage(body={'spam': ['eggs'] * 3},
+            clientId='client', destination='topic')
+        encoded = encode(msg, EncoderContext(amf3=True))
+
+        result = decode(DecoderContext(encoded, amf3=True, lazy=True))
+        conn = connection.Connection(None, 'channel', 'connection')
+        personalized = conn.personalizeMessage('subscriber', result)
+        self.assertTrue(personalized.getRawBody() is result.getRawBody())
+
+        encoded = encode(personalized, EncoderContext(amf3=True))
+        self.assertFalse(result.getRawBody().decoded)
+
+        result = decode(DecoderContext(encoded, amf3=True))
+        self.assertEquals('subscriber', result.clientId)
+        self.assertEquals({'spam': ['eggs'] * 3}, result.body)
+
+    def testLazyRawAttrs(self):
+        class RawObject(object):
+            def _getPayload(self):
+                payload = self._payload
+                if isinstance(payload, LazyValue):
+                    payload = self._payload = payload.decode()
+                return payload
+
+            def _setPayload(self, payload):
+                self._payload = payload
+
+            payload = property(_getPayload, _setPayload)
+
+        self.class_mapper.mapClass(class_def.ClassDef(RawObject, 'test_complex.raw',
+            (u'payload',), lazy_attrs=(u'payload',), raw_attrs={'payload': '_payload'}))
+        try:
+            obj = RawObject()
+            obj.payload = {'spam': ['eggs'] * 3}
+            encoded = encode(obj, EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+            result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+                amf3=True, lazy=True))
+            self.assertTrue(isinstance(result._payload, LazyValue))
+
+            # The raw payload is written without being decoded.
+            encoded = encode(result, EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+            self.assertFalse(result._payload.decoded)
+
+            result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper, amf3=True))
+            self.assertEquals({'spam': ['eggs'] * 3}, result.payload)
+        finally:
+            self.class_mapper.unmapClass(RawObject)
+
+    def testAsEncodedAmf3(self):
+        from amfast.class_def.as_types import AsEncoded
+
+        complex = self.buildComplex()
+        cached = AsEncoded(encode(complex,
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True)))
+
+        other = self.TestObject()
+        encoded = encode([other, cached, 'test', cached, other],
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True))
+
+        self.resultTest(result[1])
+        self.resultTest(result[3])
+        self.assertFalse(result[1] is result[3])
+        self.assertEquals('test', result[2])
+        self.assertTrue(result[0] is result[4])
+
+    def testAsEncodedAmf0(self):
+        from amfast.class_def.as_types import AsEncoded
+
+        value = {'spam': ['eggs', {'spam': 'eggs'}]}
+        value['self'] = value
+        cached = AsEncoded(encode(value, EncoderContext(amf3=False)), False)
+
+        other = ['test']
+        encoded = encode([other, cached, other, cached], EncoderContext(amf3=False))
+        result = decode(DecoderContext(encoded, amf3=False))
+
+        self.assertTrue(result[0] is result[2])
+        for decoded in (result[1], result[3]):
+            self.assertEquals(['eggs', {'spam': 'eggs'}], decoded['spam'])
+            self.assertTrue(decoded is decoded['self'])
+
+    def testAsEncodedAmf3InAmf0(self):
+        from amfast.class_def.as_types import AsEncoded
+
+        cached = AsEncoded(encode(self.buildComplex(),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True)))
+
+        encoded = encode([cached, cached],
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=False))
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=False))
+        self.resultTest(result[0])
+        self.resultTest(result[1])
+
+    def testAsEncodedAmf0InAmf3(self):
+        from amfast.class_def.as_types import AsEncoded
+        from amfast.encode import EncodeError
+
+        cached = AsEncoded(encode('test', EncoderContext(amf3=False)), False)
+        self.assertRaises(EncodeError, encode, cached, EncoderContext(amf3=True))
+
+    def testLazyDisabled(self):
+        encoded = encode(self.TestLazyObject(self.buildComplex()),
+            EncoderContext(class_def_mapper=self.class_mapper, amf3=True))
+
+        result = decode(DecoderContext(encoded, class_def_mapper=self.class_mapper,
+            amf3=True))
+        self.resultTest(result.payload)
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(RoundTripTestCase)
 